@@ -7,17 +7,77 @@ from flask_cors import CORS
 from dotenv import load_dotenv
 from openai import OpenAI
 from routes.blacklist_api import blacklist_api
+from routes.ais_api import ais_api
+from routes.alarm_zone_api import alarm_zone_api
+from routes.chat_session_api import chat_session_api
+from routes.profile_api import profile_api
+from routes.job_api import job_api
+from routes.landmark_api import landmark_api
+from services.ingest import start_ingest, ingest_pipeline
+from services.geofence import start_geofence
+from services.cpa import cpa_monitor, find_close_approaches, default_groups, alerts_to_geojson
+from models.vessel_store import latest_store
+from models.shared_state import geocode_cache, shared_state_stats
+from models.database import remove_session
+from services.geodesy import EARTH_RADIUS_KM, KM_TO_NM
+from services.geometry_cache import geometry_cache, coord_key, bearing_key, distance_key
+from services.buffer_union import buffer_ring, union_rings, DEFAULT_SIMPLIFY_KM
+from services.distance_matrix import resolve_points, geocode_count, MatrixResult
+from services.landmarks import landmark_index
+from models.chat_session_store import chat_sessions, SessionBusy, TURN_LOCK_TIMEOUT_S
+from services.profiler import profiler, span
+from services.jobs import job_queue
+from services.response_codec import FastJSONProvider, response_compressor
 
 # 從 .env 文件中載入環境變數
 load_dotenv()
 
 # 初始化 Flask 應用程式
 app = Flask(__name__)
-CORS(app)
+# 前端跨來源讀取分頁 / query planner 的自訂標頭
+CORS(app, expose_headers=["X-Segments-Total", "X-Segments-Pruned", "X-Next-Cursor", "X-Profile-Id"])
+
+# JSON 以 orjson 編碼（中文不轉義），超過門檻的回應依 Accept-Encoding 以 br / gzip 壓縮
+app.json = FastJSONProvider(app)
+response_compressor.init_app(app)
+
+# 每個 request 結束時歸還資料庫 session
+app.teardown_appcontext(remove_session)
 
 # 載入黑名單 API
 app.register_blueprint(blacklist_api, url_prefix="/api")
 
+# 載入 AIS 歷史航跡 API
+app.register_blueprint(ais_api, url_prefix="/api")
+
+# 載入警戒區 API（含進出事件）
+app.register_blueprint(alarm_zone_api, url_prefix="/api")
+
+# 載入對話 session API
+app.register_blueprint(chat_session_api, url_prefix="/api")
+
+# 逐 request 效能剖析（設定 PROFILE_TOKEN 或 PROFILE_SAMPLE_N 時才啟用）
+profiler.init_app(app)
+app.register_blueprint(profile_api, url_prefix="/api")
+
+# 載入背景工作 API（長時間的對話與大量幾何計算）
+app.register_blueprint(job_api, url_prefix="/api")
+
+# 載入地標 API（船位的「地標 + 方位 + 海浬」描述）
+app.register_blueprint(landmark_api, url_prefix="/api")
+
+# 設定 SHARED_STATE_NAME 時，船位與警戒區狀態由獨立的匯入行程（python -m services.ingest serve）
+# 寫入共享記憶體，各 worker 只讀取，不在此啟動匯入
+if latest_store.shared:
+    cpa_monitor.start()
+# 若設定 AIS_SOURCE（file:// / tcp:// / udp://），啟動 AIS 即時匯入
+elif os.environ.get("AIS_SOURCE"):
+    # 警戒區進出事件偵測需在匯入開始前掛上
+    start_geofence(ingest_pipeline)
+    start_ingest(os.environ["AIS_SOURCE"], columnar=bool(os.environ.get("AIS_COLUMNAR")))
+    # 船位更新後持續重算 CPA / TCPA 警示
+    cpa_monitor.start()
+
 # 設定 OpenAI API 金鑰
 client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 
@@ -28,6 +88,9 @@ GOOGLE_PLACES_API_KEY = os.environ.get("GOOGLE_PLACES_API_KEY")
 
 # --------------------- 與地理位置相關的函式 ---------------------
 def get_location_coordinates(place_name):
+    cached = geocode_cache.get(place_name)
+    if cached is not None:
+        return cached
     url = "https://maps.googleapis.com/maps/api/place/findplacefromtext/json"
     params = {
         "input": place_name,
@@ -35,11 +98,14 @@ def get_location_coordinates(place_name):
         "fields": "geometry",
         "key": GOOGLE_PLACES_API_KEY
     }
-    response = requests.get(url, params=params)
-    data = response.json()
+    with span("places.findplacefromtext"):
+        response = requests.get(url, params=params)
+        data = response.json()
     if data.get("candidates"):
         location = data["candidates"][0]["geometry"]["location"]
-        return {"latitude": location["lat"], "longitude": location["lng"]}
+        coordinates = {"latitude": location["lat"], "longitude": location["lng"]}
+        geocode_cache.put(place_name, coordinates)
+        return coordinates
     else:
         return None
 
@@ -68,15 +134,7 @@ def get_multiple_locations(place_names):
         return None
 
 def 建立_buffer_polygon(lon, lat, radius_km, num_points=64):
-    points = []
-    for i in range(num_points):
-        angle = 2 * math.pi * i / num_points
-        delta_lat = (radius_km / 111.32) * math.sin(angle)
-        denom = 111.32 * math.cos(math.radians(lat))
-        delta_lon = (radius_km / denom) * math.cos(angle) if abs(denom) >= 1e-6 else 0
-        points.append([lon + delta_lon, lat + delta_lat])
-    points.append(points[0])
-    return points
+    return buffer_ring(lon, lat, radius_km, num_points)
 
 def get_buffer_polygon(place_name, radius_km):
     """
@@ -123,12 +181,15 @@ def get_buffer_polygon(place_name, radius_km):
     }
     return geojson
 
-def get_multiple_buffer_polygons(locations):
+def get_multiple_buffer_polygons(locations, dissolve=False, simplify_km=None):
     """
     參數 locations 為列表，每個項目格式例如：
       {"place_name": "三芝雷達站", "radius_km": 10}
-    回傳的 GeoJSON 會包含每個地點的 buffer 圓以及中心點資訊
+    回傳的 GeoJSON 會包含每個地點的 buffer 圓以及中心點資訊；
+    dissolve=True 時所有 buffer 合併成一個 MultiPolygon（見 services/buffer_union.py）
     """
+    if dissolve:
+        return get_dissolved_buffer_polygons(locations, simplify_km)
     features = []
     for loc in locations:
         coordinates = get_location_coordinates(loc["place_name"])
@@ -170,6 +231,59 @@ def get_multiple_buffer_polygons(locations):
         return None
 
 
+def get_dissolved_buffer_polygons(locations, simplify_km=None):
+    """多個 buffer 的聯集：一個 MultiPolygon（重疊區域只留外框）加上各中心點；依解析後的座標與半徑快取"""
+    simplify_km = DEFAULT_SIMPLIFY_KM if simplify_km is None else max(0.0, float(simplify_km))
+    sites = []
+    for loc in locations:
+        coordinates = get_location_coordinates(loc["place_name"])
+        if coordinates:
+            sites.append((loc["place_name"], coordinates, float(loc["radius_km"])))
+    if not sites:
+        return None
+
+    key = ("buffer_union", distance_key(simplify_km),
+           tuple((coord_key(c), distance_key(r)) for _, c, r in sites))
+    labels = {f"s{i}": name for i, (name, _, _) in enumerate(sites)}
+    return geometry_cache.memoize(key, labels, lambda names: _dissolved_buffer_geojson(
+        [(names[f"s{i}"], c, r) for i, (_, c, r) in enumerate(sites)], simplify_km))
+
+
+def _dissolved_buffer_geojson(sites, simplify_km):
+    rings = [建立_buffer_polygon(c["longitude"], c["latitude"], r) for _, c, r in sites]
+    coordinates, stats = union_rings(rings, simplify_km)
+    features = [{
+        "type": "Feature",
+        "geometry": {
+            "type": "MultiPolygon",
+            "coordinates": coordinates
+        },
+        "properties": {
+            "name": f"buffer 聯集（{len(sites)} 處）",
+            "feature_type": "buffer_union",
+            "simplify_km": simplify_km,
+            **stats
+        }
+    }]
+    for name, c, r in sites:
+        features.append({
+            "type": "Feature",
+            "geometry": {
+                "type": "Point",
+                "coordinates": [c["longitude"], c["latitude"]]
+            },
+            "properties": {
+                "name": name,
+                "radius_km": r,
+                "feature_type": "center"
+            }
+        })
+    return {
+        "type": "FeatureCollection",
+        "features": features
+    }
+
+
 ### NEW ###  多點→Polygon
 def get_polygon_from_coordinates(coordinates):
     """
@@ -229,10 +343,7 @@ def load_geojson(geojson_data):
 
 # --------------------- 方位角與距離相關的函式 ---------------------
 
-# 地球半徑（公里）
-EARTH_RADIUS_KM = 6371.0
-# 海里與公里的轉換係數
-KM_TO_NM = 0.539957  # 1 海里 ≈ 1.852 公里，反向轉換
+# 地球半徑（公里）EARTH_RADIUS_KM 與海里換算係數 KM_TO_NM 定義於 services/geodesy.py，與向量化版本共用
 
 def haversine_distance(lat1, lon1, lat2, lon2):
     """
@@ -303,14 +414,35 @@ def destination_point(lat, lon, bearing_deg, distance_km):
     return {"latitude": lat2, "longitude": lon2}
 
 
+def bearing_distance_cached(origin, destination):
+    """
+    起點 → 目標的 (方位角, 公里, 海里)，依兩點座標跨 request 快取
+    """
+    return geometry_cache.pair(origin, destination, lambda: (
+        calculate_bearing(origin["latitude"], origin["longitude"],
+                          destination["latitude"], destination["longitude"]),
+        *haversine_distance(origin["latitude"], origin["longitude"],
+                            destination["latitude"], destination["longitude"]),
+    ))
+
+
 def calculate_point_by_bearing_distance(origin_place, bearing_degrees, distance_km):
     """
     從指定地名按給定方位角和距離計算新座標，回傳目標點的經緯度及 GeoJSON
+    （依起點座標與方位角 / 距離快取，get_line_from_bearing_distance 共用同一筆）
     """
     origin = get_location_coordinates(origin_place)
     if not origin:
         return {"error": f"無法找到地點: {origin_place}"}
-    
+
+    # 以鍵上的方位角 / 距離建立結果，命中同一筆的呼叫者拿到的數值一致
+    bearing_degrees, distance_km = bearing_key(bearing_degrees), distance_key(distance_km)
+    key = ("point_by_bearing", coord_key(origin), bearing_degrees, distance_km)
+    return geometry_cache.memoize(key, {"origin": origin_place}, lambda names: _point_by_bearing_geojson(
+        origin, names["origin"], bearing_degrees, distance_km))
+
+
+def _point_by_bearing_geojson(origin, origin_place, bearing_degrees, distance_km):
     dest = destination_point(origin["latitude"], origin["longitude"], bearing_degrees, distance_km)
     
     features = []
@@ -380,15 +512,15 @@ def calculate_bearing_distance_between_points(origin_place, destination_place):
         return {"error": f"無法找到起點: {origin_place}"}
     if not destination:
         return {"error": f"無法找到終點: {destination_place}"}
-    
-    bearing = calculate_bearing(
-        origin["latitude"], origin["longitude"],
-        destination["latitude"], destination["longitude"]
-    )
-    distance_km, distance_nm = haversine_distance(
-        origin["latitude"], origin["longitude"],
-        destination["latitude"], destination["longitude"]
-    )
+
+    key = ("between_points", coord_key(origin), coord_key(destination))
+    labels = {"origin": origin_place, "destination": destination_place}
+    return geometry_cache.memoize(key, labels, lambda names: _between_points_geojson(
+        origin, destination, names["origin"], names["destination"]))
+
+
+def _between_points_geojson(origin, destination, origin_place, destination_place):
+    bearing, distance_km, distance_nm = bearing_distance_cached(origin, destination)
     
     features = []
     
@@ -464,7 +596,21 @@ def calculate_multiple_bearings(origin_place, target_places):
     origin = get_location_coordinates(origin_place)
     if not origin:
         return {"error": f"無法找到起點: {origin_place}"}
-    
+
+    # 找不到的目標略過；快取鍵為起點與各目標的座標，各目標的方位 / 距離另依配對快取
+    targets = []
+    for target_place in target_places:
+        destination = get_location_coordinates(target_place)
+        if destination:
+            targets.append((target_place, destination))
+
+    key = ("multiple_bearings", coord_key(origin), tuple(coord_key(d) for _, d in targets))
+    labels = {"origin": origin_place, **{f"t{i}": name for i, (name, _) in enumerate(targets)}}
+    return geometry_cache.memoize(key, labels, lambda names: _multiple_bearings_geojson(
+        origin, names["origin"], [(names[f"t{i}"], d) for i, (_, d) in enumerate(targets)]))
+
+
+def _multiple_bearings_geojson(origin, origin_place, targets):
     features = []
     
     # 添加起點
@@ -482,19 +628,8 @@ def calculate_multiple_bearings(origin_place, target_places):
     features.append(origin_feature)
     
     # 計算到每個目標的方位和距離
-    for target_place in target_places:
-        destination = get_location_coordinates(target_place)
-        if not destination:
-            continue
-        
-        bearing = calculate_bearing(
-            origin["latitude"], origin["longitude"],
-            destination["latitude"], destination["longitude"]
-        )
-        distance_km, distance_nm = haversine_distance(
-            origin["latitude"], origin["longitude"],
-            destination["latitude"], destination["longitude"]
-        )
+    for target_place, destination in targets:
+        bearing, distance_km, distance_nm = bearing_distance_cached(origin, destination)
         
         # 目標點
         target_feature = {
@@ -548,7 +683,25 @@ def find_points_in_bearing_range(origin_place, bearing_start, bearing_end, max_d
     origin = get_location_coordinates(origin_place)
     if not origin:
         return {"error": f"無法找到起點: {origin_place}"}
-    
+
+    targets = []
+    for target_place in target_places or []:
+        destination = get_location_coordinates(target_place)
+        if destination:
+            targets.append((target_place, destination))
+
+    # 起訖方位角不取模：0°-0° 與 0°-360°、350°-10° 與 350°-370° 各自一筆，結果以鍵上的數值建立
+    bearing_start, bearing_end = bearing_key(bearing_start), bearing_key(bearing_end)
+    max_distance_km = distance_key(max_distance_km)
+    key = ("bearing_sector", coord_key(origin), bearing_start, bearing_end,
+           max_distance_km, tuple(coord_key(d) for _, d in targets))
+    labels = {"origin": origin_place, **{f"t{i}": name for i, (name, _) in enumerate(targets)}}
+    return geometry_cache.memoize(key, labels, lambda names: _bearing_sector_geojson(
+        origin, names["origin"], bearing_start, bearing_end, max_distance_km,
+        [(names[f"t{i}"], d) for i, (_, d) in enumerate(targets)]))
+
+
+def _bearing_sector_geojson(origin, origin_place, bearing_start, bearing_end, max_distance_km, targets):
     # 生成扇形區域的邊界點
     num_sector_points = 32
     sector_points = []
@@ -604,24 +757,12 @@ def find_points_in_bearing_range(origin_place, bearing_start, bearing_end, max_d
     features.append(sector_feature)
     
     # 查找目標點（如果提供了）
-    if target_places:
-        for target_place in target_places:
-            destination = get_location_coordinates(target_place)
-            if not destination:
-                continue
-            
-            bearing = calculate_bearing(
-                origin["latitude"], origin["longitude"],
-                destination["latitude"], destination["longitude"]
-            )
-            distance_km, distance_nm = haversine_distance(
-                origin["latitude"], origin["longitude"],
-                destination["latitude"], destination["longitude"]
-            )
+    if targets:
+        for target_place, destination in targets:
+            bearing, distance_km, distance_nm = bearing_distance_cached(origin, destination)
             
-            # 檢查是否在扇形範圍內
-            bearing_in_range = (bearing_start <= bearing <= bearing_end) or \
-                             ((bearing_start > bearing_end) and (bearing >= bearing_start or bearing <= bearing_end))
+            # 檢查是否在扇形範圍內（與上面畫出的圓弧相同：自起始方位角順時針 bearing_diff 度）
+            bearing_in_range = (bearing - bearing_start) % 360 <= bearing_diff
             distance_ok = distance_km <= max_distance_km
             
             if bearing_in_range and distance_ok:
@@ -648,6 +789,197 @@ def find_points_in_bearing_range(origin_place, bearing_start, bearing_end, max_d
 
 
 
+def get_close_approaches(cpa_nm=1.0, tcpa_min=30.0, shipname=None, max_results=20):
+    """
+    以最新船位計算中國籍 / 海警船與我方 / 黑名單船的最近接近點（CPA）與時間（TCPA）
+    """
+    rows = latest_store.snapshot()
+    if not rows:
+        return {"error": "目前沒有即時船位資料"}
+
+    group_a, group_b = default_groups(rows)
+    alerts = find_close_approaches(rows, cpa_nm, tcpa_min, group_a, group_b)
+    if shipname:
+        keyword = shipname.strip().upper()
+        alerts = [
+            a for a in alerts
+            if keyword in (a["vessel_a"]["shipname"] or "").upper()
+            or keyword in (a["vessel_b"]["shipname"] or "").upper()
+        ]
+
+    result = alerts_to_geojson(alerts[:max_results])
+    result["alert_count"] = len(alerts)
+    result["alerts"] = alerts[:max_results]
+    return result
+
+# 距離矩陣工具回傳完整矩陣的格數上限（超過只回傳各列最近的 k 個目標）
+MATRIX_TOOL_MAX_CELLS = 400
+# 距離矩陣（工具與 API）一次最多需要 geocode 的地名數；座標與 MMSI 不受此限
+MATRIX_MAX_GEOCODE = 100
+# 距離矩陣 API 的計算上限與回傳完整矩陣的上限（格數）
+MATRIX_API_MAX_CELLS = 25_000_000
+MATRIX_API_MAX_OUTPUT_CELLS = 1_000_000
+
+
+def calculate_distance_matrix(sources, targets, nearest_k=3):
+    """
+    計算多個起點（地名、"緯度,經度" 或 MMSI）到多個目標的距離（公里 / 海里）與方位角矩陣，
+    並列出每個起點最近的 k 個目標；GeoJSON 含所有點與每個起點到最近目標的方位線
+    """
+    names = geocode_count(sources) + geocode_count(targets)
+    if names > MATRIX_MAX_GEOCODE:
+        return {"error": f"地名過多（{names} 個），一次最多 {MATRIX_MAX_GEOCODE} 個，其餘請改用座標或 MMSI"}
+    src = resolve_points(sources, get_location_coordinates)
+    dst = resolve_points(targets, get_location_coordinates)
+    if not len(src) or not len(dst):
+        return {"error": "起點或目標皆無法解析", "unresolved": src.unresolved + dst.unresolved}
+
+    full = len(src) * len(dst) <= MATRIX_TOOL_MAX_CELLS
+    result = MatrixResult(src, dst, k=max(1, int(nearest_k)), full=full)
+    lat_a, lon_a = src.arrays()
+    lat_b, lon_b = dst.arrays()
+
+    features = []
+    for label, lat, lon in zip(src.labels, lat_a.tolist(), lon_a.tolist()):
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            "properties": {"name": label, "feature_type": "origin"}
+        })
+    for label, lat, lon in zip(dst.labels, lat_b.tolist(), lon_b.tolist()):
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [lon, lat]},
+            "properties": {"name": label, "feature_type": "target"}
+        })
+    for i, j in enumerate(result.nearest_index[:, 0].tolist()):
+        km = float(result.nearest_km[i, 0])
+        features.append({
+            "type": "Feature",
+            "geometry": {
+                "type": "LineString",
+                "coordinates": [[lon_a[i], lat_a[i]], [lon_b[j], lat_b[j]]]
+            },
+            "properties": {
+                "name": f"{src.labels[i]}到最近目標{dst.labels[j]}",
+                "feature_type": "bearing_line",
+                "bearing_degrees": round(float(result.nearest_bearing[i, 0]), 2),
+                "distance_km": round(km, 3),
+                "distance_nm": round(km * KM_TO_NM, 3)
+            }
+        })
+
+    output = {
+        "type": "FeatureCollection",
+        "features": features,
+        "sources": src.labels,
+        "targets": dst.labels,
+        "unresolved": src.unresolved + dst.unresolved,
+        "nearest": result.nearest(),
+    }
+    if full:
+        output.update(result.matrices())
+    return output
+
+
+# 距離 / 方位角矩陣（緊湊編碼：矩陣以 row-major 攤平）
+#   POST {"sources": [...], "targets": [...], "k": 3, "matrix": true}
+#   點可為地名、"lat,lon"、[lat, lon]、{"lat","lon","name"}、MMSI 或 {"mmsi"}
+@app.route('/api/distance_matrix', methods=['POST'])
+def distance_matrix_api():
+    try:
+        return jsonify(compute_distance_matrix(request.get_json(silent=True) or {}))
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+
+
+def compute_distance_matrix(data, progress=None):
+    """API 與背景工作共用；參數錯誤或矩陣過大時丟出 ValueError"""
+    sources, targets = data.get("sources"), data.get("targets")
+    if not isinstance(sources, list) or not isinstance(targets, list):
+        raise ValueError('sources 與 targets 需為陣列')
+    include_matrix = bool(data.get("matrix", True))
+    k = int(data.get("k", 0))
+    # 解析（可能呼叫外部 geocode）之前先以輸入筆數檢查上限：每筆最多解析出一個點
+    _check_matrix_size(len(sources), len(targets), include_matrix)
+    names = geocode_count(sources) + geocode_count(targets)
+    if names > MATRIX_MAX_GEOCODE:
+        raise ValueError(f'地名過多（{names} 個），一次最多 {MATRIX_MAX_GEOCODE} 個，其餘請改用座標或 MMSI')
+    if progress:
+        progress(0.05, "解析地點")
+    src = resolve_points(sources, get_location_coordinates)
+    dst = resolve_points(targets, get_location_coordinates)
+    if progress:
+        progress(0.5, f"計算 {len(src)} × {len(dst)} 矩陣")
+    # 不回傳完整矩陣時只逐段計算各列最近的 k 個，不建立 N × M 矩陣
+    return MatrixResult(src, dst, k=k, full=include_matrix).compact(include_matrix)
+
+
+def _check_matrix_size(rows, cols, include_matrix):
+    cells = rows * cols
+    if cells > MATRIX_API_MAX_CELLS or (include_matrix and cells > MATRIX_API_MAX_OUTPUT_CELLS):
+        raise ValueError(f'矩陣過大（{rows} × {cols}），請減少點數或設定 matrix=false 只取最近 k 個')
+
+
+def describe_positions_by_landmark(points, nearest_k=1):
+    """
+    以本地地標表（港口、岬角、島嶼、雷達站）描述位置，例如「基隆港東北方 12 海浬」；
+    點可為地名、"緯度,經度" 或 MMSI。GeoJSON 含各點、所用地標，以及地標到點的方位線
+    """
+    resolved = resolve_points(points, get_location_coordinates)
+    if not len(resolved):
+        return {"error": "沒有可解析的位置", "unresolved": resolved.unresolved}
+
+    index = landmark_index.get()
+    lat, lon = resolved.arrays()
+    found = index.describe(lat, lon, max(1, int(nearest_k)))
+
+    features = []
+    descriptions = []
+    used = set()
+    for i, label in enumerate(resolved.labels):
+        nearby = []
+        for j, lm in enumerate(found["landmark"][i].tolist()):
+            km = float(found["distance_nm"][i, j]) / KM_TO_NM
+            nearby.append({
+                "landmark": index.names[lm],
+                "landmark_type": index.landmarks[lm]["type"],
+                "bearing_degrees": round(float(found["bearing_deg"][i, j]), 2),
+                "distance_km": round(km, 3),
+                "distance_nm": round(float(found["distance_nm"][i, j]), 3),
+                "description": found["label"][i, j],
+            })
+            used.add(lm)
+        descriptions.append({"name": label, "description": nearby[0]["description"], "nearest": nearby})
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [float(lon[i]), float(lat[i])]},
+            "properties": {"name": f"{label}（{nearby[0]['description']}）", "feature_type": "target"}
+        })
+        lm = int(found["landmark"][i, 0])
+        features.append({
+            "type": "Feature",
+            "geometry": {
+                "type": "LineString",
+                "coordinates": [[float(index.lon[lm]), float(index.lat[lm])], [float(lon[i]), float(lat[i])]]
+            },
+            "properties": {"name": nearby[0]["description"], "feature_type": "bearing_line",
+                           "bearing_degrees": nearby[0]["bearing_degrees"],
+                           "distance_nm": nearby[0]["distance_nm"]}
+        })
+    for lm in sorted(used):
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [float(index.lon[lm]), float(index.lat[lm])]},
+            "properties": {"name": index.names[lm], "feature_type": "base_point"}
+        })
+
+    return {
+        "type": "FeatureCollection",
+        "features": features,
+        "positions": descriptions,
+        "unresolved": resolved.unresolved,
+    }
 
 # --------------------- 結束地理位置相關的函式 ---------------------
 
@@ -667,16 +999,30 @@ def serve_file(filename):
     return send_from_directory(FOLDER_PATH, filename)
 
 
-@app.route('/generate', methods=['POST'])
-def generate_text():
-    try:
-        data = request.get_json()
-        user_message = (data.get('prompt') or '').strip()
-        if not user_message:
-            return jsonify({'error': '訊息為必填'}), 400
+# 方位 / 扇形工具結果快取的命中統計
+@app.route('/api/geometry_cache/stats')
+def geometry_cache_stats():
+    return jsonify(geometry_cache.stats())
+
+
+# 跨 worker 共享的熱資料（最新船位、警戒區內船舶、地名快取）
+@app.route('/api/shared_state/stats')
+def shared_state_stats_api():
+    return jsonify(shared_state_stats())
+
+
+# 回應壓縮統計（壓縮前後位元組數、使用的 JSON 編碼器）
+@app.route('/api/compression/stats')
+def compression_stats():
+    return jsonify(response_compressor.stats())
 
-        # ========= 1. system prompt：自然語言 + 不亂露座標 =========
-        system_prompt = '''
+
+# --------------------- 對話助理 ---------------------
+CHAT_MODEL = "gpt-4.1-mini"
+
+# system prompt 與 tools 定義為模組常數：每次呼叫送出的前綴逐 byte 相同，供應商端的 prompt cache 才能命中
+# system prompt：自然語言 + 不亂露座標
+SYSTEM_PROMPT = '''
 你是個情報分析師，會使用繁體中文回覆。
 
 請嚴格遵守以下規則：
@@ -719,371 +1065,567 @@ def generate_text():
    記住：1 海浬 ≈ 1.852 公里，計算時需要轉換單位。
 '''.strip()
 
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_message},
-        ]
-
-        # ========= 2. tools 定義 =========
-        tools = [
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_location_coordinates",
-                    "description": "取得單一指定地名的經緯度",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "place_name": {
-                                "type": "string",
-                                "description": "例如 '台北101'"
-                            }
-                        },
-                        "required": ["place_name"]
+# tools 定義
+TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "get_location_coordinates",
+            "description": "取得單一指定地名的經緯度",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "place_name": {
+                        "type": "string",
+                        "description": "例如 '台北101'"
                     }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_buffer_polygon",
-                    "description": "取得以指定地名為中心，並以指定半徑（公里）劃出的 buffer 圓（GeoJSON 格式），同時回傳中心點",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "place_name": {
-                                "type": "string",
-                                "description": "例如 '台北101'"
-                            },
-                            "radius_km": {
-                                "type": "number",
-                                "description": "例如 2"
-                            }
-                        },
-                        "required": ["place_name", "radius_km"]
+                },
+                "required": ["place_name"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_buffer_polygon",
+            "description": "取得以指定地名為中心，並以指定半徑（公里）劃出的 buffer 圓（GeoJSON 格式），同時回傳中心點",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "place_name": {
+                        "type": "string",
+                        "description": "例如 '台北101'"
+                    },
+                    "radius_km": {
+                        "type": "number",
+                        "description": "例如 2"
                     }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_multiple_locations",
-                    "description": "取得多個地名的經緯度，並以 GeoJSON 陣列格式回傳",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "place_names": {
-                                "type": "array",
-                                "items": {"type": "string"},
-                                "description": "例如 ['台北101', '淡水老街']"
-                            }
-                        },
-                        "required": ["place_names"]
+                },
+                "required": ["place_name", "radius_km"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_multiple_locations",
+            "description": "取得多個地名的經緯度，並以 GeoJSON 陣列格式回傳",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "place_names": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "例如 ['台北101', '淡水老街']"
                     }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_multiple_buffer_polygons",
-                    "description": "取得多個地名，以各自指定半徑劃出 buffer 圓（GeoJSON 格式），並同時回傳中心點",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "locations": {
-                                "type": "array",
-                                "items": {
-                                    "type": "object",
-                                    "properties": {
-                                        "place_name": {
-                                            "type": "string",
-                                            "description": "例如 '三芝雷達站'"
-                                        },
-                                        "radius_km": {
-                                            "type": "number",
-                                            "description": "例如 10"
-                                        }
-                                    },
-                                    "required": ["place_name", "radius_km"]
+                },
+                "required": ["place_names"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_multiple_buffer_polygons",
+            "description": "取得多個地名，以各自指定半徑劃出 buffer 圓（GeoJSON 格式），並同時回傳中心點",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "locations": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "place_name": {
+                                    "type": "string",
+                                    "description": "例如 '三芝雷達站'"
                                 },
-                                "description": "例如 [{'place_name': '三芝雷達站', 'radius_km': 10}, {'place_name': '淡水漁人碼頭', 'radius_km': 10}]"
-                            }
+                                "radius_km": {
+                                    "type": "number",
+                                    "description": "例如 10"
+                                }
+                            },
+                            "required": ["place_name", "radius_km"]
                         },
-                        "required": ["locations"]
+                        "description": "例如 [{'place_name': '三芝雷達站', 'radius_km': 10}, {'place_name': '淡水漁人碼頭', 'radius_km': 10}]"
+                    },
+                    "dissolve": {
+                        "type": "boolean",
+                        "description": "true 時把所有 buffer 合併成單一 MultiPolygon（重疊區域只保留外框），地點多且互相重疊時使用"
+                    },
+                    "simplify_km": {
+                        "type": "number",
+                        "description": "dissolve 時外框的簡化容差（公里），預設 0.05；0 為不簡化"
                     }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_polygon_from_coordinates",
-                    "description": "將多個經緯度點依順序連線為 GeoJSON Polygon",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "coordinates": {
-                                "type": "array",
-                                "items": {
-                                    "type": "object",
-                                    "properties": {
-                                        "latitude":  {"type": "number"},
-                                        "longitude": {"type": "number"}
-                                    },
-                                    "required": ["latitude", "longitude"]
-                                },
-                                "description": "按照連線順序排列的座標列表"
-                            }
+                },
+                "required": ["locations"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_polygon_from_coordinates",
+            "description": "將多個經緯度點依順序連線為 GeoJSON Polygon",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "coordinates": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "latitude":  {"type": "number"},
+                                "longitude": {"type": "number"}
+                            },
+                            "required": ["latitude", "longitude"]
                         },
-                        "required": ["coordinates"]
+                        "description": "按照連線順序排列的座標列表"
                     }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "load_geojson",
-                    "description": "驗證並載入 GeoJSON 資料（支援點、線、面等多種圖徵）",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "geojson_data": {
-                                "type": "string",
-                                "description": "GeoJSON 格式的字串或 JSON 物件，例如包含 Point、LineString、Polygon 等圖徵"
-                            }
-                        },
-                        "required": ["geojson_data"]
+                },
+                "required": ["coordinates"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "load_geojson",
+            "description": "驗證並載入 GeoJSON 資料（支援點、線、面等多種圖徵）",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "geojson_data": {
+                        "type": "string",
+                        "description": "GeoJSON 格式的字串或 JSON 物件，例如包含 Point、LineString、Polygon 等圖徵"
                     }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "calculate_point_by_bearing_distance",
-                    "description": "從指定地名按給定方位角和距離計算新座標並生成方位線的 GeoJSON",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "origin_place": {
-                                "type": "string",
-                                "description": "起點地名，例如 '台北港'"
-                            },
-                            "bearing_degrees": {
-                                "type": "number",
-                                "description": "方位角（0-360度，0=北，90=東，180=南，270=西）"
-                            },
-                            "distance_km": {
-                                "type": "number",
-                                "description": "距離，單位公里。注意：若使用者提供的是海浬，請轉換（1海浬≈1.852公里）"
-                            }
-                        },
-                        "required": ["origin_place", "bearing_degrees", "distance_km"]
+                },
+                "required": ["geojson_data"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "calculate_point_by_bearing_distance",
+            "description": "從指定地名按給定方位角和距離計算新座標並生成方位線的 GeoJSON",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "origin_place": {
+                        "type": "string",
+                        "description": "起點地名，例如 '台北港'"
+                    },
+                    "bearing_degrees": {
+                        "type": "number",
+                        "description": "方位角（0-360度，0=北，90=東，180=南，270=西）"
+                    },
+                    "distance_km": {
+                        "type": "number",
+                        "description": "距離，單位公里。注意：若使用者提供的是海浬，請轉換（1海浬≈1.852公里）"
                     }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "calculate_bearing_distance_between_points",
-                    "description": "計算兩個地點之間的方位角、公里距離和海里距離，並繪製方位線",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "origin_place": {
-                                "type": "string",
-                                "description": "起點地名"
-                            },
-                            "destination_place": {
-                                "type": "string",
-                                "description": "終點地名"
-                            }
-                        },
-                        "required": ["origin_place", "destination_place"]
+                },
+                "required": ["origin_place", "bearing_degrees", "distance_km"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "calculate_bearing_distance_between_points",
+            "description": "計算兩個地點之間的方位角、公里距離和海里距離，並繪製方位線",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "origin_place": {
+                        "type": "string",
+                        "description": "起點地名"
+                    },
+                    "destination_place": {
+                        "type": "string",
+                        "description": "終點地名"
                     }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "get_line_from_bearing_distance",
-                    "description": "從指定起點按方位角和距離繪製方位線，回傳 GeoJSON（包含起點、終點和連接線）",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "origin_place": {
-                                "type": "string",
-                                "description": "起點地名"
-                            },
-                            "bearing_degrees": {
-                                "type": "number",
-                                "description": "方位角（度）"
-                            },
-                            "distance_km": {
-                                "type": "number",
-                                "description": "距離（公里）"
-                            }
-                        },
-                        "required": ["origin_place", "bearing_degrees", "distance_km"]
+                },
+                "required": ["origin_place", "destination_place"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_line_from_bearing_distance",
+            "description": "從指定起點按方位角和距離繪製方位線，回傳 GeoJSON（包含起點、終點和連接線）",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "origin_place": {
+                        "type": "string",
+                        "description": "起點地名"
+                    },
+                    "bearing_degrees": {
+                        "type": "number",
+                        "description": "方位角（度）"
+                    },
+                    "distance_km": {
+                        "type": "number",
+                        "description": "距離（公里）"
                     }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "calculate_multiple_bearings",
-                    "description": "從一個起點地名計算到多個目標地名的方位角和距離，回傳 GeoJSON 包含所有方位線",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "origin_place": {
-                                "type": "string",
-                                "description": "起點地名"
-                            },
-                            "target_places": {
-                                "type": "array",
-                                "items": {"type": "string"},
-                                "description": "目標地名列表，例如 ['淡水', '基隆', '宜蘭']"
-                            }
-                        },
-                        "required": ["origin_place", "target_places"]
+                },
+                "required": ["origin_place", "bearing_degrees", "distance_km"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "calculate_multiple_bearings",
+            "description": "從一個起點地名計算到多個目標地名的方位角和距離，回傳 GeoJSON 包含所有方位線",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "origin_place": {
+                        "type": "string",
+                        "description": "起點地名"
+                    },
+                    "target_places": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "目標地名列表，例如 ['淡水', '基隆', '宜蘭']"
                     }
-                }
-            },
-            {
-                "type": "function",
-                "function": {
-                    "name": "find_points_in_bearing_range",
-                    "description": "在指定的方位角範圍和距離內生成扇形區域，並可選地查找該區域內的目標點",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "origin_place": {
-                                "type": "string",
-                                "description": "起點地名"
-                            },
-                            "bearing_start": {
-                                "type": "number",
-                                "description": "起始方位角（度）"
-                            },
-                            "bearing_end": {
-                                "type": "number",
-                                "description": "終止方位角（度）"
-                            },
-                            "max_distance_km": {
-                                "type": "number",
-                                "description": "扇形最大距離（公里）"
-                            },
-                            "target_places": {
-                                "type": "array",
-                                "items": {"type": "string"},
-                                "description": "可選，要查找的目標地點列表"
-                            }
-                        },
-                        "required": ["origin_place", "bearing_start", "bearing_end", "max_distance_km"]
+                },
+                "required": ["origin_place", "target_places"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "find_points_in_bearing_range",
+            "description": "在指定的方位角範圍和距離內生成扇形區域，並可選地查找該區域內的目標點",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "origin_place": {
+                        "type": "string",
+                        "description": "起點地名"
+                    },
+                    "bearing_start": {
+                        "type": "number",
+                        "description": "起始方位角（度）"
+                    },
+                    "bearing_end": {
+                        "type": "number",
+                        "description": "終止方位角（度）"
+                    },
+                    "max_distance_km": {
+                        "type": "number",
+                        "description": "扇形最大距離（公里）"
+                    },
+                    "target_places": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "可選，要查找的目標地點列表"
                     }
-                }
+                },
+                "required": ["origin_place", "bearing_start", "bearing_end", "max_distance_km"]
             }
-        ]
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_close_approaches",
+            "description": "依即時船位計算中國籍或海警船與我方、黑名單船的最近接近點（CPA）與到達時間（TCPA），回傳接近警示",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "cpa_nm": {
+                        "type": "number",
+                        "description": "CPA 距離門檻（海里），預設 1"
+                    },
+                    "tcpa_min": {
+                        "type": "number",
+                        "description": "TCPA 時間門檻（分鐘），預設 30"
+                    },
+                    "shipname": {
+                        "type": "string",
+                        "description": "可選，只回傳包含此船名的警示"
+                    }
+                },
+                "required": []
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "calculate_distance_matrix",
+            "description": "計算多個起點到多個目標兩兩之間的距離（公里、海里）與方位角矩陣，並列出每個起點最近的幾個目標，例如「各雷達站到這些船的距離」",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "sources": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "起點：地名、'緯度,經度' 或船舶 MMSI，例如 ['三芝雷達站', '25.1,121.3']"
+                    },
+                    "targets": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "目標：地名、'緯度,經度' 或船舶 MMSI，例如 ['412123456', '基隆港']"
+                    },
+                    "nearest_k": {
+                        "type": "integer",
+                        "description": "每個起點列出最近的幾個目標，預設 3"
+                    }
+                },
+                "required": ["sources", "targets"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "describe_positions_by_landmark",
+            "description": "把位置或船舶描述成「最近地標 + 方位 + 海浬」，例如「基隆港東北方 12 海浬」，地標含港口、岬角、島嶼、雷達站；不需逐一查詢地名",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "points": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "位置：'緯度,經度'、船舶 MMSI 或地名，例如 ['25.3,121.9', '412123456']"
+                    },
+                    "nearest_k": {
+                        "type": "integer",
+                        "description": "每個位置列出最近的幾個地標，預設 1"
+                    }
+                },
+                "required": ["points"]
+            }
+        }
+    }
+]
+
+
+def _chat_messages(session, turn_messages):
+    return [{"role": "system", "content": SYSTEM_PROMPT}, *session.history(), *turn_messages]
+
+
+def _add_usage(usage, response):
+    """累計 API 回傳的 token 用量（cached_tokens 為命中 prompt cache 的輸入 token）"""
+    u = getattr(response, "usage", None)
+    if u is None:
+        return
+    details = getattr(u, "prompt_tokens_details", None)
+    usage["calls"] = usage.get("calls", 0) + 1
+    usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + (u.prompt_tokens or 0)
+    usage["cached_tokens"] = usage.get("cached_tokens", 0) + (getattr(details, "cached_tokens", 0) or 0)
+    usage["completion_tokens"] = usage.get("completion_tokens", 0) + (u.completion_tokens or 0)
+
+
+def run_tool(fn_name, arguments):
+    """依名稱執行對話助理的工具（對話流程與背景工作共用）"""
+    if fn_name == "get_location_coordinates":
+        tool_result = get_location_coordinates(arguments["place_name"])
+    elif fn_name == "get_multiple_locations":
+        tool_result = get_multiple_locations(arguments["place_names"])
+    elif fn_name == "get_buffer_polygon":
+        radius = float(arguments["radius_km"])
+        tool_result = get_buffer_polygon(arguments["place_name"], radius)
+    elif fn_name == "get_multiple_buffer_polygons":
+        tool_result = get_multiple_buffer_polygons(arguments["locations"], bool(arguments.get("dissolve")),
+                                                   arguments.get("simplify_km"))
+    elif fn_name == "get_polygon_from_coordinates":
+        tool_result = get_polygon_from_coordinates(arguments["coordinates"])
+    elif fn_name == "load_geojson":
+        tool_result = load_geojson(arguments["geojson_data"])
+    elif fn_name == "calculate_point_by_bearing_distance":
+        bearing = float(arguments["bearing_degrees"])
+        distance = float(arguments["distance_km"])
+        tool_result = calculate_point_by_bearing_distance(arguments["origin_place"], bearing, distance)
+    elif fn_name == "calculate_bearing_distance_between_points":
+        tool_result = calculate_bearing_distance_between_points(arguments["origin_place"], arguments["destination_place"])
+    elif fn_name == "get_line_from_bearing_distance":
+        bearing = float(arguments["bearing_degrees"])
+        distance = float(arguments["distance_km"])
+        tool_result = get_line_from_bearing_distance(arguments["origin_place"], bearing, distance)
+    elif fn_name == "calculate_multiple_bearings":
+        tool_result = calculate_multiple_bearings(arguments["origin_place"], arguments["target_places"])
+    elif fn_name == "find_points_in_bearing_range":
+        bearing_start = float(arguments["bearing_start"])
+        bearing_end = float(arguments["bearing_end"])
+        max_dist = float(arguments["max_distance_km"])
+        target_places = arguments.get("target_places", None)
+        tool_result = find_points_in_bearing_range(arguments["origin_place"], bearing_start, bearing_end, max_dist, target_places)
+    elif fn_name == "get_close_approaches":
+        cpa_nm = float(arguments.get("cpa_nm", 1.0))
+        tcpa_min = float(arguments.get("tcpa_min", 30.0))
+        tool_result = get_close_approaches(cpa_nm, tcpa_min, arguments.get("shipname"))
+    elif fn_name == "calculate_distance_matrix":
+        nearest_k = int(arguments.get("nearest_k", 3))
+        tool_result = calculate_distance_matrix(arguments["sources"], arguments["targets"], nearest_k)
+    elif fn_name == "describe_positions_by_landmark":
+        nearest_k = int(arguments.get("nearest_k", 1))
+        tool_result = describe_positions_by_landmark(arguments["points"], nearest_k)
+    else:
+        tool_result = {"error": f"未知的工具名稱: {fn_name}"}
+    return tool_result
+
+
+def run_chat_turn(user_message, session_id=None, progress=None):
+    """
+    執行一輪對話（含工具呼叫），回傳 {response, session_id, usage}；
+    progress(fraction, message) 供背景工作回報進度
+    """
+    # ========= 1. 對話 session：靜態前綴（tools + system prompt）→ 歷史 → 本輪 =========
+    # 同一 session 的多輪依序執行（讀取歷史 → 呼叫模型 → add_turn 之間持有 turn_lock）；
+    # 背景工作已由佇列依 session 排序，這裡只會與同步 /generate 競爭，等待有上限
+    session = chat_sessions.get_or_create(session_id)
+    if not session.turn_lock.acquire(timeout=TURN_LOCK_TIMEOUT_S):
+        raise SessionBusy("同一對話的上一輪仍在處理中，請稍後再送出")
+    try:
+        return _run_chat_turn(session, user_message, progress)
+    finally:
+        session.turn_lock.release()
+
+
+def _run_chat_turn(session, user_message, progress):
+    turn_messages = [{"role": "user", "content": user_message}]
+    usage = {}
 
-        # ========= 3. 第一次呼叫：讓模型決定要不要用 tools =========
+    # ========= 2. 第一次呼叫：讓模型決定要不要用 tools =========
+    if progress:
+        progress(0.05, "分析問題")
+    with span("openai.chat.completions"):
         first_response = client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=messages,
-            tools=tools,
+            model=CHAT_MODEL,
+            messages=_chat_messages(session, turn_messages),
+            tools=TOOLS,
             tool_choice="auto",
         )
+    _add_usage(usage, first_response)
 
-        assistant_message = first_response.choices[0].message
-
-        # ========= 4. 若沒有 tool_calls，就直接回傳自然語言 =========
-        if not getattr(assistant_message, "tool_calls", None):
-            return jsonify({'response': assistant_message.content}), 200
-
-        # ========= 5. 有 tool_calls：實際執行 Python 函式 =========
-
-        # 把這次 assistant（帶 tool_calls）加回 messages
-        messages.append({
-            "role": "assistant",
-            "content": assistant_message.content or "",
-            "tool_calls": [
-                {
-                    "id": tc.id,
-                    "type": "function",
-                    "function": {
-                        "name": tc.function.name,
-                        "arguments": tc.function.arguments,
-                    },
-                }
-                for tc in assistant_message.tool_calls
-            ],
-        })
+    assistant_message = first_response.choices[0].message
 
-        # 逐一跑每個 tool_call，呼叫你在後端定義的函式
-        for tc in assistant_message.tool_calls:
-            fn_name = tc.function.name
-            raw_args = tc.function.arguments or "{}"
+    # ========= 3. 若沒有 tool_calls，就直接回傳自然語言 =========
+    if not getattr(assistant_message, "tool_calls", None):
+        turn_messages.append({"role": "assistant", "content": assistant_message.content or ""})
+        session.add_turn(turn_messages, usage)
+        return {'response': assistant_message.content, 'session_id': session.id, 'usage': usage}
 
-            try:
-                arguments = json.loads(raw_args)
-            except Exception as ex:
-                tool_result = {"error": f"解析函式參數失敗: {str(ex)}"}
-            else:
+    # ========= 4. 有 tool_calls：實際執行 Python 函式 =========
+
+    # 把這次 assistant（帶 tool_calls）加回本輪訊息
+    turn_messages.append({
+        "role": "assistant",
+        "content": assistant_message.content or "",
+        "tool_calls": [
+            {
+                "id": tc.id,
+                "type": "function",
+                "function": {
+                    "name": tc.function.name,
+                    "arguments": tc.function.arguments,
+                },
+            }
+            for tc in assistant_message.tool_calls
+        ],
+    })
+
+    # 逐一跑每個 tool_call，呼叫你在後端定義的函式
+    tool_calls = assistant_message.tool_calls
+    for n, tc in enumerate(tool_calls):
+        fn_name = tc.function.name
+        raw_args = tc.function.arguments or "{}"
+        if progress:
+            progress(0.1 + 0.7 * n / len(tool_calls), f"執行工具 {fn_name}")
+
+        try:
+            arguments = json.loads(raw_args)
+        except Exception as ex:
+            tool_result = {"error": f"解析函式參數失敗: {str(ex)}"}
+        else:
+            with span(f"tool:{fn_name}"):
                 try:
-                    if fn_name == "get_location_coordinates":
-                        tool_result = get_location_coordinates(arguments["place_name"])
-                    elif fn_name == "get_multiple_locations":
-                        tool_result = get_multiple_locations(arguments["place_names"])
-                    elif fn_name == "get_buffer_polygon":
-                        radius = float(arguments["radius_km"])
-                        tool_result = get_buffer_polygon(arguments["place_name"], radius)
-                    elif fn_name == "get_multiple_buffer_polygons":
-                        tool_result = get_multiple_buffer_polygons(arguments["locations"])
-                    elif fn_name == "get_polygon_from_coordinates":
-                        tool_result = get_polygon_from_coordinates(arguments["coordinates"])
-                    elif fn_name == "load_geojson":
-                        tool_result = load_geojson(arguments["geojson_data"])
-                    elif fn_name == "calculate_point_by_bearing_distance":
-                        bearing = float(arguments["bearing_degrees"])
-                        distance = float(arguments["distance_km"])
-                        tool_result = calculate_point_by_bearing_distance(arguments["origin_place"], bearing, distance)
-                    elif fn_name == "calculate_bearing_distance_between_points":
-                        tool_result = calculate_bearing_distance_between_points(arguments["origin_place"], arguments["destination_place"])
-                    elif fn_name == "get_line_from_bearing_distance":
-                        bearing = float(arguments["bearing_degrees"])
-                        distance = float(arguments["distance_km"])
-                        tool_result = get_line_from_bearing_distance(arguments["origin_place"], bearing, distance)
-                    elif fn_name == "calculate_multiple_bearings":
-                        tool_result = calculate_multiple_bearings(arguments["origin_place"], arguments["target_places"])
-                    elif fn_name == "find_points_in_bearing_range":
-                        bearing_start = float(arguments["bearing_start"])
-                        bearing_end = float(arguments["bearing_end"])
-                        max_dist = float(arguments["max_distance_km"])
-                        target_places = arguments.get("target_places", None)
-                        tool_result = find_points_in_bearing_range(arguments["origin_place"], bearing_start, bearing_end, max_dist, target_places)
-                    else:
-                        tool_result = {"error": f"未知的工具名稱: {fn_name}"}
+                    tool_result = run_tool(fn_name, arguments)
                 except Exception as ex:
                     tool_result = {"error": f"執行工具時發生錯誤: {str(ex)}"}
 
-            # 把工具執行結果丟回模型，讓下一輪可以使用
-            messages.append({
-                "role": "tool",
-                "tool_call_id": tc.id,
-                "name": fn_name,
-                "content": json.dumps(tool_result, ensure_ascii=False),
-            })
+        # 把工具執行結果丟回模型，讓下一輪可以使用
+        with span("json.dumps:tool_result"):
+            content = json.dumps(tool_result, ensure_ascii=False)
+        turn_messages.append({
+            "role": "tool",
+            "tool_call_id": tc.id,
+            "name": fn_name,
+            "content": content,
+        })
 
-        # ========= 6. 第二次呼叫：請模型根據工具結果產生「最終回答」 =========
+    # ========= 5. 第二次呼叫：請模型根據工具結果產生「最終回答」 =========
+    # 帶相同的 tools 以維持前綴一致（prompt cache），tool_choice="none" 避免無限迴圈
+    if progress:
+        progress(0.85, "產生回答")
+    with span("openai.chat.completions"):
         second_response = client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=messages  # 不再帶 tools，避免無限迴圈
+            model=CHAT_MODEL,
+            messages=_chat_messages(session, turn_messages),
+            tools=TOOLS,
+            tool_choice="none",
         )
+    _add_usage(usage, second_response)
+
+    final_message = second_response.choices[0].message
+    turn_messages.append({"role": "assistant", "content": final_message.content or ""})
+    session.add_turn(turn_messages, usage)
+    return {'response': final_message.content, 'session_id': session.id, 'usage': usage}
+
+
+# 對話助理；body 帶 session_id 即延續該 session 的對話（回傳值含 session_id 與本輪 token 用量）
+@app.route('/generate', methods=['POST'])
+def generate_text():
+    try:
+        data = request.get_json()
+        user_message = (data.get('prompt') or '').strip()
+        if not user_message:
+            return jsonify({'error': '訊息為必填'}), 400
 
-        final_message = second_response.choices[0].message
-        return jsonify({'response': final_message.content}), 200
+        return jsonify(run_chat_turn(user_message, data.get('session_id'))), 200
 
+    except SessionBusy as e:
+        return jsonify({'error': str(e)}), 409
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+# --------------------- 背景工作 ---------------------
+def _generate_job(payload, progress):
+    user_message = (payload.get('prompt') or '').strip()
+    if not user_message:
+        raise ValueError('訊息為必填')
+    return run_chat_turn(user_message, payload.get('session_id'), progress)
+
+
+def _check_chat_session(payload):
+    """帶 session_id 的對話工作：session 必須存在於本節點（否則會在沒有歷史的新 session 上回答）"""
+    session_id = payload.get('session_id')
+    if session_id and chat_sessions.get(session_id) is None:
+        raise ValueError('此對話 session 不存在於本節點（可能已過期），請開始新的對話')
+
+
+def _tool_job(payload, progress):
+    return run_tool(payload["name"], payload.get("arguments") or {})
+
+
+# 優先權數字小者先執行：互動對話 > 單一工具 > 大量距離矩陣
+# 對話不沿用已完成的結果（同一問題稍後再問應依新的上下文回答），只合併重複送出的請求；
+# 同一 session 的工作依序執行，且只由持有該 session 的節點（提交的節點）執行
+job_queue.register("generate", _generate_job, priority=0, reuse_results=False,
+                   serial_key=lambda payload: payload.get('session_id'), local=True, check=_check_chat_session)
+job_queue.register("tool", _tool_job, priority=5)
+job_queue.register("distance_matrix", compute_distance_matrix, priority=9)
+job_queue.start()
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=80)
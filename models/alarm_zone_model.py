@@ -0,0 +1,31 @@
+# models/alarm_zone_model.py
+from sqlalchemy import Column, Integer, String, Text, DateTime
+from datetime import datetime
+import json
+
+from models.database import Base, engine
+
+class AlarmZone(Base):
+    __tablename__ = "alarm_zones"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, nullable=False)        # 警戒區名稱
+    coordinates = Column(Text, nullable=False)   # 外環座標 [[lon, lat], ...]（JSON）
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    @property
+    def ring(self):
+        return json.loads(self.coordinates)
+
+    def to_feature(self):
+        return {
+            "type": "Feature",
+            "properties": {
+                "id": self.id,
+                "name": self.name,
+                "created_at": self.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+            },
+            "geometry": {"type": "Polygon", "coordinates": [self.ring]},
+        }
+
+Base.metadata.create_all(engine)
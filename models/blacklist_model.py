@@ -1,27 +1,107 @@
 # models/blacklist_model.py
 from sqlalchemy import Column, Integer, String, DateTime
-from sqlalchemy.orm import declarative_base, sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy import inspect, text
 from datetime import datetime
-import os
+import threading
 
-DB_PATH = os.path.join(os.getcwd(), "assets", "blacklist.db")
-os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-
-engine = create_engine(
-    f"sqlite:///{DB_PATH}",
-    connect_args={"check_same_thread": False}
-)
-
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
-Base = declarative_base()
+from models.track_store import normalize_name
+# 連線、session 與 SQLite 設定集中於 models/database.py（此處保留舊名稱供既有程式匯入）
+from models.database import DB_PATH, engine, Base, SessionLocal, db_session, read_session, write_session
 
 class BlacklistShip(Base):
     __tablename__ = "blacklist_ships"
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)  # 船名
+    name_norm = Column(String, nullable=True, index=True)  # 正規化船名（比對用）
     note = Column(String, nullable=True)   # 備註
     created_at = Column(DateTime, default=datetime.utcnow)
 
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "note": self.note,
+            "created_at": self.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+
+class BlacklistVersion(Base):
+    """黑名單版本（單一資料列）：每次新增 / 刪除 / 匯入在同一交易內遞增，供各 worker 判斷快照是否過期"""
+    __tablename__ = "blacklist_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+def bump_version(session):
+    """在寫入交易內呼叫"""
+    session.execute(text("UPDATE blacklist_version SET version = version + 1 WHERE id = 1"))
+
+
+def _migrate():
+    """舊版資料庫沒有 name_norm 欄位：補欄位、回填並建立索引"""
+    columns = {c["name"] for c in inspect(engine).get_columns("blacklist_ships")}
+    if "name_norm" in columns:
+        return
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE blacklist_ships ADD COLUMN name_norm VARCHAR"))
+        for sid, name in conn.execute(text("SELECT id, name FROM blacklist_ships")).all():
+            conn.execute(text("UPDATE blacklist_ships SET name_norm = :n WHERE id = :id"),
+                         {"n": normalize_name(name), "id": sid})
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_blacklist_ships_name_norm ON blacklist_ships (name_norm)"))
+
+
+def _init_version():
+    with engine.begin() as conn:
+        conn.execute(text("INSERT OR IGNORE INTO blacklist_version (id, version) VALUES (1, 0)"))
+
+
+class BlacklistSnapshot:
+    """
+    記憶體內的黑名單快照：第一次讀取時載入；之後每次 get() 先讀 blacklist_version（單一資料列），
+    與載入時不同就重新載入，因此其他 worker 行程的新增 / 刪除 / 匯入也會生效。
+    本行程寫入後另呼叫 invalidate() 立即失效。
+    version 即資料庫中的黑名單版本，供衍生快取（例如與即時船位的比對結果）判斷是否需要重算。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items = None
+        self._by_name = None
+        self.version = 0
+
+    @staticmethod
+    def _db_version(session):
+        return session.execute(text("SELECT version FROM blacklist_version WHERE id = 1")).scalar() or 0
+
+    def _load(self, session):
+        ships = session.query(BlacklistShip).order_by(BlacklistShip.id.desc()).all()
+        items = [s.to_dict() for s in ships]
+        by_name = {}
+        for item in items:
+            by_name.setdefault(normalize_name(item["name"]), []).append(item)
+        return items, by_name
+
+    def get(self):
+        """回傳 (version, 依 id 由新到舊的清單, {正規化船名: [項目, ...]})"""
+        with self._lock:
+            with read_session() as session:
+                # 先讀版本再讀資料：兩者之間若有寫入，下次 get() 會看到較新的版本而重新載入
+                version = self._db_version(session)
+                if self._items is None or version != self.version:
+                    self._items, self._by_name = self._load(session)
+                    self.version = version
+            return self.version, self._items, self._by_name
+
+    def invalidate(self):
+        with self._lock:
+            self._items = None
+            self._by_name = None
+
+
 Base.metadata.create_all(engine)
+_migrate()
+_init_version()
+
+blacklist_snapshot = BlacklistSnapshot()
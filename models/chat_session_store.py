@@ -0,0 +1,227 @@
+# models/chat_session_store.py
+"""
+對話 session（記憶體）：以 session id 保存多輪對話，讓聊天面板可以追問而不必重述前文。
+
+送給模型的訊息順序固定為「tools 定義 + system prompt（靜態前綴，逐 byte 不變）→ 歷史 → 本輪」，
+歷史只在尾端追加，供應商端的 prompt cache 能持續命中前綴。
+
+  - 歷史以「輪」為單位保存（user → assistant(tool_calls) → tool 結果 → 最終回答），
+    刪減時整輪處理，不會留下沒有對應 tool_calls 的 tool 訊息
+  - 超過 token 預算時，先把舊輪的工具結果（GeoJSON）換成摘要，仍超過再丟棄最舊的輪；
+    一次刪到預算的 TRIM_TARGET 比例以下，避免每輪都改寫前面的歷史而讓 prompt cache 失效
+  - 閒置超過 TTL 的 session 移除；session 數量超過上限時移除最久未使用者
+  - 每輪記錄 API 回傳的 token 用量（含 cached_tokens）
+  - 同一 session 的多輪依序執行：背景工作由佇列依 session_id 排序（同一 session 最多一個在執行）；
+    呼叫端另在讀取歷史、呼叫模型到 add_turn 之間持有 turn_lock，等待超過 TURN_LOCK_TIMEOUT_S
+    （例如同步 /generate 與背景工作同時處理同一 session）時丟出 SessionBusy
+  - session 只存在於建立它的行程記憶體中，多節點時帶 session_id 的工作只由該節點執行
+"""
+import os
+import json
+import time
+import uuid
+import threading
+from collections import OrderedDict
+
+# 歷史訊息的 token 預算（估計值）
+HISTORY_TOKEN_BUDGET = int(os.environ.get("CHAT_HISTORY_TOKEN_BUDGET", "8000"))
+# 超過預算時刪減到預算的此比例以下
+TRIM_TARGET = 0.6
+SESSION_TTL_S = float(os.environ.get("CHAT_SESSION_TTL_S", "3600"))
+MAX_SESSIONS = int(os.environ.get("CHAT_MAX_SESSIONS", "1000"))
+# 工具結果摘要中最多列出的圖徵名稱數
+SUMMARY_MAX_NAMES = 20
+# 無法摘要的工具結果保留的字元數
+SUMMARY_MAX_CHARS = 500
+MAX_SESSION_ID_LENGTH = 64
+# 每個 session 保留的 token 用量紀錄筆數
+MAX_USAGE_RECORDS = 200
+# 等待同一 session 上一輪完成的秒數上限
+TURN_LOCK_TIMEOUT_S = float(os.environ.get("CHAT_TURN_LOCK_TIMEOUT_S", "30"))
+
+
+class SessionBusy(Exception):
+    pass
+
+
+def estimate_tokens(text):
+    """粗估 token 數：CJK 字元約 1 token，其餘約 4 字元 1 token"""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if ord(ch) >= 0x2E80)
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+def _message_tokens(message):
+    tokens = estimate_tokens(message.get("content") or "") + 4
+    for call in message.get("tool_calls") or []:
+        tokens += estimate_tokens(call["function"]["name"]) + estimate_tokens(call["function"]["arguments"])
+    return tokens
+
+
+def summarize_tool_result(content):
+    """把工具結果（JSON 字串）換成精簡摘要：保留純量欄位、圖徵數與名稱，去掉座標"""
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        data = None
+    if not isinstance(data, dict):
+        text = content or ""
+        return text if len(text) <= SUMMARY_MAX_CHARS else text[:SUMMARY_MAX_CHARS] + "…（已截斷）"
+
+    summary = {"trimmed": True}
+    for key, value in data.items():
+        if isinstance(value, (str, int, float, bool)) or value is None:
+            summary[key] = value
+    features = data.get("features")
+    if isinstance(features, list):
+        names = [(f.get("properties") or {}).get("name") for f in features if isinstance(f, dict)]
+        names = [n for n in names if n]
+        summary["feature_count"] = len(features)
+        summary["feature_names"] = names[:SUMMARY_MAX_NAMES]
+    return json.dumps(summary, ensure_ascii=False)
+
+
+class _Turn:
+    __slots__ = ("messages", "tokens", "compacted")
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.tokens = sum(_message_tokens(m) for m in messages)
+        self.compacted = False
+
+    def compact(self):
+        """把本輪的工具結果換成摘要，回傳節省的 token 數"""
+        if self.compacted:
+            return 0
+        self.compacted = True
+        before = self.tokens
+        self.messages = [
+            {**m, "content": summarize_tool_result(m["content"])} if m.get("role") == "tool" else m
+            for m in self.messages
+        ]
+        self.tokens = sum(_message_tokens(m) for m in self.messages)
+        return before - self.tokens
+
+
+class ChatSession:
+    def __init__(self, session_id):
+        self.id = session_id
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.turns = []
+        self.usage = []
+        self.turn_lock = threading.Lock()
+
+    @property
+    def history_tokens(self):
+        return sum(t.tokens for t in self.turns)
+
+    def history(self):
+        """送給模型的歷史訊息（依時間順序）"""
+        return [m for turn in self.turns for m in turn.messages]
+
+    def add_turn(self, messages, usage=None, budget=HISTORY_TOKEN_BUDGET):
+        self.turns.append(_Turn(list(messages)))
+        self.last_used = time.time()
+        if usage:
+            self.usage.append({"ts": self.last_used, **usage})
+            del self.usage[:-MAX_USAGE_RECORDS]
+        self.trim(budget)
+
+    def trim(self, budget=HISTORY_TOKEN_BUDGET):
+        total = self.history_tokens
+        if total <= budget:
+            return
+        target = budget * TRIM_TARGET
+        # 1. 由舊到新把工具結果換成摘要（最新一輪保留完整結果，供下一輪追問）
+        for turn in self.turns[:-1]:
+            if total <= target:
+                return
+            total -= turn.compact()
+        # 2. 仍超過則丟棄最舊的輪（至少保留最新一輪）
+        while total > target and len(self.turns) > 1:
+            total -= self.turns.pop(0).tokens
+        if total > budget:
+            total -= self.turns[-1].compact()
+
+    def info(self):
+        totals = {}
+        for record in self.usage:
+            for key, value in record.items():
+                if key != "ts" and isinstance(value, (int, float)):
+                    totals[key] = totals.get(key, 0) + value
+        return {
+            "session_id": self.id,
+            "created_at": self.created_at,
+            "last_used": self.last_used,
+            "turns": len(self.turns),
+            "messages": sum(len(t.messages) for t in self.turns),
+            "history_tokens": self.history_tokens,
+            "usage": self.usage,
+            "usage_total": totals,
+        }
+
+
+class ChatSessionStore:
+    def __init__(self, ttl_s=SESSION_TTL_S, max_sessions=MAX_SESSIONS):
+        self.ttl_s = ttl_s
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self.evicted = 0
+        self.expired = 0
+
+    def _expire(self, now):
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest.last_used <= self.ttl_s:
+                break
+            self._sessions.popitem(last=False)
+            self.expired += 1
+
+    def get(self, session_id):
+        with self._lock:
+            self._expire(time.time())
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def get_or_create(self, session_id=None):
+        """沿用既有 session；id 無效或已過期時建立新的 session"""
+        session_id = (session_id or "").strip()[:MAX_SESSION_ID_LENGTH]
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None:
+                session = ChatSession(uuid.uuid4().hex)
+                self._sessions[session.id] = session
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    self.evicted += 1
+            session.last_used = now
+            self._sessions.move_to_end(session.id)
+            return session
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def stats(self):
+        with self._lock:
+            self._expire(time.time())
+            sessions = list(self._sessions.values())
+            return {
+                "sessions": len(sessions),
+                "max_sessions": self.max_sessions,
+                "ttl_s": self.ttl_s,
+                "history_token_budget": HISTORY_TOKEN_BUDGET,
+                "history_tokens": sum(s.history_tokens for s in sessions),
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
+
+
+chat_sessions = ChatSessionStore()
@@ -0,0 +1,464 @@
+# models/columnar_store.py
+"""
+AIS 歷史船位的欄式（columnar）儲存格式。
+
+每天一個分割檔（YYYYMMDD.col），檔案結構：
+  [header 256 bytes][ts × capacity][mmsi × capacity][lat × capacity] ... [shiptype × capacity]
+header 記錄筆數、容量、最小/最大時間與 bbox，查詢時先以 header 剔除分割檔，
+再以 np.memmap 直接對欄位做向量化遮罩，不需要逐筆解析或建立 dict。
+
+設定 AIS_COLUMNAR 時由匯入管線寫入；歷史航跡 API（/api/chinaboat/all、positions_at）在
+serves(query, history_start) 成立時改由 iter_rows(query) 讀取：沒有船名條件（分割檔不存船名），
+且查詢範圍內的歷史資料都已寫入分割檔（最早的分割檔資料不晚於查詢起點或 NDJSON 歷史的最早資料）。
+其餘查詢仍由 track_store 的 NDJSON segment 回答。
+
+    python -m models.columnar_store compact            # 整理（排序、去重、縮小容量）
+    python -m models.columnar_store bench --rows 1000000
+"""
+import os
+import sys
+import time
+import json
+import sqlite3
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+
+COLUMNAR_DIR = os.path.join(os.getcwd(), "assets", "columnar")
+os.makedirs(COLUMNAR_DIR, exist_ok=True)
+
+MAGIC = b"AISC"
+VERSION = 1
+HEADER_SIZE = 256
+MIN_CAPACITY = 4096
+DAY_SECONDS = 86400
+
+HEADER_DTYPE = np.dtype([
+    ("magic", "S4"), ("version", "<u4"),
+    ("capacity", "<u8"), ("count", "<u8"),
+    ("min_ts", "<f8"), ("max_ts", "<f8"),
+    ("min_lon", "<f8"), ("min_lat", "<f8"), ("max_lon", "<f8"), ("max_lat", "<f8"),
+    ("sorted", "u1"),
+])
+
+# 欄位順序即檔案中的排列順序
+COLUMNS = (
+    ("ts", np.dtype("<f8")),
+    ("mmsi", np.dtype("<u4")),
+    ("lat", np.dtype("<f4")),
+    ("lon", np.dtype("<f4")),
+    ("sog", np.dtype("<f4")),
+    ("cog", np.dtype("<f4")),
+    ("shiptype", np.dtype("u1")),
+)
+
+
+def _day_key(ts):
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y%m%d")
+
+
+def _column_offsets(capacity):
+    offsets, pos = {}, HEADER_SIZE
+    for name, dtype in COLUMNS:
+        offsets[name] = pos
+        pos += dtype.itemsize * capacity
+    return offsets, pos
+
+
+def _empty_header(capacity):
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header["magic"] = MAGIC
+    header["version"] = VERSION
+    header["capacity"] = capacity
+    header["min_ts"], header["max_ts"] = np.inf, -np.inf
+    header["min_lon"], header["min_lat"] = np.inf, np.inf
+    header["max_lon"], header["max_lat"] = -np.inf, -np.inf
+    header["sorted"] = 1
+    return header
+
+
+def rows_to_columns(rows):
+    """資料列（dict，與 track_store 相同格式）→ 欄位陣列；缺值以 NaN / 0 表示"""
+    n = len(rows)
+    cols = {name: np.empty(n, dtype=dtype) for name, dtype in COLUMNS}
+    for i, row in enumerate(rows):
+        cols["ts"][i] = row["ts"]
+        cols["mmsi"][i] = row.get("mmsi") or 0
+        cols["lat"][i] = row["lat"]
+        cols["lon"][i] = row["lon"]
+        speed, course = row.get("speed"), row.get("course")
+        cols["sog"][i] = np.nan if speed is None else speed
+        cols["cog"][i] = np.nan if course is None else course
+        shiptype = row.get("shiptype")
+        cols["shiptype"][i] = int(shiptype) if shiptype not in (None, "") and str(shiptype).isdigit() else 0
+    return cols
+
+
+class Partition:
+    """單一天的分割檔"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def read_header(self):
+        header = np.fromfile(self.path, dtype=HEADER_DTYPE, count=1)
+        if header["magic"][0] != MAGIC:
+            raise ValueError(f"不是欄式分割檔: {self.path}")
+        return header
+
+    def columns(self, mode="r"):
+        """回傳 (header, {欄位: memmap})，memmap 只涵蓋已寫入的 count 筆"""
+        header = self.read_header()
+        capacity, count = int(header["capacity"][0]), int(header["count"][0])
+        offsets, _ = _column_offsets(capacity)
+        cols = {}
+        for name, dtype in COLUMNS:
+            if count == 0:
+                cols[name] = np.empty(0, dtype=dtype)
+            else:
+                cols[name] = np.memmap(self.path, dtype=dtype, mode=mode, offset=offsets[name], shape=(count,))
+        return header, cols
+
+    def create(self, capacity):
+        _, total = _column_offsets(capacity)
+        with open(self.path + ".tmp", "wb") as f:
+            f.truncate(total)
+            f.seek(0)
+            f.write(_empty_header(capacity).tobytes())
+        os.replace(self.path + ".tmp", self.path)
+
+    def rewrite(self, cols, capacity, sorted_flag):
+        """以新的容量重寫整個分割檔（擴容或整理時使用）"""
+        count = len(cols["ts"])
+        offsets, total = _column_offsets(capacity)
+        header = _empty_header(capacity)
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.truncate(total)
+        for name, dtype in COLUMNS:
+            if count:
+                mm = np.memmap(tmp, dtype=dtype, mode="r+", offset=offsets[name], shape=(count,))
+                mm[:] = cols[name]
+                mm.flush()
+                del mm
+        _update_header(header, cols, 0, count)
+        header["count"] = count
+        header["sorted"] = 1 if sorted_flag else 0
+        with open(tmp, "r+b") as f:
+            f.write(header.tobytes())
+        os.replace(tmp, self.path)
+
+
+def _update_header(header, cols, start, end):
+    if end <= start:
+        return
+    ts = cols["ts"][start:end]
+    lat, lon = cols["lat"][start:end], cols["lon"][start:end]
+    header["min_ts"] = min(float(header["min_ts"][0]), float(ts.min()))
+    header["max_ts"] = max(float(header["max_ts"][0]), float(ts.max()))
+    header["min_lon"] = min(float(header["min_lon"][0]), float(np.nanmin(lon)))
+    header["max_lon"] = max(float(header["max_lon"][0]), float(np.nanmax(lon)))
+    header["min_lat"] = min(float(header["min_lat"][0]), float(np.nanmin(lat)))
+    header["max_lat"] = max(float(header["max_lat"][0]), float(np.nanmax(lat)))
+
+
+class ColumnarStore:
+    def __init__(self, directory=COLUMNAR_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def _partition(self, day):
+        return Partition(os.path.join(self.directory, f"{day}.col"))
+
+    def partitions(self):
+        return sorted(f[:-4] for f in os.listdir(self.directory) if f.endswith(".col"))
+
+    # ---------- 寫入 ----------
+    def append(self, rows):
+        """匯入管線用的寫入介面（與 TrackStore.append 相同）"""
+        if not rows:
+            return 0
+        groups = {}
+        for row in rows:
+            groups.setdefault(_day_key(row["ts"]), []).append(row)
+        for day, day_rows in groups.items():
+            self.append_columns(day, rows_to_columns(day_rows))
+        return len(rows)
+
+    def append_columns(self, day, cols):
+        n = len(cols["ts"])
+        if n == 0:
+            return
+        with self._lock:
+            part = self._partition(day)
+            if not part.exists():
+                part.create(max(MIN_CAPACITY, n))
+            header = part.read_header()
+            capacity, count = int(header["capacity"][0]), int(header["count"][0])
+
+            if count + n > capacity:
+                _, old = part.columns()
+                merged = {name: np.concatenate([old[name], cols[name]]) for name, _ in COLUMNS}
+                was_sorted = bool(header["sorted"][0]) and (count == 0 or cols["ts"][0] >= old["ts"][-1])
+                del old
+                part.rewrite(merged, max(capacity * 2, count + n), was_sorted and _is_sorted(cols["ts"]))
+                return
+
+            offsets, _ = _column_offsets(capacity)
+            last_ts = None
+            for name, dtype in COLUMNS:
+                mm = np.memmap(part.path, dtype=dtype, mode="r+", offset=offsets[name] + count * dtype.itemsize, shape=(n,))
+                mm[:] = cols[name]
+                mm.flush()
+                del mm
+            if count:
+                last_ts = np.memmap(part.path, dtype="<f8", mode="r", offset=offsets["ts"] + (count - 1) * 8, shape=(1,))[0]
+            if (last_ts is not None and cols["ts"][0] < last_ts) or not _is_sorted(cols["ts"]):
+                header["sorted"] = 0
+            _update_header(header, cols, 0, n)
+            header["count"] = count + n
+            with open(part.path, "r+b") as f:
+                f.write(header.tobytes())
+
+    # ---------- 整理 ----------
+    def compact(self, day):
+        """依 (時間, MMSI) 排序、去除重複、將容量縮到實際筆數"""
+        with self._lock:
+            part = self._partition(day)
+            if not part.exists():
+                return 0
+            header, cols = part.columns()
+            order = np.lexsort((cols["mmsi"], cols["ts"]))
+            data = {name: np.asarray(cols[name])[order] for name, _ in COLUMNS}
+            del cols
+            if len(order):
+                dup = np.zeros(len(order), dtype=bool)
+                dup[1:] = (data["ts"][1:] == data["ts"][:-1]) & (data["mmsi"][1:] == data["mmsi"][:-1])
+                data = {name: arr[~dup] for name, arr in data.items()}
+            part.rewrite(data, max(len(data["ts"]), 1), True)
+            return len(data["ts"])
+
+    def compact_all(self):
+        return {day: self.compact(day) for day in self.partitions()}
+
+    # ---------- 查詢 ----------
+    def scan(self, start=None, end=None, min_lat=None, max_lat=None, min_lon=None, max_lon=None, mmsi=None):
+        """
+        時間 / bbox / MMSI 過濾，回傳 ({欄位: ndarray}, 統計 dict)。
+        已排序的分割檔以 searchsorted 定位時間範圍，其餘條件為向量化遮罩。
+        """
+        results = {name: [] for name, _ in COLUMNS}
+        stats = {"partitions_total": 0, "partitions_pruned": 0, "rows_scanned": 0}
+        for day in self.partitions():
+            stats["partitions_total"] += 1
+            part = self._partition(day)
+            header = part.read_header()
+            h = {k: float(header[k][0]) for k in ("min_ts", "max_ts", "min_lat", "max_lat", "min_lon", "max_lon")}
+            if (int(header["count"][0]) == 0
+                    or (start is not None and h["max_ts"] < start) or (end is not None and h["min_ts"] > end)
+                    or (min_lat is not None and h["max_lat"] < min_lat) or (max_lat is not None and h["min_lat"] > max_lat)
+                    or (min_lon is not None and h["max_lon"] < min_lon) or (max_lon is not None and h["min_lon"] > max_lon)):
+                stats["partitions_pruned"] += 1
+                continue
+
+            header, cols = part.columns()
+            lo, hi = 0, len(cols["ts"])
+            if header["sorted"][0]:
+                if start is not None:
+                    lo = int(np.searchsorted(cols["ts"], start, side="left"))
+                if end is not None:
+                    hi = int(np.searchsorted(cols["ts"], end, side="right"))
+            stats["rows_scanned"] += max(hi - lo, 0)
+            view = {name: cols[name][lo:hi] for name, _ in COLUMNS}
+
+            mask = np.ones(hi - lo, dtype=bool) if hi > lo else np.zeros(0, dtype=bool)
+            if not header["sorted"][0]:
+                if start is not None:
+                    mask &= view["ts"] >= start
+                if end is not None:
+                    mask &= view["ts"] <= end
+            if min_lat is not None:
+                mask &= view["lat"] >= min_lat
+            if max_lat is not None:
+                mask &= view["lat"] <= max_lat
+            if min_lon is not None:
+                mask &= view["lon"] >= min_lon
+            if max_lon is not None:
+                mask &= view["lon"] <= max_lon
+            if mmsi is not None:
+                mask &= view["mmsi"] == mmsi
+            for name, _ in COLUMNS:
+                results[name].append(np.asarray(view[name][mask]))
+
+        out = {
+            name: np.concatenate(results[name]) if results[name] else np.empty(0, dtype=dtype)
+            for name, dtype in COLUMNS
+        }
+        stats["rows_matched"] = len(out["ts"])
+        return out, stats
+
+    # ---------- 歷史查詢後端 ----------
+    def serves(self, query, history_start):
+        """
+        track_store.TrackQuery 能否由分割檔回答：沒有船名條件，且查詢範圍內的資料都已寫入分割檔。
+        history_start 為 NDJSON 歷史最早的時間；分割檔自此（或自查詢起點）之前即開始寫入才算完整
+        """
+        if query.shipname:
+            return False
+        days = self.partitions()
+        if not days:
+            return False
+        header = self._partition(days[0]).read_header()
+        if int(header["count"][0]) == 0:
+            return False
+        since = history_start if query.start is None else max(query.start, history_start)
+        return float(header["min_ts"][0]) <= since
+
+    def iter_rows(self, query):
+        """
+        與 TrackStore.iter_rows 相同語意（依 (時間, MMSI) 排序、套用 cursor），回傳 (rows, ColumnarPlan)；
+        資料列不含船名等靜態欄位
+        """
+        cols, stats = self.scan(query.start, query.end, query.min_lat, query.max_lat,
+                                query.min_lon, query.max_lon, query.mmsi)
+        order = np.lexsort((cols["mmsi"], cols["ts"]))
+        if query.cursor is not None:
+            ts, mmsi = cols["ts"][order], cols["mmsi"][order]
+            cursor_ts, cursor_mmsi = query.cursor
+            order = order[(ts > cursor_ts) | ((ts == cursor_ts) & (mmsi > cursor_mmsi))]
+        return columns_to_rows({name: arr[order] for name, arr in cols.items()}), ColumnarPlan(stats)
+
+
+class ColumnarPlan:
+    """欄式查詢的統計，介面與 track_store.QueryPlan 相同（summary / headers）"""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def summary(self):
+        return {"backend": "columnar", **self.stats}
+
+    def headers(self):
+        return {
+            "X-History-Backend": "columnar",
+            "X-Partitions-Total": str(self.stats["partitions_total"]),
+            "X-Partitions-Pruned": str(self.stats["partitions_pruned"]),
+        }
+
+
+def _is_sorted(arr):
+    return len(arr) < 2 or bool(np.all(arr[1:] >= arr[:-1]))
+
+
+def columns_to_rows(cols):
+    """需要輸出 JSON 時才轉回資料列"""
+    ts, mmsi = cols["ts"].tolist(), cols["mmsi"].tolist()
+    lat, lon = cols["lat"].tolist(), cols["lon"].tolist()
+    sog, cog = cols["sog"].tolist(), cols["cog"].tolist()
+    shiptype = cols["shiptype"].tolist()
+    for i in range(len(ts)):
+        yield {
+            "ts": ts[i], "mmsi": mmsi[i], "lat": lat[i], "lon": lon[i],
+            "speed": None if sog[i] != sog[i] else sog[i],
+            "course": None if cog[i] != cog[i] else cog[i],
+            "shiptype": str(shiptype[i]),
+        }
+
+
+columnar_store = ColumnarStore()
+
+
+# --------------------- 基準測試 ---------------------
+def _synthetic_rows(n, start_ts, days, seed=0):
+    rng = np.random.default_rng(seed)
+    ts = np.sort(start_ts + rng.random(n) * days * DAY_SECONDS)
+    mmsi = rng.integers(412000000, 412005000, n)
+    lat = 20 + rng.random(n) * 10
+    lon = 115 + rng.random(n) * 10
+    sog = rng.random(n) * 20
+    cog = rng.random(n) * 360
+    for i in range(n):
+        yield {"ts": float(ts[i]), "mmsi": int(mmsi[i]), "shipname": f"SHIP {mmsi[i] % 5000}",
+               "lat": float(lat[i]), "lon": float(lon[i]), "speed": float(sog[i]),
+               "course": float(cog[i]), "shiptype": "7"}
+
+
+def benchmark(rows=1_000_000, days=7):
+    """比較：欄式 memmap / NDJSON segment（track_store）/ SQLite 逐列查詢"""
+    from models.track_store import TrackStore, TrackQuery
+
+    start_ts = datetime(2025, 1, 1, tzinfo=timezone.utc).timestamp()
+    q = dict(start=start_ts + 2 * DAY_SECONDS, end=start_ts + 3 * DAY_SECONDS,
+             min_lat=22.0, max_lat=25.0, min_lon=118.0, max_lon=122.0)
+    report = {"rows": rows}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        col_dir, seg_dir = os.path.join(tmp, "col"), os.path.join(tmp, "seg")
+        os.makedirs(col_dir)
+        os.makedirs(seg_dir)
+        col, seg = ColumnarStore(col_dir), TrackStore(seg_dir)
+        db = sqlite3.connect(os.path.join(tmp, "bench.db"))
+        db.execute("CREATE TABLE pos (ts REAL, mmsi INTEGER, shipname TEXT, lat REAL, lon REAL, speed REAL, course REAL, shiptype TEXT)")
+        db.execute("CREATE INDEX ix_pos_ts ON pos (ts)")
+
+        batch = []
+        for row in _synthetic_rows(rows, start_ts, days):
+            batch.append(row)
+            if len(batch) == 50000:
+                col.append(batch)
+                seg.append(batch)
+                db.executemany("INSERT INTO pos VALUES (:ts,:mmsi,:shipname,:lat,:lon,:speed,:course,:shiptype)", batch)
+                batch = []
+        if batch:
+            col.append(batch)
+            seg.append(batch)
+            db.executemany("INSERT INTO pos VALUES (:ts,:mmsi,:shipname,:lat,:lon,:speed,:course,:shiptype)", batch)
+        db.commit()
+        col.compact_all()
+
+        t0 = time.perf_counter()
+        cols, stats = col.scan(**q)
+        report["columnar_seconds"] = time.perf_counter() - t0
+        report["columnar_matched"] = stats["rows_matched"]
+
+        t0 = time.perf_counter()
+        matched = sum(1 for _ in seg.iter_rows(TrackQuery(**q)))
+        report["ndjson_seconds"] = time.perf_counter() - t0
+        report["ndjson_matched"] = matched
+
+        t0 = time.perf_counter()
+        db.row_factory = sqlite3.Row
+        cur = db.execute("SELECT * FROM pos WHERE ts BETWEEN ? AND ? AND lat BETWEEN ? AND ? AND lon BETWEEN ? AND ?",
+                         (q["start"], q["end"], q["min_lat"], q["max_lat"], q["min_lon"], q["max_lon"]))
+        matched = sum(1 for r in cur if dict(r))
+        report["sqlite_seconds"] = time.perf_counter() - t0
+        report["sqlite_matched"] = matched
+        db.close()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AIS 欄式歷史資料工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("compact", help="整理所有分割檔")
+    bench = sub.add_parser("bench", help="與 NDJSON / SQLite 比較查詢速度")
+    bench.add_argument("--rows", type=int, default=1_000_000)
+    bench.add_argument("--days", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    if args.command == "compact":
+        result = columnar_store.compact_all()
+    else:
+        result = benchmark(args.rows, args.days)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+# models/database.py
+"""
+SQLite 資料庫層（黑名單、警戒區共用 assets/blacklist.db）。
+
+  - 每條連線設定 WAL、synchronous、busy_timeout：讀取不會擋住寫入，寫入遇到鎖會等待而不是立刻失敗
+  - 連線池大小固定（POOL_SIZE + MAX_OVERFLOW），避免同時開啟過多連線
+  - 讀取：db_session（scoped_session，每個 request 一個，request 結束時 remove_session() 自動關閉）
+    或 read_session()（背景執行緒用）；讀取交易為 DEFERRED，不會取得寫入鎖
+  - 寫入：write_session()，以 BEGIN IMMEDIATE 一開始就取得寫入鎖（避免讀轉寫時的鎖升級衝突），
+    結束時自動 commit / rollback / close
+
+可用環境變數覆寫 SQLITE_JOURNAL_MODE、SQLITE_SYNCHRONOUS、SQLITE_BUSY_TIMEOUT_MS（基準測試比較設定用）。
+"""
+import os
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import declarative_base, sessionmaker, scoped_session
+
+DB_PATH = os.path.join(os.getcwd(), "assets", "blacklist.db")
+os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+
+JOURNAL_MODE = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+# WAL 模式下 NORMAL 仍可保證資料庫一致，只有斷電時可能遺失最後幾筆交易
+SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+POOL_SIZE = 8
+MAX_OVERFLOW = 8
+POOL_TIMEOUT_S = 10
+
+engine = create_engine(
+    f"sqlite:///{DB_PATH}",
+    connect_args={"check_same_thread": False, "timeout": BUSY_TIMEOUT_MS / 1000},
+    pool_size=POOL_SIZE,
+    max_overflow=MAX_OVERFLOW,
+    pool_timeout=POOL_TIMEOUT_S,
+)
+
+
+@event.listens_for(engine, "connect")
+def _on_connect(dbapi_connection, connection_record):
+    # 交由下方 begin 事件自行送出 BEGIN（pysqlite 預設的隱式交易無法指定 IMMEDIATE）
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+@event.listens_for(engine, "begin")
+def _on_begin(conn):
+    mode = conn.get_execution_options().get("sqlite_begin", "DEFERRED")
+    conn.exec_driver_sql(f"BEGIN {mode}")
+
+
+Base = declarative_base()
+
+SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+WriteSessionLocal = sessionmaker(bind=engine.execution_options(sqlite_begin="IMMEDIATE"),
+                                 autoflush=False, autocommit=False, expire_on_commit=False)
+
+# request 範圍的讀取 session（Flask 每個 request 在同一執行緒內處理）
+db_session = scoped_session(SessionLocal)
+
+
+def remove_session(exc=None):
+    """request 結束時呼叫（app.teardown_appcontext），歸還連線"""
+    db_session.remove()
+
+
+@contextmanager
+def read_session():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@contextmanager
+def write_session():
+    session = WriteSessionLocal()
+    try:
+        yield session
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        session.close()
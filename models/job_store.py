@@ -0,0 +1,415 @@
+# models/job_store.py
+"""
+背景工作的佇列與結果儲存。
+
+  MemoryJobStore：單一行程內（預設），優先權 heap + Condition，取工作與進度更新皆即時喚醒
+  SqliteJobStore：以本機 SQLite 檔模擬多節點共用的 broker（JOB_BROKER=sqlite:///path/jobs.db），
+                  多個行程指向同一個檔案即可分工；以 BEGIN IMMEDIATE 搶工作，等待時定時輪詢
+
+兩者介面相同：submit / claim / heartbeat / progress / finish / cancel / get / wait / depth / purge。
+工作以 dict 表示：id、kind、payload、priority（數字小者先執行）、dedupe_key、status、
+progress（0–1）、message、result、error、submitted / started / finished / expires（epoch 秒）、version、
+claim（取得工作時發給 worker 的權杖）、serial_key、node。
+
+依序執行與節點綁定（claim 時判斷）：
+  - serial_key 相同的工作同時最多一個在執行（例如同一對話 session 的多輪），其餘留在佇列，
+    不會佔住 worker 等待
+  - node 不為 None 的工作只由該節點取走（例如對話 session 只存在於建立它的行程記憶體中）；
+    SQLite broker 上此類工作的租約逾時（節點已中止）時標記為失敗而不重新排隊
+
+heartbeat / progress / finish 皆需帶 claim：工作逾時被重新排隊、由其他 worker 取走後，
+原 worker 的更新與結果不再寫入（回傳 False）。
+
+重複提交：dedupe_key 相同且狀態在 reusable 內（預設為排隊、執行中、已完成且未過期）的工作直接回傳既有工作。
+"""
+import os
+import json
+import time
+import uuid
+import heapq
+import sqlite3
+import itertools
+import threading
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINAL_STATES = (DONE, FAILED, CANCELLED)
+# 失敗 / 取消的工作不參與去重（可重新提交）
+REUSABLE_STATES = (QUEUED, RUNNING, DONE)
+
+
+def new_job(job_id, kind, payload, priority, dedupe_key, serial_key=None, node=None):
+    return {
+        "id": job_id,
+        "kind": kind,
+        "payload": payload,
+        "priority": priority,
+        "dedupe_key": dedupe_key,
+        "status": QUEUED,
+        "progress": 0.0,
+        "message": None,
+        "result": None,
+        "error": None,
+        "submitted": time.time(),
+        "started": None,
+        "finished": None,
+        "expires": None,
+        "version": 0,
+        "claim": None,
+        "serial_key": serial_key,
+        "node": node,
+    }
+
+
+class QueueFull(Exception):
+    pass
+
+
+# --------------------- 單一行程 ---------------------
+class MemoryJobStore:
+    # 單一行程內 worker 不會消失而不回報，不需租約與心跳
+    lease_s = None
+
+    def __init__(self, max_queued):
+        self.max_queued = max_queued
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._jobs = {}
+        self._by_key = {}
+
+    def submit(self, job, reusable=REUSABLE_STATES):
+        """回傳 (job, deduplicated)"""
+        with self._cond:
+            self._purge(time.time())
+            existing = self._jobs.get(self._by_key.get(job["dedupe_key"]))
+            if existing is not None and existing["status"] in reusable:
+                return dict(existing), True
+            if self._queued_count() >= self.max_queued:
+                raise QueueFull(f"佇列已滿（{self.max_queued}）")
+            self._jobs[job["id"]] = job
+            self._by_key[job["dedupe_key"]] = job["id"]
+            heapq.heappush(self._heap, (job["priority"], next(self._seq), job["id"]))
+            self._cond.notify_all()
+            return dict(job), False
+
+    def _queued_count(self):
+        return sum(1 for _, _, jid in self._heap if self._jobs.get(jid, {}).get("status") == QUEUED)
+
+    def claim(self, timeout, node=None):
+        """取出此節點可執行、優先權最高的工作並標記為 running；timeout 內沒有工作回傳 None"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                busy = {j["serial_key"] for j in self._jobs.values()
+                        if j["status"] == RUNNING and j["serial_key"] is not None}
+                deferred, claimed = [], None
+                while self._heap:
+                    entry = heapq.heappop(self._heap)
+                    job = self._jobs.get(entry[2])
+                    if job is None or job["status"] != QUEUED:
+                        continue
+                    if job["node"] not in (None, node) or job["serial_key"] in busy:
+                        # 暫不可執行（同 serial_key 的工作執行中 / 屬於其他節點）：留在佇列
+                        deferred.append(entry)
+                        continue
+                    claimed = job
+                    break
+                for entry in deferred:
+                    heapq.heappush(self._heap, entry)
+                if claimed is not None:
+                    claimed.update(status=RUNNING, started=time.time(), claim=uuid.uuid4().hex)
+                    claimed["version"] += 1
+                    self._cond.notify_all()
+                    return dict(claimed)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def _update(self, job_id, expected, claim=None, **fields):
+        """工作狀態仍為 expected（且 claim 相符）時更新欄位；呼叫端需持有 self._cond"""
+        job = self._jobs.get(job_id)
+        if job is None or job["status"] != expected or (claim is not None and job["claim"] != claim):
+            return False
+        job.update(fields)
+        job["version"] += 1
+        self._cond.notify_all()
+        return True
+
+    def heartbeat(self, job_id, claim):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return job is not None and job["status"] == RUNNING and job["claim"] == claim
+
+    def progress(self, job_id, claim, fraction, message=None):
+        with self._cond:
+            return self._update(job_id, RUNNING, claim, progress=round(min(max(fraction, 0.0), 1.0), 3),
+                                message=message)
+
+    def finish(self, job_id, claim, status, result=None, error=None, ttl_s=0):
+        now = time.time()
+        fields = {"status": status, "result": result, "error": error, "finished": now, "expires": now + ttl_s}
+        if status == DONE:
+            fields["progress"] = 1.0
+        with self._cond:
+            return self._update(job_id, RUNNING, claim, **fields)
+
+    def cancel(self, job_id, ttl_s=0):
+        now = time.time()
+        with self._cond:
+            return self._update(job_id, QUEUED, status=CANCELLED, finished=now, expires=now + ttl_s)
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def wait(self, job_id, version, timeout):
+        """等到工作的 version 改變（或逾時），回傳最新狀態"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None or job["version"] != version:
+                    return dict(job) if job is not None else None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return dict(job)
+                self._cond.wait(remaining)
+
+    def depth(self):
+        """各優先權排隊中的工作數與執行中的工作數"""
+        with self._cond:
+            queued = {}
+            running = 0
+            for job in self._jobs.values():
+                if job["status"] == QUEUED:
+                    queued[job["priority"]] = queued.get(job["priority"], 0) + 1
+                elif job["status"] == RUNNING:
+                    running += 1
+            return {"queued": dict(sorted(queued.items())), "running": running, "stored": len(self._jobs)}
+
+    def purge(self):
+        with self._cond:
+            return self._purge(time.time())
+
+    def _purge(self, now):
+        expired = [jid for jid, job in self._jobs.items() if job["expires"] is not None and job["expires"] <= now]
+        for jid in expired:
+            job = self._jobs.pop(jid)
+            if self._by_key.get(job["dedupe_key"]) == jid:
+                del self._by_key[job["dedupe_key"]]
+        return len(expired)
+
+
+# --------------------- 本機 broker（多行程共用 SQLite 檔） ---------------------
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    dedupe_key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    submitted REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    expires REAL,
+    heartbeat REAL,
+    version INTEGER NOT NULL DEFAULT 0,
+    claim TEXT,
+    serial_key TEXT,
+    node TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_jobs_queue ON jobs (status, priority, submitted);
+CREATE INDEX IF NOT EXISTS ix_jobs_dedupe ON jobs (dedupe_key);
+"""
+_JSON_FIELDS = ("payload", "result")
+
+
+class SqliteJobStore:
+    def __init__(self, path, max_queued, poll_s=0.2, lease_s=600):
+        self.path = path
+        self.max_queued = max_queued
+        self.poll_s = poll_s
+        # 執行中的工作超過此秒數沒有心跳視為節點已中止，重新排入佇列（worker 每 lease_s / 3 秒送一次心跳）
+        self.lease_s = lease_s
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        # 舊版建立的檔案沒有 claim / serial_key / node 欄位
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for name in ("claim", "serial_key", "node"):
+            if name not in columns:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} TEXT")
+
+    def _conn(self):
+        """每個執行緒一條連線（autocommit，讀取不取得寫入鎖）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _connect(self):
+        return _Transaction(self._conn())
+
+    @staticmethod
+    def _row(row):
+        if row is None:
+            return None
+        job = dict(row)
+        job.pop("heartbeat", None)
+        for name in _JSON_FIELDS:
+            if job[name] is not None:
+                job[name] = json.loads(job[name])
+        return job
+
+    def submit(self, job, reusable=REUSABLE_STATES):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE expires IS NOT NULL AND expires <= ?", (now,))
+            row = conn.execute(
+                f"SELECT * FROM jobs WHERE dedupe_key = ? AND status IN ({','.join('?' * len(reusable))}) "
+                "ORDER BY submitted DESC LIMIT 1",
+                (job["dedupe_key"], *reusable),
+            ).fetchone()
+            if row is not None:
+                return self._row(row), True
+            queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+            if queued >= self.max_queued:
+                raise QueueFull(f"佇列已滿（{self.max_queued}）")
+            conn.execute(
+                "INSERT INTO jobs (id, kind, payload, priority, dedupe_key, status, submitted, version, "
+                "serial_key, node) VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?, ?)",
+                (job["id"], job["kind"], json.dumps(job["payload"], ensure_ascii=False),
+                 job["priority"], job["dedupe_key"], QUEUED, job["submitted"], job["serial_key"], job["node"]),
+            )
+        return dict(job), False
+
+    def claim(self, timeout, node=None):
+        deadline = time.monotonic() + timeout
+        while True:
+            now = time.time()
+            with self._connect() as conn:
+                # 心跳逾時的工作重新排隊；綁定節點的工作無法在其他節點重跑，標記為失敗
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, finished = ?, expires = ?, claim = NULL, "
+                    "version = version + 1 WHERE status = ? AND heartbeat < ? AND node IS NOT NULL",
+                    (FAILED, "執行節點已中止", now, now + self.lease_s, RUNNING, now - self.lease_s),
+                )
+                conn.execute(
+                    "UPDATE jobs SET status = ?, started = NULL, claim = NULL, version = version + 1 "
+                    "WHERE status = ? AND heartbeat < ?",
+                    (QUEUED, RUNNING, now - self.lease_s),
+                )
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE status = ? AND (node IS NULL OR node = ?) "
+                    "AND (serial_key IS NULL OR serial_key NOT IN "
+                    "     (SELECT serial_key FROM jobs WHERE status = ? AND serial_key IS NOT NULL)) "
+                    "ORDER BY priority, submitted LIMIT 1",
+                    (QUEUED, node, RUNNING),
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, started = ?, heartbeat = ?, claim = ?, version = version + 1 "
+                        "WHERE id = ?",
+                        (RUNNING, now, now, uuid.uuid4().hex, row["id"]),
+                    )
+                    return self._row(conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone())
+            if time.monotonic() + self.poll_s > deadline:
+                return None
+            time.sleep(self.poll_s)
+
+    def heartbeat(self, job_id, claim):
+        """延長租約（不改 version，等待中的 watch 不會被喚醒）；工作已不屬於此 claim 時回傳 False"""
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET heartbeat = ? WHERE id = ? AND status = ? AND claim = ?",
+                (time.time(), job_id, RUNNING, claim),
+            ).rowcount > 0
+
+    def progress(self, job_id, claim, fraction, message=None):
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET progress = ?, message = ?, heartbeat = ?, version = version + 1 "
+                "WHERE id = ? AND status = ? AND claim = ?",
+                (round(min(max(fraction, 0.0), 1.0), 3), message, time.time(), job_id, RUNNING, claim),
+            ).rowcount > 0
+
+    def finish(self, job_id, claim, status, result=None, error=None, ttl_s=0):
+        now = time.time()
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished = ?, expires = ?, "
+                "progress = CASE WHEN ? = 'done' THEN 1 ELSE progress END, version = version + 1 "
+                "WHERE id = ? AND status = ? AND claim = ?",
+                (status, json.dumps(result, ensure_ascii=False) if result is not None else None,
+                 error, now, now + ttl_s, status, job_id, RUNNING, claim),
+            ).rowcount > 0
+
+    def cancel(self, job_id, ttl_s=0):
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, finished = ?, expires = ?, version = version + 1 "
+                "WHERE id = ? AND status = ?",
+                (CANCELLED, now, now + ttl_s, job_id, QUEUED),
+            )
+            return cursor.rowcount > 0
+
+    def get(self, job_id):
+        return self._row(self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def wait(self, job_id, version, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job["version"] != version or time.monotonic() >= deadline:
+                return job
+            time.sleep(self.poll_s)
+
+    def depth(self):
+        conn = self._conn()
+        queued = dict(conn.execute(
+            "SELECT priority, COUNT(*) FROM jobs WHERE status = ? GROUP BY priority ORDER BY priority", (QUEUED,)
+        ).fetchall())
+        running = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (RUNNING,)).fetchone()[0]
+        stored = conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+        return {"queued": queued, "running": running, "stored": stored}
+
+    def purge(self):
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM jobs WHERE expires IS NOT NULL AND expires <= ?", (time.time(),)).rowcount
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE … COMMIT / ROLLBACK（搶工作時避免兩個節點取到同一筆）"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+def create_job_store(broker, max_queued):
+    """broker：None / "memory" → MemoryJobStore；"sqlite:///path/jobs.db" → SqliteJobStore"""
+    if not broker or broker == "memory":
+        return MemoryJobStore(max_queued)
+    if broker.startswith("sqlite:///"):
+        return SqliteJobStore(broker[len("sqlite:///"):], max_queued)
+    raise ValueError(f"不支援的 JOB_BROKER: {broker}")
@@ -0,0 +1,836 @@
+# models/shared_state.py
+"""
+多個 WSGI worker 行程共用的熱資料（multiprocessing.shared_memory），避免每個 worker 各存一份、各自過期：
+
+  - 最新船位表（SharedLatestPositionStore，介面與 models/vessel_store.LatestPositionStore 相同）
+  - 警戒區內船舶（ZoneMembershipTable，由 services/geofence.py 發佈）
+  - 地名 → 座標快取（GeocodeCache）
+
+設定 SHARED_STATE_NAME=<名稱> 時啟用。由單一寫入行程（python -m services.ingest serve）建立共享區段並寫入
+船位與警戒區狀態；web worker 只讀取，第一次使用時才連上（寫入行程尚未啟動時視為空表）。
+
+每個區段是固定格式：[header 128 bytes][欄位 × capacity]...（欄式，與 models/columnar_store.py 相同排列），
+以 seqlock 保護：
+  寫入端：seq 加 1（奇數）→ 寫入 → generation 加 1 → seq 再加 1（偶數）
+  讀取端：讀 seq（奇數表示寫入中，重試）→ 複製需要的欄位 → 再讀 seq，前後不同則重試
+讀取端不取鎖、不阻擋寫入端；generation 只需讀一個整數即可判斷資料是否更新（供圖磚、黑名單比對等快取使用）。
+columns() 另提供零複製的唯讀 NumPy view，適合自行以 generation 驗證的向量化計算。
+（依賴 x86-64 的記憶體順序與對齊 8 bytes 寫入的原子性）
+
+地名快取的寫入來自各 worker，寫入時以檔案鎖（fcntl.flock）序列化，讀取仍走 seqlock；
+平台不支援 flock 或共享區段不存在時，退回行程內 LRU。
+
+    python -m models.shared_state bench   # 寫入行程持續更新時，另一行程的讀取延遲與一致性檢查
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from multiprocessing import shared_memory
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows：地名快取只使用行程內 LRU
+    fcntl = None
+
+SHARED_STATE_NAME = os.environ.get("SHARED_STATE_NAME") or None
+VESSEL_CAPACITY = int(os.environ.get("SHARED_VESSEL_CAPACITY", "65536"))
+ZONE_MEMBERSHIP_CAPACITY = int(os.environ.get("SHARED_ZONE_CAPACITY", "65536"))
+GEOCODE_CACHE_SIZE = int(os.environ.get("GEOCODE_CACHE_SIZE", "4096"))
+GEOCODE_TTL_S = float(os.environ.get("GEOCODE_TTL_S", "86400"))
+# 讀取端重試的時間上限（寫入端在寫入中途結束時，seq 會停在奇數）
+READ_TIMEOUT_S = 0.5
+# 共享區段不存在時，重新嘗試連上的間隔（秒）
+ATTACH_RETRY_S = 1.0
+# 地名快取的探測長度（開放定址）
+GEOCODE_PROBE = 8
+
+MAGIC = b"AISH"
+HEADER_SIZE = 128
+HEADER_DTYPE = np.dtype([
+    ("magic", "S4"), ("layout", "<u4"), ("state", "<u4"), ("_pad", "<u4"),
+    ("capacity", "<u8"), ("count", "<u8"),
+    ("seq", "<u8"), ("generation", "<u8"),
+    ("writer_pid", "<u8"), ("updated_at", "<f8"),
+    # 讀取端可寫的通知計數（例如要求寫入行程重新載入警戒區）
+    ("signal", "<u8"),
+])
+LIVE, CLOSED = 1, 2
+
+
+def _layout_id(columns):
+    return zlib.crc32(repr([(name, dtype.str) for name, dtype in columns]).encode())
+
+
+def _column_offsets(columns, capacity):
+    offsets, pos = {}, HEADER_SIZE
+    for name, dtype in columns:
+        offsets[name] = pos
+        pos += dtype.itemsize * capacity
+        pos = (pos + 7) // 8 * 8
+    return offsets, pos
+
+
+def _attach(name):
+    """連上既有區段；讀取端不可讓 resource_tracker 在行程結束時刪除區段"""
+    try:
+        return shared_memory.SharedMemory(name=name, create=False, track=False)
+    except TypeError:  # Python < 3.13 沒有 track 參數：連上時暫時停用登記
+        from multiprocessing import resource_tracker
+        register = resource_tracker.register
+        resource_tracker.register = lambda *args, **kwargs: None
+        try:
+            return shared_memory.SharedMemory(name=name, create=False)
+        finally:
+            resource_tracker.register = register
+
+
+def _unlink_attached(shm):
+    """刪除以 _attach() 連上的區段（Python < 3.13 的 unlink 會向 resource_tracker 取消登記，先補登記）"""
+    if not hasattr(shm, "_track"):
+        from multiprocessing import resource_tracker
+        resource_tracker.register(shm._name, "shared_memory")
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+
+
+class SeqlockSegment:
+    """固定格式的共享區段：header + 欄位陣列，以 seqlock 保護"""
+
+    def __init__(self, shm, columns, writer):
+        self.shm = shm
+        self.name = shm.name
+        self.columns_spec = columns
+        self.writer = writer
+        buf = shm.buf
+        header = np.ndarray((1,), dtype=HEADER_DTYPE, buffer=buf)
+        if header["magic"][0] != MAGIC or header["layout"][0] != _layout_id(columns):
+            raise ValueError(f"共享區段格式不符: {shm.name}")
+        self.capacity = int(header["capacity"][0])
+        # header 欄位各自一個 view，讀寫單一整數不必經過結構陣列
+        self._h = {name: np.ndarray((1,), dtype=HEADER_DTYPE.fields[name][0], buffer=buf,
+                                    offset=HEADER_DTYPE.fields[name][1])
+                   for name in ("state", "count", "seq", "generation", "writer_pid", "updated_at", "signal")}
+        offsets, _ = _column_offsets(columns, self.capacity)
+        self._offsets = offsets
+        self.cols = {}
+        for name, dtype in columns:
+            col = np.ndarray((self.capacity,), dtype=dtype, buffer=buf, offset=offsets[name])
+            if not writer:
+                col.flags.writeable = False
+            self.cols[name] = col
+
+    @classmethod
+    def create(cls, name, columns, capacity, generation=0):
+        """建立（或取代）區段；同名的舊區段標記為 CLOSED 後刪除，讀取端會自動改連新區段"""
+        try:
+            old = _attach(name)
+        except FileNotFoundError:
+            pass
+        else:
+            np.ndarray((1,), dtype="<u4", buffer=old.buf, offset=HEADER_DTYPE.fields["state"][1])[0] = CLOSED
+            old.close()
+            _unlink_attached(old)
+        _, total = _column_offsets(columns, capacity)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=total)
+        header = np.ndarray((1,), dtype=HEADER_DTYPE, buffer=shm.buf)
+        header[0] = np.zeros((), dtype=HEADER_DTYPE)
+        header["magic"] = MAGIC
+        header["layout"] = _layout_id(columns)
+        header["state"] = LIVE
+        header["capacity"] = capacity
+        # generation 以建立時間起算：寫入行程重啟後不會與舊值重複（快取鍵不會誤用）
+        header["generation"] = generation
+        header["writer_pid"] = os.getpid()
+        del header
+        return cls(shm, columns, writer=True)
+
+    @classmethod
+    def attach(cls, name, columns):
+        return cls(_attach(name), columns, writer=False)
+
+    # ---------- header ----------
+    @property
+    def generation(self):
+        return int(self._h["generation"][0])
+
+    @property
+    def count(self):
+        return int(self._h["count"][0])
+
+    @property
+    def closed(self):
+        return int(self._h["state"][0]) != LIVE
+
+    @property
+    def signal(self):
+        return int(self._h["signal"][0])
+
+    def bump_signal(self):
+        """讀取端可呼叫；並發時可能少算一次，但值一定會改變"""
+        self._h["signal"][0] += 1
+
+    def writable(self, name):
+        """讀取端也可寫入的欄位 view（只用於不需 seqlock 保護的單一數值，或已另外取得寫入權時）"""
+        dtype = dict(self.columns_spec)[name]
+        return np.ndarray((self.capacity,), dtype=dtype, buffer=self.shm.buf, offset=self._offsets[name])
+
+    # ---------- seqlock ----------
+    def write(self):
+        return _WriteSection(self)
+
+    def read(self, fn):
+        """在 seqlock 保護下執行 fn(count)（fn 應複製所需資料）；寫入端長時間未完成時回傳 None"""
+        seq = self._h["seq"]
+        deadline = None
+        while True:
+            before = int(seq[0])
+            if not before & 1:
+                result = fn(int(self._h["count"][0]))
+                if int(seq[0]) == before:
+                    return result
+            if deadline is None:
+                deadline = time.monotonic() + READ_TIMEOUT_S
+            elif time.monotonic() > deadline:
+                return None
+            time.sleep(0)
+
+    def close(self):
+        self.cols = {}
+        self._h = {}
+        try:
+            self.shm.close()
+        except BufferError:
+            # 仍有外部持有的 view，交給 GC
+            pass
+
+    def destroy(self):
+        """寫入端結束時呼叫：標記 CLOSED 並刪除區段"""
+        self._h["state"][0] = CLOSED
+        self.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class _WriteSection:
+    __slots__ = ("segment",)
+
+    def __init__(self, segment):
+        self.segment = segment
+
+    def __enter__(self):
+        self.segment._h["seq"][0] += 1
+        return self.segment
+
+    def __exit__(self, *exc):
+        h = self.segment._h
+        h["generation"][0] += 1
+        h["updated_at"][0] = time.time()
+        h["seq"][0] += 1
+        return False
+
+
+class _SharedTable:
+    """共享區段的持有者：寫入端 open_writer() 建立區段，讀取端第一次使用時才連上"""
+
+    COLUMNS = ()
+
+    def __init__(self, name, capacity):
+        self.name = name
+        self.capacity = capacity
+        self.writer = False
+        self._segment = None
+        self._attach_lock = threading.Lock()
+        self._next_attach = 0.0
+
+    def open_writer(self):
+        self._segment = SeqlockSegment.create(self.name, self.COLUMNS, self.capacity,
+                                              generation=int(time.time() * 1000))
+        self.writer = True
+        return self
+
+    def close(self):
+        segment, self._segment = self._segment, None
+        if segment is None:
+            return
+        if self.writer:
+            segment.destroy()
+        else:
+            segment.close()
+
+    def segment(self):
+        """目前可用的區段；讀取端在區段不存在或已被取代時重新連上（有間隔限制），仍不可用時回傳 None"""
+        segment = self._segment
+        if segment is not None and (self.writer or not segment.closed):
+            return segment
+        now = time.monotonic()
+        with self._attach_lock:
+            if self._segment is not segment:
+                return self._segment
+            if now < self._next_attach:
+                return None
+            self._next_attach = now + ATTACH_RETRY_S
+            try:
+                fresh = SeqlockSegment.attach(self.name, self.COLUMNS)
+            except (FileNotFoundError, ValueError):
+                fresh = None
+            if segment is not None:
+                segment.close()
+            self._segment = fresh
+            return fresh
+
+    def info(self):
+        segment = self.segment()
+        if segment is None:
+            return {"name": self.name, "attached": False}
+        return {
+            "name": self.name,
+            "attached": True,
+            "role": "writer" if self.writer else "reader",
+            "count": segment.count,
+            "capacity": segment.capacity,
+            "generation": segment.generation,
+            "writer_pid": int(segment._h["writer_pid"][0]),
+            "updated_at": float(segment._h["updated_at"][0]),
+            "bytes": segment.shm.size,
+        }
+
+
+# --------------------- 最新船位表 ---------------------
+def _encode(value, width):
+    if value in (None, ""):
+        return b""
+    return str(value).encode("utf-8")[:width]
+
+
+def _decode_column(col):
+    """S 欄位 → str / None；AIS 文字皆為 ASCII，整欄轉換，含非 ASCII 時才逐筆以 UTF-8 解碼"""
+    try:
+        values = col.astype(f"U{col.dtype.itemsize}").tolist()
+    except UnicodeDecodeError:
+        values = [v.decode("utf-8", "ignore") for v in col.tolist()]
+    return [v or None for v in values]
+
+
+def _float(value):
+    return np.nan if value is None else float(value)
+
+
+def _nullable(values):
+    return [None if v != v else v for v in values]
+
+
+class SharedLatestPositionStore(_SharedTable):
+    """
+    最新船位表的共享記憶體版本（介面同 LatestPositionStore）。
+    寫入端另存 MMSI → 列號索引與靜態資料；表滿時覆蓋最舊的船位。
+    """
+    COLUMNS = (
+        ("mmsi", np.dtype("<u4")),
+        ("ts", np.dtype("<f8")),
+        ("lat", np.dtype("<f8")),
+        ("lon", np.dtype("<f8")),
+        ("speed", np.dtype("<f4")),
+        ("course", np.dtype("<f4")),
+        ("heading", np.dtype("<f4")),
+        ("ais_shiptype", np.dtype("<i2")),
+        ("imo", np.dtype("<i8")),
+        ("shiptype", np.dtype("S4")),
+        ("shipname", np.dtype("S40")),
+        ("destination", np.dtype("S40")),
+        ("callsign", np.dtype("S12")),
+    )
+    STRING_WIDTHS = {"shiptype": 4, "shipname": 40, "destination": 40, "callsign": 12}
+    # 有值時才出現在資料列中的欄位（與記憶體版相同：只有收過靜態訊息的船才有）
+    OPTIONAL_FIELDS = ("ais_shiptype", "callsign", "imo")
+    shared = True
+
+    def __init__(self, name, capacity=VESSEL_CAPACITY):
+        super().__init__(name, capacity)
+        self._lock = threading.Lock()
+        self._index = {}
+        self._static = {}
+        self._snapshot_cache = None
+        self.evicted = 0
+
+    def __len__(self):
+        segment = self.segment()
+        return 0 if segment is None else segment.count
+
+    @property
+    def version(self):
+        segment = self.segment()
+        return 0 if segment is None else segment.generation
+
+    # ---------- 寫入端 ----------
+    def _require_writer(self):
+        if not self.writer:
+            raise RuntimeError("共享船位表只能由匯入行程（python -m services.ingest serve）寫入")
+
+    def update_static(self, messages):
+        from models.vessel_store import STATIC_FIELDS
+
+        self._require_writer()
+        segment = self._segment
+        with self._lock:
+            touched = set()
+            for msg in messages:
+                info = self._static.setdefault(msg["mmsi"], {})
+                for name in STATIC_FIELDS:
+                    value = msg.get(name)
+                    if value not in (None, ""):
+                        info[name] = value
+                if msg["mmsi"] in self._index:
+                    touched.add(msg["mmsi"])
+            with segment.write():
+                for mmsi in touched:
+                    self._write_static(segment.cols, self._index[mmsi], self._static[mmsi])
+
+    def _write_static(self, cols, slot, info):
+        for name, value in info.items():
+            if name in self.STRING_WIDTHS:
+                cols[name][slot] = _encode(value, self.STRING_WIDTHS[name])
+            elif name in ("ais_shiptype", "imo"):
+                cols[name][slot] = int(value)
+
+    def upsert(self, rows):
+        self._require_writer()
+        segment = self._segment
+        cols = segment.cols
+        updated = 0
+        with self._lock:
+            latest = {}
+            for row in rows:
+                current = latest.get(row["mmsi"])
+                if current is None or current["ts"] <= row["ts"]:
+                    latest[row["mmsi"]] = row
+            with segment.write():
+                count = segment.count
+                for mmsi, row in latest.items():
+                    slot = self._index.get(mmsi)
+                    if slot is not None and cols["ts"][slot] > row["ts"]:
+                        continue
+                    if slot is None:
+                        if count < self.capacity:
+                            slot = count
+                            count += 1
+                        else:
+                            slot = int(np.argmin(cols["ts"][:count]))
+                            del self._index[int(cols["mmsi"][slot])]
+                            self.evicted += 1
+                        self._index[mmsi] = slot
+                        for name, _ in self.COLUMNS:
+                            cols[name][slot] = b"" if name in self.STRING_WIDTHS else (-1 if name in ("ais_shiptype", "imo") else 0)
+                    cols["mmsi"][slot] = mmsi
+                    cols["ts"][slot] = row["ts"]
+                    cols["lat"][slot] = row["lat"]
+                    cols["lon"][slot] = row["lon"]
+                    for name in ("speed", "course", "heading"):
+                        cols[name][slot] = _float(row.get(name))
+                    for name, width in self.STRING_WIDTHS.items():
+                        value = row.get(name)
+                        if value not in (None, "") or name not in self._static.get(mmsi, ()):
+                            cols[name][slot] = _encode(value, width)
+                    for name in ("ais_shiptype", "imo"):
+                        if row.get(name) is not None:
+                            cols[name][slot] = int(row[name])
+                    info = self._static.get(mmsi)
+                    if info:
+                        # 靜態資料只補空白欄位（與記憶體版相同）
+                        for name, value in info.items():
+                            if row.get(name) in (None, ""):
+                                self._write_static(cols, slot, {name: value})
+                    updated += 1
+                segment._h["count"][0] = count
+        return updated
+
+    # ---------- 讀取 ----------
+    def _rows(self, cols, idx):
+        names = [name for name, _ in self.COLUMNS]
+        lists = {name: cols[name][idx] for name in names}
+        for name in names:
+            if name in self.STRING_WIDTHS:
+                lists[name] = _decode_column(lists[name])
+            elif name in ("speed", "course", "heading"):
+                lists[name] = _nullable(lists[name].tolist())
+            elif name in ("ais_shiptype", "imo"):
+                lists[name] = [None if v < 0 else v for v in lists[name].tolist()]
+            else:
+                lists[name] = lists[name].tolist()
+        rows = [dict(zip(names, values)) for values in zip(*(lists[name] for name in names))]
+        for name in self.OPTIONAL_FIELDS:
+            for row, value in zip(rows, lists[name]):
+                if value is None:
+                    del row[name]
+        return rows
+
+    def columns(self):
+        """(generation, {欄位: 唯讀 view}) 零複製；讀完後以 generation 是否改變判斷資料是否一致"""
+        segment = self.segment()
+        if segment is None:
+            return 0, {name: np.empty(0, dtype=dtype) for name, dtype in self.COLUMNS}
+        generation = segment.generation
+        count = segment.count
+        views = {}
+        for name, col in segment.cols.items():
+            view = col[:count]
+            view.flags.writeable = False
+            views[name] = view
+        return generation, views
+
+    def snapshot(self, since_ts=None):
+        """所有船位的複本（list）；同一 generation 只轉換一次資料列，之後回傳其複本"""
+        segment = self.segment()
+        if segment is None:
+            return []
+        cached = self._snapshot_cache
+        if cached is None or cached[0] != segment.generation or cached[1] is not segment:
+            copied = segment.read(lambda count: (segment.generation,
+                                                 {name: col[:count].copy() for name, col in segment.cols.items()}))
+            if copied is None:
+                return []
+            generation, cols = copied
+            cached = self._snapshot_cache = (generation, segment, self._rows(cols, slice(None)))
+        rows = cached[2]
+        if since_ts is not None:
+            rows = [r for r in rows if r["ts"] >= since_ts]
+        return [dict(r) for r in rows]
+
+    def get(self, mmsi):
+        segment = self.segment()
+        if segment is None:
+            return None
+
+        def _find(count):
+            hit = np.flatnonzero(segment.cols["mmsi"][:count] == int(mmsi))
+            if not len(hit):
+                return {}
+            return {name: col[hit[:1]].copy() for name, col in segment.cols.items()}
+
+        cols = segment.read(_find)
+        if not cols:
+            return None
+        return self._rows(cols, [0])[0]
+
+    def static_info(self, mmsi):
+        if self.writer:
+            with self._lock:
+                return dict(self._static.get(mmsi) or {})
+        from models.vessel_store import STATIC_FIELDS
+
+        row = self.get(mmsi) or {}
+        return {name: row[name] for name in STATIC_FIELDS if row.get(name) not in (None, "")}
+
+    def stats(self):
+        return {**self.info(), "evicted": self.evicted}
+
+
+# --------------------- 警戒區內船舶 ---------------------
+class ZoneMembershipTable(_SharedTable):
+    """目前在各警戒區內的 (zone_id, mmsi, entered_ts)；寫入端每次狀態改變時整批發佈"""
+    COLUMNS = (
+        ("zone_id", np.dtype("<i8")),
+        ("mmsi", np.dtype("<u4")),
+        ("entered_ts", np.dtype("<f8")),
+    )
+
+    def __init__(self, name, capacity=ZONE_MEMBERSHIP_CAPACITY):
+        super().__init__(name, capacity)
+        self.truncated = 0
+
+    def publish(self, entries):
+        """entries：[(zone_id, mmsi, entered_ts)]"""
+        segment = self._segment
+        if len(entries) > self.capacity:
+            self.truncated += len(entries) - self.capacity
+            entries = entries[:self.capacity]
+        n = len(entries)
+        with segment.write():
+            if n:
+                zone_ids, mmsis, entered = zip(*entries)
+                segment.cols["zone_id"][:n] = zone_ids
+                segment.cols["mmsi"][:n] = mmsis
+                segment.cols["entered_ts"][:n] = [np.nan if t is None else t for t in entered]
+            segment._h["count"][0] = n
+
+    def entries(self):
+        """[(zone_id, mmsi, entered_ts)]；區段不可用時回傳 None"""
+        segment = self.segment()
+        if segment is None:
+            return None
+        cols = segment.read(lambda count: [segment.cols[name][:count].tolist()
+                                           for name, _ in self.COLUMNS])
+        if cols is None:
+            return None
+        return [(z, m, None if t != t else t) for z, m, t in zip(*cols)]
+
+    def request_reload(self):
+        """讀取端（web worker）修改警戒區後呼叫，寫入行程下一批船位前重新載入"""
+        segment = self.segment()
+        if segment is not None:
+            segment.bump_signal()
+
+    def reload_signal(self):
+        segment = self.segment()
+        return None if segment is None else segment.signal
+
+
+# --------------------- 地名 → 座標快取 ---------------------
+def _geocode_key(place_name):
+    name = " ".join(str(place_name).split())
+    digest = hashlib.blake2b(name.encode("utf-8"), digest_size=8).digest()
+    # 0 保留給空槽
+    return name, (int.from_bytes(digest, "little") or 1)
+
+
+class SharedGeocodeTable(_SharedTable):
+    """開放定址雜湊表；寫入端（任一 worker）以 flock 序列化，讀取走 seqlock"""
+    NAME_WIDTH = 96
+    COLUMNS = (
+        ("key", np.dtype("<u8")),
+        ("lat", np.dtype("<f8")),
+        ("lon", np.dtype("<f8")),
+        ("stored_at", np.dtype("<f8")),
+        ("used_at", np.dtype("<f8")),
+        ("name", np.dtype(f"S{NAME_WIDTH}")),
+    )
+
+    def __init__(self, name, capacity=GEOCODE_CACHE_SIZE):
+        # 容量取 2 的次方，槽位以位元遮罩計算
+        super().__init__(name, 1 << max(4, (capacity - 1).bit_length()))
+        self._lock_path = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+
+    def _window(self, key):
+        start = key & (self.capacity - 1)
+        return [(start + i) & (self.capacity - 1) for i in range(GEOCODE_PROBE)]
+
+    def get(self, place_name, ttl_s):
+        segment = self.segment()
+        if segment is None:
+            return None
+        name, key = _geocode_key(place_name)
+        window = self._window(key)
+        encoded = name.encode("utf-8")[:self.NAME_WIDTH]
+        now = time.time()
+
+        def _find(_count):
+            cols = segment.cols
+            for slot in window:
+                if int(cols["key"][slot]) == key and bytes(cols["name"][slot]) == encoded:
+                    return slot, float(cols["lat"][slot]), float(cols["lon"][slot]), float(cols["stored_at"][slot])
+            return False
+
+        found = segment.read(_find)
+        if not found or now - found[3] > ttl_s:
+            return None
+        slot, lat, lon, _ = found
+        # 近似 LRU：命中時更新使用時間（單一 8 bytes 寫入，不經過 seqlock）
+        segment.writable("used_at")[slot] = now
+        return {"latitude": lat, "longitude": lon}
+
+    def put(self, place_name, coords):
+        segment = self.segment()
+        if segment is None or fcntl is None:
+            return False
+        name, key = _geocode_key(place_name)
+        window = self._window(key)
+        cols = {n: segment.writable(n) for n, _ in self.COLUMNS}
+        encoded = name.encode("utf-8")[:self.NAME_WIDTH]
+        now = time.time()
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                slot = next((s for s in window if int(cols["key"][s]) == key and bytes(cols["name"][s]) == encoded),
+                            None)
+                if slot is None:
+                    slot = next((s for s in window if int(cols["key"][s]) == 0), None)
+                if slot is None:
+                    slot = min(window, key=lambda s: float(cols["used_at"][s]))
+                # flock 內同一時間只有一個寫入端，seqlock 的寫入流程與匯入行程相同
+                with segment.write():
+                    if int(cols["key"][slot]) == 0:
+                        segment._h["count"][0] += 1
+                    cols["key"][slot] = key
+                    cols["name"][slot] = encoded
+                    cols["lat"][slot] = coords["latitude"]
+                    cols["lon"][slot] = coords["longitude"]
+                    cols["stored_at"][slot] = now
+                    cols["used_at"][slot] = now
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return True
+
+
+class GeocodeCache:
+    """地名 → 座標快取：共享區段可用時跨 worker 共用，否則為行程內 LRU（找不到的地名不快取）"""
+
+    def __init__(self, shared=None, max_entries=GEOCODE_CACHE_SIZE, ttl_s=GEOCODE_TTL_S):
+        self.shared = shared
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._local = OrderedDict()
+        self.counters = {"hits": 0, "misses": 0, "shared_hits": 0}
+
+    def get(self, place_name):
+        if self.shared is not None:
+            coords = self.shared.get(place_name, self.ttl_s)
+            if coords is not None:
+                with self._lock:
+                    self.counters["hits"] += 1
+                    self.counters["shared_hits"] += 1
+                return coords
+        name, _ = _geocode_key(place_name)
+        now = time.time()
+        with self._lock:
+            entry = self._local.get(name)
+            if entry is not None and now - entry[1] <= self.ttl_s:
+                self._local.move_to_end(name)
+                self.counters["hits"] += 1
+                return dict(entry[0])
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, place_name, coords):
+        if coords is None:
+            return
+        if self.shared is not None and self.shared.put(place_name, coords):
+            return
+        name, _ = _geocode_key(place_name)
+        with self._lock:
+            self._local[name] = (dict(coords), time.time())
+            self._local.move_to_end(name)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            out = {**self.counters, "local_entries": len(self._local), "ttl_s": self.ttl_s}
+        if self.shared is not None:
+            out["shared"] = self.shared.info()
+        return out
+
+
+# --------------------- 單例 ---------------------
+if SHARED_STATE_NAME:
+    shared_positions = SharedLatestPositionStore(f"{SHARED_STATE_NAME}_vessels")
+    zone_membership = ZoneMembershipTable(f"{SHARED_STATE_NAME}_zones")
+    geocode_cache = GeocodeCache(SharedGeocodeTable(f"{SHARED_STATE_NAME}_geocode"))
+else:
+    shared_positions = None
+    zone_membership = None
+    geocode_cache = GeocodeCache()
+
+
+def open_shared_writer():
+    """匯入行程啟動時呼叫：建立全部共享區段，行程結束時刪除"""
+    import atexit
+
+    if not SHARED_STATE_NAME:
+        raise RuntimeError("未設定 SHARED_STATE_NAME")
+    tables = [shared_positions, zone_membership, geocode_cache.shared]
+    for table in tables:
+        table.open_writer()
+    atexit.register(lambda: [table.close() for table in tables])
+
+
+def shared_state_stats():
+    return {
+        "enabled": bool(SHARED_STATE_NAME),
+        "vessels": shared_positions.stats() if shared_positions is not None else None,
+        "zone_membership": zone_membership.info() if zone_membership is not None else None,
+        "geocode": geocode_cache.stats(),
+    }
+
+
+# --------------------- 效能測試 ---------------------
+def _bench_reader(name, seconds, out):
+    reader = SharedLatestPositionStore(name)
+    torn = reads = 0
+    latency = []
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        t0 = time.perf_counter()
+        segment = reader.segment()
+        if segment is None:
+            time.sleep(0.01)
+            continue
+        copied = segment.read(lambda count: (segment.cols["lat"][:count].copy(), segment.cols["lon"][:count].copy(),
+                                             segment.cols["speed"][:count].copy()))
+        latency.append(time.perf_counter() - t0)
+        if copied is None:
+            continue
+        lat, lon, speed = copied
+        reads += 1
+        # 寫入端每一輪以同一個值寫入 lat、lon 與 speed：三欄不一致即代表讀到寫入中途的資料
+        torn += int(np.count_nonzero((lat != lon) | (lat.astype(np.float32) != speed)))
+    t0 = time.perf_counter()
+    for _ in range(200):
+        reader.version
+    version_us = (time.perf_counter() - t0) / 200 * 1e6
+    t0 = time.perf_counter()
+    rows = reader.snapshot()
+    snapshot_ms = (time.perf_counter() - t0) * 1000
+    t0 = time.perf_counter()
+    reader.get(rows[len(rows) // 2]["mmsi"])
+    get_us = (time.perf_counter() - t0) * 1e6
+    latency.sort()
+    out.put({"reads": reads, "torn_rows": torn,
+             "column_copy_p50_us": round(latency[len(latency) // 2] * 1e6, 1),
+             "column_copy_p99_us": round(latency[int(len(latency) * 0.99)] * 1e6, 1),
+             "version_us": round(version_us, 2), "snapshot_ms": round(snapshot_ms, 1),
+             "snapshot_rows": len(rows), "get_us": round(get_us, 1)})
+
+
+def benchmark(vessels=50_000, seconds=3.0):
+    import multiprocessing as mp
+
+    name = f"aicop_bench_{os.getpid()}"
+    writer = SharedLatestPositionStore(name, capacity=vessels).open_writer()
+    out = mp.get_context("spawn").Queue()
+    try:
+        base = [{"ts": 0.0, "mmsi": 412000000 + k, "shipname": f"V{k}", "lat": 0.0, "lon": 0.0,
+                 "speed": 0.0, "course": 0.0, "heading": None, "shiptype": "7", "destination": None}
+                for k in range(vessels)]
+        writer.upsert(base)
+        proc = mp.get_context("spawn").Process(target=_bench_reader, args=(name, seconds, out))
+        proc.start()
+        batches = 0
+        t_end = time.monotonic() + seconds + 1.0
+        while time.monotonic() < t_end:
+            value = float(batches % 1000) + 0.5
+            start = (batches * 500) % vessels
+            writer.upsert([{**r, "ts": float(batches + 1), "lat": value, "lon": value, "speed": value}
+                           for r in base[start:start + 500]])
+            # 每一輪把全部列改成同一個值，讀取端可驗證一致性
+            with writer._segment.write() as seg:
+                n = seg.count
+                seg.cols["lat"][:n] = value
+                seg.cols["lon"][:n] = value
+                seg.cols["speed"][:n] = value
+            batches += 1
+        result = out.get(timeout=30)
+        proc.join()
+        yield {"vessels": vessels, "writer_batches": batches,
+               "writer_batches_per_s": round(batches / (seconds + 1.0)), **result}
+    finally:
+        writer.close()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["bench"]:
+        print("用法: python -m models.shared_state bench")
+        sys.exit(1)
+    for line in benchmark():
+        print(json.dumps(line, ensure_ascii=False))
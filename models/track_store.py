@@ -0,0 +1,431 @@
+# models/track_store.py
+"""
+AIS 歷史航跡儲存。
+
+資料依時間切分為 segment（預設每小時一個 NDJSON 檔），每個 segment 旁邊有一份
+meta 檔，記錄時間範圍與經緯度外框（bbox），每批寫入後更新（大小固定，不隨資料量成長）；
+「船名 → 行位移」索引另存於 names 檔，只在 segment 整理（seal）或結束時寫入，
+啟動時由 names 檔涵蓋的位置起掃描資料檔補齊尚未寫入的部分。
+查詢時先由 query planner 依時間 / bbox / 船名剔除不相關的 segment，
+再逐行串流讀取，因此記憶體用量只與單一 segment 有關，與查詢結果大小無關。
+"""
+import os
+import json
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+TRACKS_DIR = os.path.join(os.getcwd(), "assets", "tracks")
+os.makedirs(TRACKS_DIR, exist_ok=True)
+
+# 每個 segment 涵蓋的秒數（1 小時）
+SEGMENT_SECONDS = 3600
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+_INPUT_TIME_FORMATS = ("%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M")
+
+
+# --------------------- 共用小工具 ---------------------
+def parse_time(value):
+    """
+    將前端傳入的時間字串（例如 '2025-01-01 12:00:00.000'、'2025-01-01T12:00'）
+    轉為 UTC epoch 秒。空值回傳 None，格式錯誤丟出 ValueError。
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip().replace("T", " ")
+    for fmt in _INPUT_TIME_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).replace(tzinfo=timezone.utc).timestamp()
+        except ValueError:
+            continue
+    raise ValueError(f"無法解析時間: {value}")
+
+
+def format_time(ts):
+    """epoch 秒 → 'YYYY-MM-DD HH:MM:SS.mmm'（UTC，不帶時區，與既有 API 相同）"""
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime(TIME_FORMAT + ".%f")[:-3]
+
+
+def normalize_name(name):
+    """船名正規化：去頭尾空白、轉大寫、合併連續空白"""
+    return " ".join((name or "").upper().split())
+
+
+def row_key(row):
+    """keyset 排序鍵：(時間, MMSI)"""
+    return (row["ts"], row.get("mmsi") or 0)
+
+
+def encode_cursor(row):
+    return f"{row['ts']!r},{row.get('mmsi') or 0}"
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        ts, mmsi = cursor.split(",", 1)
+        return (float(ts), int(mmsi))
+    except ValueError:
+        raise ValueError(f"cursor 格式錯誤: {cursor}")
+
+
+# --------------------- 查詢條件 ---------------------
+@dataclass
+class TrackQuery:
+    shipname: str = None
+    start: float = None
+    end: float = None
+    min_lat: float = None
+    max_lat: float = None
+    min_lon: float = None
+    max_lon: float = None
+    mmsi: int = None
+    cursor: tuple = None
+
+    @classmethod
+    def from_args(cls, args):
+        """由 request.args（或任何 dict）建立查詢條件，參數名稱與 ais.js 相同"""
+        def _float(name):
+            value = args.get(name)
+            if value in (None, ""):
+                return None
+            try:
+                return float(value)
+            except ValueError:
+                raise ValueError(f"{name} 必須是數字")
+
+        mmsi = args.get("mmsi")
+        return cls(
+            shipname=normalize_name(args.get("shipname")) or None,
+            start=parse_time(args.get("start")),
+            end=parse_time(args.get("end")),
+            min_lat=_float("min_lat"),
+            max_lat=_float("max_lat"),
+            min_lon=_float("min_lon"),
+            max_lon=_float("max_lon"),
+            mmsi=int(mmsi) if mmsi not in (None, "") else None,
+            cursor=decode_cursor(args.get("cursor")),
+        )
+
+    def match(self, row):
+        ts = row["ts"]
+        if self.start is not None and ts < self.start:
+            return False
+        if self.end is not None and ts > self.end:
+            return False
+        if self.mmsi is not None and row.get("mmsi") != self.mmsi:
+            return False
+        lat, lon = row.get("lat"), row.get("lon")
+        if self.min_lat is not None and (lat is None or lat < self.min_lat):
+            return False
+        if self.max_lat is not None and (lat is None or lat > self.max_lat):
+            return False
+        if self.min_lon is not None and (lon is None or lon < self.min_lon):
+            return False
+        if self.max_lon is not None and (lon is None or lon > self.max_lon):
+            return False
+        if self.shipname and self.shipname not in normalize_name(row.get("shipname")):
+            return False
+        return True
+
+    def overlaps(self, seg):
+        """回傳 segment 被剔除的原因（'time' / 'bbox' / 'cursor'），可能包含結果則回傳 None"""
+        if self.start is not None and seg.max_ts < self.start:
+            return "time"
+        if self.end is not None and seg.min_ts > self.end:
+            return "time"
+        if self.cursor is not None and seg.max_ts < self.cursor[0]:
+            return "cursor"
+        min_lon, min_lat, max_lon, max_lat = seg.bbox
+        if self.min_lat is not None and max_lat < self.min_lat:
+            return "bbox"
+        if self.max_lat is not None and min_lat > self.max_lat:
+            return "bbox"
+        if self.min_lon is not None and max_lon < self.min_lon:
+            return "bbox"
+        if self.max_lon is not None and min_lon > self.max_lon:
+            return "bbox"
+        return None
+
+
+# --------------------- segment ---------------------
+@dataclass
+class Segment:
+    key: int                      # floor(ts / SEGMENT_SECONDS)
+    rows: int = 0
+    size: int = 0                 # 已寫入的位元組數
+    min_ts: float = float("inf")
+    max_ts: float = float("-inf")
+    bbox: list = field(default_factory=lambda: [180.0, 90.0, -180.0, -90.0])
+    names: dict = field(default_factory=dict)   # 正規化船名 → [行位移, ...]
+    sorted: bool = True
+    last_key: tuple = None
+    indexed_size: int = 0         # names 檔已涵蓋的位元組數
+
+    def add(self, row, offset):
+        ts = row["ts"]
+        self.rows += 1
+        self.min_ts = min(self.min_ts, ts)
+        self.max_ts = max(self.max_ts, ts)
+        lat, lon = row.get("lat"), row.get("lon")
+        if lat is not None and lon is not None:
+            self.bbox = [min(self.bbox[0], lon), min(self.bbox[1], lat),
+                         max(self.bbox[2], lon), max(self.bbox[3], lat)]
+        self.names.setdefault(normalize_name(row.get("shipname")), []).append(offset)
+        key = row_key(row)
+        if self.last_key is not None and key < self.last_key:
+            self.sorted = False
+        self.last_key = key
+
+    def to_meta(self):
+        return {
+            "key": self.key, "rows": self.rows, "size": self.size,
+            "min_ts": self.min_ts, "max_ts": self.max_ts, "bbox": self.bbox,
+            "sorted": self.sorted, "last_key": self.last_key, "indexed_size": self.indexed_size,
+        }
+
+    @classmethod
+    def from_meta(cls, meta):
+        last_key = meta.get("last_key")
+        seg = cls(
+            key=meta["key"], rows=meta["rows"], size=meta["size"],
+            min_ts=meta["min_ts"], max_ts=meta["max_ts"], bbox=meta["bbox"],
+            sorted=meta["sorted"], last_key=tuple(last_key) if last_key else None,
+        )
+        if "names" in meta:
+            # 舊版 meta 內含完整索引
+            seg.names, seg.indexed_size = meta["names"], meta["size"]
+        return seg
+
+
+@dataclass
+class SegmentScan:
+    """查詢當下對 segment 的快照：只讀到 size 為止，避免讀到正在寫入的半行"""
+    key: int
+    path: str
+    size: int
+    sorted: bool
+    offsets: list = None          # 有船名條件時，只讀這些行
+
+
+@dataclass
+class QueryPlan:
+    scans: list
+    total: int
+    pruned: int
+    pruned_by: dict
+
+    def summary(self):
+        return {
+            "segments_total": self.total,
+            "segments_scanned": len(self.scans),
+            "segments_pruned": self.pruned,
+            "pruned_by": self.pruned_by,
+        }
+
+    def headers(self):
+        return {
+            "X-Segments-Total": str(self.total),
+            "X-Segments-Pruned": str(self.pruned),
+        }
+
+
+# --------------------- 儲存主體 ---------------------
+class TrackStore:
+    def __init__(self, directory=TRACKS_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._segments = {}
+        self._load()
+
+    def _load(self):
+        for fname in os.listdir(self.directory):
+            if not fname.endswith(".meta.json"):
+                continue
+            with open(os.path.join(self.directory, fname), "r", encoding="utf-8") as f:
+                seg = Segment.from_meta(json.load(f))
+            if not seg.names:
+                seg.indexed_size = 0
+                if os.path.exists(self._names_path(seg.key)):
+                    with open(self._names_path(seg.key), "r", encoding="utf-8") as f:
+                        saved = json.load(f)
+                    if saved["size"] <= seg.size:
+                        seg.names, seg.indexed_size = saved["names"], saved["size"]
+            if seg.indexed_size < seg.size:
+                self._index_tail(seg)
+            self._segments[seg.key] = seg
+
+    def _index_tail(self, seg):
+        """由 names 索引涵蓋的位置起掃描資料檔，補上其後各行的船名索引"""
+        offset = seg.indexed_size
+        with open(self._data_path(seg.key), "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if offset + len(line) > seg.size:
+                    break
+                row = json.loads(line)
+                seg.names.setdefault(normalize_name(row.get("shipname")), []).append(offset)
+                offset += len(line)
+
+    def _data_path(self, key):
+        return os.path.join(self.directory, f"seg_{key}.ndjson")
+
+    def _meta_path(self, key):
+        return os.path.join(self.directory, f"seg_{key}.meta.json")
+
+    def _names_path(self, key):
+        return os.path.join(self.directory, f"seg_{key}.names.json")
+
+    @staticmethod
+    def _dump(path, data):
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+
+    def _write_meta(self, seg):
+        self._dump(self._meta_path(seg.key), seg.to_meta())
+
+    def _write_index(self, seg):
+        """寫入完整的船名索引（seal 或 segment 結束時），再更新 meta 的 indexed_size"""
+        self._dump(self._names_path(seg.key), {"size": seg.size, "names": seg.names})
+        seg.indexed_size = seg.size
+        self._write_meta(seg)
+
+    # ---------- 寫入 ----------
+    def append(self, rows):
+        """
+        批次寫入歷史資料。每筆 row 至少需包含 ts（epoch 秒），其餘欄位：
+        mmsi、shipname、lat、lon、speed、course、heading、shiptype、destination。
+        """
+        groups = {}
+        for row in rows:
+            groups.setdefault(int(row["ts"] // SEGMENT_SECONDS), []).append(row)
+
+        with self._lock:
+            for key, seg_rows in groups.items():
+                # 批次內先依 (時間, MMSI) 排序：只有晚到的資料會讓 segment 變成亂序，結束後由 seal_closed 整理
+                seg_rows.sort(key=row_key)
+                seg = self._segments.get(key) or Segment(key=key)
+                with open(self._data_path(key), "ab") as f:
+                    for row in seg_rows:
+                        line = json.dumps(row, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+                        f.write(line)
+                        seg.add(row, seg.size)
+                        seg.size += len(line)
+                self._segments[key] = seg
+                self._write_meta(seg)
+        return sum(len(v) for v in groups.values())
+
+    def seal(self, key):
+        """將亂序寫入的 segment 依 (時間, MMSI) 重新排序並重建索引，之後查詢即可純串流"""
+        with self._lock:
+            seg = self._segments.get(key)
+            if seg is None or seg.sorted:
+                return False
+            path = self._data_path(key)
+            with open(path, "rb") as f:
+                rows = [json.loads(line) for line in f.read(seg.size).splitlines() if line]
+            rows.sort(key=row_key)
+
+            fresh = Segment(key=key)
+            with open(path + ".tmp", "wb") as f:
+                for row in rows:
+                    line = json.dumps(row, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+                    f.write(line)
+                    fresh.add(row, fresh.size)
+                    fresh.size += len(line)
+            # 舊索引的行位移在重新排序後失效：先移除，中途中止時啟動會整份重建
+            if os.path.exists(self._names_path(key)):
+                os.remove(self._names_path(key))
+            os.replace(path + ".tmp", path)
+            self._segments[key] = fresh
+            self._write_index(fresh)
+            return True
+
+    def seal_closed(self, now_ts, grace_seconds=600):
+        """
+        整理所有已結束（含寬限時間）且亂序的 segment，回傳整理的數量；
+        已結束、未亂序但船名索引尚未完整寫入的 segment 一併寫入索引
+        """
+        with self._lock:
+            closed = [s for k, s in self._segments.items() if (k + 1) * SEGMENT_SECONDS + grace_seconds < now_ts]
+            keys = [s.key for s in closed if not s.sorted]
+            for seg in closed:
+                if seg.sorted and seg.indexed_size < seg.size:
+                    self._write_index(seg)
+        return sum(1 for k in keys if self.seal(k))
+
+    # ---------- 查詢 ----------
+    def first_ts(self):
+        """最早一筆資料的時間；沒有資料時為 inf"""
+        with self._lock:
+            return min((s.min_ts for s in self._segments.values()), default=float("inf"))
+
+    def plan(self, query):
+        scans = []
+        pruned_by = {"time": 0, "bbox": 0, "shipname": 0, "cursor": 0}
+        with self._lock:
+            segments = sorted(self._segments.values(), key=lambda s: s.key)
+            for seg in segments:
+                reason = query.overlaps(seg)
+                offsets = None
+                if reason is None and query.shipname:
+                    offsets = [o for name, offs in seg.names.items()
+                               if query.shipname in name for o in offs]
+                    if not offsets:
+                        reason = "shipname"
+                if reason:
+                    pruned_by[reason] += 1
+                    continue
+                if offsets is not None:
+                    offsets.sort()
+                scans.append(SegmentScan(seg.key, self._data_path(seg.key), seg.size, seg.sorted, offsets))
+
+        return QueryPlan(
+            scans=scans,
+            total=len(segments),
+            pruned=len(segments) - len(scans),
+            pruned_by=pruned_by,
+        )
+
+    def _read_scan(self, scan):
+        with open(scan.path, "rb") as f:
+            if scan.offsets is None:
+                remaining = scan.size
+                for line in f:
+                    remaining -= len(line)
+                    if remaining < 0:
+                        break
+                    yield json.loads(line)
+            else:
+                for offset in scan.offsets:
+                    f.seek(offset)
+                    yield json.loads(f.readline())
+
+    def iter_rows(self, query, plan=None):
+        """依 (時間, MMSI) 順序逐筆產生符合條件的資料（generator）"""
+        plan = plan or self.plan(query)
+        cursor = query.cursor
+        for scan in plan.scans:
+            matched = (row for row in self._read_scan(scan) if query.match(row))
+            if not scan.sorted:
+                # 亂序 segment：僅在單一 segment 範圍內排序，記憶體仍受 segment 大小限制
+                matched = iter(sorted(matched, key=row_key))
+            for row in matched:
+                if cursor is not None and row_key(row) <= cursor:
+                    continue
+                yield row
+
+
+def to_public_row(row):
+    """內部格式 → 前端格式（補上 timestamp 字串，移除內部 ts）"""
+    out = {k: v for k, v in row.items() if k != "ts"}
+    out["timestamp"] = format_time(row["ts"])
+    return out
+
+
+track_store = TrackStore()
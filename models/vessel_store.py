@@ -0,0 +1,83 @@
+# models/vessel_store.py
+"""
+最新船位表（記憶體內）：每個 MMSI 只保留最新一筆位置，並合併靜態資料（船名、船種、目的地）。
+每次寫入都會遞增 version，供快取（例如圖磚）判斷是否需要重算。
+設定 SHARED_STATE_NAME 時改用共享記憶體版本（models/shared_state.py），多個 worker 行程共用同一張表。
+"""
+import threading
+
+from models.shared_state import shared_positions
+
+# 靜態訊息中會合併進船位的欄位
+STATIC_FIELDS = ("shipname", "shiptype", "ais_shiptype", "destination", "callsign", "imo")
+
+
+class LatestPositionStore:
+    shared = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._positions = {}
+        self._static = {}
+        self.version = 0
+
+    def __len__(self):
+        return len(self._positions)
+
+    def update_static(self, messages):
+        """批次更新靜態資料（AIS type 5 / 19 / 24）"""
+        with self._lock:
+            for msg in messages:
+                info = self._static.setdefault(msg["mmsi"], {})
+                for name in STATIC_FIELDS:
+                    value = msg.get(name)
+                    if value not in (None, ""):
+                        info[name] = value
+                pos = self._positions.get(msg["mmsi"])
+                if pos is not None:
+                    pos.update(info)
+            self.version += 1
+
+    def upsert(self, rows):
+        """
+        批次寫入位置（格式與歷史航跡相同，需含 ts、mmsi、lat、lon）。
+        只有時間較新的資料會覆蓋舊資料；回傳實際更新的筆數。
+        """
+        updated = 0
+        with self._lock:
+            for row in rows:
+                mmsi = row["mmsi"]
+                current = self._positions.get(mmsi)
+                if current is not None and current["ts"] > row["ts"]:
+                    continue
+                merged = dict(row)
+                info = self._static.get(mmsi)
+                if info:
+                    for name, value in info.items():
+                        if merged.get(name) in (None, ""):
+                            merged[name] = value
+                self._positions[mmsi] = merged
+                updated += 1
+            if updated:
+                self.version += 1
+        return updated
+
+    def static_info(self, mmsi):
+        with self._lock:
+            return dict(self._static.get(mmsi) or {})
+
+    def get(self, mmsi):
+        with self._lock:
+            row = self._positions.get(mmsi)
+            return dict(row) if row else None
+
+    def snapshot(self, since_ts=None):
+        """回傳所有船位的複本（list），since_ts 可排除過舊的船位"""
+        with self._lock:
+            rows = list(self._positions.values())
+        if since_ts is not None:
+            rows = [r for r in rows if r["ts"] >= since_ts]
+        return [dict(r) for r in rows]
+
+
+latest_store = shared_positions if shared_positions is not None else LatestPositionStore()
@@ -0,0 +1,117 @@
+# models/zone_event_log.py
+"""
+警戒區進出事件記錄（只新增、不修改）。
+
+事件依日期寫入 assets/zone_events/YYYYMMDD.ndjson，一行一筆；
+最近的事件另外保留在記憶體中，查詢最近事件時不必讀檔。
+"""
+import os
+import json
+import heapq
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+from models.track_store import format_time
+
+ZONE_EVENTS_DIR = os.path.join(os.getcwd(), "assets", "zone_events")
+os.makedirs(ZONE_EVENTS_DIR, exist_ok=True)
+
+# 記憶體中保留的最近事件數
+RECENT_EVENTS = 2000
+DAY_SECONDS = 86400
+
+
+def _day_key(ts):
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y%m%d")
+
+
+class ZoneEventLog:
+    def __init__(self, directory=ZONE_EVENTS_DIR, recent=RECENT_EVENTS):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=recent)
+        self.count = 0
+
+    def _path(self, day):
+        return os.path.join(self.directory, f"{day}.ndjson")
+
+    def append(self, events):
+        """批次寫入事件（依事件時間分日）"""
+        if not events:
+            return
+        by_day = {}
+        for ev in events:
+            by_day.setdefault(_day_key(ev["ts"]), []).append(ev)
+        with self._lock:
+            for day, items in by_day.items():
+                with open(self._path(day), "a", encoding="utf-8") as f:
+                    for ev in items:
+                        f.write(json.dumps(ev, ensure_ascii=False, separators=(",", ":")) + "\n")
+            self._recent.extend(events)
+            self.count += len(events)
+
+    def recent(self, limit=100):
+        with self._lock:
+            items = list(self._recent)
+        return items[-limit:]
+
+    def query(self, zone_id=None, mmsi=None, start=None, end=None, limit=500):
+        """
+        依時間範圍讀取事件檔（預設最近一天），可依 zone_id / mmsi 篩選，
+        回傳時間順序的最後 limit 筆。
+        """
+        if end is None:
+            end = datetime.now(timezone.utc).timestamp()
+        if start is None:
+            start = end - DAY_SECONDS
+
+        def _match(ev):
+            return (start <= ev["ts"] <= end
+                    and (zone_id is None or ev["zone_id"] == zone_id)
+                    and (mmsi is None or ev["mmsi"] == mmsi))
+
+        if limit <= 0:
+            return []
+        # 同一天內寫入順序是偵測順序，不一定是事件時間順序（晚到的回報），
+        # 以 (ts, 讀取序號) 的最小堆積保留事件時間最新的 limit 筆，同時間維持寫入順序
+        heap = []
+        seq = 0
+        day_ts = start - start % DAY_SECONDS
+        while day_ts <= end:
+            path = self._path(_day_key(day_ts))
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            ev = json.loads(line)
+                            if _match(ev):
+                                item = (ev["ts"], seq, ev)
+                                seq += 1
+                                if len(heap) < limit:
+                                    heapq.heappush(heap, item)
+                                elif item > heap[0]:
+                                    heapq.heapreplace(heap, item)
+            day_ts += DAY_SECONDS
+        return [ev for _, _, ev in sorted(heap)]
+
+
+def make_event(kind, ts, zone, row, dwell_s=None):
+    event = {
+        "event": kind,
+        "ts": ts,
+        "timestamp": format_time(ts),
+        "zone_id": zone.zone_id,
+        "zone_name": zone.name,
+        "mmsi": row.get("mmsi"),
+        "shipname": row.get("shipname"),
+        "lat": row["lat"],
+        "lon": row["lon"],
+    }
+    if dwell_s is not None:
+        event["dwell_s"] = round(dwell_s, 1)
+    return event
+
+
+zone_event_log = ZoneEventLog()
@@ -0,0 +1,299 @@
+# routes/ais_api.py
+import time
+import itertools
+import numpy as np
+from flask import Blueprint, request, jsonify, abort, Response, stream_with_context
+from models.track_store import track_store, TrackQuery, to_public_row, encode_cursor, parse_time
+from models.vessel_store import latest_store
+from models.columnar_store import columnar_store
+from services.ingest import ingest_pipeline
+from services.vessel_tiles import vessel_tiles, TileEncodingError
+from services.wire_format import MIME_TYPE as VESSEL_BINARY_MIME, encode_rows, wants_binary
+from services.projection import project_rows, interpolate_at, max_age_for, max_age_bound, DEFAULT_MAX_GAP_S
+from services.cpa import cpa_monitor, find_close_approaches, default_groups, alerts_to_geojson
+from services.track_reduce import ReduceOptions, ReduceStats, reduce_tracks, to_linestrings
+from services.geodesy import within_radius, PRECISIONS, KM_TO_NM
+from services.landmarks import landmark_index
+from services.response_codec import iter_json_object, iter_ndjson
+
+ais_api = Blueprint("ais_api", __name__)
+
+# 單頁最多筆數
+MAX_PAGE_SIZE = 5000
+# geometry=linestring 最多暫存的（精簡後）座標點數，超過回 400
+LINESTRING_MAX_POINTS = 200_000
+
+
+# 歷史航跡查詢
+#   ?shipname=&start=&end=&min_lat=&max_lat=&min_lon=&max_lon=   （與 ais.js 相同）
+#   &limit=N&cursor=...   → keyset 分頁，回傳 next_cursor
+#   &format=ndjson        → 一行一筆串流回傳（搭配 limit 時下一頁 cursor 在 X-Next-Cursor 標頭）
+#   &simplify=dp|bucket&tolerance_m=&bucket_seconds=&max_points=   → 航跡精簡
+#   &geometry=linestring  → 每艘船一條 LineString（GeoJSON Feature），需搭配 simplify 或 max_points
+@ais_api.route("/chinaboat/all", methods=["GET"])
+def get_chinaboat_all():
+    try:
+        query = TrackQuery.from_args(request.args)
+        limit = request.args.get("limit", type=int)
+        geometry = request.args.get("geometry", "points")
+        if geometry not in ("points", "linestring"):
+            raise ValueError("geometry 必須是 points 或 linestring")
+        reduce_opts = None
+        if request.args.get("simplify") or request.args.get("max_points"):
+            reduce_opts = ReduceOptions.from_args(request.args, query.start, query.end)
+        if (reduce_opts or geometry == "linestring") and limit:
+            raise ValueError("simplify / geometry=linestring 不支援 limit 分頁")
+        # LineString 需先暫存每艘船的所有座標，未精簡時等於把整段歷史放進記憶體
+        if geometry == "linestring" and not reduce_opts:
+            raise ValueError("geometry=linestring 需搭配 simplify 或 max_points")
+    except ValueError as e:
+        abort(400, str(e))
+
+    rows, plan = _history_rows(query)
+    fmt = request.args.get("format", "json")
+
+    stats = ReduceStats()
+    if reduce_opts:
+        rows = reduce_tracks(rows, reduce_opts, stats)
+    if geometry == "linestring":
+        # 回應開始前先組好所有 Feature，超過點數上限時仍可回 400
+        try:
+            items = list(to_linestrings(rows, LINESTRING_MAX_POINTS))
+        except ValueError as e:
+            abort(400, str(e))
+    else:
+        items = (to_public_row(row) for row in rows)
+
+    if fmt == "ndjson" and not limit:
+        return Response(stream_with_context(iter_ndjson(items)),
+                        mimetype="application/x-ndjson", headers=plan.headers())
+
+    if limit:
+        # keyset 分頁：多取一筆判斷是否還有下一頁
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        page = list(itertools.islice(rows, limit + 1))
+        has_more = len(page) > limit
+        page = page[:limit]
+        next_cursor = encode_cursor(page[-1]) if has_more else None
+        # 二進位與 NDJSON 沒有外層物件，下一頁 cursor 放在 X-Next-Cursor 標頭
+        headers = dict(plan.headers())
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+        if fmt == "ndjson":
+            return Response(iter_ndjson(to_public_row(r) for r in page),
+                            mimetype="application/x-ndjson", headers=headers)
+        if wants_binary(request):
+            return Response(encode_rows(page), mimetype=VESSEL_BINARY_MIME, headers=headers)
+        return jsonify({
+            "count": len(page),
+            "data": [to_public_row(r) for r in page],
+            "next_cursor": next_cursor,
+            "plan": plan.summary(),
+        }), 200, plan.headers()
+
+    # 未分頁：以串流方式分批輸出完整 JSON，count 放在最後
+    def trailer(count):
+        tail = {"count": count, "plan": plan.summary()}
+        if reduce_opts:
+            tail["reduction"] = stats.summary()
+        return tail
+
+    if geometry == "linestring":
+        body = iter_json_object({"type": "FeatureCollection"}, "features", items, trailer)
+    else:
+        body = iter_json_object(None, "data", items, trailer)
+    return Response(stream_with_context(body), mimetype="application/json", headers=plan.headers())
+
+
+def _history_rows(query):
+    """歷史資料來源：欄式分割檔可回答時以 columnar_store（向量化遮罩），否則逐行讀 NDJSON segment；回傳 (rows, plan)"""
+    if columnar_store.serves(query, track_store.first_ts()):
+        rows, plan = columnar_store.iter_rows(query)
+        return _with_static(rows), plan
+    plan = track_store.plan(query)
+    return track_store.iter_rows(query, plan), plan
+
+
+def _with_static(rows):
+    """欄式分割檔不存船名、目的地等靜態欄位，以最新船位表的靜態資料補上"""
+    static = {}
+    for row in rows:
+        info = static.get(row["mmsi"])
+        if info is None:
+            info = static[row["mmsi"]] = latest_store.static_info(row["mmsi"])
+        row.setdefault("shipname", None)
+        for name, value in info.items():
+            if row.get(name) in (None, ""):
+                row[name] = value
+        yield row
+
+
+def _projection_time(args):
+    """?project=now 或 ?at=時間 → epoch 秒；未要求推算時回傳 None"""
+    if args.get("at"):
+        return parse_time(args.get("at"))
+    if args.get("project") == "now":
+        return time.time()
+    return None
+
+
+# 最新船位（每艘船一筆）
+#   ?project=now 或 ?at=時間 → 依航向航速推算到該時間（外推上限依船種，&max_age=秒 則全部使用該值）
+#   ?landmarks=1 → 每筆加上最近地標描述（landmark_label，例如「基隆港東北方 12 海浬」，僅 JSON）
+@ais_api.route("/chinaboat/latest", methods=["GET"])
+def get_chinaboat_latest():
+    try:
+        at_ts = _projection_time(request.args)
+        max_age = request.args.get("max_age", type=float)
+    except ValueError as e:
+        abort(400, str(e))
+
+    rows = latest_store.snapshot()
+    if at_ts is not None:
+        rows = project_rows(rows, at_ts, max_age)
+    # Accept: application/x-aicop-vessels → 欄式二進位格式
+    if wants_binary(request):
+        return Response(encode_rows(rows), mimetype=VESSEL_BINARY_MIME)
+    # JSON 分批編碼串流輸出，不先組出整份字串
+    if request.args.get("landmarks") == "1":
+        data = landmark_index.get().annotate_rows([to_public_row(r) for r in rows])
+    else:
+        data = (to_public_row(r) for r in rows)
+    return Response(stream_with_context(iter_json_object({"count": len(rows)}, "data", data)),
+                    mimetype="application/json")
+
+
+# 指定點半徑內的最新船位（依距離排序），例如 24 海里鄰接區內的船
+#   ?lat=&lon=&radius_nm=（預設 24）&precision=flat|sphere|ellipsoid（預設 sphere）&landmarks=1（加上最近地標描述）
+#   先以平面近似粗篩，只對候選船以指定精度精算距離
+@ais_api.route("/chinaboat/nearby", methods=["GET"])
+def get_chinaboat_nearby():
+    try:
+        lat = request.args.get("lat", type=float)
+        lon = request.args.get("lon", type=float)
+        radius_nm = request.args.get("radius_nm", 24.0, type=float)
+        precision = request.args.get("precision", "sphere")
+        if lat is None or lon is None:
+            raise ValueError("lat、lon 為必填")
+        if precision not in PRECISIONS:
+            raise ValueError(f"precision 必須是 {' / '.join(PRECISIONS)}")
+    except ValueError as e:
+        abort(400, str(e))
+
+    rows = [r for r in latest_store.snapshot() if r.get("lat") is not None and r.get("lon") is not None]
+    stats = {}
+    idx, dist_km = within_radius(
+        lat, lon,
+        np.fromiter((r["lat"] for r in rows), dtype=np.float64, count=len(rows)),
+        np.fromiter((r["lon"] for r in rows), dtype=np.float64, count=len(rows)),
+        radius_nm / KM_TO_NM, precision, stats,
+    )
+    data = []
+    for i, d in zip(idx.tolist(), dist_km.tolist()):
+        item = to_public_row(rows[i])
+        item["distance_nm"] = round(d * KM_TO_NM, 3)
+        data.append(item)
+    if request.args.get("landmarks") == "1":
+        landmark_index.get().annotate_rows(data)
+    return jsonify({"count": len(data), "stats": stats, "data": data})
+
+
+# AIS 匯入狀態：每秒訊息數、解碼錯誤、佇列深度
+@ais_api.route("/ingest/stats", methods=["GET"])
+def get_ingest_stats():
+    return jsonify(ingest_pipeline.stats())
+
+
+# CPA / TCPA 警示（中國籍 / 海警 × 我方 / 黑名單）
+#   無參數 → 背景監看的最新結果
+#   ?cpa_nm=&tcpa_min= → 依指定門檻即時計算；&scope=all → 所有船兩兩配對
+#   &format=geojson → 回傳 FeatureCollection
+@ais_api.route("/cpa/alerts", methods=["GET"])
+def get_cpa_alerts():
+    args = request.args
+    if any(k in args for k in ("cpa_nm", "tcpa_min", "scope")):
+        try:
+            cpa_nm = args.get("cpa_nm", cpa_monitor.cpa_nm, type=float)
+            tcpa_min = args.get("tcpa_min", cpa_monitor.tcpa_min, type=float)
+        except ValueError as e:
+            abort(400, str(e))
+        rows = latest_store.snapshot()
+        group_a, group_b = (None, None) if args.get("scope") == "all" else default_groups(rows)
+        stats = {}
+        alerts = find_close_approaches(rows, cpa_nm, tcpa_min, group_a, group_b, stats)
+    else:
+        cpa_monitor.ensure_fresh()
+        alerts, stats = cpa_monitor.alerts()
+
+    if args.get("format") == "geojson":
+        return jsonify(alerts_to_geojson(alerts))
+    return jsonify({"count": len(alerts), "stats": stats, "data": alerts})
+
+
+# 船位圖磚：低縮放層級回傳 cluster，高縮放層級回傳個別船舶
+#   ?format=bin（或 Accept: application/octet-stream）→ 二進位格式
+@ais_api.route("/tiles/vessels/<int:z>/<int:x>/<int:y>", methods=["GET"])
+def get_vessel_tile(z, x, y):
+    fmt = request.args.get("format")
+    if not fmt:
+        fmt = "bin" if request.accept_mimetypes.best == "application/octet-stream" else "json"
+    try:
+        payload, version = vessel_tiles.get_tile(z, x, y, "bin" if fmt == "bin" else "json")
+    except TileEncodingError as e:
+        # 資料無法以二進位表示時不回 500：告知改用 JSON
+        abort(406, f"{e}；請改用 format=json")
+    except ValueError as e:
+        abort(400, str(e))
+
+    etag = f"{version}-{fmt}"
+    # If-None-Match 採弱比對：壓縮後的回應帶的是弱 ETag（W/"..."）
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers={"ETag": f'"{etag}"'})
+
+    if fmt == "bin":
+        resp = Response(payload, mimetype="application/octet-stream")
+    else:
+        resp = jsonify(payload)
+    resp.headers["ETag"] = f'"{etag}"'
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+
+@ais_api.route("/tiles/stats", methods=["GET"])
+def get_tile_stats():
+    return jsonify(vessel_tiles.stats())
+
+
+# 歷史回放：每艘船在指定時間的位置（前後回報內插，超過最後回報則外推）
+#   ?at=時間&max_gap=秒&max_age=秒 以及 shipname / bbox 條件（與 /chinaboat/all 相同）；未指定 max_age 時依船種
+@ais_api.route("/chinaboat/positions_at", methods=["GET"])
+def get_positions_at():
+    try:
+        at_ts = parse_time(request.args.get("at"))
+        if at_ts is None:
+            raise ValueError("at 為必填")
+        max_gap = request.args.get("max_gap", DEFAULT_MAX_GAP_S, type=float)
+        max_age = request.args.get("max_age", type=float)
+        query = TrackQuery.from_args(request.args)
+    except ValueError as e:
+        abort(400, str(e))
+
+    query.start = at_ts - max(max_gap, max_age_bound(max_age))
+    query.end = at_ts + max_gap
+    rows = list(_history_rows(query)[0])
+
+    def _col(key):
+        return np.array([np.nan if r.get(key) is None else r[key] for r in rows], dtype=np.float64)
+
+    result = interpolate_at(
+        np.array([r.get("mmsi") or 0 for r in rows], dtype=np.int64),
+        _col("ts"), _col("lat"), _col("lon"), _col("speed"), _col("course"),
+        at_ts, max_gap, max_age_for(rows, max_age),
+    )
+    data = []
+    for lat, lon, mode, idx in zip(result["lat"].tolist(), result["lon"].tolist(),
+                                   result["mode"].tolist(), result["source_index"].tolist()):
+        item = to_public_row(rows[idx])
+        item.update({"lat": lat, "lon": lon, "mode": "interpolated" if mode == 0 else "projected"})
+        data.append(item)
+    return jsonify({"count": len(data), "at": at_ts, "data": data})
@@ -0,0 +1,118 @@
+# routes/alarm_zone_api.py
+import json
+from flask import Blueprint, request, jsonify, abort
+from models.database import db_session, write_session
+from models.alarm_zone_model import AlarmZone
+from models.vessel_store import latest_store
+from models.zone_event_log import zone_event_log
+from models.track_store import parse_time, format_time
+from services.geofence import geofence, Zone
+from services.cpa import is_cn_or_coast_guard
+
+alarm_zone_api = Blueprint("alarm_zone_api", __name__)
+
+
+def _reload_zones():
+    try:
+        geofence.load_zones()
+    except Exception as e:
+        print(f"❌ 重新載入警戒區失敗: {e}")
+
+
+# 取得所有警戒區（GeoJSON）
+@alarm_zone_api.route("/alarm_zones", methods=["GET"])
+def get_alarm_zones():
+    zones = db_session.query(AlarmZone).order_by(AlarmZone.id).all()
+    features = [z.to_feature() for z in zones]
+    return jsonify({"type": "FeatureCollection", "features": features})
+
+
+# 新增警戒區（FeatureCollection，每個 Polygon 一個警戒區）
+@alarm_zone_api.route("/alarm_zones", methods=["POST"])
+def add_alarm_zones():
+    data = request.get_json() or {}
+    features = data.get("features") or []
+    if not features:
+        abort(400, "features is required")
+
+    zones = []
+    for f in features:
+        geometry = f.get("geometry") or {}
+        name = ((f.get("properties") or {}).get("name") or "").strip()
+        if geometry.get("type") != "Polygon" or not name:
+            abort(400, "每個 feature 需為具名稱的 Polygon")
+        ring = geometry["coordinates"][0]
+        try:
+            Zone(None, name, ring)   # 驗證頂點數
+        except ValueError as e:
+            abort(400, str(e))
+        zones.append(AlarmZone(name=name, coordinates=json.dumps(ring)))
+
+    with write_session() as session:
+        session.add_all(zones)
+        session.flush()
+        ids = [z.id for z in zones]
+
+    _reload_zones()
+    return jsonify({"message": "created", "ids": ids})
+
+
+# 刪除警戒區
+@alarm_zone_api.route("/alarm_zones/<int:zid>", methods=["DELETE"])
+def delete_alarm_zone(zid):
+    with write_session() as session:
+        deleted = session.query(AlarmZone).filter_by(id=zid).delete()
+    if not deleted:
+        abort(404, "not found")
+
+    _reload_zones()
+    return jsonify({"message": "deleted"})
+
+
+# 各警戒區目前在內的中國籍 / 海警船（前端紅點通知），含進入時間與停留秒數
+@alarm_zone_api.route("/custom_zone_cn", methods=["GET"])
+def get_custom_zone_cn():
+    data = {}
+    for zone_id, occupants in geofence.occupants().items():
+        ships = []
+        for occ in occupants:
+            row = latest_store.get(occ["mmsi"])
+            if row is None or not is_cn_or_coast_guard(row):
+                continue
+            ships.append({
+                "mmsi": occ["mmsi"],
+                "shipname": row.get("shipname") or str(occ["mmsi"]),
+                "lat": round(row["lat"], 5),
+                "lon": round(row["lon"], 5),
+                "entered_at": format_time(occ["entered_ts"]),
+                "dwell_s": occ["dwell_s"],
+            })
+        data[str(zone_id)] = ships
+    return jsonify({"status": "success", "data": data})
+
+
+# 進出事件歷史
+#   ?zone_id=&mmsi=&start=&end=&limit=    （預設最近一天）
+#   ?recent=1 → 只回傳記憶體中的最近事件
+@alarm_zone_api.route("/alarm_zones/events", methods=["GET"])
+def get_zone_events():
+    try:
+        limit = max(1, min(request.args.get("limit", 500, type=int), 5000))
+        if request.args.get("recent"):
+            events = zone_event_log.recent(limit)
+        else:
+            events = zone_event_log.query(
+                zone_id=request.args.get("zone_id", type=int),
+                mmsi=request.args.get("mmsi", type=int),
+                start=parse_time(request.args.get("start")),
+                end=parse_time(request.args.get("end")),
+                limit=limit,
+            )
+    except ValueError as e:
+        abort(400, str(e))
+    return jsonify({"count": len(events), "data": events})
+
+
+@alarm_zone_api.route("/alarm_zones/stats", methods=["GET"])
+def get_zone_stats():
+    return jsonify(geofence.stats())
@@ -1,27 +1,96 @@
 # routes/blacklist_api.py
-from flask import Blueprint, request, jsonify, abort
-from models.blacklist_model import SessionLocal, BlacklistShip
+import csv
+import threading
+from flask import Blueprint, request, jsonify, abort, Response, stream_with_context
+from models.blacklist_model import BlacklistShip, blacklist_snapshot, bump_version, db_session, write_session
+from models.track_store import normalize_name, format_time
+from models.vessel_store import latest_store
+from services.blacklist_io import PARSERS, detect_format, import_entries, iter_entries, export_csv, export_ndjson
 
 blacklist_api = Blueprint("blacklist_api", __name__)
 
-# 取得所有黑名單
-@blacklist_api.route("/blacklist_ships", methods=["GET"])
-def get_blacklist_ships():
-    session = SessionLocal()
-    ships = session.query(BlacklistShip).order_by(BlacklistShip.id.desc()).all()
+# 單頁最多筆數
+MAX_PAGE_SIZE = 500
+
+# 黑名單 × 即時船位的比對結果，依 (黑名單 version, 船位表 version) 快取
+_positions_lock = threading.Lock()
+_positions_cache = {"key": None, "payload": None}
 
-    data = [
-        {
-            "id": s.id,
-            "name": s.name,
-            "note": s.note,
-            "created_at": s.created_at.strftime("%Y-%m-%d %H:%M:%S"),
-        }
-        for s in ships
-    ]
 
-    session.close()
-    return jsonify({"count": len(data), "items": data})
+# 取得黑名單
+#   無參數 → 全部（由記憶體快照回傳）
+#   ?limit=N&cursor=<上一頁最後的 id> → keyset 分頁（依 id 由新到舊）
+#   ?name= → 依正規化船名查詢（使用 name_norm 索引）
+@blacklist_api.route("/blacklist_ships", methods=["GET"])
+def get_blacklist_ships():
+    limit = request.args.get("limit", type=int)
+    cursor = request.args.get("cursor", type=int)
+    name = request.args.get("name")
+
+    if not limit and cursor is None and not name:
+        _, items, _ = blacklist_snapshot.get()
+        return jsonify({"count": len(items), "items": items})
+
+    query = db_session.query(BlacklistShip)
+    if name:
+        query = query.filter(BlacklistShip.name_norm == normalize_name(name))
+    if cursor is not None:
+        query = query.filter(BlacklistShip.id < cursor)
+    query = query.order_by(BlacklistShip.id.desc())
+
+    if limit:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        ships = query.limit(limit + 1).all()
+        has_more = len(ships) > limit
+        ships = ships[:limit]
+    else:
+        ships = query.all()
+        has_more = False
+
+    data = [s.to_dict() for s in ships]
+    return jsonify({
+        "count": len(data),
+        "items": data,
+        "next_cursor": data[-1]["id"] if has_more else None,
+    })
+
+
+# 黑名單與即時船位比對（依正規化船名 hash 查表），每筆附上目前位置（查無則為 null）
+@blacklist_api.route("/blacklist_ships/positions", methods=["GET"])
+def get_blacklist_positions():
+    bl_version, items, _ = blacklist_snapshot.get()
+    key = (bl_version, latest_store.version)
+    with _positions_lock:
+        if _positions_cache["key"] == key:
+            return jsonify(_positions_cache["payload"])
+
+    by_name = {}
+    for row in latest_store.snapshot():
+        name = normalize_name(row.get("shipname"))
+        current = by_name.get(name)
+        if name and (current is None or row["ts"] > current["ts"]):
+            by_name[name] = row
+
+    data = []
+    for item in items:
+        row = by_name.get(normalize_name(item["name"]))
+        position = None
+        if row is not None:
+            position = {
+                "mmsi": row.get("mmsi"),
+                "shipname": row.get("shipname"),
+                "lat": row["lat"],
+                "lon": row["lon"],
+                "speed": row.get("speed"),
+                "course": row.get("course"),
+                "timestamp": format_time(row["ts"]),
+            }
+        data.append({**item, "position": position})
+
+    payload = {"count": len(data), "matched": sum(1 for d in data if d["position"]), "items": data}
+    with _positions_lock:
+        _positions_cache.update(key=key, payload=payload)
+    return jsonify(payload)
 
 
 # 新增黑名單
@@ -34,41 +103,61 @@ def add_blacklist_ship():
     if not name:
         abort(400, "name is required")
 
-    session = SessionLocal()
-    try:
-        ship = BlacklistShip(name=name, note=note)
+    with write_session() as session:
+        ship = BlacklistShip(name=name, name_norm=normalize_name(name), note=note)
         session.add(ship)
-        session.commit()
-
+        session.flush()
         new_id = ship.id
-        return jsonify({"message": "created", "id": new_id})
-
-    except Exception as e:
-        session.rollback()
-        abort(500, str(e))
+        bump_version(session)
+    blacklist_snapshot.invalidate()
 
-    finally:
-        session.close()
+    return jsonify({"message": "created", "id": new_id})
 
 
 # 刪除黑名單
 @blacklist_api.route("/blacklist_ships/<int:sid>", methods=["DELETE"])
 def delete_blacklist_ship(sid):
-    session = SessionLocal()
-    ship = session.query(BlacklistShip).filter_by(id=sid).first()
-
-    if not ship:
-        session.close()
+    with write_session() as session:
+        deleted = session.query(BlacklistShip).filter_by(id=sid).delete()
+        if deleted:
+            bump_version(session)
+    if not deleted:
         abort(404, "not found")
+    blacklist_snapshot.invalidate()
+
+    return jsonify({"message": "deleted"})
 
-    try:
-        session.delete(ship)
-        session.commit()
-        return jsonify({"message": "deleted"})
 
-    except Exception as e:
-        session.rollback()
-        abort(500, str(e))
+# 批次匯入（依正規化船名 upsert，單一交易）
+#   本文為 CSV（name,note）/ NDJSON / JSON 陣列，或 multipart 上傳 file 欄位
+#   ?format=csv|ndjson|json 可指定格式，否則依 Content-Type / 檔名判斷
+@blacklist_api.route("/blacklist_ships/import", methods=["POST"])
+def import_blacklist_ships():
+    upload = request.files.get("file")
+    if upload is not None:
+        stream, content_type, filename = upload.stream, upload.content_type, upload.filename
+    else:
+        stream, content_type, filename = request.stream, request.content_type, None
 
-    finally:
-        session.close()
+    try:
+        fmt = detect_format(content_type, filename, request.args.get("format"))
+        report = import_entries(PARSERS[fmt](stream))
+    except (ValueError, csv.Error, UnicodeDecodeError) as e:
+        abort(400, str(e))
+
+    return jsonify({"message": "imported", "format": fmt, **report})
+
+
+# 串流匯出：?format=csv（預設，可直接以 Excel 開啟）| ndjson
+@blacklist_api.route("/blacklist_ships/export", methods=["GET"])
+def export_blacklist_ships():
+    fmt = request.args.get("format", "csv")
+    if fmt == "csv":
+        body, mimetype = export_csv(iter_entries()), "text/csv; charset=utf-8"
+    elif fmt == "ndjson":
+        body, mimetype = export_ndjson(iter_entries()), "application/x-ndjson"
+    else:
+        abort(400, "format 必須是 csv 或 ndjson")
+
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename=blacklist_ships.{fmt}"})
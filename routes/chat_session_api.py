@@ -0,0 +1,27 @@
+# routes/chat_session_api.py
+from flask import Blueprint, jsonify, abort
+from models.chat_session_store import chat_sessions
+
+chat_session_api = Blueprint("chat_session_api", __name__)
+
+
+@chat_session_api.route("/chat_sessions/stats", methods=["GET"])
+def get_chat_session_stats():
+    return jsonify(chat_sessions.stats())
+
+
+# 單一 session 的輪數、歷史 token 估計與每輪 token 用量
+@chat_session_api.route("/chat_sessions/<session_id>", methods=["GET"])
+def get_chat_session(session_id):
+    session = chat_sessions.get(session_id)
+    if session is None:
+        abort(404, "not found")
+    return jsonify(session.info())
+
+
+# 結束對話（前端清除聊天時呼叫）
+@chat_session_api.route("/chat_sessions/<session_id>", methods=["DELETE"])
+def delete_chat_session(session_id):
+    if not chat_sessions.delete(session_id):
+        abort(404, "not found")
+    return jsonify({"message": "deleted"})
@@ -0,0 +1,73 @@
+# routes/job_api.py
+import json
+from flask import Blueprint, request, jsonify, abort, Response, stream_with_context
+from models.job_store import QueueFull
+from services.jobs import job_queue, UnknownJobKind
+
+job_api = Blueprint("job_api", __name__)
+
+
+def _public(job):
+    job = dict(job)
+    job.pop("dedupe_key", None)
+    job.pop("claim", None)
+    return job
+
+
+# 提交工作：{"kind": "generate" | "tool" | "distance_matrix", "payload": {...}, "priority": 可選}
+#   回傳 202 與 job_id；相同 kind + payload 的工作尚在排隊 / 執行中 / 結果未過期時回傳既有工作
+@job_api.route("/jobs", methods=["POST"])
+def submit_job():
+    data = request.get_json(silent=True) or {}
+    kind = data.get("kind")
+    payload = data.get("payload") or {}
+    if not kind or not isinstance(payload, dict):
+        abort(400, "kind 為必填，payload 需為物件")
+    try:
+        priority = data.get("priority")
+        job, deduplicated = job_queue.submit(kind, payload, None if priority is None else int(priority))
+    except (UnknownJobKind, ValueError, TypeError) as e:
+        abort(400, str(e))
+    except QueueFull as e:
+        return jsonify({"error": str(e)}), 503
+
+    return jsonify({"job_id": job["id"], "status": job["status"], "deduplicated": deduplicated}), 202
+
+
+@job_api.route("/jobs/stats", methods=["GET"])
+def get_job_stats():
+    return jsonify(job_queue.stats())
+
+
+# 查詢工作狀態與結果（輪詢）
+@job_api.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404, "not found")
+    return jsonify(_public(job))
+
+
+# 以 Server-Sent Events 串流進度，完成時送出含結果的最後一則後結束
+@job_api.route("/jobs/<job_id>/events", methods=["GET"])
+def stream_job(job_id):
+    if job_queue.get(job_id) is None:
+        abort(404, "not found")
+
+    def generate():
+        for job in job_queue.watch(job_id):
+            if job is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: {job['status']}\ndata: {json.dumps(_public(job), ensure_ascii=False)}\n\n"
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# 取消排隊中的工作（執行中的工作無法中斷）
+@job_api.route("/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    if not job_queue.cancel(job_id):
+        abort(409, "只能取消排隊中的工作")
+    return jsonify({"message": "cancelled"})
@@ -0,0 +1,52 @@
+# routes/landmark_api.py
+import numpy as np
+from flask import Blueprint, request, jsonify, abort
+from services.landmarks import landmark_index, LANDMARK_TYPES
+
+landmark_api = Blueprint("landmark_api", __name__)
+
+# 一次描述的點數上限
+MAX_DESCRIBE_POINTS = 200_000
+
+
+# 地標清單（港口、岬角、島嶼、雷達站）
+@landmark_api.route("/landmarks", methods=["GET"])
+def list_landmarks():
+    index = landmark_index.get()
+    return jsonify({"count": len(index), "types": LANDMARK_TYPES, "data": index.landmarks})
+
+
+# 批次反向地理編碼：POST {"lat": [...], "lon": [...], "k": 1}
+#   回傳與輸入同順序的 labels（例如「基隆港東北方 12 海浬」）；k > 1 時另附前 k 個地標
+@landmark_api.route("/landmarks/describe", methods=["POST"])
+def describe_positions():
+    data = request.get_json(silent=True) or {}
+    try:
+        lat = np.asarray(data.get("lat"), dtype=np.float64).ravel()
+        lon = np.asarray(data.get("lon"), dtype=np.float64).ravel()
+        k = int(data.get("k", 1))
+        if k < 1:
+            raise ValueError("k 必須大於等於 1")
+        if len(lat) != len(lon):
+            raise ValueError("lat 與 lon 長度需相同")
+        if len(lat) > MAX_DESCRIBE_POINTS:
+            raise ValueError(f"一次最多 {MAX_DESCRIBE_POINTS} 個點")
+        if not (np.all(np.abs(lat) <= 90) and np.all(np.abs(lon) <= 180)):
+            raise ValueError("座標超出範圍")
+    except (TypeError, ValueError) as e:
+        abort(400, str(e))
+
+    index = landmark_index.get()
+    if not len(lat):
+        return jsonify({"count": 0, "labels": []})
+    found = index.describe(lat, lon, k)
+    result = {"count": len(lat), "labels": found["label"][:, 0].tolist()}
+    if k > 1:
+        names = np.array(index.names, dtype=object)
+        result["nearest"] = {
+            "landmark": names[found["landmark"]].tolist(),
+            "bearing_deg": np.round(found["bearing_deg"], 1).tolist(),
+            "distance_nm": np.round(found["distance_nm"], 2).tolist(),
+            "label": found["label"].tolist(),
+        }
+    return jsonify(result)
@@ -0,0 +1,37 @@
+# routes/profile_api.py
+from flask import Blueprint, request, jsonify, abort, Response
+from services.profiler import profiler
+
+profile_api = Blueprint("profile_api", __name__)
+
+
+@profile_api.before_request
+def _require_admin():
+    if not profiler.enabled or not profiler.authorized(request.headers, request.remote_addr):
+        abort(404)
+
+
+# 最近 K 筆剖析結果的摘要（由新到舊）
+@profile_api.route("/profiles", methods=["GET"])
+def list_profiles():
+    items = profiler.recent()
+    return jsonify({"count": len(items), "items": items})
+
+
+# 單筆剖析：預設回傳摘要；?format=speedscope | collapsed 下載火焰圖資料
+@profile_api.route("/profiles/<profile_id>", methods=["GET"])
+def get_profile(profile_id):
+    profile = profiler.get(profile_id)
+    if profile is None:
+        abort(404, "not found")
+
+    fmt = request.args.get("format", "summary")
+    if fmt == "summary":
+        return jsonify(profile.summary())
+    if fmt == "speedscope":
+        response = jsonify(profile.speedscope())
+        response.headers["Content-Disposition"] = f"attachment; filename={profile.id}.speedscope.json"
+        return response
+    if fmt == "collapsed":
+        return Response(profile.collapsed(), mimetype="text/plain; charset=utf-8")
+    abort(400, "format 必須是 summary、speedscope 或 collapsed")
@@ -0,0 +1,339 @@
+# services/ais_decoder.py
+"""
+AIS NMEA（!AIVDM / !AIVDO）串流解碼器。
+
+支援訊息類型 1/2/3（A 類動態）、5（A 類靜態）、18/19（B 類動態）、24（B 類靜態），
+多段（multi-fragment）句子會依 (總段數, 序號, 頻道) 重組。
+解碼結果為 dict，位置訊息含 lat/lon/speed/course/heading，靜態訊息含船名、船種、目的地。
+"""
+import time
+import threading
+from collections import OrderedDict
+
+# 未完成的多段訊息最多暫存數量與秒數
+MAX_PENDING_FRAGMENTS = 1024
+FRAGMENT_TIMEOUT = 60.0
+
+POSITION_TYPES = (1, 2, 3, 18, 19)
+STATIC_TYPES = (5, 19, 24)
+
+
+class AisDecodeError(ValueError):
+    pass
+
+
+# --------------------- 6-bit 處理 ---------------------
+def _payload_to_int(payload, fill_bits):
+    """將 6-bit armored payload 轉為 (大整數, 位元數)"""
+    value = 0
+    for ch in payload:
+        v = ord(ch) - 48
+        if v > 40:
+            v -= 8
+        if v < 0 or v > 63:
+            raise AisDecodeError(f"非法 payload 字元: {ch!r}")
+        value = (value << 6) | v
+    nbits = len(payload) * 6 - fill_bits
+    return value >> fill_bits, nbits
+
+
+class _Bits:
+    __slots__ = ("value", "nbits")
+
+    def __init__(self, value, nbits):
+        self.value = value
+        self.nbits = nbits
+
+    def uint(self, start, length):
+        end = start + length
+        if end > self.nbits:
+            raise AisDecodeError("訊息長度不足")
+        return (self.value >> (self.nbits - end)) & ((1 << length) - 1)
+
+    def int(self, start, length):
+        v = self.uint(start, length)
+        if v & (1 << (length - 1)):
+            v -= 1 << length
+        return v
+
+    def text(self, start, length):
+        """6-bit ASCII 字串，去除 '@' 填充與尾端空白"""
+        length = min(length, (self.nbits - start) // 6 * 6)
+        chars = []
+        for i in range(start, start + length, 6):
+            v = self.uint(i, 6)
+            chars.append(chr(v + 64 if v < 32 else v))
+        return "".join(chars).split("@", 1)[0].strip()
+
+
+# --------------------- 欄位轉換 ---------------------
+def _speed(raw):
+    return None if raw == 1023 else raw / 10.0
+
+
+def _lon(raw):
+    v = raw / 600000.0
+    return None if raw == 0x6791AC0 or abs(v) > 180 else v
+
+
+def _lat(raw):
+    v = raw / 600000.0
+    return None if raw == 0x3412140 or abs(v) > 90 else v
+
+
+def _course(raw):
+    return None if raw >= 3600 else raw / 10.0
+
+
+def _heading(raw):
+    return None if raw == 511 else raw
+
+
+def ais_shiptype_to_category(code):
+    """
+    AIS 船種代碼（0-99）→ 前端使用的船種分類字串：
+    '2' 漁船、'3' 拖船/特殊用途、'4' 高速船、'6' 客船、'7' 貨船、'8' 油輪、'9' 遊艇、'0' 未知
+    """
+    if code is None:
+        return "0"
+    if code == 30:
+        return "2"
+    if code in (31, 32, 33, 34, 35, 50, 51, 52, 53, 54, 55, 56, 57, 58, 59):
+        return "3"
+    if 40 <= code <= 49 or 20 <= code <= 29:
+        return "4"
+    if 60 <= code <= 69:
+        return "6"
+    if 70 <= code <= 79:
+        return "7"
+    if 80 <= code <= 89:
+        return "8"
+    if code in (36, 37):
+        return "9"
+    return "0"
+
+
+def _decode_position_a(bits):
+    return {
+        "status": bits.uint(38, 4),
+        "turn": bits.int(42, 8),
+        "speed": _speed(bits.uint(50, 10)),
+        "lon": _lon(bits.int(61, 28)),
+        "lat": _lat(bits.int(89, 27)),
+        "course": _course(bits.uint(116, 12)),
+        "heading": _heading(bits.uint(128, 9)),
+    }
+
+
+def _decode_position_b(bits):
+    return {
+        "speed": _speed(bits.uint(46, 10)),
+        "lon": _lon(bits.int(57, 28)),
+        "lat": _lat(bits.int(85, 27)),
+        "course": _course(bits.uint(112, 12)),
+        "heading": _heading(bits.uint(124, 9)),
+    }
+
+
+def _decode_static_5(bits):
+    shiptype = bits.uint(232, 8)
+    return {
+        "imo": bits.uint(40, 30),
+        "callsign": bits.text(70, 42),
+        "shipname": bits.text(112, 120),
+        "ais_shiptype": shiptype,
+        "shiptype": ais_shiptype_to_category(shiptype),
+        "draught": bits.uint(294, 8) / 10.0,
+        "destination": bits.text(302, 120),
+    }
+
+
+def decode_payload(payload, fill_bits=0):
+    """解碼單一（已重組）payload，回傳 dict；不支援的類型回傳 None"""
+    bits = _Bits(*_payload_to_int(payload, fill_bits))
+    msg_type = bits.uint(0, 6)
+    msg = {"type": msg_type, "mmsi": bits.uint(8, 30)}
+
+    if msg_type in (1, 2, 3):
+        msg.update(_decode_position_a(bits))
+    elif msg_type == 18:
+        msg.update(_decode_position_b(bits))
+    elif msg_type == 19:
+        msg.update(_decode_position_b(bits))
+        shiptype = bits.uint(263, 8)
+        msg.update({
+            "shipname": bits.text(143, 120),
+            "ais_shiptype": shiptype,
+            "shiptype": ais_shiptype_to_category(shiptype),
+        })
+    elif msg_type == 5:
+        msg.update(_decode_static_5(bits))
+    elif msg_type == 24:
+        part = bits.uint(38, 2)
+        msg["part"] = part
+        if part == 0:
+            msg["shipname"] = bits.text(40, 120)
+        elif part == 1:
+            shiptype = bits.uint(40, 8)
+            msg.update({
+                "ais_shiptype": shiptype,
+                "shiptype": ais_shiptype_to_category(shiptype),
+                "callsign": bits.text(90, 42),
+            })
+        else:
+            return None
+    else:
+        return None
+    return msg
+
+
+# --------------------- NMEA 句子 ---------------------
+def _checksum_ok(body, checksum):
+    calc = 0
+    for ch in body:
+        calc ^= ord(ch)
+    try:
+        return calc == int(checksum, 16)
+    except ValueError:
+        return False
+
+
+def _parse_tag_block(tag):
+    """解析 NMEA 4.0 tag block（例如 'c:1700000000,s:station*hh'），回傳 dict"""
+    fields = {}
+    for item in tag.split("*", 1)[0].split(","):
+        if ":" in item:
+            k, v = item.split(":", 1)
+            fields[k] = v
+    return fields
+
+
+class AisDecoder:
+    """
+    逐行餵入 NMEA 句子的解碼器（非執行緒安全，單一來源使用一個實例）。
+    feed() 回傳解碼後的訊息 dict，未完成的分段或無法解碼時回傳 None。
+    """
+
+    def __init__(self, verify_checksum=True):
+        self.verify_checksum = verify_checksum
+        self._pending = OrderedDict()
+        self.counters = {
+            "sentences": 0,
+            "messages": 0,
+            "decode_errors": 0,
+            "checksum_errors": 0,
+            "unsupported": 0,
+            "fragments_dropped": 0,
+        }
+
+    def feed(self, line, received_at=None):
+        line = line.strip() if isinstance(line, str) else line.decode("ascii", "replace").strip()
+        if not line:
+            return None
+        self.counters["sentences"] += 1
+        ts = received_at if received_at is not None else time.time()
+
+        try:
+            # tag block：\c:1700000000*hh\!AIVDM,...
+            if line.startswith("\\"):
+                end = line.index("\\", 1)
+                tags = _parse_tag_block(line[1:end])
+                line = line[end + 1:]
+                if "c" in tags:
+                    c = float(tags["c"])
+                    ts = c / 1000.0 if c > 1e11 else c
+
+            start = line.find("!")
+            if start < 0:
+                raise AisDecodeError("不是 AIS 句子")
+            line = line[start:]
+            if not (line.startswith("!AIVDM") or line.startswith("!AIVDO")):
+                raise AisDecodeError("不是 AIVDM/AIVDO 句子")
+
+            body, _, checksum = line[1:].partition("*")
+            if self.verify_checksum and not _checksum_ok(body, checksum[:2]):
+                self.counters["checksum_errors"] += 1
+                raise AisDecodeError("checksum 錯誤")
+
+            parts = body.split(",")
+            if len(parts) < 7:
+                raise AisDecodeError("欄位數不足")
+            count, num = int(parts[1]), int(parts[2])
+            seq_id, channel, payload = parts[3], parts[4], parts[5]
+            fill_bits = int(parts[6] or 0)
+
+            if count > 1:
+                assembled = self._reassemble(count, num, seq_id, channel, payload, fill_bits, ts)
+                if assembled is None:
+                    return None
+                payload, fill_bits, ts = assembled
+
+            msg = decode_payload(payload, fill_bits)
+        except (AisDecodeError, ValueError, IndexError):
+            self.counters["decode_errors"] += 1
+            return None
+
+        if msg is None:
+            self.counters["unsupported"] += 1
+            return None
+        msg["ts"] = ts
+        self.counters["messages"] += 1
+        return msg
+
+    def _reassemble(self, count, num, seq_id, channel, payload, fill_bits, ts):
+        """暫存分段；收齊時回傳 (完整 payload, 最後一段的 fill bits, 第一段的時間)"""
+        key = (count, seq_id, channel)
+        if num == 1:
+            if key in self._pending:
+                self.counters["fragments_dropped"] += 1
+            self._pending[key] = {"received": time.monotonic(), "ts": ts, "parts": {1: payload}, "fill": 0}
+            self._pending.move_to_end(key)
+        else:
+            entry = self._pending.get(key)
+            if entry is None:
+                self.counters["fragments_dropped"] += 1
+                return None
+            entry["parts"][num] = payload
+        if num == count:
+            self._pending[key]["fill"] = fill_bits
+
+        entry = self._pending[key]
+        if len(entry["parts"]) < count:
+            self._evict()
+            return None
+        del self._pending[key]
+        return "".join(entry["parts"][i] for i in range(1, count + 1)), entry["fill"], entry["ts"]
+
+    def _evict(self):
+        """丟棄過多或過久未收齊的分段（以接收時間計，不受 tag block 時間影響）"""
+        now = time.monotonic()
+        while self._pending:
+            key, entry = next(iter(self._pending.items()))
+            if len(self._pending) > MAX_PENDING_FRAGMENTS or now - entry["received"] > FRAGMENT_TIMEOUT:
+                del self._pending[key]
+                self.counters["fragments_dropped"] += 1
+            else:
+                break
+
+
+class RateMeter:
+    """以 1 秒為單位的滑動視窗計算每秒事件數"""
+
+    def __init__(self, window_seconds=10):
+        self.window = window_seconds
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def add(self, n=1, now=None):
+        sec = int(now if now is not None else time.time())
+        with self._lock:
+            self._buckets[sec] = self._buckets.get(sec, 0) + n
+            if len(self._buckets) > self.window * 2:
+                for k in [k for k in self._buckets if k < sec - self.window]:
+                    del self._buckets[k]
+
+    def rate(self, now=None):
+        sec = int(now if now is not None else time.time())
+        with self._lock:
+            total = sum(v for k, v in self._buckets.items() if sec - self.window <= k < sec)
+        return total / float(self.window)
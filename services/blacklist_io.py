@@ -0,0 +1,212 @@
+# services/blacklist_io.py
+"""
+黑名單批次匯入 / 匯出。
+
+匯入：CSV（欄位 name, note）、NDJSON（一行一筆）或 JSON 陣列，逐列串流解析，
+依正規化船名 upsert（已存在則更新備註，否則新增），全部在同一個交易內以 executemany 分批寫入。
+每列的錯誤（缺船名、格式錯誤等）收集在 errors 中回報，不影響其他列。
+
+匯出：依 id 由舊到新逐批讀取並串流輸出 CSV / NDJSON。
+"""
+import io
+import csv
+import json
+import time
+from datetime import datetime
+
+from sqlalchemy import insert, update, select, bindparam
+
+from models.blacklist_model import BlacklistShip, blacklist_snapshot, bump_version, read_session, write_session
+from models.track_store import normalize_name
+
+# executemany 每批筆數
+BATCH_SIZE = 1000
+# 回報中最多列出的錯誤筆數
+MAX_REPORTED_ERRORS = 1000
+MAX_NAME_LENGTH = 100
+EXPORT_FIELDS = ("id", "name", "note", "created_at")
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+# --------------------- 解析 ---------------------
+def _text_stream(stream, encoding="utf-8-sig"):
+    """bytes stream → 文字 stream（utf-8-sig 可吃掉 Excel 匯出的 BOM）"""
+    if isinstance(stream, io.TextIOBase):
+        return stream
+    return io.TextIOWrapper(stream, encoding=encoding, newline="")
+
+
+def iter_csv(stream):
+    """CSV：第一列為標題（需含 name，note 可選）；產生 (列號, dict 或 ImportRowError)"""
+    reader = csv.DictReader(_text_stream(stream))
+    fields = [f.strip().lower() for f in (reader.fieldnames or [])]
+    if "name" not in fields:
+        raise ValueError("CSV 標題列需包含 name 欄位")
+    reader.fieldnames = fields
+    for row in reader:
+        # DictReader 的列號：標題為第 1 列
+        yield reader.line_num, row
+
+
+def iter_ndjson(stream):
+    for line_no, line in enumerate(_text_stream(stream), start=1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_no, ImportRowError(f"JSON 格式錯誤: {e.msg}")
+            continue
+        yield line_no, item
+
+
+def iter_json(stream):
+    """JSON 陣列或 {"items": [...]}；需整份解析"""
+    data = json.load(_text_stream(stream))
+    if isinstance(data, dict):
+        data = data.get("items")
+    if not isinstance(data, list):
+        raise ValueError("JSON 需為陣列或含 items 陣列的物件")
+    for index, item in enumerate(data, start=1):
+        yield index, item
+
+
+PARSERS = {"csv": iter_csv, "ndjson": iter_ndjson, "json": iter_json}
+
+
+def detect_format(content_type, filename=None, explicit=None):
+    if explicit:
+        if explicit not in PARSERS:
+            raise ValueError(f"不支援的格式: {explicit}")
+        return explicit
+    name = (filename or "").lower()
+    ctype = (content_type or "").lower()
+    if name.endswith(".csv") or "csv" in ctype:
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl")) or "ndjson" in ctype:
+        return "ndjson"
+    return "json"
+
+
+def _clean(item):
+    if isinstance(item, ImportRowError):
+        raise item
+    if not isinstance(item, dict):
+        raise ImportRowError("每筆資料需為物件")
+    name = " ".join(str(item.get("name") or "").split())
+    if not name:
+        raise ImportRowError("name 為必填")
+    if len(name) > MAX_NAME_LENGTH:
+        raise ImportRowError(f"name 超過 {MAX_NAME_LENGTH} 字")
+    note = item.get("note")
+    note = (str(note).strip() or None) if note is not None else None
+    return name, note
+
+
+# --------------------- 匯入 ---------------------
+def import_entries(rows):
+    """
+    rows：(列號, dict) 的 iterable（例如 iter_csv 的結果）。
+    檔案內同名的列以後出現者為準。回傳統計與錯誤列表。
+    """
+    started = time.perf_counter()
+    errors = []
+    error_count = 0
+    pending = {}   # name_norm → (name, note)
+    total = 0
+
+    for line_no, item in rows:
+        total += 1
+        try:
+            name, note = _clean(item)
+        except ImportRowError as e:
+            error_count += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({"row": line_no, "error": str(e)})
+            continue
+        pending[normalize_name(name)] = (name, note)
+
+    inserted = updated = unchanged = 0
+    with write_session() as session:
+        existing = {}
+        norms = list(pending)
+        for start in range(0, len(norms), BATCH_SIZE):
+            chunk = norms[start:start + BATCH_SIZE]
+            stmt = select(BlacklistShip.id, BlacklistShip.name_norm, BlacklistShip.note) \
+                .where(BlacklistShip.name_norm.in_(chunk))
+            for sid, norm, note in session.execute(stmt):
+                existing.setdefault(norm, (sid, note))
+
+        now = datetime.utcnow()
+        to_insert, to_update = [], []
+        for norm, (name, note) in pending.items():
+            current = existing.get(norm)
+            if current is None:
+                to_insert.append({"name": name, "name_norm": norm, "note": note, "created_at": now})
+            elif note is not None and note != current[1]:
+                to_update.append({"b_id": current[0], "b_note": note})
+            else:
+                unchanged += 1
+
+        table = BlacklistShip.__table__
+        for start in range(0, len(to_insert), BATCH_SIZE):
+            session.execute(insert(table), to_insert[start:start + BATCH_SIZE])
+        if to_update:
+            stmt = update(table).where(table.c.id == bindparam("b_id")).values(note=bindparam("b_note"))
+            for start in range(0, len(to_update), BATCH_SIZE):
+                session.execute(stmt, to_update[start:start + BATCH_SIZE])
+        inserted, updated = len(to_insert), len(to_update)
+        if inserted or updated:
+            bump_version(session)
+
+    if inserted or updated:
+        blacklist_snapshot.invalidate()
+
+    return {
+        "rows": total,
+        "inserted": inserted,
+        "updated": updated,
+        "unchanged": unchanged,
+        "duplicates_in_file": total - error_count - len(pending),
+        "error_count": error_count,
+        "errors": errors,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+# --------------------- 匯出 ---------------------
+def iter_entries(batch_size=BATCH_SIZE):
+    """依 id 由舊到新 keyset 逐批讀取，產生 dict"""
+    last_id = 0
+    while True:
+        with read_session() as session:
+            ships = session.query(BlacklistShip).filter(BlacklistShip.id > last_id) \
+                .order_by(BlacklistShip.id).limit(batch_size).all()
+            batch = [s.to_dict() for s in ships]
+        if not batch:
+            return
+        yield from batch
+        last_id = batch[-1]["id"]
+
+
+def export_csv(entries):
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=EXPORT_FIELDS)
+    # BOM 讓 Excel 正確辨識 UTF-8
+    yield "\ufeff"
+    writer.writeheader()
+    for count, entry in enumerate(entries, start=1):
+        writer.writerow(entry)
+        if count % 500 == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def export_ndjson(entries):
+    for entry in entries:
+        yield json.dumps(entry, ensure_ascii=False) + "\n"
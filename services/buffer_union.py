@@ -0,0 +1,365 @@
+# services/buffer_union.py
+"""
+多個 buffer 圓的聯集（dissolve）：把重疊的 buffer 合併成最少的 MultiPolygon，
+減少送給對話模型與 Cesium 的頂點數，之後「是否在任一 buffer 內」的判斷也只需檢查一組外框。
+
+作法（平面多邊形裁切，NumPy 向量化）：
+  1. 以所有頂點的平均經緯度為原點投影到局部平面（公里）。此投影對經緯度是仿射變換，
+     直線邊投影後仍是直線，聯集結果與直接在經緯度上計算相同，只是讓簡化容差有公里單位
+  2. 外框互相重疊的多邊形兩兩求邊的交點，在交點處切開邊（交點座標兩邊共用，之後可精確串接）
+  3. 中點落在其他多邊形內部的子邊捨棄，其餘即為聯集的邊界
+  4. 依端點串成環：逆時針為外環、順時針為洞（buffer 圍出的空隙），洞歸入包含它的外環
+  5. 每個環以 Douglas–Peucker 簡化到 simplify_km 容差
+
+    python -m services.buffer_union bench   # 30 個海岸雷達站 20 公里 buffer：頂點數、payload、點位判斷速度
+"""
+import sys
+import json
+import math
+import time
+
+import numpy as np
+
+# 局部平面投影：每度緯度 / 赤道每度經度的公里數
+_KM_PER_DEG_LAT = 110.574
+_KM_PER_DEG_LON = 111.32
+# 預設簡化容差（公里）；64 邊形半徑 20 公里時弦與圓弧的最大差距約 24 公尺
+DEFAULT_SIMPLIFY_KM = 0.05
+# 交點參數在端點附近時視為端點（避免切出極短的子邊）
+_EPS = 1e-9
+# 點位判斷時，邊數超過此值的環依 y 分帶
+BAND_EDGES = 64
+COORD_DECIMALS = 6
+
+
+def buffer_ring(lon, lat, radius_km, num_points=64):
+    """以 (lon, lat) 為中心、半徑 radius_km 的近似圓（閉合的 [[lon, lat], ...]）"""
+    points = []
+    for i in range(num_points):
+        angle = 2 * math.pi * i / num_points
+        delta_lat = (radius_km / 111.32) * math.sin(angle)
+        denom = 111.32 * math.cos(math.radians(lat))
+        delta_lon = (radius_km / denom) * math.cos(angle) if abs(denom) >= 1e-6 else 0
+        points.append([lon + delta_lon, lat + delta_lat])
+    points.append(points[0])
+    return points
+
+
+class _LocalProjection:
+    def __init__(self, lon0, lat0):
+        self.lon0 = lon0
+        self.lat0 = lat0
+        self.kx = _KM_PER_DEG_LON * math.cos(math.radians(lat0))
+        self.ky = _KM_PER_DEG_LAT
+
+    def forward(self, lonlat):
+        lonlat = np.asarray(lonlat, dtype=np.float64)
+        return np.column_stack(((lonlat[:, 0] - self.lon0) * self.kx, (lonlat[:, 1] - self.lat0) * self.ky))
+
+    def inverse(self, xy):
+        return np.column_stack((xy[:, 0] / self.kx + self.lon0, xy[:, 1] / self.ky + self.lat0))
+
+
+def _signed_area(ring):
+    x, y = ring[:, 0], ring[:, 1]
+    return 0.5 * float(np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y))
+
+
+def _points_in_ring(px, py, ring):
+    """
+    射線法；ring 為不閉合的 (n, 2) 陣列，回傳布林陣列（邊界上的點結果不定）。
+    邊數多時依 y 切成水平帶，每個點只與跨過所在帶的邊比較（聯集後的大外環不會比逐一檢查各圓慢）
+    """
+    if len(ring) <= BAND_EDGES or len(px) == 0:
+        return _crossings_odd(px, py, ring[:, 0], ring[:, 1], np.roll(ring[:, 0], -1), np.roll(ring[:, 1], -1))
+    x1, y1 = ring[:, 0], ring[:, 1]
+    x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+    lo, hi = float(y1.min()), float(y1.max())
+    nbands = max(1, len(ring) // (BAND_EDGES // 4))
+    edges_lo = np.minimum(y1, y2)
+    edges_hi = np.maximum(y1, y2)
+    band = np.clip(((py - lo) / (hi - lo) * nbands).astype(np.int64), 0, nbands - 1)
+    inside = np.zeros(len(px), dtype=bool)
+    valid = (py >= lo) & (py <= hi)
+    for b in np.unique(band[valid]).tolist():
+        sel = np.flatnonzero(valid & (band == b))
+        b_lo = lo + (hi - lo) * b / nbands
+        b_hi = lo + (hi - lo) * (b + 1) / nbands
+        e = np.flatnonzero((edges_hi >= b_lo) & (edges_lo <= b_hi))
+        inside[sel] = _crossings_odd(px[sel], py[sel], x1[e], y1[e], x2[e], y2[e])
+    return inside
+
+
+def _crossings_odd(px, py, x1, y1, x2, y2):
+    px = px[:, None]
+    py = py[:, None]
+    crosses = (y1 > py) != (y2 > py)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_at = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+    return (np.count_nonzero(crosses & (px < x_at), axis=1) % 2) == 1
+
+
+def _open_ring(coords):
+    ring = np.asarray(coords, dtype=np.float64)
+    if len(ring) > 1 and np.array_equal(ring[0], ring[-1]):
+        ring = ring[:-1]
+    return ring
+
+
+def _split_points(rings, boxes):
+    """外框重疊的多邊形兩兩求交點，回傳 {(多邊形, 邊): [(t, 交點)]}"""
+    splits = {}
+    n = len(rings)
+    for i in range(n):
+        a0 = rings[i]
+        a1 = np.roll(a0, -1, axis=0)
+        for j in range(i + 1, n):
+            if (boxes[i][0] > boxes[j][2] or boxes[j][0] > boxes[i][2]
+                    or boxes[i][1] > boxes[j][3] or boxes[j][1] > boxes[i][3]):
+                continue
+            b0 = rings[j]
+            b1 = np.roll(b0, -1, axis=0)
+            r = (a1 - a0)[:, None, :]
+            s = (b1 - b0)[None, :, :]
+            qp = b0[None, :, :] - a0[:, None, :]
+            denom = r[..., 0] * s[..., 1] - r[..., 1] * s[..., 0]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                t = (qp[..., 0] * s[..., 1] - qp[..., 1] * s[..., 0]) / denom
+                u = (qp[..., 0] * r[..., 1] - qp[..., 1] * r[..., 0]) / denom
+            hit = (np.abs(denom) > 1e-15) & (t >= -_EPS) & (t <= 1 + _EPS) & (u >= -_EPS) & (u <= 1 + _EPS)
+            for ea, eb in zip(*np.nonzero(hit)):
+                ta, ub = float(t[ea, eb]), float(u[ea, eb])
+                # 交點落在端點附近時直接使用該端點座標，兩邊的節點才會完全相同
+                if ta <= _EPS:
+                    point = a0[ea]
+                elif ta >= 1 - _EPS:
+                    point = a1[ea]
+                elif ub <= _EPS:
+                    point = b0[eb]
+                elif ub >= 1 - _EPS:
+                    point = b1[eb]
+                else:
+                    point = a0[ea] + ta * (a1[ea] - a0[ea])
+                point = (float(point[0]), float(point[1]))
+                if _EPS < ta < 1 - _EPS:
+                    splits.setdefault((i, int(ea)), []).append((ta, point))
+                if _EPS < ub < 1 - _EPS:
+                    splits.setdefault((j, int(eb)), []).append((ub, point))
+    return splits
+
+
+def _boundary_edges(rings, boxes):
+    """聯集邊界的有向邊 [(起點, 終點)]，方向與原多邊形相同（外環逆時針）"""
+    splits = _split_points(rings, boxes)
+    sub_edges = []
+    owners = {}
+    for i, ring in enumerate(rings):
+        nodes = [(float(x), float(y)) for x, y in ring]
+        sub = []
+        for e in range(len(nodes)):
+            chain = [nodes[e]] + [p for _, p in sorted(splits.get((i, e), ()))] + [nodes[(e + 1) % len(nodes)]]
+            sub.extend((a, b) for a, b in zip(chain, chain[1:]) if a != b)
+        sub_edges.append(sub)
+        for edge in sub:
+            owners.setdefault(edge, set()).add(i)
+
+    # 重合的邊在射線法中結果不定，先行處理：反向（兩多邊形由兩側共用的邊界）兩條都去掉，
+    # 同向只留一條，且不與擁有同一條邊的多邊形比較
+    edges = []
+    for i, sub in enumerate(sub_edges):
+        sub = [edge for edge in sub if (edge[1], edge[0]) not in owners and min(owners[edge]) == i]
+        if not sub:
+            continue
+        mid = np.array([((a[0] + b[0]) / 2, (a[1] + b[1]) / 2) for a, b in sub])
+        inside = np.zeros(len(sub), dtype=bool)
+        for j, other in enumerate(rings):
+            if j == i:
+                continue
+            box = boxes[j]
+            cand = np.flatnonzero(~inside & (mid[:, 0] >= box[0]) & (mid[:, 0] <= box[2])
+                                  & (mid[:, 1] >= box[1]) & (mid[:, 1] <= box[3]))
+            cand = [k for k in cand.tolist() if j not in owners[sub[k]]]
+            if cand:
+                inside[cand] = _points_in_ring(mid[cand, 0], mid[cand, 1], other)
+        edges.extend(edge for edge, drop in zip(sub, inside.tolist()) if not drop)
+    return edges
+
+
+def _link_rings(edges):
+    outgoing = {}
+    for a, b in edges:
+        outgoing.setdefault(a, []).append(b)
+    rings = []
+    for start in list(outgoing):
+        while outgoing.get(start):
+            ring = [start]
+            prev, node = start, outgoing[start].pop()
+            while node != start:
+                ring.append(node)
+                choices = outgoing.get(node)
+                if not choices:
+                    break
+                if len(choices) == 1:
+                    nxt = choices.pop()
+                else:
+                    # 多個區域在同一點相接：選左轉最多的邊，讓每個環都緊貼自己的區域
+                    din = (node[0] - prev[0], node[1] - prev[1])
+
+                    def _turn(p):
+                        dout = (p[0] - node[0], p[1] - node[1])
+                        return math.atan2(din[0] * dout[1] - din[1] * dout[0], din[0] * dout[0] + din[1] * dout[1])
+
+                    nxt = max(choices, key=_turn)
+                    choices.remove(nxt)
+                prev, node = node, nxt
+            if node == start and len(ring) >= 3:
+                rings.append(np.array(ring))
+    return rings
+
+
+def _simplify(ring, tolerance):
+    """閉合環的 Douglas–Peucker（ring 不閉合）；從距第一點最遠的點切成兩段分別簡化"""
+    if tolerance <= 0 or len(ring) <= 4:
+        return ring
+    far = int(np.argmax(np.hypot(*(ring - ring[0]).T)))
+    closed = np.vstack((ring, ring[:1]))
+    keep = np.zeros(len(closed), dtype=bool)
+    keep[[0, far, len(ring)]] = True
+    stack = [(0, far), (far, len(ring))]
+    while stack:
+        lo, hi = stack.pop()
+        if hi - lo < 2:
+            continue
+        seg = closed[hi] - closed[lo]
+        pts = closed[lo + 1:hi] - closed[lo]
+        length = math.hypot(seg[0], seg[1])
+        if length == 0:
+            dist = np.hypot(pts[:, 0], pts[:, 1])
+        else:
+            dist = np.abs(pts[:, 0] * seg[1] - pts[:, 1] * seg[0]) / length
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance:
+            mid = lo + 1 + k
+            keep[mid] = True
+            stack.append((lo, mid))
+            stack.append((mid, hi))
+    return closed[:-1][keep[:-1]]
+
+
+def union_rings(rings, simplify_km=DEFAULT_SIMPLIFY_KM):
+    """
+    多個簡單多邊形（外環 [[lon, lat], ...]，可閉合或不閉合）的聯集。
+    回傳 (GeoJSON MultiPolygon 的 coordinates, 統計)；每個 polygon 為 [外環, 洞...]，環皆閉合。
+    """
+    rings = [_open_ring(r) for r in rings]
+    rings = [r for r in rings if len(r) >= 3]
+    if not rings:
+        return [], {"input_polygons": 0, "input_vertices": 0, "polygons": 0, "holes": 0, "vertices": 0}
+    all_points = np.vstack(rings)
+    proj = _LocalProjection(float(all_points[:, 0].mean()), float(all_points[:, 1].mean()))
+
+    projected, seen = [], set()
+    for ring in rings:
+        xy = proj.forward(ring)
+        area = _signed_area(xy)
+        if abs(area) < 1e-12:
+            continue
+        if area < 0:
+            xy = xy[::-1]
+        # 完全相同的多邊形（同一地點重複列出）只留一個
+        signature = xy.round(9).tobytes()
+        if signature in seen:
+            continue
+        seen.add(signature)
+        projected.append(xy)
+    boxes = [(r[:, 0].min(), r[:, 1].min(), r[:, 0].max(), r[:, 1].max()) for r in projected]
+
+    outers, holes = [], []
+    for ring in _link_rings(_boundary_edges(projected, boxes)):
+        ring = _simplify(ring, simplify_km) if simplify_km else ring
+        if len(ring) < 3:
+            continue
+        area = _signed_area(ring)
+        (outers if area > 0 else holes).append((abs(area), ring))
+
+    # 洞歸入包含它、面積最小的外環
+    outers.sort(key=lambda item: item[0])
+    polygons = [[ring] for _, ring in outers]
+    for _, hole in holes:
+        probe = hole[:1]
+        for k, (_, outer) in enumerate(outers):
+            if _points_in_ring(probe[:, 0], probe[:, 1], outer)[0]:
+                polygons[k].append(hole)
+                break
+
+    def _lonlat(ring):
+        coords = proj.inverse(ring).round(COORD_DECIMALS).tolist()
+        return coords + coords[:1]
+
+    coordinates = [[_lonlat(r) for r in polygon] for polygon in polygons]
+    stats = {
+        "input_polygons": len(rings),
+        "input_vertices": int(sum(len(r) for r in rings)),
+        "polygons": len(polygons),
+        "holes": sum(len(p) - 1 for p in polygons),
+        "vertices": int(sum(len(r) for p in polygons for r in p)),
+    }
+    return coordinates, stats
+
+
+def points_in_multipolygon(coordinates, lons, lats):
+    """(lons, lats) 是否落在 MultiPolygon（GeoJSON coordinates）內，含洞的判斷；回傳布林陣列"""
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.asarray(lats, dtype=np.float64)
+    inside = np.zeros(lons.shape, dtype=bool)
+    for polygon in coordinates:
+        outer = _open_ring(polygon[0])
+        box = np.flatnonzero(~inside & (lons >= outer[:, 0].min()) & (lons <= outer[:, 0].max())
+                             & (lats >= outer[:, 1].min()) & (lats <= outer[:, 1].max()))
+        if not len(box):
+            continue
+        hit = _points_in_ring(lons[box], lats[box], outer)
+        for hole in polygon[1:]:
+            hit &= ~_points_in_ring(lons[box], lats[box], _open_ring(hole))
+        inside[box] = hit
+    return inside
+
+
+# --------------------- 效能測試 ---------------------
+def benchmark(sites=30, radius_km=20.0, points=100_000):
+    rng = np.random.default_rng(7)
+    # 台灣西岸一帶的站點（彼此間距小於 buffer 直徑，大量重疊）
+    site_lat = np.linspace(22.4, 25.2, sites) + rng.normal(0, 0.03, sites)
+    site_lon = 120.1 + (site_lat - 22.4) * 0.45 + rng.normal(0, 0.05, sites)
+    rings = [buffer_ring(lon, lat, radius_km) for lon, lat in zip(site_lon.tolist(), site_lat.tolist())]
+
+    for simplify_km in (0.0, DEFAULT_SIMPLIFY_KM, 0.2):
+        started = time.perf_counter()
+        coordinates, stats = union_rings(rings, simplify_km)
+        elapsed = time.perf_counter() - started
+        yield {"op": "union", "simplify_km": simplify_km, "ms": round(elapsed * 1000, 1), **stats,
+               "bytes_separate": len(json.dumps(rings)), "bytes_union": len(json.dumps(coordinates))}
+
+    # 點位判斷：逐一檢查各 buffer vs 檢查聯集外框（未簡化時結果應相同）
+    coordinates, _ = union_rings(rings, 0.0)
+    lons = rng.uniform(119.6, 121.8, points)
+    lats = rng.uniform(22.0, 25.6, points)
+    started = time.perf_counter()
+    separate = np.zeros(points, dtype=bool)
+    for ring in rings:
+        separate |= points_in_multipolygon([[ring]], lons, lats)
+    separate_s = time.perf_counter() - started
+    started = time.perf_counter()
+    dissolved = points_in_multipolygon(coordinates, lons, lats)
+    dissolved_s = time.perf_counter() - started
+    yield {"op": "contains", "points": points, "inside": int(dissolved.sum()),
+           "mismatches": int(np.count_nonzero(separate != dissolved)),
+           "separate_ms": round(separate_s * 1000, 1), "dissolved_ms": round(dissolved_s * 1000, 1)}
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["bench"]:
+        print("用法: python -m services.buffer_union bench")
+        sys.exit(1)
+    for line in benchmark():
+        print(json.dumps(line, ensure_ascii=False))
@@ -0,0 +1,389 @@
+# services/cpa.py
+"""
+CPA / TCPA（最近接近點 / 到達最近接近點的時間）計算。
+
+兩兩比對所有船是 O(n²)，數萬艘船時不可行，因此：
+  1. 依「最大航速 × 預測時間 + CPA 門檻」決定格網大小，把船分到經緯度格網
+  2. 只比對同格與相鄰 8 格的船（在預測時間內可能接近的船一定落在相鄰格）
+  3. 候選配對以 NumPy 一次計算 CPA / TCPA，篩選出距離與時間都在門檻內的配對
+
+監看對象分兩組：
+  A 組：中國海警（船名關鍵字）或中國籍船舶（MMSI MID 412–414）
+  B 組：我方船舶（環境變數 OWN_MMSI，逗號分隔）與黑名單船名
+只計算 A × B 的配對；兩組都不指定時計算所有配對。
+
+    python -m services.cpa bench     # 10k / 50k 艘的格網 vs 暴力比對
+"""
+import os
+import sys
+import json
+import time
+import threading
+
+import numpy as np
+
+from models.vessel_store import latest_store
+from models.track_store import normalize_name, format_time
+from services.geodesy import KNOT_TO_KMH, KM_TO_NM, destination_points
+
+# 預設門檻
+DEFAULT_CPA_NM = 1.0
+DEFAULT_TCPA_MIN = 30.0
+# 航速上限（節），超過視為錯誤資料並截斷，格網大小依此計算
+MAX_SPEED_KN = 30.0
+# 每批處理的船數（控制候選配對陣列的記憶體用量）
+CHUNK_SIZE = 4096
+# 持續監看的重算間隔（秒）
+MONITOR_INTERVAL = 5.0
+
+CN_MMSI_PREFIXES = ("412", "413", "414")
+COAST_GUARD_KEYWORDS = ("HAIJING", "HAI JING", "CHINA COAST GUARD", "CHINACOASTGUARD")
+
+KM_PER_DEG_LAT = 110.574
+KM_PER_DEG_LON = 111.320
+
+
+def is_cn_or_coast_guard(row):
+    name = normalize_name(row.get("shipname") or "")
+    if any(k in name for k in COAST_GUARD_KEYWORDS):
+        return True
+    return str(row.get("mmsi") or "").startswith(CN_MMSI_PREFIXES)
+
+
+def own_mmsi_set():
+    return {int(m) for m in os.environ.get("OWN_MMSI", "").replace(" ", "").split(",") if m.isdigit()}
+
+
+def blacklist_names():
+    from models.blacklist_model import blacklist_snapshot
+
+    _, _, by_name = blacklist_snapshot.get()
+    return set(by_name)
+
+
+def default_groups(rows):
+    """回傳 (A 組遮罩, B 組遮罩)"""
+    own = own_mmsi_set()
+    blacklisted = blacklist_names()
+    group_a = np.fromiter((is_cn_or_coast_guard(r) for r in rows), dtype=bool, count=len(rows))
+    group_b = np.fromiter(
+        ((r.get("mmsi") in own) or normalize_name(r.get("shipname") or "") in blacklisted for r in rows),
+        dtype=bool, count=len(rows))
+    return group_a, group_b
+
+
+def cpa_tcpa(dx, dy, dvx, dvy):
+    """
+    向量化 CPA / TCPA。dx、dy 為 B 相對 A 的位置（公里），dvx、dvy 為相對速度（公里/小時）；
+    回傳 (dcpa_km, tcpa_h)。TCPA 為負（正在遠離）時截為 0，此時 dcpa 即為目前距離。
+    """
+    dv2 = dvx * dvx + dvy * dvy
+    moving = dv2 > 1e-12
+    tcpa = np.zeros_like(dx)
+    np.divide(-(dx * dvx + dy * dvy), dv2, out=tcpa, where=moving)
+    np.maximum(tcpa, 0.0, out=tcpa)
+    return np.hypot(dx + dvx * tcpa, dy + dvy * tcpa), tcpa
+
+
+class VesselArrays:
+    """
+    船位資料列 → 計算用欄位陣列（缺航速 / 航向視為靜止）。
+    速度分量與經度換算係數每船只算一次，配對計算只剩加減乘除。
+    """
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.lat = np.array([r["lat"] for r in rows], dtype=np.float64)
+        self.lon = np.array([r["lon"] for r in rows], dtype=np.float64)
+        sog = np.array([np.nan if r.get("speed") is None else r["speed"] for r in rows], dtype=np.float64)
+        cog = np.array([np.nan if r.get("course") is None else r["course"] for r in rows], dtype=np.float64)
+        moving = np.isfinite(sog) & np.isfinite(cog)
+        self.sog = np.where(moving, np.clip(sog, 0.0, MAX_SPEED_KN), 0.0)
+        self.cog = np.where(moving, cog, 0.0)
+        speed_kmh = self.sog * KNOT_TO_KMH
+        self.vx = speed_kmh * np.sin(np.radians(self.cog))
+        self.vy = speed_kmh * np.cos(np.radians(self.cog))
+        # 以 A 船緯度的等距圓柱投影換算經差，CPA 門檻範圍內誤差可忽略
+        self.km_per_deg_lon = KM_PER_DEG_LON * np.cos(np.radians(self.lat))
+
+    def __len__(self):
+        return len(self.lat)
+
+    def relative(self, i, j):
+        """配對 (i, j) 的相對位置（公里）與相對速度（公里/小時）"""
+        dlon = (self.lon[j] - self.lon[i] + 540.0) % 360.0 - 180.0
+        return (dlon * self.km_per_deg_lon[i], (self.lat[j] - self.lat[i]) * KM_PER_DEG_LAT,
+                self.vx[j] - self.vx[i], self.vy[j] - self.vy[i])
+
+
+def _grid_keys(lat, lon, max_speed_kn, cpa_km, horizon_h):
+    """格網大小 = CPA 門檻 + 兩船以最大航速相向的距離；回傳 (每船格網鍵, 列寬)"""
+    reach_km = cpa_km + 2 * max_speed_kn * KNOT_TO_KMH * horizon_h
+    cell_lat = max(reach_km / KM_PER_DEG_LAT, 1e-4)
+    max_abs_lat = min(float(np.max(np.abs(lat))) if len(lat) else 0.0, 85.0)
+    cell_lon = max(reach_km / (KM_PER_DEG_LON * np.cos(np.radians(max_abs_lat))), 1e-4)
+
+    cy = np.floor((lat + 90.0) / cell_lat).astype(np.int64)
+    cx = np.floor((lon + 180.0) / cell_lon).astype(np.int64)
+    width = int(360.0 / cell_lon) + 3
+    return (cy + 1) * width + (cx + 1), width
+
+
+def candidate_pairs(keys, width, rows_i, is_target):
+    """對 rows_i 中每艘船，找出相鄰 9 格內且 is_target 為 True 的其他船，回傳 (i, j) 索引陣列"""
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    out_i, out_j = [], []
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            target = keys[rows_i] + dy * width + dx
+            lo = np.searchsorted(sorted_keys, target, side="left")
+            hi = np.searchsorted(sorted_keys, target, side="right")
+            counts = hi - lo
+            total = int(counts.sum())
+            if not total:
+                continue
+            i_idx = np.repeat(rows_i, counts)
+            # 每段 [lo, hi) 展開成連續位置
+            offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            j_idx = order[np.repeat(lo, counts) + offsets]
+            keep = is_target[j_idx] & (i_idx != j_idx)
+            out_i.append(i_idx[keep])
+            out_j.append(j_idx[keep])
+    if not out_i:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty
+    return np.concatenate(out_i), np.concatenate(out_j)
+
+
+def find_close_approaches(rows, cpa_nm=DEFAULT_CPA_NM, tcpa_min=DEFAULT_TCPA_MIN,
+                          group_a=None, group_b=None, stats=None):
+    """
+    找出 A × B 配對中 DCPA ≤ cpa_nm 且 TCPA ≤ tcpa_min 的船對，依 TCPA 排序。
+    group_a / group_b 為布林遮罩，None 表示全部船。stats（dict）會填入配對數等統計。
+    """
+    vessels = VesselArrays(rows)
+    n = len(vessels)
+    stats = stats if stats is not None else {}
+    stats.update({"vessels": n, "candidate_pairs": 0, "alerts": 0})
+    if n < 2:
+        return []
+
+    is_a = np.ones(n, dtype=bool) if group_a is None else np.asarray(group_a, dtype=bool)
+    is_b = np.ones(n, dtype=bool) if group_b is None else np.asarray(group_b, dtype=bool)
+    cpa_km = cpa_nm / KM_TO_NM
+    horizon_h = tcpa_min / 60.0
+    keys, width = _grid_keys(vessels.lat, vessels.lon, float(vessels.sog.max()), cpa_km, horizon_h)
+
+    # 以船數較少的一組為查詢端（例如少數我方船 × 大量中國籍船）
+    swap = is_b.sum() < is_a.sum()
+    source, target = (is_b, is_a) if swap else (is_a, is_b)
+
+    alerts_i, alerts_j, dcpa_all, tcpa_all, range_all = [], [], [], [], []
+    rows_src = np.flatnonzero(source)
+    for start in range(0, len(rows_src), CHUNK_SIZE):
+        i, j = candidate_pairs(keys, width, rows_src[start:start + CHUNK_SIZE], target)
+        if swap:
+            i, j = j, i
+        # (i, j) 與 (j, i) 都符合 A × B 時只保留 i < j
+        keep = ~(is_a[j] & is_b[i]) | (i < j)
+        i, j = i[keep], j[keep]
+        stats["candidate_pairs"] += int(len(i))
+        if not len(i):
+            continue
+        dx, dy, dvx, dvy = vessels.relative(i, j)
+        rng = np.hypot(dx, dy)
+        # 目前距離超過「門檻 + 相對速度 × 預測時間」的配對不可能接近，先剔除
+        near = rng <= cpa_km + np.hypot(dvx, dvy) * horizon_h
+        i, j, rng, dx, dy, dvx, dvy = i[near], j[near], rng[near], dx[near], dy[near], dvx[near], dvy[near]
+        dcpa, tcpa = cpa_tcpa(dx, dy, dvx, dvy)
+        hit = (dcpa <= cpa_km) & (tcpa <= horizon_h)
+        alerts_i.append(i[hit])
+        alerts_j.append(j[hit])
+        dcpa_all.append(dcpa[hit])
+        tcpa_all.append(tcpa[hit])
+        range_all.append(rng[hit])
+
+    if not alerts_i:
+        return []
+    i, j = np.concatenate(alerts_i), np.concatenate(alerts_j)
+    dcpa, tcpa, rng = np.concatenate(dcpa_all), np.concatenate(tcpa_all), np.concatenate(range_all)
+    order = np.argsort(tcpa, kind="stable")
+    i, j, dcpa, tcpa, rng = i[order], j[order], dcpa[order], tcpa[order], rng[order]
+    stats["alerts"] = int(len(i))
+
+    # 最近接近時兩船的位置
+    dist_a = vessels.sog[i] * KNOT_TO_KMH * tcpa
+    dist_b = vessels.sog[j] * KNOT_TO_KMH * tcpa
+    cpa_lat_a, cpa_lon_a = destination_points(vessels.lat[i], vessels.lon[i], vessels.cog[i], dist_a)
+    cpa_lat_b, cpa_lon_b = destination_points(vessels.lat[j], vessels.lon[j], vessels.cog[j], dist_b)
+
+    alerts = []
+    for k, (a, b) in enumerate(zip(i.tolist(), j.tolist())):
+        ra, rb = rows[a], rows[b]
+        alerts.append({
+            "vessel_a": {"mmsi": ra.get("mmsi"), "shipname": ra.get("shipname"),
+                         "lat": ra["lat"], "lon": ra["lon"],
+                         "cpa_lat": float(cpa_lat_a[k]), "cpa_lon": float(cpa_lon_a[k])},
+            "vessel_b": {"mmsi": rb.get("mmsi"), "shipname": rb.get("shipname"),
+                         "lat": rb["lat"], "lon": rb["lon"],
+                         "cpa_lat": float(cpa_lat_b[k]), "cpa_lon": float(cpa_lon_b[k])},
+            "dcpa_nm": round(float(dcpa[k]) * KM_TO_NM, 3),
+            "tcpa_min": round(float(tcpa[k]) * 60.0, 1),
+            "range_nm": round(float(rng[k]) * KM_TO_NM, 3),
+        })
+    return alerts
+
+
+def alerts_to_geojson(alerts):
+    """每組警示輸出兩艘船目前位置與 CPA 連線（供地圖顯示 / LLM 工具回傳）"""
+    features = []
+    for alert in alerts:
+        a, b = alert["vessel_a"], alert["vessel_b"]
+        props = {"dcpa_nm": alert["dcpa_nm"], "tcpa_min": alert["tcpa_min"], "range_nm": alert["range_nm"]}
+        for v, role in ((a, "vessel_a"), (b, "vessel_b")):
+            features.append({
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [v["lon"], v["lat"]]},
+                "properties": {"name": v["shipname"] or str(v["mmsi"]), "mmsi": v["mmsi"],
+                               "feature_type": role, **props},
+            })
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "LineString",
+                         "coordinates": [[a["cpa_lon"], a["cpa_lat"]], [b["cpa_lon"], b["cpa_lat"]]]},
+            "properties": {"name": f"CPA {a['shipname'] or a['mmsi']} / {b['shipname'] or b['mmsi']}",
+                           "feature_type": "cpa_line", **props},
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+class CpaMonitor:
+    """背景執行緒：最新船位表 version 改變時重算 CPA 警示"""
+
+    def __init__(self, store=latest_store, interval=MONITOR_INTERVAL,
+                 cpa_nm=DEFAULT_CPA_NM, tcpa_min=DEFAULT_TCPA_MIN):
+        self.store = store
+        self.interval = interval
+        self.cpa_nm = cpa_nm
+        self.tcpa_min = tcpa_min
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._alerts = []
+        self._stats = {}
+        self._version = None
+
+    def run_once(self):
+        version = self.store.version
+        if version == self._version:
+            return False
+        rows = self.store.snapshot()
+        stats = {}
+        t0 = time.perf_counter()
+        group_a, group_b = default_groups(rows)
+        alerts = find_close_approaches(rows, self.cpa_nm, self.tcpa_min, group_a, group_b, stats)
+        stats.update({"version": version, "elapsed_ms": round((time.perf_counter() - t0) * 1000, 2),
+                      "computed_at": format_time(time.time())})
+        with self._lock:
+            self._alerts, self._stats, self._version = alerts, stats, version
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"❌ CPA 計算失敗: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="cpa-monitor", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def has_result(self):
+        with self._lock:
+            return self._version is not None
+
+    def ensure_fresh(self):
+        """背景執行緒尚未算出第一份結果時，先同步計算一次"""
+        if not self.has_result:
+            self.run_once()
+
+    def alerts(self):
+        with self._lock:
+            return list(self._alerts), dict(self._stats)
+
+
+cpa_monitor = CpaMonitor()
+
+
+# --------------------- 基準測試 ---------------------
+def _synthetic_rows(n, rng):
+    """集中在台灣周邊的隨機船位"""
+    return [
+        {"mmsi": 412000000 + k, "shipname": f"V{k}",
+         "lat": float(21 + rng.random() * 6), "lon": float(117 + rng.random() * 6),
+         "speed": float(rng.random() * 20), "course": float(rng.random() * 360)}
+        for k in range(n)
+    ]
+
+
+def _brute_force(rows, cpa_nm, tcpa_min, block=2000):
+    """暴力比對所有配對（分塊向量化），只用於驗證與比較"""
+    v = VesselArrays(rows)
+    n = len(v)
+    cpa_km, horizon_h = cpa_nm / KM_TO_NM, tcpa_min / 60.0
+    pairs = set()
+    for s in range(0, n, block):
+        i = np.arange(s, min(s + block, n))[:, None]
+        j = np.arange(n)[None, :]
+        i, j = np.broadcast_arrays(i, j)
+        mask = j > i
+        i, j = i[mask], j[mask]
+        dcpa, tcpa = cpa_tcpa(*v.relative(i, j))
+        hit = (dcpa <= cpa_km) & (tcpa <= horizon_h)
+        pairs.update(zip(i[hit].tolist(), j[hit].tolist()))
+    return pairs
+
+
+def benchmark(sizes=(10_000, 50_000), cpa_nm=DEFAULT_CPA_NM, tcpa_min=DEFAULT_TCPA_MIN, brute_max=10_000):
+    rng = np.random.default_rng(0)
+    report = []
+    for n in sizes:
+        rows = _synthetic_rows(n, rng)
+        stats = {}
+        t0 = time.perf_counter()
+        alerts = find_close_approaches(rows, cpa_nm, tcpa_min, stats=stats)
+        grid_s = time.perf_counter() - t0
+        line = {"vessels": n, "all_pairs": n * (n - 1) // 2, "candidate_pairs": stats["candidate_pairs"],
+                "alerts": len(alerts), "grid_ms": round(grid_s * 1000, 1)}
+        # 實際監看情境：A 組為全部船，B 組（我方 / 黑名單）約 1%
+        group_b = np.arange(n) % 100 == 0
+        t0 = time.perf_counter()
+        watch = find_close_approaches(rows, cpa_nm, tcpa_min, group_b=group_b)
+        line.update({"watch_b_vessels": int(group_b.sum()), "watch_alerts": len(watch),
+                     "watch_ms": round((time.perf_counter() - t0) * 1000, 1)})
+        if n <= brute_max:
+            index = {r["mmsi"]: k for k, r in enumerate(rows)}
+            t0 = time.perf_counter()
+            expected = _brute_force(rows, cpa_nm, tcpa_min)
+            line["brute_force_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+            got = {tuple(sorted((index[a["vessel_a"]["mmsi"]], index[a["vessel_b"]["mmsi"]]))) for a in alerts}
+            line["matches_brute_force"] = got == expected
+        report.append(line)
+    return report
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["bench"]:
+        print("用法: python -m services.cpa bench")
+        sys.exit(1)
+    for line in benchmark():
+        print(json.dumps(line))
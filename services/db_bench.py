@@ -0,0 +1,135 @@
+# services/db_bench.py
+"""
+黑名單資料庫並行壓力測試：多個執行緒同時對 /api/blacklist_ships 送出混合的 GET / POST / DELETE，
+統計每種操作的次數、延遲（p50 / p95 / max）與錯誤數（例如 database is locked）。
+
+每種設定在獨立的子行程與暫存目錄中執行（models/database.py 在匯入時就建立 engine）：
+  tuned ：WAL + synchronous=NORMAL + busy_timeout（目前設定）
+  legacy：rollback journal（DELETE）+ synchronous=FULL + 不等待鎖（舊行為）
+
+    python -m services.db_bench [--threads 16] [--seconds 5]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+
+CONFIGS = {
+    "tuned": {},
+    "legacy": {"SQLITE_JOURNAL_MODE": "DELETE", "SQLITE_SYNCHRONOUS": "FULL", "SQLITE_BUSY_TIMEOUT_MS": "0"},
+}
+# 操作比例：讀取為主
+MIX = (("get_page", 0.45), ("get_name", 0.2), ("post", 0.2), ("delete", 0.15))
+
+
+def _percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 2)
+
+
+def _worker(threads, seconds):
+    """在子行程內執行：建立只含黑名單 API 的 Flask app 並施加負載"""
+    from flask import Flask
+    from models.database import remove_session
+    from routes.blacklist_api import blacklist_api
+
+    app = Flask(__name__)
+    app.teardown_appcontext(remove_session)
+    app.register_blueprint(blacklist_api, url_prefix="/api")
+
+    seed = app.test_client()
+    for k in range(200):
+        seed.post("/api/blacklist_ships", json={"name": f"SEED {k}", "note": "bench"})
+
+    results = {name: {"latency": [], "errors": 0} for name, _ in MIX}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def run(tid):
+        client = app.test_client()
+        rnd = random.Random(tid)
+        created = []
+        names, weights = zip(*MIX)
+        while time.perf_counter() < deadline:
+            op = rnd.choices(names, weights)[0]
+            t0 = time.perf_counter()
+            if op == "get_page":
+                resp = client.get(f"/api/blacklist_ships?limit=50&cursor={rnd.randint(50, 400)}")
+            elif op == "get_name":
+                resp = client.get(f"/api/blacklist_ships?name=seed {rnd.randint(0, 199)}")
+            elif op == "post":
+                resp = client.post("/api/blacklist_ships", json={"name": f"T{tid} {rnd.random()}"})
+                if resp.status_code == 200:
+                    created.append(resp.get_json()["id"])
+            else:
+                if not created:
+                    continue
+                resp = client.delete(f"/api/blacklist_ships/{created.pop()}")
+            elapsed = time.perf_counter() - t0
+            with lock:
+                r = results[op]
+                if resp.status_code == 200:
+                    r["latency"].append(elapsed)
+                else:
+                    r["errors"] += 1
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=run, args=(t,)) for t in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    wall = time.perf_counter() - started
+
+    report = {"threads": threads, "seconds": round(wall, 2), "ops": {}}
+    total = 0
+    for name, r in results.items():
+        ok = len(r["latency"])
+        total += ok
+        report["ops"][name] = {
+            "ok": ok, "errors": r["errors"],
+            "p50_ms": _percentile(r["latency"], 0.5), "p95_ms": _percentile(r["latency"], 0.95),
+            "max_ms": _percentile(r["latency"], 1.0),
+        }
+    report["ok_per_s"] = round(total / wall, 1)
+    report["errors"] = sum(r["errors"] for r in results.values())
+    return report
+
+
+def benchmark(threads=16, seconds=5):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    reports = {}
+    for name, overrides in CONFIGS.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            env = {**os.environ, **overrides, "PYTHONPATH": root}
+            out = subprocess.run(
+                [sys.executable, "-m", "services.db_bench", "--worker",
+                 "--threads", str(threads), "--seconds", str(seconds)],
+                cwd=tmp, env=env, capture_output=True, text=True,
+            )
+            if out.returncode != 0:
+                reports[name] = {"error": out.stderr[-500:]}
+            else:
+                reports[name] = json.loads(out.stdout.strip().splitlines()[-1])
+    return reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="黑名單資料庫並行壓力測試")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(_worker(args.threads, args.seconds), ensure_ascii=False))
+    else:
+        for name, report in benchmark(args.threads, args.seconds).items():
+            print(json.dumps({"config": name, **report}, ensure_ascii=False))
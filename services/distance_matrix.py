@@ -0,0 +1,321 @@
+# services/distance_matrix.py
+"""
+N × M 距離 / 方位角矩陣（例如「各雷達站到這批船的距離」）。
+
+兩組點各自先算好弧度與 sin / cos，再以 NumPy 廣播一次計算整批列的
+haversine 距離與起始方位角（公式同 services/geodesy.py），依列分段以控制暫存陣列的記憶體用量。
+結果以 float32 存放（數千 × 數千時記憶體減半，距離誤差 < 1 公尺）。
+只需要各列最近 k 個目標時（MatrixResult(..., full=False)）逐段計算並只保留每段的前 k 個，
+不建立完整的 N × M 矩陣，記憶體只與 CHUNK_CELLS 與 N × k 有關。
+
+點可以是：
+  - 地名（交給呼叫端提供的 geocode 函式解析）
+  - "lat,lon" 字串、[lat, lon]、{"lat", "lon"} 或 {"latitude", "longitude"}
+  - MMSI（9 位數字字串或 {"mmsi": ...}），取最新船位表中的位置
+
+    python -m services.distance_matrix bench
+"""
+import re
+import sys
+import json
+import time
+import math
+
+import numpy as np
+
+from models.vessel_store import latest_store
+from services.geodesy import EARTH_RADIUS_KM, KM_TO_NM
+
+# 每段最多計算的格數（列數 = CHUNK_CELLS // M），約數十 MB 的暫存陣列
+CHUNK_CELLS = 2_000_000
+
+_COORD_RE = re.compile(r"^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*$")
+_MMSI_RE = re.compile(r"^\s*\d{9}\s*$")
+
+
+def _rounded(values, decimals):
+    """float32 先轉 float64 再四捨五入，避免 tolist() 產生 122.16300201416016 這類數值"""
+    return np.round(values.astype(np.float64), decimals)
+
+
+class PointList:
+    """解析後的點：labels、lat / lon 陣列，以及無法解析的項目"""
+
+    def __init__(self):
+        self.labels = []
+        self.lat = []
+        self.lon = []
+        self.unresolved = []
+
+    def add(self, label, lat, lon):
+        if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+            self.unresolved.append(label)
+            return
+        self.labels.append(label)
+        self.lat.append(lat)
+        self.lon.append(lon)
+
+    def arrays(self):
+        return np.asarray(self.lat, dtype=np.float64), np.asarray(self.lon, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.labels)
+
+
+def _vessel_point(mmsi):
+    row = latest_store.get(int(mmsi))
+    if row is None:
+        return None
+    return (row.get("shipname") or str(row["mmsi"])), row["lat"], row["lon"]
+
+
+def geocode_count(items):
+    """items 中需要交給 geocode 解析的項目數（地名字串；座標、MMSI 不計），供呼叫端在解析前檢查上限"""
+    count = 0
+    for item in items or []:
+        if isinstance(item, (dict, list, tuple)):
+            continue
+        text = str(item).strip()
+        if not (_COORD_RE.match(text) or _MMSI_RE.match(text)):
+            count += 1
+    return count
+
+
+def resolve_points(items, geocode=None):
+    """items → PointList；geocode(name) 回傳 {"latitude", "longitude"} 或 None"""
+    points = PointList()
+    for item in items or []:
+        if isinstance(item, dict):
+            if item.get("mmsi") is not None:
+                found = _vessel_point(item["mmsi"])
+                if found is None:
+                    points.unresolved.append(str(item["mmsi"]))
+                else:
+                    points.add(item.get("name") or found[0], found[1], found[2])
+                continue
+            lat = item.get("lat", item.get("latitude"))
+            lon = item.get("lon", item.get("longitude"))
+            if lat is None or lon is None:
+                points.unresolved.append(item.get("name") or json.dumps(item, ensure_ascii=False))
+                continue
+            points.add(item.get("name") or f"{lat},{lon}", float(lat), float(lon))
+        elif isinstance(item, (list, tuple)) and len(item) == 2:
+            points.add(f"{item[0]},{item[1]}", float(item[0]), float(item[1]))
+        else:
+            text = str(item).strip()
+            match = _COORD_RE.match(text)
+            if match:
+                points.add(text, float(match.group(1)), float(match.group(2)))
+                continue
+            if _MMSI_RE.match(text):
+                found = _vessel_point(text)
+                if found is not None:
+                    points.add(found[0], found[1], found[2])
+                else:
+                    points.unresolved.append(text)
+                continue
+            location = geocode(text) if geocode else None
+            if location:
+                points.add(text, location["latitude"], location["longitude"])
+            else:
+                points.unresolved.append(text)
+    return points
+
+
+def compute_matrix(lat_a, lon_a, lat_b, lon_b, chunk_cells=CHUNK_CELLS):
+    """回傳 (distance_km, bearing_deg)，皆為 shape (N, M) 的 float32 陣列"""
+    n, m = len(lat_a), len(lat_b)
+    distance = np.empty((n, m), dtype=np.float32)
+    bearing = np.empty((n, m), dtype=np.float32)
+    for s, block_km, block_deg in _iter_blocks(lat_a, lon_a, lat_b, lon_b, chunk_cells):
+        distance[s] = block_km
+        bearing[s] = block_deg
+    return distance, bearing
+
+
+def compute_nearest(lat_a, lon_a, lat_b, lon_b, k, chunk_cells=CHUNK_CELLS):
+    """
+    不建立完整矩陣，逐段求每列最近的 k 個目標：
+    回傳 (index, distance_km, bearing_deg)，shape (N, k)，依距離排序
+    """
+    n, m = len(lat_a), len(lat_b)
+    k = max(0, min(int(k), m))
+    index = np.empty((n, k), dtype=np.int64)
+    distance = np.empty((n, k), dtype=np.float32)
+    bearing = np.empty((n, k), dtype=np.float32)
+    if k == 0:
+        return index, distance, bearing
+    for s, block_km, block_deg in _iter_blocks(lat_a, lon_a, lat_b, lon_b, chunk_cells):
+        idx, km = nearest_k(block_km.astype(np.float32), k)
+        index[s], distance[s] = idx, km
+        bearing[s] = np.take_along_axis(block_deg, idx, axis=1)
+    return index, distance, bearing
+
+
+def _iter_blocks(lat_a, lon_a, lat_b, lon_b, chunk_cells):
+    """依列分段產生 (列 slice, 距離, 方位角)，每段最多 chunk_cells 格"""
+    n, m = len(lat_a), len(lat_b)
+    if n == 0 or m == 0:
+        return
+
+    phi_a = np.radians(lat_a)[:, None]
+    lam_a = np.radians(lon_a)[:, None]
+    sin_a, cos_a = np.sin(phi_a), np.cos(phi_a)
+    phi_b = np.radians(lat_b)[None, :]
+    lam_b = np.radians(lon_b)[None, :]
+    sin_b, cos_b = np.sin(phi_b), np.cos(phi_b)
+
+    rows = max(1, chunk_cells // m)
+    for start in range(0, n, rows):
+        s = slice(start, start + rows)
+        dlon = lam_b - lam_a[s]
+        cos_dlon = np.cos(dlon)
+        # haversine：sin²(Δφ/2) + cosφ1·cosφ2·sin²(Δλ/2)，其中 sin²(x/2) = (1 - cos x) / 2
+        h = (1.0 - (sin_a[s] * sin_b + cos_a[s] * cos_b)) * 0.5 \
+            + cos_a[s] * cos_b * (1.0 - cos_dlon) * 0.5
+        distance = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+        y = np.sin(dlon) * cos_b
+        x = cos_a[s] * sin_b - sin_a[s] * cos_b * cos_dlon
+        yield s, distance, (np.degrees(np.arctan2(y, x)) + 360.0) % 360.0
+
+
+def nearest_k(distance, k):
+    """每列距離最近的 k 個目標：回傳 (index, distance)，shape (N, k)，依距離排序"""
+    n, m = distance.shape
+    k = max(0, min(int(k), m))
+    if k == 0 or n == 0:
+        return np.empty((n, 0), dtype=np.int64), np.empty((n, 0), dtype=np.float32)
+    if k < m:
+        idx = np.argpartition(distance, k - 1, axis=1)[:, :k]
+    else:
+        idx = np.broadcast_to(np.arange(m), (n, m)).copy()
+    picked = np.take_along_axis(distance, idx, axis=1)
+    order = np.argsort(picked, axis=1, kind="stable")
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(picked, order, axis=1)
+
+
+class MatrixResult:
+    """full=False 時只計算各列最近的 k 個目標（distance_km / bearing_deg 為 None）"""
+
+    def __init__(self, sources, targets, k=0, full=True):
+        self.sources = sources
+        self.targets = targets
+        lat_a, lon_a = sources.arrays()
+        lat_b, lon_b = targets.arrays()
+        started = time.perf_counter()
+        if full:
+            self.distance_km, self.bearing_deg = compute_matrix(lat_a, lon_a, lat_b, lon_b)
+            self.nearest_index, self.nearest_km = nearest_k(self.distance_km, k)
+            self.nearest_bearing = np.take_along_axis(self.bearing_deg, self.nearest_index, axis=1)
+        else:
+            self.distance_km = self.bearing_deg = None
+            self.nearest_index, self.nearest_km, self.nearest_bearing = \
+                compute_nearest(lat_a, lon_a, lat_b, lon_b, k)
+        self.elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    @property
+    def shape(self):
+        return len(self.sources), len(self.targets)
+
+    @property
+    def distance_nm(self):
+        return self.distance_km * np.float32(KM_TO_NM)
+
+    def matrices(self):
+        """巢狀 list 形式的三個矩陣（列 = 起點，行 = 目標）"""
+        return {
+            "distance_km": _rounded(self.distance_km, 3).tolist(),
+            "distance_nm": _rounded(self.distance_nm, 3).tolist(),
+            "bearing_degrees": _rounded(self.bearing_deg, 2).tolist(),
+        }
+
+    def nearest(self):
+        """[{source, nearest: [{target, distance_km, distance_nm, bearing_degrees}]}]"""
+        out = []
+        for i, label in enumerate(self.sources.labels):
+            items = []
+            for j, km, deg in zip(self.nearest_index[i].tolist(), self.nearest_km[i].tolist(),
+                                  self.nearest_bearing[i].tolist()):
+                items.append({
+                    "target": self.targets.labels[j],
+                    "distance_km": round(km, 3),
+                    "distance_nm": round(km * KM_TO_NM, 3),
+                    "bearing_degrees": round(deg, 2),
+                })
+            out.append({"source": label, "nearest": items})
+        return out
+
+    def compact(self, include_matrix=True):
+        """
+        緊湊編碼：矩陣以 row-major 攤平的一維陣列回傳（第 i 列第 j 行 = values[i * cols + j]），
+        nearest_index 同樣攤平（每列 k 個）
+        """
+        n, m = self.shape
+        out = {
+            "rows": n,
+            "cols": m,
+            "sources": self.sources.labels,
+            "targets": self.targets.labels,
+            "unresolved": {"sources": self.sources.unresolved, "targets": self.targets.unresolved},
+            "elapsed_ms": self.elapsed_ms,
+        }
+        if include_matrix and self.distance_km is not None:
+            out["distance_km"] = _rounded(self.distance_km, 3).ravel().tolist()
+            out["distance_nm"] = _rounded(self.distance_nm, 3).ravel().tolist()
+            out["bearing_deg"] = _rounded(self.bearing_deg, 2).ravel().tolist()
+        k = self.nearest_index.shape[1]
+        if k:
+            out["k"] = k
+            out["nearest_index"] = self.nearest_index.ravel().tolist()
+            out["nearest_km"] = _rounded(self.nearest_km, 3).ravel().tolist()
+        return out
+
+
+# --------------------- 效能測試 ---------------------
+def _loop_matrix(lat_a, lon_a, lat_b, lon_b):
+    """逐對以 math 計算（與 app.py calculate_multiple_bearings 相同的作法）"""
+    out = []
+    for la, lo in zip(lat_a, lon_a):
+        p1, l1 = math.radians(la), math.radians(lo)
+        row = []
+        for lb, lob in zip(lat_b, lon_b):
+            p2, l2 = math.radians(lb), math.radians(lob)
+            a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin((l2 - l1) / 2) ** 2
+            km = EARTH_RADIUS_KM * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+            y = math.sin(l2 - l1) * math.cos(p2)
+            x = math.cos(p1) * math.sin(p2) - math.sin(p1) * math.cos(p2) * math.cos(l2 - l1)
+            row.append((km, (math.degrees(math.atan2(y, x)) + 360) % 360))
+        out.append(row)
+    return out
+
+
+def benchmark(sizes=((8, 40), (500, 500), (2000, 2000), (5000, 5000)), loop_max_cells=250_000):
+    rng = np.random.default_rng(7)
+    for n, m in sizes:
+        lat_a, lon_a = rng.uniform(20, 28, n), rng.uniform(117, 125, n)
+        lat_b, lon_b = rng.uniform(20, 28, m), rng.uniform(117, 125, m)
+
+        started = time.perf_counter()
+        distance, bearing = compute_matrix(lat_a, lon_a, lat_b, lon_b)
+        nearest_k(distance, 5)
+        vector_s = time.perf_counter() - started
+
+        result = {"n": n, "m": m, "numpy_s": round(vector_s, 4)}
+        if n * m <= loop_max_cells:
+            started = time.perf_counter()
+            loop = _loop_matrix(lat_a, lon_a, lat_b, lon_b)
+            result["loop_s"] = round(time.perf_counter() - started, 4)
+            loop_km = np.array([[c[0] for c in row] for row in loop])
+            loop_brg = np.array([[c[1] for c in row] for row in loop])
+            result["max_km_diff"] = float(np.abs(loop_km - distance).max())
+            diff = np.abs(loop_brg - bearing)
+            result["max_bearing_diff"] = float(np.minimum(diff, 360 - diff).max())
+        yield result
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["bench"]:
+        print("用法: python -m services.distance_matrix bench")
+        sys.exit(1)
+    for line in benchmark():
+        print(json.dumps(line))
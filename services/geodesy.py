@@ -0,0 +1,261 @@
+# services/geodesy.py
+"""
+向量化的大圓計算（NumPy），公式與 app.py 的 haversine_distance / calculate_bearing /
+destination_point 相同，但一次處理整個陣列，供船位推算、矩陣計算等批次功能使用。
+
+距離提供三種精度（precision）：
+  "flat"      ：局部平面近似（equirectangular），只有乘加與一次 sqrt，供粗篩
+  "sphere"    ：haversine（球體，半徑 EARTH_RADIUS_KM），一般用途；與 WGS-84 相差約 0.5% 以內
+  "ellipsoid" ：WGS-84 橢球 Vincenty 反算，公釐級，供法定界線等最終判定
+
+within_radius() 先以經緯度外框與平面近似（含誤差餘裕）篩掉明顯在外的點，只對候選點以指定精度精算。
+
+    python -m services.geodesy bench   # 各精度的速度與 within_radius 篩選效果
+    python -m services.geodesy check   # 台灣海峽緯度範圍內各精度的誤差上限驗證
+"""
+import sys
+import json
+import time
+
+import numpy as np
+
+# 地球半徑（公里）
+EARTH_RADIUS_KM = 6371.0
+# 海里與公里的轉換係數
+KM_TO_NM = 0.539957  # 1 海里 ≈ 1.852 公里，反向轉換
+# 1 節 = 1.852 公里/小時
+KNOT_TO_KMH = 1.852
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """兩組點的大圓距離（公里），參數可為純量或可廣播的陣列"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def bearing_deg(lat1, lon1, lat2, lon2):
+    """點 1 → 點 2 的方位角（0-360 度），參數可廣播"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    dlon = lon2 - lon1
+    y = np.sin(dlon) * np.cos(lat2)
+    x = np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon)
+    return (np.degrees(np.arctan2(y, x)) + 360.0) % 360.0
+
+
+def destination_points(lat, lon, bearing, distance_km):
+    """由起點、方位角、距離計算終點，回傳 (lat, lon) 陣列"""
+    lat_rad = np.radians(np.asarray(lat, dtype=np.float64))
+    lon_rad = np.radians(np.asarray(lon, dtype=np.float64))
+    brg = np.radians(np.asarray(bearing, dtype=np.float64))
+    d = np.asarray(distance_km, dtype=np.float64) / EARTH_RADIUS_KM
+
+    lat2 = np.arcsin(np.sin(lat_rad) * np.cos(d) + np.cos(lat_rad) * np.sin(d) * np.cos(brg))
+    lon2 = lon_rad + np.arctan2(np.sin(brg) * np.sin(d) * np.cos(lat_rad),
+                                np.cos(d) - np.sin(lat_rad) * np.sin(lat2))
+    lon2 = (np.degrees(lon2) + 540.0) % 360.0 - 180.0
+    return np.degrees(lat2), lon2
+
+
+# --------------------- 分級精度 ---------------------
+# WGS-84
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+# 每度緯度的最短長度（赤道，公里），外框篩選用（保守）
+_KM_PER_DEG_LAT_MIN = 110.574
+
+PRECISIONS = ("flat", "sphere", "ellipsoid")
+# 平面近似粗篩的誤差餘裕：距離 ≤ 1000 公里、緯度 ≤ 60° 時，平面近似與 WGS-84 的差距
+# 小於 1%（check 驗證）；額外加上固定餘裕處理極短距離
+FLAT_FILTER_MARGIN = 0.01
+FLAT_FILTER_MARGIN_KM = 0.05
+VINCENTY_MAX_ITER = 200
+VINCENTY_TOL = 1e-12
+
+
+def equirect_km(lat1, lon1, lat2, lon2):
+    """局部平面近似距離（公里）：以平均緯度的 cos 縮放經度差"""
+    lat1, lon1, lat2, lon2 = (np.asarray(v, dtype=np.float64) for v in (lat1, lon1, lat2, lon2))
+    dlon = (lon2 - lon1 + 540.0) % 360.0 - 180.0
+    x = np.radians(dlon) * np.cos(np.radians((lat1 + lat2) * 0.5))
+    y = np.radians(lat2 - lat1)
+    return EARTH_RADIUS_KM * np.sqrt(x * x + y * y)
+
+
+def vincenty_inverse(lat1, lon1, lat2, lon2):
+    """
+    WGS-84 橢球的 Vincenty 反算，回傳 (距離公里, 起始方位角度)，參數可廣播。
+    近對蹠點不收斂時退回 haversine（該情況在本系統的使用範圍不會發生）。
+    """
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(*(np.asarray(v, dtype=np.float64) for v in (lat1, lon1, lat2, lon2)))
+    f = WGS84_F
+    L = np.radians(lon2 - lon1)
+    U1 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    U2 = np.arctan((1 - f) * np.tan(np.radians(lat2)))
+    sinU1, cosU1 = np.sin(U1), np.cos(U1)
+    sinU2, cosU2 = np.sin(U2), np.cos(U2)
+
+    lam = L.copy()
+    converged = np.zeros(L.shape, dtype=bool)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for _ in range(VINCENTY_MAX_ITER):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cosU2 * sin_lam, cosU1 * sinU2 - sinU1 * cosU2 * cos_lam)
+            cos_sigma = sinU1 * sinU2 + cosU1 * cosU2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma > 0, cosU1 * cosU2 * sin_lam / sin_sigma, 0.0)
+            cos2_alpha = 1 - sin_alpha * sin_alpha
+            # 赤道上的線 cos²α = 0
+            cos_2sm = np.where(cos2_alpha > 0, cos_sigma - 2 * sinU1 * sinU2 / cos2_alpha, 0.0)
+            C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+            lam_new = L + (1 - C) * f * sin_alpha * (
+                sigma + C * sin_sigma * (cos_2sm + C * cos_sigma * (-1 + 2 * cos_2sm * cos_2sm)))
+            converged = np.abs(lam_new - lam) < VINCENTY_TOL
+            lam = np.where(converged, lam, lam_new)
+            if converged.all():
+                break
+
+        sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+        u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+        A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+        B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+        delta_sigma = B * sin_sigma * (cos_2sm + B / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sm ** 2)
+            - B / 6 * cos_2sm * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sm ** 2)))
+        distance = WGS84_B * A * (sigma - delta_sigma) / 1000.0
+        bearing = (np.degrees(np.arctan2(cosU2 * sin_lam, cosU1 * sinU2 - sinU1 * cosU2 * cos_lam)) + 360.0) % 360.0
+
+    if not converged.all():
+        bad = ~converged
+        distance = np.where(bad, haversine_km(lat1, lon1, lat2, lon2), distance)
+        bearing = np.where(bad, bearing_deg(lat1, lon1, lat2, lon2), bearing)
+    return distance, bearing
+
+
+def distance_km(lat1, lon1, lat2, lon2, precision="sphere"):
+    """依 precision（flat / sphere / ellipsoid）計算距離（公里）"""
+    if precision == "flat":
+        return equirect_km(lat1, lon1, lat2, lon2)
+    if precision == "sphere":
+        return haversine_km(lat1, lon1, lat2, lon2)
+    if precision == "ellipsoid":
+        return vincenty_inverse(lat1, lon1, lat2, lon2)[0]
+    raise ValueError(f"precision 必須是 {' / '.join(PRECISIONS)}")
+
+
+def within_radius(lat0, lon0, lat, lon, radius_km, precision="sphere", stats=None):
+    """
+    找出距 (lat0, lon0) radius_km 內的點：先以經緯度外框、再以平面近似（加誤差餘裕）篩選，
+    候選點才以 precision 精算。回傳 (索引陣列, 距離公里陣列)，依距離排序；
+    stats（dict）會填入各階段剩下的點數。
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    if precision not in PRECISIONS:
+        raise ValueError(f"precision 必須是 {' / '.join(PRECISIONS)}")
+    reach = radius_km * (1 + FLAT_FILTER_MARGIN) + FLAT_FILTER_MARGIN_KM
+
+    # 1. 經緯度外框（只做比較）
+    dlat = reach / _KM_PER_DEG_LAT_MIN
+    max_abs_lat = min(abs(lat0) + dlat, 89.9)
+    dlon = min(dlat / np.cos(np.radians(max_abs_lat)), 180.0)
+    dlon_all = np.abs((lon - lon0 + 540.0) % 360.0 - 180.0)
+    idx = np.flatnonzero((np.abs(lat - lat0) <= dlat) & (dlon_all <= dlon))
+
+    # 2. 平面近似
+    flat = equirect_km(lat0, lon0, lat[idx], lon[idx])
+    keep = flat <= reach
+    idx, flat = idx[keep], flat[keep]
+    candidates = len(idx)
+
+    # 3. 精算
+    dist = flat if precision == "flat" else distance_km(lat0, lon0, lat[idx], lon[idx], precision)
+    keep = dist <= radius_km
+    idx, dist = idx[keep], dist[keep]
+    order = np.argsort(dist, kind="stable")
+
+    if stats is not None:
+        stats.update(total=len(lat), candidates=candidates, matched=len(idx), precision=precision)
+    return idx[order], dist[order]
+
+
+# --------------------- 效能測試 / 誤差驗證 ---------------------
+def _strait_pairs(n, max_km, seed=11):
+    """台灣海峽一帶（21–27°N, 117–123°E）的隨機點對，第二點在第一點 max_km 內"""
+    rng = np.random.default_rng(seed)
+    lat1 = rng.uniform(21.0, 27.0, n)
+    lon1 = rng.uniform(117.0, 123.0, n)
+    lat2, lon2 = destination_points(lat1, lon1, rng.uniform(0, 360, n), rng.uniform(0, max_km, n))
+    return lat1, lon1, lat2, lon2
+
+
+def check():
+    """各精度相對 WGS-84 的最大誤差（依距離分段），並驗證 within_radius 不會漏掉點；不符時丟出 AssertionError"""
+    # Vincenty (1975) 原文的測試例：Flinders Peak → Buninyong，54972.271 m、306°52'05.37"
+    d, brg = vincenty_inverse(-(37 + 57 / 60 + 3.72030 / 3600), 144 + 25 / 60 + 29.52440 / 3600,
+                              -(37 + 39 / 60 + 10.15610 / 3600), 143 + 55 / 60 + 35.38390 / 3600)
+    assert abs(float(d) * 1000 - 54972.271) < 0.001, float(d)
+    assert abs(float(brg) - (306 + 52 / 60 + 5.37 / 3600)) < 1e-5, float(brg)
+    yield {"reference": "Flinders Peak → Buninyong", "distance_m": round(float(d) * 1000, 4),
+           "bearing_deg": round(float(brg), 6)}
+
+    for max_km in (10, 50, 200, 1000):
+        lat1, lon1, lat2, lon2 = _strait_pairs(200_000, max_km)
+        exact = vincenty_inverse(lat1, lon1, lat2, lon2)[0]
+        row = {"max_km": max_km}
+        for precision in ("flat", "sphere"):
+            approx = distance_km(lat1, lon1, lat2, lon2, precision)
+            err = approx - exact
+            rel = np.abs(err) / np.maximum(exact, 1e-9)
+            row[precision] = {"max_abs_m": round(float(np.abs(err).max()) * 1000, 2),
+                              "max_rel": round(float(rel[exact > 0.1].max()), 6)}
+            # 粗篩的誤差餘裕必須涵蓋平面近似與球體模型的誤差
+            assert np.all(approx <= exact * (1 + FLAT_FILTER_MARGIN) + FLAT_FILTER_MARGIN_KM), precision
+            assert np.all(exact <= approx * (1 + FLAT_FILTER_MARGIN) + FLAT_FILTER_MARGIN_KM), precision
+        yield row
+
+    # within_radius（任一精度）與對全部點直接精算的結果一致
+    rng = np.random.default_rng(5)
+    lat = rng.uniform(20.0, 28.0, 100_000)
+    lon = rng.uniform(116.0, 124.0, 100_000)
+    for precision in PRECISIONS:
+        radius = 24 * 1.852
+        idx, _ = within_radius(24.5, 120.0, lat, lon, radius, precision)
+        brute = np.flatnonzero(distance_km(24.5, 120.0, lat, lon, precision) <= radius)
+        assert set(idx.tolist()) == set(brute.tolist()), precision
+    yield {"within_radius": "consistent", "precisions": list(PRECISIONS)}
+
+
+def benchmark(n=1_000_000):
+    lat1, lon1, lat2, lon2 = _strait_pairs(n, 500)
+    for precision in PRECISIONS:
+        started = time.perf_counter()
+        distance_km(lat1, lon1, lat2, lon2, precision)
+        yield {"op": "distance_km", "precision": precision, "n": n,
+               "ms": round((time.perf_counter() - started) * 1000, 1)}
+
+    # 24 海里內的船：粗篩 + 精算 vs 對全部點精算
+    rng = np.random.default_rng(3)
+    lat = rng.uniform(18.0, 30.0, n)
+    lon = rng.uniform(115.0, 125.0, n)
+    radius = 24 * 1.852
+    for precision in ("sphere", "ellipsoid"):
+        stats = {}
+        started = time.perf_counter()
+        within_radius(24.5, 120.0, lat, lon, radius, precision, stats)
+        tiered = time.perf_counter() - started
+        started = time.perf_counter()
+        distance_km(24.5, 120.0, lat, lon, precision) <= radius
+        brute = time.perf_counter() - started
+        yield {"op": "within_radius", "precision": precision, "n": n, "radius_km": round(radius, 3),
+               "tiered_ms": round(tiered * 1000, 1), "direct_ms": round(brute * 1000, 1), **stats}
+
+
+if __name__ == "__main__":
+    commands = {"bench": benchmark, "check": check}
+    if sys.argv[1:] not in (["bench"], ["check"]):
+        print("用法: python -m services.geodesy bench | check")
+        sys.exit(1)
+    for line in commands[sys.argv[1]]():
+        print(json.dumps(line, ensure_ascii=False))
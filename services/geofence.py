@@ -0,0 +1,337 @@
+# services/geofence.py
+"""
+警戒區進出事件偵測（串流處理，掛在 AIS 匯入管線的 listener 上）。
+
+  - 警戒區外框依格網（GRID_DEG 度）建立索引，每筆新船位只檢查所在格網碰到的警戒區，
+    以及該船目前在內 / 待確認的警戒區（離開時才能產生 exit）
+  - 每個 (船, 警戒區) 只在「在內」或「待確認」時保留一筆小型狀態，在外且無待確認即刪除
+  - 抑制邊界上的 GPS 抖動：
+      空間遲滯：距離邊界 HYSTERESIS_M 以內的點不改變狀態
+      去彈跳：需連續 CONFIRM_COUNT 筆落在另一側才確認進入 / 離開
+  - 確認後的事件寫入 models/zone_event_log.py，事件時間為第一筆越界的回報時間
+  - 設定 SHARED_STATE_NAME 時，匯入行程每次有進出事件即把「目前在內的船」發佈到共享記憶體，
+    web worker 的 occupants() 直接讀取；worker 修改警戒區後通知匯入行程重新載入
+
+    python -m services.geofence bench
+"""
+import sys
+import json
+import math
+import time
+import threading
+
+from models.vessel_store import latest_store
+from models.zone_event_log import zone_event_log, make_event
+from models.shared_state import zone_membership
+
+# 索引格網大小（度）
+GRID_DEG = 0.25
+# 邊界遲滯帶寬（公尺）
+HYSTERESIS_M = 50.0
+# 連續幾筆落在另一側才確認
+CONFIRM_COUNT = 2
+
+_M_PER_DEG_LAT = 110574.0
+_M_PER_DEG_LON = 111320.0
+
+
+def _cell(lat, lon):
+    return (math.floor(lat / GRID_DEG), math.floor(lon / GRID_DEG))
+
+
+class Zone:
+    """警戒區多邊形（外環 [[lon, lat], ...]）"""
+
+    __slots__ = ("zone_id", "name", "ring", "min_lon", "min_lat", "max_lon", "max_lat")
+
+    def __init__(self, zone_id, name, ring):
+        if ring and ring[0] == ring[-1]:
+            ring = ring[:-1]
+        if len(ring) < 3:
+            raise ValueError(f"警戒區 {name} 至少需要三個頂點")
+        self.zone_id = zone_id
+        self.name = name
+        self.ring = [(float(lon), float(lat)) for lon, lat in ring]
+        lons = [p[0] for p in self.ring]
+        lats = [p[1] for p in self.ring]
+        self.min_lon, self.max_lon = min(lons), max(lons)
+        self.min_lat, self.max_lat = min(lats), max(lats)
+
+    def classify(self, lat, lon, margin_m=HYSTERESIS_M):
+        """
+        回傳 1（在內）、0（在外）或 None（在遲滯帶內，不改變狀態）。
+        射線法判斷內外，同一次走訪計算到各邊的最短距離（局部等距投影，公尺）。
+        """
+        margin_lat = margin_m / _M_PER_DEG_LAT
+        kx = _M_PER_DEG_LON * math.cos(math.radians(lat))
+        margin_lon = margin_m / kx if kx > 0 else 180.0
+        if (lon < self.min_lon - margin_lon or lon > self.max_lon + margin_lon
+                or lat < self.min_lat - margin_lat or lat > self.max_lat + margin_lat):
+            return 0
+
+        inside = False
+        min_d2 = math.inf
+        ring = self.ring
+        x1, y1 = ring[-1]
+        for x2, y2 in ring:
+            if (y1 > lat) != (y2 > lat) and lon < (x2 - x1) * (lat - y1) / (y2 - y1) + x1:
+                inside = not inside
+            # 點到線段距離
+            ax, ay = (x1 - lon) * kx, (y1 - lat) * _M_PER_DEG_LAT
+            bx, by = (x2 - lon) * kx, (y2 - lat) * _M_PER_DEG_LAT
+            dx, dy = bx - ax, by - ay
+            seg2 = dx * dx + dy * dy
+            t = 0.0 if seg2 == 0 else max(0.0, min(1.0, -(ax * dx + ay * dy) / seg2))
+            px, py = ax + dx * t, ay + dy * t
+            d2 = px * px + py * py
+            if d2 < min_d2:
+                min_d2 = d2
+            x1, y1 = x2, y2
+
+        if min_d2 <= margin_m * margin_m:
+            return None
+        return 1 if inside else 0
+
+
+class _State:
+    """(船, 警戒區) 狀態：是否在內、待確認筆數與時間、進入時間"""
+
+    __slots__ = ("inside", "pending", "pending_ts", "entered_ts")
+
+    def __init__(self):
+        self.inside = False
+        self.pending = 0
+        self.pending_ts = None
+        self.entered_ts = None
+
+
+class GeofenceEngine:
+    def __init__(self, event_log=zone_event_log, confirm_count=CONFIRM_COUNT, margin_m=HYSTERESIS_M,
+                 membership=zone_membership):
+        self.event_log = event_log
+        self.confirm_count = confirm_count
+        self.margin_m = margin_m
+        # 共享記憶體中的「目前在內的船」（匯入行程寫入、web worker 讀取）；未啟用時為 None
+        self.membership = membership
+        self._reload_seen = None
+        self._lock = threading.Lock()
+        self._zones = {}
+        self._zones_loaded = False
+        self._grid = {}
+        # mmsi → {zone_id: _State}
+        self._states = {}
+        # mmsi → 最後處理的回報時間（忽略亂序的舊資料）
+        self._last_ts = {}
+        self.counters = {"positions": 0, "zone_checks": 0, "events": 0, "stale": 0}
+
+    # ---------- 警戒區 ----------
+    def set_zones(self, zones):
+        """重建警戒區與格網索引；已刪除警戒區的狀態一併清除"""
+        grid = {}
+        for zone in zones:
+            for cy in range(math.floor(zone.min_lat / GRID_DEG), math.floor(zone.max_lat / GRID_DEG) + 1):
+                for cx in range(math.floor(zone.min_lon / GRID_DEG), math.floor(zone.max_lon / GRID_DEG) + 1):
+                    grid.setdefault((cy, cx), []).append(zone)
+        with self._lock:
+            self._zones = {z.zone_id: z for z in zones}
+            self._zones_loaded = True
+            self._grid = grid
+            for mmsi in list(self._states):
+                states = self._states[mmsi]
+                for zone_id in [zid for zid in states if zid not in self._zones]:
+                    del states[zone_id]
+                if not states:
+                    del self._states[mmsi]
+            self._publish()
+
+    def load_zones(self, notify=True):
+        """由資料庫載入警戒區；web worker 修改警戒區後呼叫時（notify），一併通知匯入行程重新載入"""
+        from models.database import read_session
+        from models.alarm_zone_model import AlarmZone
+
+        with read_session() as session:
+            zones = [Zone(z.id, z.name, z.ring) for z in session.query(AlarmZone).all()]
+        self.set_zones(zones)
+        if notify and self.membership is not None and not self.membership.writer:
+            self.membership.request_reload()
+        return len(zones)
+
+    def _check_reload(self):
+        """匯入行程：web worker 要求重新載入警戒區時（共享區段的通知計數改變）重新載入"""
+        signal = self.membership.reload_signal()
+        if self._reload_seen is None:
+            self._reload_seen = signal
+        elif signal != self._reload_seen:
+            self._reload_seen = signal
+            self.load_zones(notify=False)
+
+    def _publish(self):
+        """匯入行程：把目前在內的船發佈到共享記憶體（需持有 self._lock）"""
+        if self.membership is None or not self.membership.writer:
+            return
+        self.membership.publish([(zone_id, mmsi, state.entered_ts)
+                                 for mmsi, states in self._states.items()
+                                 for zone_id, state in states.items() if state.inside])
+
+    # ---------- 串流處理 ----------
+    def process(self, rows):
+        """ingest listener：處理一批船位，回傳產生的事件"""
+        if self.membership is not None and self.membership.writer:
+            self._check_reload()
+        events = []
+        with self._lock:
+            grid = self._grid
+            zones = self._zones
+            for row in rows:
+                mmsi = row.get("mmsi")
+                ts = row["ts"]
+                last = self._last_ts.get(mmsi)
+                if last is not None and ts <= last:
+                    self.counters["stale"] += 1
+                    continue
+                self._last_ts[mmsi] = ts
+                self.counters["positions"] += 1
+
+                lat, lon = row["lat"], row["lon"]
+                states = self._states.get(mmsi)
+                candidates = grid.get(_cell(lat, lon), ())
+                if states:
+                    candidates = list(candidates) + [zones[zid] for zid in states
+                                                     if zones[zid] not in candidates]
+                elif not candidates:
+                    continue
+
+                for zone in candidates:
+                    self.counters["zone_checks"] += 1
+                    side = zone.classify(lat, lon, self.margin_m)
+                    if side is None:
+                        continue
+                    state = states.get(zone.zone_id) if states else None
+                    inside = state.inside if state else False
+                    if bool(side) == inside:
+                        if state is not None:
+                            state.pending = 0
+                            state.pending_ts = None
+                            if not inside:
+                                del states[zone.zone_id]
+                        continue
+
+                    if state is None:
+                        states = self._states.setdefault(mmsi, {})
+                        state = states[zone.zone_id] = _State()
+                    if state.pending == 0:
+                        state.pending_ts = ts
+                    state.pending += 1
+                    if state.pending < self.confirm_count:
+                        continue
+
+                    # 確認越界
+                    crossed_ts = state.pending_ts
+                    if side:
+                        state.inside = True
+                        state.entered_ts = crossed_ts
+                        state.pending = 0
+                        state.pending_ts = None
+                        events.append(make_event("enter", crossed_ts, zone, row))
+                    else:
+                        dwell = crossed_ts - state.entered_ts if state.entered_ts is not None else None
+                        events.append(make_event("exit", crossed_ts, zone, row, dwell))
+                        del states[zone.zone_id]
+
+                if states is not None and not states:
+                    self._states.pop(mmsi, None)
+
+            self.counters["events"] += len(events)
+            if events:
+                self._publish()
+        if events and self.event_log is not None:
+            self.event_log.append(events)
+        return events
+
+    # ---------- 查詢 ----------
+    def occupants(self, now_ts=None):
+        """目前在各警戒區內的船：{zone_id: [{mmsi, entered_ts, dwell_s}, ...]}"""
+        now_ts = time.time() if now_ts is None else now_ts
+        if self.membership is not None and not self.membership.writer:
+            return self._shared_occupants(now_ts)
+        out = {zid: [] for zid in self._zones}
+        with self._lock:
+            for mmsi, states in self._states.items():
+                for zone_id, state in states.items():
+                    if state.inside:
+                        out[zone_id].append({"mmsi": mmsi, "entered_ts": state.entered_ts,
+                                             "dwell_s": round(now_ts - state.entered_ts, 1)})
+        return out
+
+    def _shared_occupants(self, now_ts):
+        """web worker：由共享記憶體讀取（匯入行程尚未啟動時為空）；警戒區清單自資料庫載入，供沒有船的警戒區也列出"""
+        if not self._zones_loaded:
+            try:
+                self.load_zones(notify=False)
+            except Exception as e:
+                print(f"❌ 載入警戒區失敗: {e}")
+        out = {zid: [] for zid in self._zones}
+        for zone_id, mmsi, entered_ts in self.membership.entries() or ():
+            dwell = round(now_ts - entered_ts, 1) if entered_ts is not None else None
+            out.setdefault(zone_id, []).append({"mmsi": mmsi, "entered_ts": entered_ts, "dwell_s": dwell})
+        return out
+
+    def stats(self):
+        with self._lock:
+            tracked = sum(len(s) for s in self._states.values())
+            out = {**self.counters, "zones": len(self._zones), "tracked_states": tracked,
+                   "grid_cells": len(self._grid)}
+        if self.membership is not None:
+            out["shared"] = self.membership.info()
+        return out
+
+
+geofence = GeofenceEngine()
+
+
+def start_geofence(pipeline, engine=geofence):
+    """載入警戒區並掛到匯入管線（app.py 啟用即時匯入時呼叫）"""
+    engine.load_zones()
+    if engine.process not in pipeline.listeners:
+        pipeline.listeners.append(engine.process)
+
+
+# --------------------- 基準測試 ---------------------
+def benchmark(n_zones=200, n_vessels=20_000, n_positions=500_000):
+    import random
+
+    rnd = random.Random(0)
+    zones = []
+    for k in range(n_zones):
+        clat, clon = 21 + rnd.random() * 6, 117 + rnd.random() * 6
+        r = 0.05 + rnd.random() * 0.3
+        ring = [[clon + r * math.cos(a / 12 * 2 * math.pi), clat + r * math.sin(a / 12 * 2 * math.pi)]
+                for a in range(12)]
+        zones.append(Zone(k, f"Z{k}", ring))
+
+    engine = GeofenceEngine(event_log=None, membership=None)
+    engine.set_zones(zones)
+    start = [(21 + rnd.random() * 6, 117 + rnd.random() * 6) for _ in range(n_vessels)]
+    rows = []
+    t = 1735689600.0
+    for i in range(n_positions):
+        v = i % n_vessels
+        lat, lon = start[v]
+        step = i // n_vessels
+        rows.append({"ts": t + step * 10, "mmsi": 412000000 + v, "shipname": f"V{v}",
+                     "lat": lat + step * 0.001, "lon": lon + step * 0.001})
+
+    t0 = time.perf_counter()
+    events = 0
+    for s in range(0, len(rows), 500):
+        events += len(engine.process(rows[s:s + 500]))
+    elapsed = time.perf_counter() - t0
+    return {"zones": n_zones, "vessels": n_vessels, "positions": n_positions, "events": events,
+            "positions_per_s": round(n_positions / elapsed), **engine.stats()}
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["bench"]:
+        print("用法: python -m services.geofence bench")
+        sys.exit(1)
+    print(json.dumps(benchmark()))
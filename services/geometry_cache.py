@@ -0,0 +1,157 @@
+# services/geometry_cache.py
+"""
+方位 / 距離 / 扇形工具的結果快取（跨 request 共用）。
+
+  - 快取鍵為「解析後的座標 + 四捨五入的參數」，不是地名字串：
+    不同寫法但解析到同一點的地名會命中同一筆
+  - 存放完成的 FeatureCollection（有上限的 LRU），地名以佔位字串存放，取出時才換成本次的地名
+  - 參數鍵只做四捨五入、不取模（0° 與 360°、350°→10° 與 350°→370° 是不同的鍵），
+    結果一律以鍵上的參數值建立，同一個鍵不會因先到的呼叫者而帶出不同的數值
+  - 起點 → 目標的方位角 / 距離另外以配對為單位快取：同一起點、目標清單為先前超集合時，
+    已算過的目標直接沿用，只計算新的目標
+"""
+import json
+import sys
+import threading
+from collections import OrderedDict
+
+# 座標精度（小數位，約 0.1 公尺）
+COORD_DECIMALS = 6
+# 方位角、距離參數的精度
+BEARING_DECIMALS = 2
+DISTANCE_DECIMALS = 3
+DEFAULT_MAX_ENTRIES = 4096
+
+
+def coord_key(point):
+    """{"latitude", "longitude"} → 四捨五入後的 (lat, lon)"""
+    return (round(point["latitude"], COORD_DECIMALS), round(point["longitude"], COORD_DECIMALS))
+
+
+def bearing_key(value):
+    return round(float(value), BEARING_DECIMALS)
+
+
+def distance_key(value):
+    return round(float(value), DISTANCE_DECIMALS)
+
+
+def _placeholder(slot):
+    return f"\x00{slot}\x00"
+
+
+class GeometryCache:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.counters = {"hits": 0, "misses": 0, "pair_hits": 0, "pair_misses": 0, "evictions": 0}
+
+    def _get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def _put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def memoize(self, key, labels, build):
+        """
+        labels：{槽位: 本次的地名}；build(placeholders) 以佔位字串代替地名建立 FeatureCollection。
+        含 error 的結果不快取。回傳已換上本次地名的 FeatureCollection（新的 dict，可自由修改）。
+        """
+        key = ("fc",) + tuple(key)
+        fc = self._get(key)
+        if fc is None:
+            with self._lock:
+                self.counters["misses"] += 1
+            fc = build({slot: _placeholder(slot) for slot in labels})
+            if "error" in fc:
+                return fc
+            self._put(key, fc)
+        else:
+            with self._lock:
+                self.counters["hits"] += 1
+        return _materialize(fc, labels)
+
+    def pair(self, origin, destination, compute):
+        """起點 → 目標的計算結果（例如方位角與距離），依兩點座標快取"""
+        key = ("pair", coord_key(origin), coord_key(destination))
+        value = self._get(key)
+        with self._lock:
+            self.counters["pair_hits" if value is not None else "pair_misses"] += 1
+        if value is None:
+            value = compute()
+            self._put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hit_rate": round(self.counters["hits"] / lookups, 3) if lookups else None,
+            }
+
+
+def _materialize(fc, labels):
+    """複製 FeatureCollection（geometry 共用），把 properties 中的佔位字串換成地名"""
+    replacements = [(_placeholder(slot), str(text)) for slot, text in labels.items()]
+
+    def _sub(value):
+        if isinstance(value, str) and "\x00" in value:
+            for token, text in replacements:
+                value = value.replace(token, text)
+        return value
+
+    out = dict(fc)
+    out["features"] = [
+        {**feature, "properties": {k: _sub(v) for k, v in (feature.get("properties") or {}).items()}}
+        for feature in fc.get("features", [])
+    ]
+    return out
+
+
+geometry_cache = GeometryCache()
+
+
+def check():
+    """快取鍵不會讓意義不同的參數共用一筆結果；不符時丟出 AssertionError"""
+    cache = GeometryCache()
+    origin = coord_key({"latitude": 25.0, "longitude": 121.5})
+
+    def sector(start, end):
+        key = ("bearing_sector", origin, bearing_key(start), bearing_key(end), distance_key(50))
+        return cache.memoize(key, {"origin": "A"}, lambda names: {
+            "type": "FeatureCollection",
+            "features": [{"type": "Feature", "geometry": None,
+                          "properties": {"name": names["origin"], "range": [key[2], key[3]]}}],
+        })["features"][0]["properties"]["range"]
+
+    for first, second in (((0, 360), (0, 0)), ((350, 370), (350, 10)), ((45.001, 0), (45.004, 0))):
+        sector(*first)
+        got = sector(*second)
+        assert got == [bearing_key(v) for v in second], (first, second, got)
+        yield {"first": list(first), "second": list(second), "cached_range": got}
+    yield cache.stats()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["check"]:
+        print("用法: python -m services.geometry_cache check")
+        sys.exit(1)
+    for line in check():
+        print(json.dumps(line, ensure_ascii=False))
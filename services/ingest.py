@@ -0,0 +1,296 @@
+# services/ingest.py
+"""
+AIS 即時資料匯入管線。
+
+  來源（檔案 / TCP / UDP） → AisDecoder → 有界佇列 → 寫入執行緒（批次）
+                                                   ├→ 最新船位表（latest_store）
+                                                   └→ 歷史航跡（track_store）
+寫入執行緒每 SEAL_INTERVAL_S 秒把已結束、因晚到資料而亂序的歷史 segment 重新排序（track_store.seal_closed），
+查詢時即可純串流讀取，不需在記憶體中排序整個 segment。
+
+佇列滿時：檔案與 TCP 來源會阻塞讀取（back-pressure，對方的送出也會跟著變慢）；
+UDP 無法讓對方減速，逾時仍放不進去就丟棄並計數。
+
+多個 web worker 行程時，由獨立的匯入行程寫入共享記憶體（models/shared_state.py），worker 只讀取：
+
+    SHARED_STATE_NAME=aicop AIS_SOURCE=tcp://host:port python -m services.ingest serve
+"""
+import os
+import sys
+import time
+import queue
+import socket
+import threading
+from urllib.parse import urlparse
+
+from models.track_store import track_store
+from models.vessel_store import latest_store
+from services.ais_decoder import AisDecoder, RateMeter, POSITION_TYPES, STATIC_TYPES
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 1.0
+# UDP 放不進佇列時最多等待的秒數
+UDP_PUT_TIMEOUT = 0.05
+# 寫入執行緒整理（seal）已結束且亂序的歷史 segment 的間隔秒數
+SEAL_INTERVAL_S = float(os.environ.get("TRACK_SEAL_INTERVAL_S", "300"))
+
+_STOP = object()
+
+
+def message_to_row(msg):
+    """位置訊息 → 歷史航跡 / 最新船位的資料列格式"""
+    return {
+        "ts": msg["ts"],
+        "mmsi": msg["mmsi"],
+        "shipname": msg.get("shipname"),
+        "lat": msg["lat"],
+        "lon": msg["lon"],
+        "speed": msg.get("speed"),
+        "course": msg.get("course"),
+        "heading": msg.get("heading"),
+        "shiptype": msg.get("shiptype"),
+        "destination": msg.get("destination"),
+    }
+
+
+class IngestPipeline:
+    def __init__(self, latest=latest_store, history=track_store,
+                 queue_size=DEFAULT_QUEUE_SIZE, batch_size=DEFAULT_BATCH_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, seal_interval=SEAL_INTERVAL_S):
+        self.latest = latest
+        self.history = history
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.seal_interval = seal_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        # 每批位置寫入後呼叫的 listener：fn(rows)
+        self.listeners = []
+
+        self.decoder = AisDecoder()
+        self._decoder_lock = threading.Lock()
+        self.rate = RateMeter()
+        self.counters = {"queued": 0, "dropped": 0, "written": 0, "batches": 0, "write_errors": 0,
+                         "listener_errors": 0, "sealed_segments": 0}
+        # 來源執行緒（submit）與寫入執行緒（_flush）都會更新 counters
+        self._counters_lock = threading.Lock()
+        self._thread = None
+
+    # ---------- 生產端 ----------
+    def submit(self, msg, block=True, timeout=None):
+        """放入一筆已解碼訊息；佇列滿且無法等待時回傳 False（並計入 dropped）"""
+        try:
+            self.queue.put(msg, block=block, timeout=timeout)
+        except queue.Full:
+            self._count(dropped=1)
+            return False
+        self._count(queued=1)
+        return True
+
+    def _count(self, **deltas):
+        with self._counters_lock:
+            for name, value in deltas.items():
+                self.counters[name] += value
+
+    def feed_line(self, line, block=True, timeout=None, received_at=None):
+        with self._decoder_lock:
+            msg = self.decoder.feed(line, received_at)
+        if msg is None:
+            return False
+        self.rate.add()
+        return self.submit(msg, block=block, timeout=timeout)
+
+    # ---------- 消費端 ----------
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="ais-ingest-writer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """送出停止訊號，等待佇列內資料全部寫完"""
+        if self._thread is not None:
+            self.queue.put(_STOP)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        next_seal = time.monotonic() + self.seal_interval
+        while True:
+            try:
+                item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                self._flush(batch)
+                return
+            if item is not None:
+                batch.append(item)
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._flush(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+            if time.monotonic() >= next_seal:
+                self._seal()
+                next_seal = time.monotonic() + self.seal_interval
+
+    def _seal(self):
+        try:
+            self._count(sealed_segments=self.history.seal_closed(time.time()))
+        except Exception as e:
+            print(f"❌ 整理歷史 segment 失敗: {e}")
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        statics = [m for m in batch if m["type"] in STATIC_TYPES]
+        rows = []
+        for msg in batch:
+            if msg["type"] in POSITION_TYPES and msg.get("lat") is not None and msg.get("lon") is not None:
+                rows.append(message_to_row(msg))
+        try:
+            if statics:
+                self.latest.update_static(statics)
+            if rows:
+                # 補上已知的船名等靜態欄位，再寫入歷史
+                for row in rows:
+                    for name, value in self.latest.static_info(row["mmsi"]).items():
+                        if name in row and row[name] in (None, ""):
+                            row[name] = value
+                self.latest.upsert(rows)
+                self.history.append(rows)
+        except Exception as e:
+            # 寫入失敗不可讓寫入執行緒結束，記錄後繼續處理下一批
+            self._count(write_errors=1)
+            print(f"❌ AIS 批次寫入失敗: {e}")
+            rows = []
+        finally:
+            self._count(batches=1, written=len(batch))
+        if rows:
+            self._notify(rows)
+
+    def _notify(self, rows):
+        # listener 各自攔截例外：不算寫入失敗，也不影響其他 listener
+        for listener in self.listeners:
+            try:
+                listener(rows)
+            except Exception as e:
+                self._count(listener_errors=1)
+                print(f"❌ AIS listener {getattr(listener, '__qualname__', listener)} 失敗: {e}")
+
+    def stats(self):
+        with self._decoder_lock:
+            decoder = dict(self.decoder.counters)
+        with self._counters_lock:
+            counters = dict(self.counters)
+        return {
+            "messages_per_second": self.rate.rate(),
+            "queue_depth": self.queue.qsize(),
+            "queue_capacity": self.queue.maxsize,
+            "decoder": decoder,
+            **counters,
+        }
+
+
+# --------------------- 資料來源 ---------------------
+def ingest_file(pipeline, path, stop_event=None):
+    with open(path, "r", encoding="ascii", errors="replace") as f:
+        for line in f:
+            if stop_event is not None and stop_event.is_set():
+                break
+            pipeline.feed_line(line)
+
+
+def ingest_tcp(pipeline, host, port, stop_event=None, reconnect_delay=5.0):
+    """連到 AIS TCP 伺服器逐行讀取，斷線後自動重連"""
+    while stop_event is None or not stop_event.is_set():
+        try:
+            with socket.create_connection((host, port), timeout=30) as sock:
+                with sock.makefile("r", encoding="ascii", errors="replace") as f:
+                    for line in f:
+                        if stop_event is not None and stop_event.is_set():
+                            return
+                        pipeline.feed_line(line)
+        except OSError as e:
+            print(f"⚠️ AIS TCP 連線中斷（{host}:{port}）: {e}")
+        time.sleep(reconnect_delay)
+
+
+def ingest_udp(pipeline, host, port, stop_event=None):
+    """接收 UDP datagram（一個封包可能包含多行）"""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind((host, port))
+        sock.settimeout(1.0)
+        while stop_event is None or not stop_event.is_set():
+            try:
+                data, _ = sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            for line in data.decode("ascii", "replace").splitlines():
+                pipeline.feed_line(line, timeout=UDP_PUT_TIMEOUT)
+
+
+def run_source(pipeline, source_url, stop_event=None):
+    """
+    依 URL 選擇來源：
+      file:///path/to/ais.nmea、tcp://host:port、udp://0.0.0.0:10110
+    """
+    url = urlparse(source_url)
+    if url.scheme == "file":
+        ingest_file(pipeline, url.path, stop_event)
+    elif url.scheme == "tcp":
+        ingest_tcp(pipeline, url.hostname, url.port, stop_event)
+    elif url.scheme == "udp":
+        ingest_udp(pipeline, url.hostname or "0.0.0.0", url.port, stop_event)
+    else:
+        raise ValueError(f"不支援的 AIS 來源: {source_url}")
+
+
+ingest_pipeline = IngestPipeline()
+
+
+def start_ingest(source_url, pipeline=ingest_pipeline, columnar=False):
+    """
+    在背景執行緒啟動匯入（app.py 依環境變數 AIS_SOURCE 呼叫）。
+    columnar=True 時，每批位置同時寫入欄式歷史檔（models/columnar_store.py）。
+    """
+    if columnar:
+        from models.columnar_store import columnar_store
+        if columnar_store.append not in pipeline.listeners:
+            pipeline.listeners.append(columnar_store.append)
+    pipeline.start()
+    thread = threading.Thread(target=run_source, args=(pipeline, source_url),
+                              name="ais-ingest-source", daemon=True)
+    thread.start()
+    return thread
+
+
+def serve(source_url, columnar=False):
+    """單一寫入行程：建立共享區段，執行匯入與警戒區偵測直到收到中斷訊號"""
+    import signal
+    from models.shared_state import open_shared_writer
+    from services.geofence import start_geofence
+
+    open_shared_writer()
+    # SIGTERM 轉成正常結束，atexit 才會刪除共享區段
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    start_geofence(ingest_pipeline)
+    start_ingest(source_url, columnar=columnar)
+    print(f"✅ AIS 匯入行程已啟動（{source_url}，共享區段 {os.environ.get('SHARED_STATE_NAME')}）")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ingest_pipeline.stop(timeout=10)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] != ["serve"] or not (sys.argv[2:3] or os.environ.get("AIS_SOURCE")):
+        print("用法: python -m services.ingest serve [AIS_SOURCE]（需設定 SHARED_STATE_NAME）")
+        sys.exit(1)
+    serve(sys.argv[2] if len(sys.argv) > 2 else os.environ["AIS_SOURCE"],
+          columnar=bool(os.environ.get("AIS_COLUMNAR")))
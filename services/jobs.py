@@ -0,0 +1,226 @@
+# services/jobs.py
+"""
+背景工作：長時間的 LLM 對話鏈與大型多點幾何計算改為提交工作、輪詢或串流進度，
+不再佔住 request 執行緒直到完成（也不會被瀏覽器 / proxy 逾時中斷）。
+
+  - 工作種類以 register(kind, handler, priority) 註冊，handler(payload, progress) 回傳可 JSON 化的結果；
+    progress(fraction, message) 回報進度
+  - 固定數量的 worker 執行緒依優先權取工作（數字小者先，互動對話優先於大量矩陣計算）
+  - 相同 kind + payload 的工作在排隊、執行中或結果尚未過期時不重複執行，直接回傳既有工作
+    （reuse_results=False 的種類只合併排隊 / 執行中的工作，例如對話：同一問題稍後再問應重新回答）
+  - 結果保留 JOB_RESULT_TTL_S 秒
+  - register(..., serial_key=fn) 的種類：fn(payload) 相同的工作依序執行（佇列在 claim 時略過，不佔 worker 等待）；
+    local=True 的種類只由提交的節點執行；check=fn(payload) 於提交時驗證，不符時丟出 ValueError
+  - 有租約的 broker（SQLite）：執行期間另以計時執行緒每 lease_s / 3 秒送心跳，長時間沒有進度回報的工作
+    不會被其他節點當成中止而重跑；結果只在仍持有該工作的 claim 時寫入
+  - 佇列存放在 models/job_store.py：預設為行程內記憶體；JOB_BROKER=sqlite:///path/jobs.db 時
+    多個行程（節點）共用同一個 SQLite 檔分工
+"""
+import os
+import time
+import json
+import uuid
+import socket
+import hashlib
+import threading
+from collections import deque
+
+from models.job_store import (
+    create_job_store, new_job, QueueFull, QUEUED, RUNNING, DONE, FAILED, FINAL_STATES, REUSABLE_STATES,
+)
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_MAX_QUEUED = int(os.environ.get("JOB_MAX_QUEUED", "200"))
+JOB_RESULT_TTL_S = float(os.environ.get("JOB_RESULT_TTL_S", "600"))
+JOB_BROKER = os.environ.get("JOB_BROKER") or None
+# 本節點的識別（local 種類的工作只由提交的節點執行）
+JOB_NODE_ID = os.environ.get("JOB_NODE_ID") or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+# worker 等待工作的逾時（秒），逾時後順便清除過期結果
+CLAIM_TIMEOUT_S = 5.0
+# 等待時間 / 執行時間統計保留的筆數
+METRIC_WINDOW = 500
+
+
+class UnknownJobKind(ValueError):
+    pass
+
+
+def dedupe_key(kind, payload):
+    canonical = json.dumps([kind, payload], sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+def _percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * p))] * 1000, 1)
+
+
+class JobQueue:
+    def __init__(self, broker=JOB_BROKER, workers=JOB_WORKERS, max_queued=JOB_MAX_QUEUED,
+                 result_ttl_s=JOB_RESULT_TTL_S, node_id=JOB_NODE_ID):
+        self.store = create_job_store(broker, max_queued)
+        self.broker = broker or "memory"
+        self.node_id = node_id
+        self.workers = workers
+        self.result_ttl_s = result_ttl_s
+        self._handlers = {}
+        self._options = {}
+        self._threads = []
+        self._lock = threading.Lock()
+        self._wait_s = {}       # priority → deque(等待秒數)
+        self._run_s = {}        # kind → deque(執行秒數)
+        self.counters = {"submitted": 0, "deduplicated": 0, "rejected": 0, "completed": 0, "failed": 0,
+                         "lost_claim": 0}
+
+    def register(self, kind, handler, priority, reuse_results=True, serial_key=None, local=False, check=None):
+        self._handlers[kind] = (handler, priority, REUSABLE_STATES if reuse_results else (QUEUED, RUNNING))
+        self._options[kind] = (serial_key, local, check)
+
+    def kinds(self):
+        return {kind: priority for kind, (_, priority, _) in self._handlers.items()}
+
+    def submit(self, kind, payload, priority=None):
+        """回傳 (job, deduplicated)；佇列滿時丟出 QueueFull"""
+        if kind not in self._handlers:
+            raise UnknownJobKind(f"未知的工作種類: {kind}")
+        _, default_priority, reusable = self._handlers[kind]
+        if priority is None:
+            priority = default_priority
+        serial_key, local, check = self._options[kind]
+        if check is not None:
+            check(payload)
+        job = new_job(uuid.uuid4().hex, kind, payload, int(priority), dedupe_key(kind, payload),
+                      serial_key=(serial_key(payload) or None) if serial_key else None,
+                      node=self.node_id if local else None)
+        try:
+            job, deduplicated = self.store.submit(job, reusable)
+        except QueueFull:
+            with self._lock:
+                self.counters["rejected"] += 1
+            raise
+        with self._lock:
+            self.counters["deduplicated" if deduplicated else "submitted"] += 1
+        return job, deduplicated
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def cancel(self, job_id):
+        return self.store.cancel(job_id, self.result_ttl_s)
+
+    def watch(self, job_id, timeout_s=300.0, heartbeat_s=15.0):
+        """
+        產生工作狀態的變化（供 SSE 串流）：每次 version 改變時產生一次，
+        heartbeat_s 內沒有變化時產生 None（呼叫端可送出保持連線的註解），結束狀態或逾時後停止
+        """
+        job = self.store.get(job_id)
+        deadline = time.monotonic() + timeout_s
+        while job is not None:
+            yield job
+            if job["status"] in FINAL_STATES or time.monotonic() >= deadline:
+                return
+            version = job["version"]
+            while True:
+                current = self.store.wait(job_id, version, heartbeat_s)
+                if current is None or current["version"] != version:
+                    job = current
+                    break
+                if time.monotonic() >= deadline:
+                    return
+                yield None
+
+    # ---------- worker ----------
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for n in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"job-worker-{n}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _worker(self):
+        while True:
+            try:
+                job = self.store.claim(CLAIM_TIMEOUT_S, self.node_id)
+            except Exception as e:
+                print(f"❌ 取得背景工作失敗: {e}")
+                time.sleep(CLAIM_TIMEOUT_S)
+                continue
+            if job is None:
+                self.store.purge()
+                continue
+            self._run(job)
+
+    def _run(self, job):
+        handler = self._handlers.get(job["kind"], (None,))[0]
+        self._record(self._wait_s, job["priority"], job["started"] - job["submitted"])
+        job_id, claim = job["id"], job["claim"]
+
+        def progress(fraction, message=None):
+            self.store.progress(job_id, claim, fraction, message)
+
+        done = threading.Event()
+        if self.store.lease_s:
+            threading.Thread(target=self._heartbeat, args=(job_id, claim, done),
+                             name=f"job-heartbeat-{job_id[:8]}", daemon=True).start()
+
+        started = time.perf_counter()
+        try:
+            if handler is None:
+                raise UnknownJobKind(f"此節點未註冊工作種類: {job['kind']}")
+            result = handler(job["payload"], progress)
+        except Exception as e:
+            status, fields = FAILED, {"error": str(e)}
+        else:
+            status, fields = DONE, {"result": result}
+        finally:
+            done.set()
+        if self.store.finish(job_id, claim, status, ttl_s=self.result_ttl_s, **fields):
+            with self._lock:
+                self.counters["completed" if status == DONE else "failed"] += 1
+        else:
+            # 租約已失效（工作被重新排隊或已有其他結果），結果不寫入
+            with self._lock:
+                self.counters["lost_claim"] += 1
+        self._record(self._run_s, job["kind"], time.perf_counter() - started)
+
+    def _heartbeat(self, job_id, claim, done):
+        interval = self.store.lease_s / 3
+        while not done.wait(interval):
+            try:
+                if not self.store.heartbeat(job_id, claim):
+                    return
+            except Exception as e:
+                print(f"❌ 背景工作心跳失敗: {e}")
+
+    def _record(self, metric, key, seconds):
+        with self._lock:
+            metric.setdefault(key, deque(maxlen=METRIC_WINDOW)).append(seconds)
+
+    def stats(self):
+        depth = self.store.depth()
+        with self._lock:
+            wait = {str(p): {"p50_ms": _percentile(v, 0.5), "p95_ms": _percentile(v, 0.95), "n": len(v)}
+                    for p, v in sorted(self._wait_s.items())}
+            run = {k: {"p50_ms": _percentile(v, 0.5), "p95_ms": _percentile(v, 0.95), "n": len(v)}
+                   for k, v in sorted(self._run_s.items())}
+            counters = dict(self.counters)
+        return {
+            "broker": self.broker if not self.broker.startswith("sqlite") else "sqlite",
+            "node": self.node_id,
+            "workers": len(self._threads),
+            "queue_depth": sum(depth["queued"].values()),
+            "queued_by_priority": {str(p): n for p, n in depth["queued"].items()},
+            "running": depth["running"],
+            "stored": depth["stored"],
+            "wait_time_by_priority": wait,
+            "run_time_by_kind": run,
+            "kinds": self.kinds(),
+            **counters,
+        }
+
+
+job_queue = JobQueue()
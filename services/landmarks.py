@@ -0,0 +1,390 @@
+# services/landmarks.py
+"""
+本地反向地理編碼：把船位描述成「最近地標 + 方位 + 距離」，例如「基隆港東北方 12 海浬」。
+
+地標（港口、岬角、島嶼、雷達站…）來自 JSON 檔（預設 assets/landmarks.json，可用 LANDMARKS_PATH 指定），
+每筆為 {"name", "type", "lat", "lon"}。地標轉成單位球上的 xyz 後建 k-d tree（依最長軸中位數切分），
+查詢時整批點一起處理：各點先走到所在葉節點得到第 k 近距離的上限，再由根節點逐層展開，
+外框距離超過上限的子樹整棵略過。弦長與大圓距離單調對應，結果與暴力搜尋相同；不需要逐船呼叫 Places API。
+
+方位與距離使用 services/geodesy 的 bearing_deg / haversine_km（與 app.py 的 calculate_bearing /
+haversine_distance 同公式的向量化版本），方位為「地標 → 船」。
+
+    python -m services.landmarks bench   # 10k 個船位的最近地標查詢 / 標註耗時，並與暴力搜尋比對
+"""
+import os
+import sys
+import json
+import time
+import threading
+
+import numpy as np
+
+from services.geodesy import EARTH_RADIUS_KM, KM_TO_NM, bearing_deg, haversine_km
+
+LANDMARKS_PATH = os.environ.get("LANDMARKS_PATH") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets", "landmarks.json")
+
+# k-d tree 葉節點最多的地標數
+LEAF_SIZE = 16
+# 地標數不超過此值時直接以矩陣乘法計算全部距離（樹的走訪反而較慢）
+DIRECT_MAX = 256
+# 一次查詢的點數（控制 點數 × 葉節點數 的暫存陣列大小）
+QUERY_CHUNK = 65536
+# 小於此距離（海里）時標為「○○附近」
+NEAR_NM = 0.5
+# 描述文字的距離上限（海里，約半個地球周長）
+MAX_LABEL_NM = 10800
+
+# 八方位（方位角 0 度為北，順時針）
+COMPASS_8 = ("北", "東北", "東", "東南", "南", "西南", "西", "西北")
+LANDMARK_TYPES = {"port": "港口", "cape": "岬角", "island": "島嶼", "radar": "雷達站"}
+
+
+def _unit_vectors(lat, lon):
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def compass_name(bearing):
+    """方位角 → 八方位中文（例如 45 → 東北）"""
+    return COMPASS_8[int(((float(bearing) % 360.0) + 22.5) // 45.0) % 8]
+
+
+def format_label(name, bearing, distance_nm):
+    """地標 + 方位 + 距離 → 「基隆港東北方 12 海浬」；10 海浬內取到小數一位"""
+    if distance_nm < NEAR_NM:
+        return f"{name}附近"
+    text = f"{distance_nm:.1f}" if distance_nm < 10 else f"{distance_nm:.0f}"
+    return f"{name}{compass_name(bearing)}方 {text} 海浬"
+
+
+def load_landmarks(path=LANDMARKS_PATH):
+    """讀取地標檔；缺欄位或座標不合法的項目略過"""
+    with open(path, encoding="utf-8") as f:
+        items = json.load(f)
+    landmarks = []
+    for item in items:
+        try:
+            lat, lon = float(item["lat"]), float(item["lon"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if item.get("name") and -90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0:
+            landmarks.append({"name": item["name"], "type": item.get("type") or "", "lat": lat, "lon": lon})
+    return landmarks
+
+
+class LandmarkIndex:
+    """地標的 k-d tree；nearest() / describe() 一次處理整個座標陣列"""
+
+    def __init__(self, landmarks, leaf_size=LEAF_SIZE):
+        if not landmarks:
+            raise ValueError("地標清單為空")
+        self.landmarks = list(landmarks)
+        self.names = [lm["name"] for lm in self.landmarks]
+        self.lat = np.array([lm["lat"] for lm in self.landmarks], dtype=np.float64)
+        self.lon = np.array([lm["lon"] for lm in self.landmarks], dtype=np.float64)
+
+        self._xyz = _unit_vectors(self.lat, self.lon)
+        self._build(self._xyz, leaf_size)
+        self._prefix = None
+
+    def __len__(self):
+        return len(self.landmarks)
+
+    def _build(self, xyz, leaf_size):
+        """
+        以最長軸中位數遞迴切分。節點以陣列保存（外框、左右子節點、切分軸與切分值），
+        葉節點的地標補齊成 (葉節點數, leaf_size, 3) 的陣列，查詢時可整批取用。
+        """
+        order = np.arange(len(xyz))
+        bounds, lo, hi, left, right, axis, split = [], [], [], [], [], [], []
+
+        def new_node(start, end):
+            bounds.append((start, end))
+            for column in (lo, hi):
+                column.append(None)
+            for column in (left, right, axis):
+                column.append(-1)
+            split.append(0.0)
+            return len(bounds) - 1
+
+        stack = [new_node(0, len(xyz))]
+        while stack:
+            node = stack.pop()
+            start, end = bounds[node]
+            pts = xyz[order[start:end]]
+            lo[node], hi[node] = pts.min(axis=0), pts.max(axis=0)
+            if end - start <= leaf_size:
+                continue
+            ax = int(np.argmax(hi[node] - lo[node]))
+            mid = (end - start) // 2
+            part = np.argpartition(pts[:, ax], mid)
+            order[start:end] = order[start:end][part]
+            axis[node], split[node] = ax, float(pts[part[mid], ax])
+            left[node], right[node] = new_node(start, start + mid), new_node(start + mid, end)
+            stack.extend((left[node], right[node]))
+
+        self._lo, self._hi = np.array(lo), np.array(hi)
+        self._left, self._right = np.array(left), np.array(right)
+        self._axis, self._split = np.array(axis), np.array(split)
+        leaves = np.flatnonzero(self._left < 0)
+        self._leaf_no = np.full(len(bounds), -1, dtype=np.int64)
+        self._leaf_no[leaves] = np.arange(len(leaves))
+        # 補齊的位置座標設在單位球外（距離必大於任何真實地標），索引為 -1
+        self._leaf_xyz = np.full((len(leaves), leaf_size, 3), 8.0)
+        self._leaf_idx = np.full((len(leaves), leaf_size), -1, dtype=np.int64)
+        for i, node in enumerate(leaves.tolist()):
+            start, end = bounds[node]
+            self._leaf_xyz[i, :end - start] = xyz[order[start:end]]
+            self._leaf_idx[i, :end - start] = order[start:end]
+
+    def nearest(self, lat, lon, k=1):
+        """
+        每個點最近的 k 個地標；回傳 (地標索引, 距離公里)，shape 皆為 (N, k)，依距離排序。
+        """
+        q = _unit_vectors(np.atleast_1d(lat), np.atleast_1d(lon)).reshape(-1, 3)
+        k = max(1, min(int(k), len(self)))
+        index = np.empty((len(q), k), dtype=np.int64)
+        chord2 = np.empty((len(q), k), dtype=np.float64)
+        for start in range(0, len(q), QUERY_CHUNK):
+            end = start + QUERY_CHUNK
+            index[start:end], chord2[start:end] = self._query(q[start:end], k)
+        # 弦長 → 大圓距離
+        chord = np.sqrt(np.maximum(chord2, 0.0))
+        distance = 2.0 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord / 2.0, 0.0, 1.0))
+        return index, distance
+
+    def _leaf_distances(self, q, leaf):
+        """q[i] 到葉節點 leaf[i] 內各地標的弦長平方，shape (N, leaf_size)"""
+        diff = self._leaf_xyz[leaf] - q[:, None, :]
+        return np.einsum("nlc,nlc->nl", diff, diff)
+
+    def _query(self, q, k):
+        """回傳 (地標索引, 弦長平方)"""
+        n = len(q)
+        if len(self) <= DIRECT_MAX:
+            # 地標很少時樹的走訪成本高於直接算：|q - p|² = 2 - 2 q·p，一次矩陣乘法
+            d = 2.0 - 2.0 * (q @ self._xyz.T)
+            if k == 1:
+                idx = np.argmin(d, axis=1)[:, None]
+                return idx, np.take_along_axis(d, idx, axis=1)
+            if k < len(self):
+                idx = np.argpartition(d, k - 1, axis=1)[:, :k]
+            else:
+                idx = np.broadcast_to(np.arange(len(self)), d.shape)
+            order = np.argsort(np.take_along_axis(d, idx, axis=1), axis=1, kind="stable")
+            idx = np.take_along_axis(idx, order, axis=1)
+            return idx, np.take_along_axis(d, idx, axis=1)
+        # 1. 每個點沿切分面往下走到所在葉節點，先以該葉節點的地標得到第 k 近距離的上限
+        node = np.zeros(n, dtype=np.int64)
+        inner = np.flatnonzero(self._left[node] >= 0)
+        while len(inner):
+            at = node[inner]
+            go_right = q[inner, self._axis[at]] >= self._split[at]
+            node[inner] = np.where(go_right, self._right[at], self._left[at])
+            inner = inner[self._left[node[inner]] >= 0]
+        first = self._leaf_no[node]
+        d = self._leaf_distances(q, first)
+        idx = self._leaf_idx[first]
+        if d.shape[1] < k:
+            pad = k - d.shape[1]
+            d = np.pad(d, ((0, 0), (0, pad)), constant_values=np.inf)
+            idx = np.pad(idx, ((0, 0), (0, pad)), constant_values=-1)
+        order = np.argsort(d, axis=1, kind="stable")[:, :k]
+        best_d = np.take_along_axis(d, order, axis=1)
+        best_i = np.take_along_axis(idx, order, axis=1)
+
+        # 2. 由根節點逐層展開 (點, 節點) 配對，外框距離超過上限的子樹整棵略過
+        pq = np.arange(n)
+        pn = np.zeros(n, dtype=np.int64)
+        while len(pq):
+            gap = np.maximum(self._lo[pn] - q[pq], 0.0) + np.maximum(q[pq] - self._hi[pn], 0.0)
+            keep = np.einsum("nc,nc->n", gap, gap) <= best_d[pq, -1]
+            pq, pn = pq[keep], pn[keep]
+            is_leaf = self._left[pn] < 0
+            lq, leaf = pq[is_leaf], self._leaf_no[pn[is_leaf]]
+            fresh = leaf != first[lq]
+            if fresh.any():
+                self._merge(q, lq[fresh], leaf[fresh], best_d, best_i)
+            iq, inner = pq[~is_leaf], pn[~is_leaf]
+            pq = np.concatenate([iq, iq])
+            pn = np.concatenate([self._left[inner], self._right[inner]])
+        return best_i, best_d
+
+    def _merge(self, q, cq, leaf, best_d, best_i):
+        """把點 cq 對葉節點 leaf 的距離併入各點目前的前 k 名（同一點可出現多次）"""
+        k = best_d.shape[1]
+        d = self._leaf_distances(q[cq], leaf)
+        if k == 1:
+            j = np.argmin(d, axis=1)
+            dj = d[np.arange(len(cq)), j]
+            better = dj < best_d[cq, 0]
+            cq, dj, ij = cq[better], dj[better], self._leaf_idx[leaf[better], j[better]]
+            np.minimum.at(best_d[:, 0], cq, dj)
+            win = dj == best_d[cq, 0]
+            best_i[cq[win], 0] = ij[win]
+            return
+        # 每列先取前 k 名，再與各點目前的前 k 名一起依 (點, 距離) 排序
+        if d.shape[1] > k:
+            part = np.argpartition(d, k - 1, axis=1)[:, :k]
+            d, slot = np.take_along_axis(d, part, axis=1), part
+        else:
+            slot = np.broadcast_to(np.arange(d.shape[1]), d.shape)
+        cand = d < best_d[cq, -1][:, None]
+        if not cand.any():
+            return
+        rows = np.nonzero(cand)
+        cand_q = cq[rows[0]]
+        touched = np.unique(cand_q)
+        all_q = np.concatenate([np.repeat(touched, k), cand_q])
+        all_d = np.concatenate([best_d[touched].ravel(), d[rows]])
+        all_i = np.concatenate([best_i[touched].ravel(), self._leaf_idx[leaf[rows[0]], slot[rows]]])
+        order = np.lexsort((all_d, all_q))
+        sorted_q = all_q[order]
+        rank = np.arange(len(order)) - np.searchsorted(sorted_q, sorted_q, side="left")
+        top = order[rank < k]
+        best_d[touched] = all_d[top].reshape(-1, k)
+        best_i[touched] = all_i[top].reshape(-1, k)
+
+    def _label_tables(self):
+        """描述文字的字串表（地標 × 八方位的前綴、距離字尾），第一次使用時建立"""
+        if self._prefix is None:
+            self._near = np.array([f"{name}附近" for name in self.names], dtype=object)
+            self._tenths = np.array([f"{v / 10:.1f} 海浬" for v in range(101)], dtype=object)
+            self._whole = np.array([f"{v} 海浬" for v in range(MAX_LABEL_NM + 1)], dtype=object)
+            self._prefix = np.array([[f"{name}{d}方 " for d in COMPASS_8] for name in self.names], dtype=object)
+        return self._prefix, self._near, self._tenths, self._whole
+
+    def _labels(self, index, bearing, distance_nm):
+        """format_label 的陣列版本：以查表組字串，避免逐筆格式化"""
+        prefix, near, tenths, whole = self._label_tables()
+        compass = ((np.mod(bearing, 360.0) + 22.5) // 45.0).astype(np.int64) % 8
+        suffix = np.where(
+            distance_nm < 10,
+            tenths[np.clip(np.round(distance_nm * 10).astype(np.int64), 0, 100)],
+            whole[np.clip(np.round(distance_nm).astype(np.int64), 0, MAX_LABEL_NM)],
+        )
+        return np.where(distance_nm < NEAR_NM, near[index], prefix[index, compass] + suffix)
+
+    def describe(self, lat, lon, k=1):
+        """
+        回傳 dict：landmark（地標索引）/ bearing_deg（地標 → 點）/ distance_nm / label，
+        皆為 shape (N, k) 的陣列（label 為 object 陣列）
+        """
+        lat = np.atleast_1d(np.asarray(lat, dtype=np.float64))
+        lon = np.atleast_1d(np.asarray(lon, dtype=np.float64))
+        index, _ = self.nearest(lat, lon, k)
+        lm_lat, lm_lon = self.lat[index], self.lon[index]
+        bearing = bearing_deg(lm_lat, lm_lon, lat[:, None], lon[:, None])
+        distance_nm = haversine_km(lm_lat, lm_lon, lat[:, None], lon[:, None]) * KM_TO_NM
+        return {"landmark": index, "bearing_deg": bearing, "distance_nm": distance_nm,
+                "label": self._labels(index, bearing, distance_nm)}
+
+    def labels(self, lat, lon):
+        """每個點最近地標的描述文字（list）"""
+        return self.describe(lat, lon, 1)["label"][:, 0].tolist()
+
+    def annotate_rows(self, rows, k=1):
+        """
+        一次標註整批船位（dict，需含 lat / lon），就地加入 landmark、landmark_label、
+        landmark_bearing_deg、landmark_distance_nm；k > 1 時另加 landmarks（前 k 個）。回傳 rows。
+        """
+        valid = [r for r in rows if r.get("lat") is not None and r.get("lon") is not None]
+        if not valid:
+            return rows
+        lat = np.fromiter((r["lat"] for r in valid), dtype=np.float64, count=len(valid))
+        lon = np.fromiter((r["lon"] for r in valid), dtype=np.float64, count=len(valid))
+        found = self.describe(lat, lon, k)
+        index = found["landmark"].tolist()
+        bearing = np.round(found["bearing_deg"], 1).tolist()
+        distance = np.round(found["distance_nm"], 2).tolist()
+        for row, idx, brg, nm, label in zip(valid, index, bearing, distance, found["label"].tolist()):
+            row["landmark"] = self.names[idx[0]]
+            row["landmark_label"] = label[0]
+            row["landmark_bearing_deg"] = brg[0]
+            row["landmark_distance_nm"] = nm[0]
+            if k > 1:
+                row["landmarks"] = [
+                    {"name": self.names[i], "bearing_deg": b, "distance_nm": d, "label": text}
+                    for i, b, d, text in zip(idx, brg, nm, label)
+                ]
+        return rows
+
+    def stats(self):
+        types = {}
+        for lm in self.landmarks:
+            types[lm["type"]] = types.get(lm["type"], 0) + 1
+        return {"landmarks": len(self), "nodes": len(self._left), "leaves": len(self._leaf_xyz), "types": types}
+
+
+class _LazyIndex:
+    """第一次使用時才讀取地標檔；reload() 重新讀取（例如更新地標檔後）"""
+
+    def __init__(self, path=LANDMARKS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._index = None
+
+    def get(self):
+        with self._lock:
+            if self._index is None:
+                self._index = LandmarkIndex(load_landmarks(self.path))
+            return self._index
+
+    def reload(self):
+        with self._lock:
+            self._index = LandmarkIndex(load_landmarks(self.path))
+            return self._index
+
+
+landmark_index = _LazyIndex()
+
+
+# --------------------- 效能測試 ---------------------
+def _brute_nearest(index, lat, lon, k, chunk=2000):
+    out = []
+    for start in range(0, len(lat), chunk):
+        d = haversine_km(lat[start:start + chunk, None], lon[start:start + chunk, None],
+                         index.lat[None], index.lon[None])
+        out.append(np.sort(d, axis=1)[:, :k])
+    return np.concatenate(out)
+
+
+def _timed(fn, *args, repeat=5):
+    fn(*args)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(*args)
+    return result, (time.perf_counter() - started) / repeat * 1000
+
+
+def benchmark(n=10_000, k=3, synthetic=20_000):
+    rng = np.random.default_rng(7)
+    lat = rng.uniform(20.0, 27.5, n)
+    lon = rng.uniform(116.0, 123.5, n)
+    # 實際地標檔，以及模擬大型地名庫（synthetic 個地標）看 k-d tree 剪枝的效果
+    fake = [{"name": f"P{i}", "type": "", "lat": a, "lon": b}
+            for i, (a, b) in enumerate(zip(rng.uniform(18.0, 30.0, synthetic).tolist(),
+                                           rng.uniform(114.0, 126.0, synthetic).tolist()))]
+    for name, index in (("landmarks.json", landmark_index.get()), ("synthetic", LandmarkIndex(fake))):
+        (_, dist), tree_ms = _timed(index.nearest, lat, lon, k)
+        brute, brute_ms = _timed(_brute_nearest, index, lat, lon, k, repeat=1)
+        labels, labels_ms = _timed(index.labels, lat, lon)
+        rows = [{"lat": a, "lon": b} for a, b in zip(lat.tolist(), lon.tolist())]
+        _, annotate_ms = _timed(index.annotate_rows, rows)
+        yield {"index": name, **index.stats(), "n": n, "k": k,
+               "nearest_ms": round(tree_ms, 1), "brute_ms": round(brute_ms, 1),
+               "mismatches": int(np.count_nonzero(np.abs(dist - brute) > 1e-6)),
+               "labels_ms": round(labels_ms, 1), "annotate_rows_ms": round(annotate_ms, 1),
+               "example": labels[0]}
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["bench"]:
+        print("用法: python -m services.landmarks bench")
+        sys.exit(1)
+    for line in benchmark():
+        print(json.dumps(line, ensure_ascii=False))
@@ -0,0 +1,359 @@
+# services/profiler.py
+"""
+逐 request 的取樣式效能剖析（找出慢的 /generate、黑名單查詢把時間花在 OpenAI、Places、JSON 還是 SQLAlchemy）。
+
+啟用條件（未設定任何一項時不掛任何 hook，對 request 沒有額外負擔）：
+  PROFILE_TOKEN=<token>   request 帶 X-Profile: <token> 標頭時剖析該 request
+  PROFILE_SAMPLE_N=N      每 N 個 API request（/api/*、/generate）剖析 1 個
+
+剖析方式：背景取樣執行緒每 PROFILE_INTERVAL_MS 毫秒以 sys._current_frames() 讀取被剖析 request
+所在執行緒的呼叫堆疊並累計次數，不使用 sys.setprofile（不影響未被剖析的 request）。
+span(name) 標記工具呼叫、外部呼叫與 SQL，取樣時目前的 span 會成為堆疊最上層的虛擬 frame，
+同時記錄每個 span 的起訖時間。
+
+結果寫到 PROFILE_DIR（預設 assets/profiles/）：
+  <id>.collapsed          collapsed stack（flamegraph.pl / speedscope 皆可讀）
+  <id>.speedscope.json    speedscope 格式
+  <id>.summary.json       摘要：耗時、各 span 累計、最常出現的 leaf frame
+記憶體中保留最近 PROFILE_KEEP 筆，較舊的連同檔案一起刪除。
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import itertools
+import threading
+from collections import Counter, deque
+
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN") or None
+PROFILE_SAMPLE_N = int(os.environ.get("PROFILE_SAMPLE_N", "0"))
+PROFILE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "5"))
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", "20"))
+PROFILE_DIR = os.environ.get("PROFILE_DIR") or os.path.join(os.getcwd(), "assets", "profiles")
+PROFILE_HEADER = "X-Profile"
+# 抽樣剖析只針對這些路徑（靜態檔不剖析）；剖析管理端點本身不剖析
+SAMPLED_PREFIXES = ("/api/", "/generate")
+ADMIN_PREFIX = "/api/profiles"
+# 摘要中列出的 leaf frame 數
+SUMMARY_TOP_FRAMES = 15
+MAX_STACK_DEPTH = 128
+
+_local = threading.local()
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class RequestProfile:
+    def __init__(self, name, thread_id, interval_ms=PROFILE_INTERVAL_MS):
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        self.name = name
+        self.thread_id = thread_id
+        self.interval_ms = interval_ms
+        self.started = time.perf_counter()
+        self.started_at = time.time()
+        self.elapsed_ms = None
+        self.samples = Counter()
+        self.span_stack = []
+        self.spans = []
+        self.status = None
+
+    def sample(self, frame):
+        stack = []
+        while frame is not None and len(stack) < MAX_STACK_DEPTH:
+            stack.append(_frame_label(frame.f_code))
+            frame = frame.f_back
+        stack.reverse()
+        # 目前 span 以虛擬 frame 放在堆疊最上層，flamegraph 中可依 span 分組
+        spans = tuple(f"[{name}]" for name, _ in tuple(self.span_stack))
+        self.samples[(f"[{self.name}]",) + spans + tuple(stack)] += 1
+
+    def push_span(self, name):
+        self.span_stack.append((name, time.perf_counter()))
+
+    def pop_span(self):
+        if not self.span_stack:
+            return
+        name, started = self.span_stack.pop()
+        now = time.perf_counter()
+        self.spans.append({
+            "name": name,
+            "start_ms": round((started - self.started) * 1000, 2),
+            "duration_ms": round((now - started) * 1000, 2),
+            "depth": len(self.span_stack),
+        })
+
+    def finish(self, status=None):
+        while self.span_stack:
+            self.pop_span()
+        self.elapsed_ms = round((time.perf_counter() - self.started) * 1000, 2)
+        self.status = status
+
+    # ---------- 輸出 ----------
+    def collapsed(self):
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.samples.most_common())
+
+    def speedscope(self):
+        frames, index = [], {}
+        samples, weights = [], []
+        for stack, count in self.samples.items():
+            ids = []
+            for label in stack:
+                if label not in index:
+                    index[label] = len(frames)
+                    frames.append({"name": label})
+                ids.append(index[label])
+            samples.append(ids)
+            weights.append(round(count * self.interval_ms, 3))
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "aicop-profiler",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": self.name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": self.elapsed_ms or 0,
+                "samples": samples,
+                "weights": weights,
+            }],
+        }
+
+    def summary(self):
+        by_span = {}
+        for s in self.spans:
+            agg = by_span.setdefault(s["name"], {"count": 0, "total_ms": 0.0})
+            agg["count"] += 1
+            agg["total_ms"] = round(agg["total_ms"] + s["duration_ms"], 2)
+        leaves = Counter()
+        for stack, count in self.samples.items():
+            leaves[stack[-1]] += count
+        total = sum(self.samples.values())
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "started_at": self.started_at,
+            "elapsed_ms": self.elapsed_ms,
+            "interval_ms": self.interval_ms,
+            "sample_count": total,
+            "spans": dict(sorted(by_span.items(), key=lambda kv: -kv[1]["total_ms"])),
+            "top_frames": [
+                {"frame": label, "samples": count, "share": round(count / total, 3)}
+                for label, count in leaves.most_common(SUMMARY_TOP_FRAMES)
+            ],
+            "timeline": self.spans,
+        }
+
+
+class _Sampler(threading.Thread):
+    """唯一的取樣執行緒：沒有剖析中的 request 時在 Event 上等待，不會空轉"""
+
+    def __init__(self, interval_ms):
+        super().__init__(name="request-profiler", daemon=True)
+        self.interval = interval_ms / 1000
+        self._lock = threading.Lock()
+        self._active = {}
+        self._wake = threading.Event()
+
+    def add(self, profile):
+        with self._lock:
+            self._active[profile.id] = profile
+        self._wake.set()
+
+    def remove(self, profile):
+        with self._lock:
+            self._active.pop(profile.id, None)
+            if not self._active:
+                self._wake.clear()
+
+    def run(self):
+        while True:
+            self._wake.wait()
+            # 取樣期間持有鎖：remove() 回傳後該 profile 不會再被寫入
+            with self._lock:
+                frames = sys._current_frames()
+                for profile in self._active.values():
+                    frame = frames.get(profile.thread_id)
+                    if frame is not None:
+                        profile.sample(frame)
+                del frames
+            time.sleep(self.interval)
+
+
+class Profiler:
+    def __init__(self, token=PROFILE_TOKEN, sample_n=PROFILE_SAMPLE_N, directory=PROFILE_DIR,
+                 keep=PROFILE_KEEP, interval_ms=PROFILE_INTERVAL_MS):
+        self.token = token
+        self.sample_n = sample_n
+        self.directory = directory
+        self.interval_ms = interval_ms
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+        self._recent = deque()
+        self._keep = keep
+        self._sampler = None
+
+    @property
+    def enabled(self):
+        return bool(self.token or self.sample_n)
+
+    def authorized(self, headers, remote_addr=None):
+        """管理端點：設定 token 時需帶相同標頭，否則只允許本機"""
+        if self.token:
+            return headers.get(PROFILE_HEADER) == self.token
+        return remote_addr in ("127.0.0.1", "::1")
+
+    def should_profile(self, path, headers):
+        if path.startswith(ADMIN_PREFIX):
+            return False
+        if self.token and headers.get(PROFILE_HEADER) == self.token:
+            return True
+        if self.sample_n and path.startswith(SAMPLED_PREFIXES):
+            return next(self._counter) % self.sample_n == 0
+        return False
+
+    def start(self, name):
+        with self._lock:
+            if self._sampler is None:
+                self._sampler = _Sampler(self.interval_ms)
+                self._sampler.start()
+        profile = RequestProfile(name, threading.get_ident(), self.interval_ms)
+        _local.profile = profile
+        self._sampler.add(profile)
+        return profile
+
+    def stop(self, profile, status=None):
+        self._sampler.remove(profile)
+        _local.profile = None
+        profile.finish(status)
+        self._save(profile)
+
+    def _save(self, profile):
+        summary = profile.summary()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            base = os.path.join(self.directory, profile.id)
+            with open(base + ".collapsed", "w", encoding="utf-8") as f:
+                f.write(profile.collapsed())
+            with open(base + ".speedscope.json", "w", encoding="utf-8") as f:
+                json.dump(profile.speedscope(), f, ensure_ascii=False)
+            with open(base + ".summary.json", "w", encoding="utf-8") as f:
+                json.dump(summary, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            print(f"❌ 寫入剖析結果失敗: {e}")
+
+        with self._lock:
+            self._recent.append(profile)
+            expired = []
+            while len(self._recent) > self._keep:
+                expired.append(self._recent.popleft())
+        for old in expired:
+            for suffix in (".collapsed", ".speedscope.json", ".summary.json"):
+                try:
+                    os.remove(os.path.join(self.directory, old.id + suffix))
+                except OSError:
+                    pass
+
+    def recent(self):
+        with self._lock:
+            profiles = list(self._recent)
+        return [
+            {k: v for k, v in p.summary().items() if k not in ("timeline", "top_frames")}
+            for p in reversed(profiles)
+        ]
+
+    def get(self, profile_id):
+        with self._lock:
+            for profile in self._recent:
+                if profile.id == profile_id:
+                    return profile
+        return None
+
+    def init_app(self, app):
+        """設定啟用時才掛上 request hook 與 SQL 事件；否則什麼都不做"""
+        if not self.enabled:
+            return
+        from flask import request
+
+        @app.before_request
+        def _start_profile():
+            if self.should_profile(request.path, request.headers):
+                request.environ["aicop.profile"] = self.start(f"{request.method} {request.path}")
+
+        @app.after_request
+        def _tag_response(response):
+            profile = request.environ.get("aicop.profile")
+            if profile is not None:
+                response.headers["X-Profile-Id"] = profile.id
+                profile.status = response.status_code
+            return response
+
+        @app.teardown_request
+        def _stop_profile(exc):
+            profile = request.environ.pop("aicop.profile", None)
+            if profile is not None:
+                self.stop(profile, 500 if exc is not None else profile.status)
+
+        _install_sql_spans()
+
+
+def current_profile():
+    return getattr(_local, "profile", None)
+
+
+class span:
+    """標記一段工作（工具呼叫、外部 API、SQL）；目前 request 未被剖析時只多一次屬性查詢"""
+    __slots__ = ("name", "profile")
+
+    def __init__(self, name):
+        self.name = name
+        self.profile = None
+
+    def __enter__(self):
+        profile = getattr(_local, "profile", None)
+        if profile is not None:
+            profile.push_span(self.name)
+            self.profile = profile
+        return self
+
+    def __exit__(self, *exc):
+        if self.profile is not None:
+            self.profile.pop_span()
+        return False
+
+
+def _install_sql_spans():
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        profile = getattr(_local, "profile", None)
+        if profile is not None:
+            verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "SQL"
+            profile.push_span(f"sql:{verb}")
+            context._aicop_profile = profile
+
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        profile = getattr(context, "_aicop_profile", None)
+        if profile is not None:
+            context._aicop_profile = None
+            profile.pop_span()
+
+    def _error(exception_context):
+        context = exception_context.execution_context
+        profile = getattr(context, "_aicop_profile", None) if context is not None else None
+        if profile is not None:
+            context._aicop_profile = None
+            profile.pop_span()
+
+    event.listen(Engine, "before_cursor_execute", _before)
+    event.listen(Engine, "after_cursor_execute", _after)
+    event.listen(Engine, "handle_error", _error)
+
+
+profiler = Profiler()
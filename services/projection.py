@@ -0,0 +1,163 @@
+# services/projection.py
+"""
+船位推算（dead reckoning）。
+
+  - project()       ：依最後一筆的航向、航速，把所有船位一次外推到指定時間
+  - interpolate_at()：歷史回放用，在前後兩筆回報之間內插，超過最後一筆則外推
+外推時間以「staleness cap」為上限（預設依船種分類，見 SHIPTYPE_MAX_AGE_S；也可整批指定），
+超過上限的船只推到上限並標記 stale。
+全部以 NumPy 向量運算完成，沒有逐船的 Python 迴圈。
+"""
+import numpy as np
+
+from services.geodesy import destination_points, KNOT_TO_KMH
+
+# 外推時間上限（秒）
+DEFAULT_MAX_AGE_S = 1800.0
+# 依船種分類（ais_decoder.ais_shiptype_to_category）的外推上限（秒）：航向穩定的貨船、油輪可外推較久，
+# 常轉向或停留作業的漁船、拖船 / 特殊用途船、遊艇與高速船較短；未列出的船種使用 DEFAULT_MAX_AGE_S
+SHIPTYPE_MAX_AGE_S = {
+    "2": 900.0,    # 漁船
+    "3": 900.0,    # 拖船 / 特殊用途
+    "4": 600.0,    # 高速船
+    "6": 1800.0,   # 客船
+    "7": 3600.0,   # 貨船
+    "8": 3600.0,   # 油輪
+    "9": 900.0,    # 遊艇
+}
+# 內插時前後兩筆回報的最大間隔（秒），超過則視為資料中斷
+DEFAULT_MAX_GAP_S = 3600.0
+# 低於此航速（節）視為停船，不外推
+MIN_MOVING_SPEED = 0.5
+
+
+def project(lat, lon, sog, cog, report_ts, at_ts, max_age_s=DEFAULT_MAX_AGE_S):
+    """
+    向量化外推。sog（節）、cog（度）為 NaN 或航速過低的船維持原位。
+    max_age_s 可為純量或每艘船一個上限的陣列。
+    回傳 dict：lat、lon、age_s（距最後回報秒數）、projected_s（實際外推秒數）、stale（bool）
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    sog = np.asarray(sog, dtype=np.float64)
+    cog = np.asarray(cog, dtype=np.float64)
+    age = np.asarray(at_ts, dtype=np.float64) - np.asarray(report_ts, dtype=np.float64)
+    cap = np.broadcast_to(np.asarray(max_age_s, dtype=np.float64), age.shape)
+
+    dt = np.clip(age, 0.0, cap)
+    moving = np.isfinite(sog) & np.isfinite(cog) & (sog >= MIN_MOVING_SPEED)
+    dist_km = np.where(moving, np.nan_to_num(sog) * KNOT_TO_KMH * dt / 3600.0, 0.0)
+    new_lat, new_lon = destination_points(lat, lon, np.nan_to_num(cog), dist_km)
+    new_lat = np.where(moving, new_lat, lat)
+    new_lon = np.where(moving, new_lon, lon)
+
+    return {
+        "lat": new_lat,
+        "lon": new_lon,
+        "age_s": age,
+        "projected_s": np.where(moving, dt, 0.0),
+        "stale": age > cap,
+    }
+
+
+def max_age_for(rows, max_age_s=None):
+    """每筆資料列的外推上限陣列：指定 max_age_s 時全部使用該值，否則依 shiptype 查 SHIPTYPE_MAX_AGE_S"""
+    if max_age_s is not None:
+        return np.full(len(rows), float(max_age_s))
+    return np.array([SHIPTYPE_MAX_AGE_S.get(str(r.get("shiptype") or ""), DEFAULT_MAX_AGE_S) for r in rows],
+                    dtype=np.float64)
+
+
+def max_age_bound(max_age_s=None):
+    """max_age_for 可能回傳的最大上限（歷史回放決定往前查詢多久時使用）"""
+    if max_age_s is not None:
+        return float(max_age_s)
+    return max(DEFAULT_MAX_AGE_S, *SHIPTYPE_MAX_AGE_S.values())
+
+
+def project_rows(rows, at_ts, max_age_s=None):
+    """
+    對船位資料列（最新船位表格式）外推，回傳新的資料列，
+    保留原始位置於 reported_lat / reported_lon，並加上 age_s、max_age_s、stale、projected 欄位。
+    max_age_s 為 None 時每艘船依船種決定上限（max_age_for）。
+    """
+    if not rows:
+        return []
+
+    def _col(key):
+        return np.array([np.nan if r.get(key) is None else r[key] for r in rows], dtype=np.float64)
+
+    cap = max_age_for(rows, max_age_s)
+    result = project(_col("lat"), _col("lon"), _col("speed"), _col("course"), _col("ts"), at_ts, cap)
+    lat, lon = result["lat"].tolist(), result["lon"].tolist()
+    age, projected_s, stale = result["age_s"].tolist(), result["projected_s"].tolist(), result["stale"].tolist()
+    cap = cap.tolist()
+
+    out = []
+    for i, row in enumerate(rows):
+        item = dict(row)
+        item.update({
+            "reported_lat": row["lat"], "reported_lon": row["lon"],
+            "lat": lat[i], "lon": lon[i],
+            "age_s": age[i], "max_age_s": cap[i], "projected_s": projected_s[i],
+            "stale": stale[i], "projected": projected_s[i] > 0,
+        })
+        out.append(item)
+    return out
+
+
+def interpolate_at(mmsi, ts, lat, lon, sog, cog, at_ts,
+                   max_gap_s=DEFAULT_MAX_GAP_S, max_age_s=DEFAULT_MAX_AGE_S):
+    """
+    歷史回放：給定多艘船的回報（欄位陣列，順序不限），計算每艘船在 at_ts 的位置。
+    前後都有回報且間隔不超過 max_gap_s 時線性內插；只有較早的回報時外推（受 max_age_s 限制，
+    可為純量或與輸入回報對齊的陣列，以所用回報的上限為準）；
+    at_ts 早於該船第一筆回報則不輸出。
+    回傳 dict：mmsi、lat、lon、mode（0=內插、1=外推）、source_index（用來取回船名等欄位）
+    """
+    mmsi = np.asarray(mmsi)
+    ts = np.asarray(ts, dtype=np.float64)
+    if len(ts) == 0:
+        empty = np.empty(0)
+        return {"mmsi": mmsi[:0], "lat": empty, "lon": empty, "mode": empty.astype(np.int8),
+                "source_index": empty.astype(np.int64)}
+
+    order = np.lexsort((ts, mmsi))
+    ms, tt = mmsi[order], ts[order]
+    starts = np.flatnonzero(np.r_[True, ms[1:] != ms[:-1]])
+    group = np.cumsum(np.r_[True, ms[1:] != ms[:-1]]) - 1
+    ends = np.r_[starts[1:], len(ms)]
+
+    # 以 (船序號, 時間) 組成單調遞增的鍵，一次 searchsorted 找出每艘船在 at_ts 的位置
+    span = float(tt.max() - tt.min()) + 1.0
+    t0 = float(tt.min())
+    keys = group * span + (tt - t0)
+    query = np.arange(len(starts)) * span + (float(np.clip(at_ts, t0, t0 + span - 1)) - t0)
+    pos = np.searchsorted(keys, query, side="right")
+    prev = pos - 1
+    has_prev = prev >= starts
+    has_prev &= ts[order[np.clip(prev, 0, len(ms) - 1)]] <= at_ts
+    has_next = pos < ends
+    prev = np.clip(prev, 0, len(ms) - 1)
+    nxt = np.clip(pos, 0, len(ms) - 1)
+
+    p_idx, n_idx = order[prev], order[nxt]
+    gap = ts[n_idx] - ts[p_idx]
+    interp = has_prev & has_next & (gap <= max_gap_s) & (gap > 0)
+    frac = np.where(interp, (at_ts - ts[p_idx]) / np.where(gap > 0, gap, 1.0), 0.0)
+
+    lat_i = lat[p_idx] + (lat[n_idx] - lat[p_idx]) * frac
+    dlon = (lon[n_idx] - lon[p_idx] + 540.0) % 360.0 - 180.0   # 跨換日線時取短邊
+    lon_i = (lon[p_idx] + dlon * frac + 540.0) % 360.0 - 180.0
+
+    cap = np.broadcast_to(np.asarray(max_age_s, dtype=np.float64), ts.shape)[p_idx]
+    dr = project(lat[p_idx], lon[p_idx], sog[p_idx], cog[p_idx], ts[p_idx], at_ts, cap)
+    keep = has_prev & (interp | (at_ts - ts[p_idx] <= cap))
+
+    return {
+        "mmsi": ms[starts][keep],
+        "lat": np.where(interp, lat_i, dr["lat"])[keep],
+        "lon": np.where(interp, lon_i, dr["lon"])[keep],
+        "mode": np.where(interp, 0, 1).astype(np.int8)[keep],
+        "source_index": p_idx[keep],
+    }
@@ -0,0 +1,122 @@
+# services/replay.py
+"""
+NMEA 錄製檔重播工具（同時作為匯入管線的吞吐量基準測試）。
+
+    python -m services.replay recorded.nmea --speed 10
+    python -m services.replay recorded.nmea --speed 0          # 不限速，測最大吞吐量
+    python -m services.replay recorded.nmea --target tcp://127.0.0.1:10110
+
+句子若帶有 tag block 時間（\\c:...\\），依原始時間差除以 --speed 的速度重播；
+沒有時間資訊的檔案一律以最快速度送出。
+未指定 --target 時直接餵入本機的 IngestPipeline（寫入暫存目錄，不影響正式資料）。
+"""
+import sys
+import time
+import socket
+import argparse
+import tempfile
+from urllib.parse import urlparse
+
+from services.ais_decoder import _parse_tag_block
+
+
+def _line_time(line):
+    if line.startswith("\\"):
+        end = line.find("\\", 1)
+        if end > 0:
+            tags = _parse_tag_block(line[1:end])
+            if "c" in tags:
+                try:
+                    c = float(tags["c"])
+                except ValueError:
+                    return None
+                return c / 1000.0 if c > 1e11 else c
+    return None
+
+
+def paced_lines(path, speed):
+    """依 tag block 時間與倍速逐行產生句子（generator）"""
+    first_src = first_wall = None
+    with open(path, "r", encoding="ascii", errors="replace") as f:
+        for line in f:
+            if speed > 0:
+                src = _line_time(line)
+                if src is not None:
+                    if first_src is None:
+                        first_src, first_wall = src, time.monotonic()
+                    delay = (src - first_src) / speed - (time.monotonic() - first_wall)
+                    if delay > 0:
+                        time.sleep(delay)
+            yield line
+
+
+def _make_sender(target):
+    url = urlparse(target)
+    if url.scheme == "tcp":
+        sock = socket.create_connection((url.hostname, url.port))
+        return lambda line: sock.sendall(line.encode("ascii", "replace")), sock.close
+    if url.scheme == "udp":
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        return lambda line: sock.sendto(line.encode("ascii", "replace"), (url.hostname, url.port)), sock.close
+    raise ValueError(f"不支援的目標: {target}")
+
+
+def replay(path, speed=1.0, target=None):
+    """重播並回傳統計結果 dict"""
+    lines = 0
+    started = time.perf_counter()
+
+    if target:
+        send, close = _make_sender(target)
+        try:
+            for line in paced_lines(path, speed):
+                send(line if line.endswith("\n") else line + "\n")
+                lines += 1
+        finally:
+            close()
+        elapsed = time.perf_counter() - started
+        return {"lines": lines, "seconds": elapsed, "lines_per_second": lines / elapsed if elapsed else None}
+
+    # 本機管線：歷史資料寫入暫存目錄
+    from models.track_store import TrackStore
+    from models.vessel_store import LatestPositionStore
+    from services.ingest import IngestPipeline
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pipeline = IngestPipeline(latest=LatestPositionStore(), history=TrackStore(tmp)).start()
+        for line in paced_lines(path, speed):
+            pipeline.feed_line(line)
+            lines += 1
+        pipeline.stop()
+        elapsed = time.perf_counter() - started
+        stats = pipeline.stats()
+
+    decoded = stats["decoder"]["messages"]
+    return {
+        "lines": lines,
+        "messages": decoded,
+        "decode_errors": stats["decoder"]["decode_errors"],
+        "written": stats["written"],
+        "dropped": stats["dropped"],
+        "vessels": len(pipeline.latest),
+        "seconds": elapsed,
+        "lines_per_second": lines / elapsed if elapsed else None,
+        "messages_per_second": decoded / elapsed if elapsed else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="重播 NMEA 錄製檔")
+    parser.add_argument("path")
+    parser.add_argument("--speed", type=float, default=1.0, help="重播倍速，0 表示不限速")
+    parser.add_argument("--target", help="tcp://host:port 或 udp://host:port；省略則餵入本機管線")
+    args = parser.parse_args(argv)
+
+    result = replay(args.path, args.speed, args.target)
+    for key, value in result.items():
+        print(f"{key:>20}: {value:.1f}" if isinstance(value, float) else f"{key:>20}: {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,367 @@
+# services/response_codec.py
+"""
+API 回應層：較快的 JSON 編碼、gzip / brotli 壓縮，以及大型陣列的分批串流輸出。
+
+  FastJSONProvider   ：Flask JSON provider（app.json），有安裝 orjson 時以 orjson 編碼 / 解碼，
+                       中文直接輸出 UTF-8（不轉成 \\uXXXX），不排序鍵；orjson 無法處理的物件退回標準函式庫
+  response_compressor：after_request 依 Accept-Encoding 協商 br / gzip，超過 COMPRESS_MIN_BYTES 的回應才壓縮；
+                       串流回應邊產生邊壓縮，不會整份放進記憶體；每個片段壓縮後即 sync flush，
+                       用戶端可立即解開已送出的部分（NDJSON 逐批顯示，不會等整個回應結束）
+  iter_json_object() ：{...fields, "data": [...], ...trailer(count)} 以每 STREAM_BATCH 筆一次編碼的片段輸出
+
+設定（環境變數）：
+  COMPRESS_ENCODINGS       ：可用的壓縮格式與優先順序，預設 "br,gzip"（未安裝 Brotli 時只用 gzip；設為空字串停用壓縮）
+  COMPRESS_MIN_BYTES       ：小於此大小的回應不壓縮，預設 1024
+  COMPRESS_GZIP_LEVEL      ：gzip 壓縮等級 1–9，預設 5
+  COMPRESS_BROTLI_QUALITY  ：brotli 品質 0–11，預設 4（動態回應用高品質太耗 CPU）
+
+    python -m services.response_codec bench   # 代表性回應：編碼 CPU 時間與傳輸大小（前 / 後）
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import threading
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # 未安裝 orjson：仍使用標準函式庫（輸出一樣不轉義中文）
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # 未安裝 Brotli：只協商 gzip
+    brotli = None
+
+COMPRESS_ENCODINGS = tuple(
+    e for e in (s.strip().lower() for s in os.environ.get("COMPRESS_ENCODINGS", "br,gzip").split(","))
+    if e == "gzip" or (e == "br" and brotli is not None)
+)
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.environ.get("COMPRESS_GZIP_LEVEL", "5"))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get("COMPRESS_BROTLI_QUALITY", "4"))
+
+# 可壓縮的內容類型（SSE 需即時送出，不壓縮）
+COMPRESSIBLE_MIMETYPES = {
+    "application/json", "application/geo+json", "application/x-ndjson",
+    "application/javascript", "text/css", "text/csv", "text/html", "text/plain",
+    "application/x-aicop-vessels",
+}
+# 串流輸出時每次編碼的筆數
+STREAM_BATCH = 512
+
+if orjson is not None:
+    _ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+                       | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS)
+
+
+def _std_default(o):
+    # 與 Flask 預設相同（日期轉 HTTP 日期、dataclass 轉 dict 等）
+    return DefaultJSONProvider.default(o)
+
+
+def dumps_bytes(obj):
+    """緊湊 JSON（UTF-8 bytes）；orjson 無法處理時（例如超過 64 位元的整數）退回標準函式庫"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=_std_default, option=_ORJSON_OPTIONS)
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_std_default).encode("utf-8")
+
+
+def dumps(obj):
+    """緊湊 JSON 字串（中文不轉義）"""
+    return dumps_bytes(obj).decode("utf-8")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    以 orjson 實作 jsonify / request.get_json；debug 模式（或 compact=False）時仍縮排輸出。
+    呼叫端指定 orjson 不支援的參數（例如 cls）時交給 DefaultJSONProvider。
+    """
+    ensure_ascii = False
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or set(kwargs) - {"separators", "indent"}:
+            return super().dumps(obj, **kwargs)
+        return self._encode(obj, bool(kwargs.get("indent"))).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def _encode(self, obj, pretty=False):
+        if orjson is None:
+            return super().dumps(obj, indent=2 if pretty else None,
+                                 separators=None if pretty else (",", ":")).encode("utf-8")
+        option = _ORJSON_OPTIONS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=self.default, option=option)
+        except TypeError:
+            return super().dumps(obj, indent=2 if pretty else None,
+                                 separators=None if pretty else (",", ":")).encode("utf-8")
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(self._encode(obj, pretty) + b"\n", mimetype=self.mimetype)
+
+
+# --------------------- 串流輸出 ---------------------
+def iter_json_array(items, batch=STREAM_BATCH):
+    """items → JSON 陣列內容（不含中括號），每 batch 筆編碼一次；回傳產生器"""
+    chunk = []
+    first = True
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= batch:
+            body = dumps_bytes(chunk)[1:-1]
+            yield body if first else b"," + body
+            first = False
+            chunk = []
+    if chunk:
+        body = dumps_bytes(chunk)[1:-1]
+        yield body if first else b"," + body
+
+
+def iter_json_object(fields, array_key, items, trailer=None, batch=STREAM_BATCH):
+    """
+    以片段輸出 {...fields, array_key: [...items], ...trailer(count)}；
+    trailer 在 items 全部輸出後才以總筆數呼叫（例如把 count 放在最後）
+    """
+    count = 0
+
+    def counted():
+        nonlocal count
+        for item in items:
+            count += 1
+            yield item
+
+    head = dumps_bytes(fields or {})[:-1]
+    yield head + (b"," if len(head) > 1 else b"") + dumps_bytes(array_key) + b":["
+    yield from iter_json_array(counted(), batch)
+    tail = dumps_bytes(trailer(count) if trailer else {})[1:]
+    yield b"]" + (b"," if len(tail) > 1 else b"") + tail
+
+
+def iter_ndjson(items, batch=STREAM_BATCH):
+    """items → NDJSON（一行一筆），每 batch 筆合併成一個片段"""
+    chunk = []
+    for item in items:
+        chunk.append(dumps_bytes(item))
+        if len(chunk) >= batch:
+            yield b"\n".join(chunk) + b"\n"
+            chunk = []
+    if chunk:
+        yield b"\n".join(chunk) + b"\n"
+
+
+# --------------------- 壓縮 ---------------------
+class _Compressor:
+    """gzip / brotli 的增量壓縮器，統一 compress() / sync_flush() / flush() 介面"""
+
+    def __init__(self, encoding, gzip_level, brotli_quality):
+        self.encoding = encoding
+        if encoding == "br":
+            self._obj = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._obj = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self._obj.process(data) if self.encoding == "br" else self._obj.compress(data)
+
+    def sync_flush(self):
+        """輸出目前緩衝的內容（不結束串流），接收端可立即解壓到此為止的資料"""
+        return self._obj.flush() if self.encoding == "br" else self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def flush(self):
+        return self._obj.finish() if self.encoding == "br" else self._obj.flush()
+
+
+def compress_bytes(data, encoding, gzip_level=COMPRESS_GZIP_LEVEL, brotli_quality=COMPRESS_BROTLI_QUALITY):
+    if encoding == "br":
+        return brotli.compress(data, quality=brotli_quality)
+    c = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return c.compress(data) + c.flush()
+
+
+class ResponseCompressor:
+    """依 Accept-Encoding 壓縮回應；init_app() 後對所有 route 生效"""
+
+    def __init__(self, encodings=COMPRESS_ENCODINGS, min_bytes=COMPRESS_MIN_BYTES,
+                 gzip_level=COMPRESS_GZIP_LEVEL, brotli_quality=COMPRESS_BROTLI_QUALITY):
+        self.encodings = tuple(encodings)
+        self.min_bytes = min_bytes
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self._lock = threading.Lock()
+        self._stats = {"compressed": 0, "streamed": 0, "skipped_small": 0, "bytes_in": 0, "bytes_out": 0}
+
+    def init_app(self, app):
+        if not self.encodings:
+            return
+        from flask import request
+
+        @app.after_request
+        def _compress_response(response):
+            return self.process(request, response)
+
+    def negotiate(self, accept_encodings):
+        """回傳要使用的壓縮格式（"br" / "gzip"）或 None；q 值相同時依 self.encodings 的順序"""
+        best, best_q = None, 0.0
+        for encoding in self.encodings:
+            q = accept_encodings.quality(encoding)
+            if q > best_q:
+                best, best_q = encoding, q
+        return best
+
+    def process(self, req, response):
+        if (req.method == "HEAD" or response.direct_passthrough
+                or response.status_code < 200 or response.status_code in (204, 206) or response.status_code >= 300
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES
+                or "Content-Encoding" in response.headers):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = self.negotiate(req.accept_encodings)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = self._stream(response.response, encoding)
+            response.headers.pop("Content-Length", None)
+            self._count(streamed=1)
+        else:
+            data = response.get_data()
+            if len(data) < self.min_bytes:
+                self._count(skipped_small=1)
+                return response
+            body = compress_bytes(data, encoding, self.gzip_level, self.brotli_quality)
+            response.set_data(body)
+            self._count(compressed=1, bytes_in=len(data), bytes_out=len(body))
+        response.headers["Content-Encoding"] = encoding
+        # 壓縮後的內容與原本逐 byte 不同，強 ETag 改為弱 ETag
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def _stream(self, chunks, encoding):
+        compressor = _Compressor(encoding, self.gzip_level, self.brotli_quality)
+        size_in = size_out = 0
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode("utf-8")
+                if not chunk:
+                    continue
+                size_in += len(chunk)
+                out = compressor.compress(chunk) + compressor.sync_flush()
+                if out:
+                    size_out += len(out)
+                    yield out
+            out = compressor.flush()
+            size_out += len(out)
+            yield out
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+            self._count(bytes_in=size_in, bytes_out=size_out)
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, value in deltas.items():
+                self._stats[name] += value
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["ratio"] = round(stats["bytes_out"] / stats["bytes_in"], 3) if stats["bytes_in"] else None
+        stats.update(encodings=list(self.encodings), min_bytes=self.min_bytes, gzip_level=self.gzip_level,
+                     brotli_quality=self.brotli_quality if brotli is not None else None,
+                     json_backend="orjson" if orjson is not None else "json")
+        return stats
+
+
+response_compressor = ResponseCompressor()
+
+
+# --------------------- 效能測試 ---------------------
+def _payloads():
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    names = ["閩獅漁 06688", "MIN YANG", "海警 2901", "ZHE DAI YU", "浙岱漁 03237", "HAI XUN 06"]
+    vessels = {"count": 10_000, "data": [
+        {"mmsi": 412000000 + i, "shipname": f"{names[i % len(names)]} {i % 997}",
+         "lat": round(float(20 + rng.random() * 8), 6), "lon": round(float(116 + rng.random() * 8), 6),
+         "speed": round(float(rng.random() * 15), 1), "course": round(float(rng.random() * 360), 1),
+         "heading": None, "shiptype": "3", "destination": "舟山", "timestamp": "2025-01-01 08:00:00",
+         "landmark_label": "基隆港東北方 12 海浬"}
+        for i in range(10_000)
+    ]}
+    angles = np.linspace(0, 2 * np.pi, 721)
+    geojson = {"type": "FeatureCollection", "features": [
+        {"type": "Feature",
+         "geometry": {"type": "Polygon", "coordinates": [[
+             [round(lon + r * float(np.cos(t)), 6), round(lat + r * float(np.sin(t)), 6)] for t in angles]]},
+         "properties": {"name": f"警戒區 {i}", "radius_km": round(r * 111, 1)}}
+        for i, (lat, lon, r) in enumerate(zip(rng.uniform(22, 26, 40).tolist(), rng.uniform(119, 122, 40).tolist(),
+                                              rng.uniform(0.1, 0.4, 40).tolist()))
+    ]}
+    blacklist = {"count": 2000, "items": [
+        {"id": i, "name": f"{names[i % len(names)]} {i}", "note": "可疑越界作業", "created_at": "2025-01-01 08:00:00"}
+        for i in range(2000)
+    ]}
+    return {"vessels_10k": vessels, "geojson_buffers": geojson, "blacklist_2k": blacklist}
+
+
+def _cpu_ms(fn, repeat=5):
+    fn()
+    started = time.process_time()
+    for _ in range(repeat):
+        out = fn()
+    return out, (time.process_time() - started) / repeat * 1000
+
+
+def benchmark():
+    # 原本：Flask 預設 provider（sort_keys、ensure_ascii）不壓縮
+    def before(obj):
+        return json.dumps(obj, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+    for name, obj in _payloads().items():
+        body, before_ms = _cpu_ms(lambda: before(obj))
+        row = {"payload": name, "before_bytes": len(body), "before_ms": round(before_ms, 1)}
+        fast, fast_ms = _cpu_ms(lambda: dumps_bytes(obj))
+        row.update(json_backend="orjson" if orjson is not None else "json",
+                   json_bytes=len(fast), json_ms=round(fast_ms, 1))
+        for encoding in ("gzip",) + (("br",) if brotli is not None else ()):
+            packed, pack_ms = _cpu_ms(lambda: compress_bytes(fast, encoding))
+            row[f"{encoding}_bytes"] = len(packed)
+            row[f"{encoding}_total_ms"] = round(fast_ms + pack_ms, 1)
+        yield row
+
+    # 串流：分批編碼 vs 逐筆編碼（/chinaboat/all 原本的做法）
+    rows = _payloads()["vessels_10k"]["data"] * 10
+    _, per_item_ms = _cpu_ms(lambda: sum(len(json.dumps(r, ensure_ascii=False, separators=(",", ":"))) for r in rows), 2)
+    pieces, batched_ms = _cpu_ms(lambda: list(iter_json_object({}, "data", rows, lambda n: {"count": n})), 2)
+    yield {"stream": "100k vessels", "per_item_ms": round(per_item_ms, 1), "batched_ms": round(batched_ms, 1),
+           "chunks": len(pieces), "largest_chunk_bytes": max(len(p) for p in pieces)}
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["bench"]:
+        print("用法: python -m services.response_codec bench")
+        sys.exit(1)
+    for line in benchmark():
+        print(json.dumps(line, ensure_ascii=False))
@@ -0,0 +1,237 @@
+# services/track_reduce.py
+"""
+航跡精簡（串流式）。
+
+輸入為依時間排序、多艘船交錯的 AIS 資料列，依 MMSI 分開處理：
+  - "dp"     ：分段 Douglas–Peucker，容許誤差 tolerance_m（公尺）
+  - "bucket" ：時間桶降採樣，每艘船每 bucket_seconds 只保留一點
+轉向點（相對於段落起點的累積航向變化 > turn_deg）與停船點（速度跨越 stop_speed）
+一律保留。每艘船最多只暫存 window 筆，因此不會把整條航跡放進記憶體。
+"""
+import math
+from dataclasses import dataclass, field
+
+from models.track_store import format_time
+
+# 每艘船 DP 視窗的最大點數
+DEFAULT_WINDOW = 256
+# 緯度 1 度的公尺數（局部平面近似用）
+METERS_PER_DEG = 111320.0
+
+
+@dataclass
+class ReduceOptions:
+    mode: str = "dp"              # "dp" 或 "bucket"
+    tolerance_m: float = 50.0
+    bucket_seconds: float = 300.0
+    turn_deg: float = 30.0
+    stop_speed: float = 0.5       # 節
+    window: int = DEFAULT_WINDOW
+
+    @classmethod
+    def from_args(cls, args, start=None, end=None):
+        """
+        由 request.args 建立選項。
+        max_points 搭配查詢時間範圍換算為 bucket_seconds（每艘船約 max_points 點）。
+        """
+        mode = args.get("simplify", "dp")
+        if mode not in ("dp", "bucket"):
+            raise ValueError("simplify 必須是 dp 或 bucket")
+        opts = cls(mode=mode)
+        for name in ("tolerance_m", "bucket_seconds", "turn_deg", "stop_speed"):
+            value = args.get(name)
+            if value not in (None, ""):
+                try:
+                    setattr(opts, name, float(value))
+                except ValueError:
+                    raise ValueError(f"{name} 必須是數字")
+        max_points = args.get("max_points")
+        if max_points not in (None, ""):
+            try:
+                max_points = int(max_points)
+            except ValueError:
+                raise ValueError("max_points 必須是整數")
+            if max_points <= 0 or start is None or end is None:
+                raise ValueError("max_points 需為正整數，且需同時指定 start 與 end")
+            opts.mode = "bucket"
+            opts.bucket_seconds = max((end - start) / max_points, 1.0)
+        if opts.tolerance_m <= 0 or opts.bucket_seconds <= 0:
+            raise ValueError("tolerance_m 與 bucket_seconds 必須大於 0")
+        return opts
+
+
+@dataclass
+class ReduceStats:
+    input: int = 0
+    output: int = 0
+
+    def summary(self):
+        ratio = (self.input / self.output) if self.output else None
+        return {"input": self.input, "output": self.output, "ratio": ratio}
+
+
+@dataclass
+class _VesselState:
+    window: list = field(default_factory=list)
+    last_row: dict = None
+    last_emitted: dict = None
+    last_bucket: int = None
+
+
+# --------------------- 幾何 ---------------------
+def _course_diff(a, b):
+    d = abs((a - b) % 360)
+    return 360 - d if d > 180 else d
+
+
+def _perpendicular_m(p, a, b):
+    """點 p 到線段 a-b 的距離（公尺，局部等距圓柱投影）"""
+    k = math.cos(math.radians(a["lat"]))
+    ax, ay = 0.0, 0.0
+    bx, by = (b["lon"] - a["lon"]) * k * METERS_PER_DEG, (b["lat"] - a["lat"]) * METERS_PER_DEG
+    px, py = (p["lon"] - a["lon"]) * k * METERS_PER_DEG, (p["lat"] - a["lat"]) * METERS_PER_DEG
+    dx, dy = bx - ax, by - ay
+    seg2 = dx * dx + dy * dy
+    if seg2 == 0:
+        return math.hypot(px, py)
+    t = max(0.0, min(1.0, (px * dx + py * dy) / seg2))
+    return math.hypot(px - t * dx, py - t * dy)
+
+
+def douglas_peucker(points, tolerance_m):
+    """回傳需保留的索引（已排序，包含首尾），以堆疊實作避免遞迴深度問題"""
+    n = len(points)
+    if n <= 2:
+        return list(range(n))
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        max_d, idx = 0.0, None
+        for k in range(i + 1, j):
+            d = _perpendicular_m(points[k], points[i], points[j])
+            if d > max_d:
+                max_d, idx = d, k
+        if idx is not None and max_d > tolerance_m:
+            keep[idx] = True
+            stack.append((i, idx))
+            stack.append((idx, j))
+    return [i for i in range(n) if keep[i]]
+
+
+# --------------------- 串流精簡 ---------------------
+def _is_key_point(row, prev, anchor, opts):
+    """轉向點或停船/起航點"""
+    if prev is None:
+        return True
+    course, anchor_course = row.get("course"), anchor.get("course") if anchor else None
+    if course is not None and anchor_course is not None and _course_diff(course, anchor_course) > opts.turn_deg:
+        return True
+    speed, prev_speed = row.get("speed"), prev.get("speed")
+    if speed is not None and prev_speed is not None:
+        if (speed < opts.stop_speed) != (prev_speed < opts.stop_speed):
+            return True
+    return False
+
+
+def _flush_window(state, opts):
+    """對視窗執行 DP，輸出除了首點（已輸出）以外被保留的點，最後一點成為新錨點"""
+    window = state.window
+    if len(window) < 2:
+        return []
+    kept = [window[i] for i in douglas_peucker(window, opts.tolerance_m)[1:]]
+    state.window = [window[-1]]
+    return kept
+
+
+def reduce_tracks(rows, opts, stats=None):
+    """
+    串流精簡航跡（generator）。輸出仍為資料列，但各船之間不保證全域時間順序。
+    """
+    stats = stats if stats is not None else ReduceStats()
+    states = {}
+
+    for row in rows:
+        stats.input += 1
+        if row.get("lat") is None or row.get("lon") is None:
+            continue
+        st = states.setdefault(row.get("mmsi") or row.get("shipname"), _VesselState())
+        anchor = st.window[0] if st.window else st.last_emitted
+        key_point = _is_key_point(row, st.last_row, anchor, opts)
+        st.last_row = row
+
+        if opts.mode == "bucket":
+            bucket = int(row["ts"] // opts.bucket_seconds)
+            if key_point or bucket != st.last_bucket:
+                st.last_bucket = bucket
+                st.last_emitted = row
+                stats.output += 1
+                yield row
+            continue
+
+        if not st.window:
+            st.window = [row]
+            st.last_emitted = row
+            stats.output += 1
+            yield row
+            continue
+
+        st.window.append(row)
+        if key_point or len(st.window) >= opts.window:
+            for kept in _flush_window(st, opts):
+                st.last_emitted = kept
+                stats.output += 1
+                yield kept
+
+    # 收尾：輸出 DP 視窗剩餘點，bucket 模式補上每艘船的最後一點
+    for st in states.values():
+        if opts.mode == "bucket":
+            if st.last_row is not None and st.last_row is not st.last_emitted:
+                stats.output += 1
+                yield st.last_row
+        else:
+            for kept in _flush_window(st, opts):
+                stats.output += 1
+                yield kept
+
+
+def to_linestrings(rows, max_points=None):
+    """
+    將（精簡後的）資料列組成每艘船一條 LineString Feature。
+    只暫存精簡後的座標；單點航跡以 Point 輸出。
+    暫存點數超過 max_points 時丟出 ValueError。
+    """
+    tracks = {}
+    for count, row in enumerate(rows, 1):
+        if max_points is not None and count > max_points:
+            raise ValueError(f"航跡點數超過 {max_points}，請加大 tolerance_m / bucket_seconds 或縮小查詢範圍")
+        key = row.get("mmsi") or row.get("shipname")
+        track = tracks.get(key)
+        if track is None:
+            track = tracks[key] = {"row": row, "coordinates": [], "times": []}
+        track["coordinates"].append([row["lon"], row["lat"]])
+        track["times"].append(format_time(row["ts"]))
+
+    for track in tracks.values():
+        row = track["row"]
+        coords = track["coordinates"]
+        geometry = (
+            {"type": "LineString", "coordinates": coords}
+            if len(coords) > 1 else
+            {"type": "Point", "coordinates": coords[0]}
+        )
+        yield {
+            "type": "Feature",
+            "geometry": geometry,
+            "properties": {
+                "mmsi": row.get("mmsi"),
+                "shipname": row.get("shipname"),
+                "shiptype": row.get("shiptype"),
+                "feature_type": "track",
+                "point_count": len(coords),
+                "start": track["times"][0],
+                "end": track["times"][-1],
+                "times": track["times"],
+            },
+        }
@@ -0,0 +1,189 @@
+# services/vessel_tiles.py
+"""
+船位圖磚（z/x/y，Web Mercator XYZ 切法）。
+
+由最新船位表計算：低縮放層級回傳聚合後的 cluster（格網內船數與重心），
+高縮放層級（或圖磚內船數不多時）回傳個別船舶。
+圖磚依最新船位表的 version 快取，船位更新後自動失效。
+"""
+import math
+import struct
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from models.vessel_store import latest_store
+
+# 此層級（含）以上回傳個別船舶
+VESSEL_MIN_ZOOM = 9
+# 低層級時，圖磚內船數不超過此值也直接回傳個別船舶
+MAX_VESSELS_PER_CLUSTER_TILE = 50
+# 聚合格網：每張圖磚切成 GRID × GRID 格
+CLUSTER_GRID = 32
+MAX_ZOOM = 22
+TILE_CACHE_SIZE = 2048
+
+TILE_MAGIC = b"AIST"
+KIND_CLUSTERS = 0
+KIND_VESSELS = 1
+
+
+class TileEncodingError(Exception):
+    """圖磚內容無法以二進位格式表示（例如欄位值超出型別範圍）"""
+
+
+def tile_bounds(z, x, y):
+    """回傳圖磚經緯度範圍 (min_lon, min_lat, max_lon, max_lat)"""
+    n = 2 ** z
+    min_lon = x / n * 360.0 - 180.0
+    max_lon = (x + 1) / n * 360.0 - 180.0
+    max_lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    min_lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def _mercator_y(lat, z):
+    """緯度 → 該層級的圖磚 y 座標（浮點數，向量化）"""
+    lat_rad = np.radians(np.clip(lat, -85.0511, 85.0511))
+    return (1.0 - np.log(np.tan(lat_rad) + 1.0 / np.cos(lat_rad)) / math.pi) / 2.0 * (2 ** z)
+
+
+class _Snapshot:
+    """某個 version 的船位陣列（同一 version 只建立一次）"""
+
+    def __init__(self, version, rows):
+        self.version = version
+        self.rows = rows
+        self.lat = np.array([r["lat"] for r in rows], dtype=np.float64)
+        self.lon = np.array([r["lon"] for r in rows], dtype=np.float64)
+
+
+class VesselTileService:
+    def __init__(self, store=latest_store, cache_size=TILE_CACHE_SIZE):
+        self.store = store
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _current_snapshot(self):
+        version = self.store.version
+        with self._lock:
+            snap = self._snapshot
+            if snap is not None and snap.version == version:
+                return snap
+        snap = _Snapshot(version, self.store.snapshot())
+        with self._lock:
+            self._snapshot = snap
+            # version 改變：舊圖磚全部失效
+            self._cache.clear()
+        return snap
+
+    def get_tile(self, z, x, y, fmt="json"):
+        """回傳 (payload, version)；payload 為 dict（json）或 bytes（bin）"""
+        if not (0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            raise ValueError("圖磚座標超出範圍")
+        snap = self._current_snapshot()
+        key = (z, x, y, fmt)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] == snap.version:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached[1], snap.version
+            self.misses += 1
+
+        tile = self._build(snap, z, x, y)
+        if fmt == "bin":
+            try:
+                payload = encode_tile_binary(tile)
+            except (struct.error, OverflowError, ValueError) as e:
+                raise TileEncodingError(f"圖磚 {z}/{x}/{y} 無法編碼為二進位格式: {e}") from e
+        else:
+            payload = tile
+        with self._lock:
+            self._cache[key] = (snap.version, payload)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return payload, snap.version
+
+    def _build(self, snap, z, x, y):
+        min_lon, min_lat, max_lon, max_lat = tile_bounds(z, x, y)
+        mask = (snap.lon >= min_lon) & (snap.lon < max_lon) & (snap.lat > min_lat) & (snap.lat <= max_lat)
+        idx = np.nonzero(mask)[0]
+        tile = {"z": z, "x": x, "y": y, "version": snap.version, "count": int(len(idx))}
+
+        if z >= VESSEL_MIN_ZOOM or len(idx) <= MAX_VESSELS_PER_CLUSTER_TILE:
+            tile["kind"] = "vessels"
+            tile["vessels"] = [
+                {
+                    "mmsi": snap.rows[i].get("mmsi"),
+                    "shipname": snap.rows[i].get("shipname"),
+                    "lat": snap.rows[i]["lat"],
+                    "lon": snap.rows[i]["lon"],
+                    "course": snap.rows[i].get("course"),
+                    "speed": snap.rows[i].get("speed"),
+                    "shiptype": snap.rows[i].get("shiptype"),
+                }
+                for i in idx.tolist()
+            ]
+            return tile
+
+        # 聚合：以圖磚內的像素格網分組，計算每格船數與重心
+        lat, lon = snap.lat[idx], snap.lon[idx]
+        n = 2 ** z
+        gx = np.clip(((lon + 180.0) / 360.0 * n - x) * CLUSTER_GRID, 0, CLUSTER_GRID - 1).astype(np.int32)
+        gy = np.clip((_mercator_y(lat, z) - y) * CLUSTER_GRID, 0, CLUSTER_GRID - 1).astype(np.int32)
+        cell = gy * CLUSTER_GRID + gx
+        cells, inverse, counts = np.unique(cell, return_inverse=True, return_counts=True)
+        sum_lat = np.bincount(inverse, weights=lat, minlength=len(cells))
+        sum_lon = np.bincount(inverse, weights=lon, minlength=len(cells))
+        tile["kind"] = "clusters"
+        tile["clusters"] = [
+            {"lat": la, "lon": lo, "count": c}
+            for la, lo, c in zip((sum_lat / counts).tolist(), (sum_lon / counts).tolist(), counts.tolist())
+        ]
+        return tile
+
+    def stats(self):
+        with self._lock:
+            return {"cached_tiles": len(self._cache), "hits": self.hits, "misses": self.misses,
+                    "version": self._snapshot.version if self._snapshot else None}
+
+
+def encode_tile_binary(tile):
+    """
+    圖磚二進位格式（little-endian）：
+      magic 'AIST' | u8 kind | u8 z | u16 保留 | u32 x | u32 y | u64 version | u32 count
+      （version 為船位表版本；共享記憶體模式下以毫秒時間戳起算，超出 32 位元）
+      clusters：f32 lat[n] | f32 lon[n] | u32 count[n]
+      vessels ：u32 mmsi[n] | f32 lat[n] | f32 lon[n] | f32 course[n] | f32 speed[n] | u8 shiptype[n]
+                | u32 名稱位元組數 | UTF-8 船名（以 '\\n' 分隔）
+    缺值以 NaN 表示。
+    """
+    kind = KIND_CLUSTERS if tile["kind"] == "clusters" else KIND_VESSELS
+    items = tile["clusters"] if kind == KIND_CLUSTERS else tile["vessels"]
+    parts = [TILE_MAGIC, struct.pack("<BBHIIQI", kind, tile["z"], 0, tile["x"], tile["y"], tile["version"], len(items))]
+
+    def _f32(key):
+        return np.array([np.nan if it.get(key) is None else it[key] for it in items], dtype="<f4").tobytes()
+
+    if kind == KIND_CLUSTERS:
+        parts += [_f32("lat"), _f32("lon"), np.array([it["count"] for it in items], dtype="<u4").tobytes()]
+    else:
+        shiptypes = [str(it.get("shiptype") or "0") for it in items]
+        names = "\n".join((it.get("shipname") or "").replace("\n", " ") for it in items).encode("utf-8")
+        parts += [
+            np.array([it.get("mmsi") or 0 for it in items], dtype="<u4").tobytes(),
+            _f32("lat"), _f32("lon"), _f32("course"), _f32("speed"),
+            np.array([int(s) if s.isdigit() else 0 for s in shiptypes], dtype="u1").tobytes(),
+            struct.pack("<I", len(names)), names,
+        ]
+    return b"".join(parts)
+
+
+vessel_tiles = VesselTileService()
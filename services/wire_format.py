@@ -0,0 +1,145 @@
+# services/wire_format.py
+"""
+船位清單的二進位傳輸格式（欄式，取代逐筆重複欄位名稱的 JSON）。
+
+MIME：application/x-aicop-vessels，所有數值為 little-endian，區段皆對齊 4 bytes：
+
+    header（24 bytes）
+      magic 'AISV' | u16 version | u16 flags | u32 count | u32 name_count | u32 names_bytes | u32 保留
+    f64 ts[count]            epoch 秒（缺值 NaN）
+    u32 mmsi[count]
+    f32 lat[count] | f32 lon[count] | f32 course[count] | f32 speed[count]   （缺值 NaN）
+    u32 name_index[count]    指向船名字串表
+    u8  shiptype[count]      （補齊到 4 bytes）
+    UTF-8 船名字串表，以 '\\n' 分隔，共 name_count 筆
+
+序列化時直接從欄位取值組成 NumPy 陣列，不會為每筆資料建立中介 dict。
+瀏覽器端以 static/utils.js 的 decodeVesselBinary() 用 TypedArray 直接讀取。
+
+    python -m services.wire_format bench
+"""
+import sys
+import json
+import time
+import struct
+
+import numpy as np
+
+MIME_TYPE = "application/x-aicop-vessels"
+MAGIC = b"AISV"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIIII")
+
+
+def _float_column(rows, key):
+    return np.array([np.nan if r.get(key) is None else r[key] for r in rows], dtype="<f4")
+
+
+def _shiptype_code(value):
+    text = str(value or "0")
+    return int(text) if text.isdigit() else 0
+
+
+def encode_columns(ts, mmsi, lat, lon, course, speed, shiptype, names):
+    """由欄位陣列編碼；names 為每筆的船名（list/ndarray of str）"""
+    count = len(ts)
+    lookup = {}
+    name_index = np.fromiter((lookup.setdefault(n, len(lookup)) for n in names), dtype="<u4", count=count)
+    table = list(lookup)
+    names_blob = "\n".join(n.replace("\n", " ") for n in table).encode("utf-8")
+    shiptype = np.asarray(shiptype, dtype="u1")
+    pad = (-count) % 4
+
+    return b"".join([
+        HEADER.pack(MAGIC, VERSION, 0, count, len(table), len(names_blob), 0),
+        np.asarray(ts, dtype="<f8").tobytes(),
+        np.asarray(mmsi, dtype="<u4").tobytes(),
+        np.asarray(lat, dtype="<f4").tobytes(),
+        np.asarray(lon, dtype="<f4").tobytes(),
+        np.asarray(course, dtype="<f4").tobytes(),
+        np.asarray(speed, dtype="<f4").tobytes(),
+        name_index.tobytes(),
+        shiptype.tobytes(), b"\0" * pad,
+        names_blob,
+    ])
+
+
+def encode_rows(rows):
+    """由船位資料列（最新船位表 / 歷史航跡格式）編碼"""
+    return encode_columns(
+        ts=np.array([r["ts"] for r in rows], dtype="<f8"),
+        mmsi=np.array([r.get("mmsi") or 0 for r in rows], dtype="<u4"),
+        lat=_float_column(rows, "lat"),
+        lon=_float_column(rows, "lon"),
+        course=_float_column(rows, "course"),
+        speed=_float_column(rows, "speed"),
+        shiptype=np.array([_shiptype_code(r.get("shiptype")) for r in rows], dtype="u1"),
+        names=[r.get("shipname") or "" for r in rows],
+    )
+
+
+def decode(payload):
+    """解碼為欄位 dict（主要供測試與基準測試驗證）"""
+    magic, version, _, count, name_count, names_bytes, _ = HEADER.unpack_from(payload, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("不是 AISV 格式")
+    pos = HEADER.size
+    out = {}
+    for name, dtype in (("ts", "<f8"), ("mmsi", "<u4"), ("lat", "<f4"), ("lon", "<f4"),
+                        ("course", "<f4"), ("speed", "<f4"), ("name_index", "<u4"), ("shiptype", "u1")):
+        arr = np.frombuffer(payload, dtype=dtype, count=count, offset=pos)
+        out[name] = arr
+        pos += arr.nbytes
+    pos += (-count) % 4
+    table = payload[pos:pos + names_bytes].decode("utf-8").split("\n") if name_count else []
+    out["shipname"] = [table[i] for i in out.pop("name_index")]
+    return out
+
+
+def wants_binary(req):
+    """內容協商：Accept 中 MIME_TYPE 優先於 JSON 時回傳 True"""
+    return req.accept_mimetypes.best_match(["application/json", MIME_TYPE]) == MIME_TYPE
+
+
+# --------------------- 基準測試 ---------------------
+def benchmark(sizes=(1_000, 10_000, 100_000), repeat=3):
+    from models.track_store import to_public_row
+
+    rng = np.random.default_rng(0)
+    report = []
+    for n in sizes:
+        rows = [
+            {"ts": 1735689600.0 + i, "mmsi": 412000000 + i, "shipname": f"MIN YANG {i % 3000}",
+             "lat": float(20 + rng.random() * 10), "lon": float(115 + rng.random() * 10),
+             "speed": float(rng.random() * 20), "course": float(rng.random() * 360),
+             "heading": None, "shiptype": "7", "destination": "ZHOUSHAN"}
+            for i in range(n)
+        ]
+
+        def _time(fn):
+            best = None
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                out = fn()
+                elapsed = time.perf_counter() - t0
+                best = elapsed if best is None else min(best, elapsed)
+            return best, out
+
+        json_s, json_body = _time(lambda: json.dumps(
+            {"count": n, "data": [to_public_row(r) for r in rows]}, ensure_ascii=False).encode("utf-8"))
+        bin_s, bin_body = _time(lambda: encode_rows(rows))
+        report.append({
+            "vessels": n,
+            "json_bytes": len(json_body), "json_ms": round(json_s * 1000, 2),
+            "binary_bytes": len(bin_body), "binary_ms": round(bin_s * 1000, 2),
+            "size_ratio": round(len(json_body) / len(bin_body), 1),
+        })
+    return report
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["bench"]:
+        print("用法: python -m services.wire_format bench")
+        sys.exit(1)
+    for line in benchmark():
+        print(json.dumps(line))
@@ -1,5 +1,5 @@
 import { viewer } from "../viewer/viewer.js";
-import { loadCSS, loadHTML, makePanelDraggable } from "../../utils.js";
+import { loadCSS, loadHTML, makePanelDraggable, decodeVesselBinary, VESSEL_BINARY_MIME } from "../../utils.js";
 
 // 載入 CSS
 loadCSS('components/ais/ais.css');
@@ -26,7 +26,8 @@ loadHTML(`
             <label>開始時間: <br><input type="datetime-local" id="start" style="width: 205px;"></label><br>
             <label>結束時間: <br><input type="datetime-local" id="end" style="width: 205px;"></label><br>
             <label><input type="checkbox" id="toggleCN" checked> 顯示 CN 船</label><br>
-            <label><input type="checkbox" id="toggleCCG" checked> 顯示 CCG 海警船</label><br><br>
+            <label><input type="checkbox" id="toggleCCG" checked> 顯示 CCG 海警船</label><br>
+            <label><input type="checkbox" id="toggleSimplify" checked> 精簡航跡（保留轉向/停船點）</label><br><br>
 
             <button id="loadAisBtn">查詢</button>
         </div>
@@ -88,6 +89,83 @@ function getArrowPolyline(longitude, latitude, heading, length, color) {
 }
 
 
+// 畫出一筆歷史查詢結果（箭頭）
+function drawHistoryShip(ship) {
+    // ⭐ 勾勾控制 — 如果沒勾 CN，就不顯示
+    if (!toggleCN.checked) return;
+
+    // === 🧩 防呆：跳過無效資料 ===
+    if (
+        ship.lat === null || ship.lon === null ||
+        isNaN(ship.lat) || isNaN(ship.lon) ||
+        ship.lat === undefined || ship.lon === undefined
+    ) {
+        console.warn(`❌ 無效座標: ${ship.shipname}`, ship);
+        return;
+    }
+
+    const course = parseFloat(ship.course);
+    if (isNaN(course)) {
+        console.warn(`⚠️ 無效航向: ${ship.shipname}`, ship.course);
+        return;
+    }
+
+    // === 顏色依船種 ===
+    let color;
+    switch (ship.shiptype) {
+        case '2': color = Cesium.Color.BLUE.withAlpha(0.7); break;
+        case '3':
+        case '7':
+        case '8': color = Cesium.Color.GRAY.withAlpha(0.7); break;
+        case '6': color = Cesium.Color.YELLOW.withAlpha(0.7); break;
+        case '1':
+        case '9': color = Cesium.Color.PINK.withAlpha(0.7); break;
+        default: color = Cesium.Color.CYAN.withAlpha(0.7); break;
+    }
+
+    // === 避免 speed 為 null 導致 NaN ===
+    const speed = parseFloat(ship.speed) || 0;
+    const arrowLength = 10 + speed * 100;
+
+    const position = Cesium.Cartesian3.fromDegrees(ship.lon, ship.lat);
+
+    viewer.entities.add({
+        name: ship.shipname,
+        position: position,
+        polyline: getArrowPolyline(ship.lon, ship.lat, course, arrowLength, color),
+        description: `
+            <table>
+                <tr><td>船名:</td><td>${ship.shipname}</td></tr>
+                <tr><td>速度:</td><td>${speed} 節</td></tr>
+                <tr><td>航向:</td><td>${course}°</td></tr>
+                <tr><td>目的地:</td><td>${ship.destination || "未知"}</td></tr>
+                <tr><td>最後更新:</td><td>${new Date(ship.timestamp).toISOString()}</td></tr>
+            </table>
+
+            <br>
+
+            <b>🔗 相關連結</b><br>
+            🌐 <a href="https://www.google.com/maps?q=${ship.lat},${ship.lon}&z=10" target="_blank" style="color:#4aa3ff;">
+                Google Maps
+            </a><br>
+
+            🚢 <a href="https://www.marinetraffic.com/en/ais/home/centerx:${ship.lon}/centery:${ship.lat}/zoom:12"
+                target="_blank" style="color:#4aa3ff;">
+                MarineTraffic（查看此船）
+            </a>
+        `
+
+        // // ✅ 儲存原始資料，用於鏡頭縮放時重繪箭頭
+        // properties: {
+        //     lon: ship.lon,
+        //     lat: ship.lat,
+        //     course: ship.course,
+        //     baseLength: 10 + speed * 100
+        //}
+    });
+}
+
+
 // ======== AIS 查詢功能 ========
 loadAisBtn.addEventListener('click', async () => {
     try {
@@ -114,101 +192,58 @@ loadAisBtn.addEventListener('click', async () => {
             queryParams.set('max_lon', maxLon);
         }
 
+        // ⭐ 由後端精簡航跡，避免每筆回報都畫一個箭頭
+        if (document.getElementById('toggleSimplify').checked) {
+            queryParams.set('simplify', 'dp');
+            queryParams.set('tolerance_m', '100');
+        }
+        queryParams.set('format', 'ndjson');
+
         const url = `http://127.0.0.1:5000/api/chinaboat/all?${queryParams.toString()}`;
         console.log(`🚀 查詢 URL: ${url}`);
 
         const response = await fetch(url);
-        const data = await response.json();
 
         // 🚫 不再清空所有實體，只移除非海警船的實體
         viewer.entities.values
         .filter(e => !ccgEntities.includes(e) && !cnEntities.includes(e))
         .forEach(e => viewer.entities.remove(e));
 
-
-
-        // 若後端有回傳 count/data 結構
-        const ships = data.data || data;
-        console.log(`✅ 共 ${ships.length} 筆結果`);
-
-        ships.forEach(ship => {
-
-            // ⭐ 勾勾控制 — 如果沒勾 CN，就不顯示
-            if (!toggleCN.checked) return;
-
-            // === 🧩 防呆：跳過無效資料 ===
-            if (
-                ship.lat === null || ship.lon === null ||
-                isNaN(ship.lat) || isNaN(ship.lon) ||
-                ship.lat === undefined || ship.lon === undefined
-            ) {
-                console.warn(`❌ 無效座標: ${ship.shipname}`, ship);
-                return;
+        let count = 0;
+        const contentType = response.headers.get('Content-Type') || '';
+        if (contentType.includes('application/x-ndjson') && response.body) {
+            // ⭐ NDJSON 串流：邊收邊畫，不必等整份結果下載完
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+                const lines = buffer.split('\n');
+                buffer = lines.pop();
+                lines.forEach(line => {
+                    if (!line.trim()) return;
+                    drawHistoryShip(JSON.parse(line));
+                    count++;
+                });
+                if (done) break;
             }
-
-            const course = parseFloat(ship.course);
-            if (isNaN(course)) {
-                console.warn(`⚠️ 無效航向: ${ship.shipname}`, ship.course);
-                return;
-            }
-
-            // === 顏色依船種 ===
-            let color;
-            switch (ship.shiptype) {
-                case '2': color = Cesium.Color.BLUE.withAlpha(0.7); break;
-                case '3':
-                case '7':
-                case '8': color = Cesium.Color.GRAY.withAlpha(0.7); break;
-                case '6': color = Cesium.Color.YELLOW.withAlpha(0.7); break;
-                case '1':
-                case '9': color = Cesium.Color.PINK.withAlpha(0.7); break;
-                default: color = Cesium.Color.CYAN.withAlpha(0.7); break;
+            if (buffer.trim()) {
+                drawHistoryShip(JSON.parse(buffer));
+                count++;
             }
-
-            // === 避免 speed 為 null 導致 NaN ===
-            const speed = parseFloat(ship.speed) || 0;
-            const arrowLength = 10 + speed * 100;
-
-            const position = Cesium.Cartesian3.fromDegrees(ship.lon, ship.lat);
-
-            viewer.entities.add({
-                name: ship.shipname,
-                position: position,
-                polyline: getArrowPolyline(ship.lon, ship.lat, course, arrowLength, color),
-                description: `
-                    <table>
-                        <tr><td>船名:</td><td>${ship.shipname}</td></tr>
-                        <tr><td>速度:</td><td>${speed} 節</td></tr>
-                        <tr><td>航向:</td><td>${course}°</td></tr>
-                        <tr><td>目的地:</td><td>${ship.destination || "未知"}</td></tr>
-                        <tr><td>最後更新:</td><td>${new Date(ship.timestamp).toISOString()}</td></tr>
-                    </table>
-
-                    <br>
-
-                    <b>🔗 相關連結</b><br>
-                    🌐 <a href="https://www.google.com/maps?q=${ship.lat},${ship.lon}&z=10" target="_blank" style="color:#4aa3ff;">
-                        Google Maps
-                    </a><br>
-
-                    🚢 <a href="https://www.marinetraffic.com/en/ais/home/centerx:${ship.lon}/centery:${ship.lat}/zoom:12"
-                        target="_blank" style="color:#4aa3ff;">
-                        MarineTraffic（查看此船）
-                    </a>
-                `
-
-                // // ✅ 儲存原始資料，用於鏡頭縮放時重繪箭頭
-                // properties: {
-                //     lon: ship.lon,
-                //     lat: ship.lat,
-                //     course: ship.course,
-                //     baseLength: 10 + speed * 100
-                //}
-            });
-        });
+            console.log(`📉 剔除 segment: ${response.headers.get('X-Segments-Pruned')}/${response.headers.get('X-Segments-Total')}`);
+        } else {
+            const data = await response.json();
+            // 若後端有回傳 count/data 結構
+            const ships = data.data || data;
+            ships.forEach(drawHistoryShip);
+            count = ships.length;
+        }
+        console.log(`✅ 共 ${count} 筆結果`);
 
         // 若查無資料，提示使用者
-        if (ships.length === 0) {
+        if (count === 0) {
             alert("查無結果，請調整查詢條件或範圍！");
         }
 
@@ -237,6 +272,32 @@ let ccgEntities = [];
 // ★ 建立一個專門存 CN 最新位置的陣列
 let cnEntities = [];   // ★
 
+// 批次取得「最近地標 + 方位 + 海浬」描述（例如「基隆港東北方 12 海浬」），一次請求處理整批船
+// 回傳與 ships 同順序的文字陣列；失敗時回傳空陣列（只是少顯示描述）
+const LANDMARK_DESCRIBE_API = "http://127.0.0.1:5000/api/landmarks/describe";
+async function describeByLandmark(lats, lons) {
+    if (!lats.length) return [];
+    try {
+        const resp = await fetch(LANDMARK_DESCRIBE_API, {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({ lat: Array.from(lats), lon: Array.from(lons) })
+        });
+        if (!resp.ok) return [];
+        return (await resp.json()).labels || [];
+    } catch (error) {
+        console.error("❌ 取得地標描述失敗:", error);
+        return [];
+    }
+}
+
+// CCG 船（需有經緯度）的地標描述，依 ship 物件對應
+async function landmarkLabelsFor(boats) {
+    const valid = boats.filter(ship => ship.lat && ship.lon);
+    const labels = await describeByLandmark(valid.map(s => s.lat), valid.map(s => s.lon));
+    return new Map(valid.map((ship, i) => [ship, labels[i]]));
+}
+
 // 載入海警船資料（12nm 紅色半透明、12–24nm 黃色半透明，旁邊顯示船名）
 async function loadCCGShips() {
     try {
@@ -255,6 +316,8 @@ async function loadCCGShips() {
 
         console.log(`📡 12nm內: ${data12.boats.length} 艘, 12–24nm: ${data24.boats.length} 艘`);
 
+        const landmarkLabels = await landmarkLabelsFor([...data12.boats, ...data24.boats]);
+
         // 顯示時間差格式
         function formatTimeDiff(timestamp) {
             if (!timestamp) return "未知";
@@ -320,6 +383,7 @@ async function loadCCGShips() {
                 description: `
                     <b>${ship.shipname}</b><br>
                     經緯度: ${ship.lat.toFixed(5)}, ${ship.lon.toFixed(5)}<br>
+                    位置: ${landmarkLabels.get(ship) || "—"}<br>
                     狀態: <span style="color:red;font-weight:bold;">12海浬內</span><br>
                     最後更新: ${formatTimeDiff(ship.timestamp)}<br>
                     原始時間: ${ship.timestamp}
@@ -358,6 +422,7 @@ async function loadCCGShips() {
                 description: `
                     <b>${ship.shipname}</b><br>
                     經緯度: ${ship.lat.toFixed(5)}, ${ship.lon.toFixed(5)}<br>
+                    位置: ${landmarkLabels.get(ship) || "—"}<br>
                     狀態: <span style="color:orange;font-weight:bold;">12–24海浬</span><br>
                     最後更新: ${formatTimeDiff(ship.timestamp)}<br>
                     原始時間: ${ship.timestamp}
@@ -380,56 +445,85 @@ async function loadCCGShips() {
 // ================================
 // CN 最新位置（改成箭頭版）
 // ================================
+// 畫出一艘 CN 船最新位置（箭頭），回傳 entity
+function drawLatestShip(ship) {
+    if (!ship.lat || !ship.lon) return null;
+
+    // 船種顏色維持原樣
+    let color;
+    switch (ship.shiptype) {
+        case '2': color = Cesium.Color.BLUE.withAlpha(0.7); break;
+        case '3':
+        case '7':
+        case '8': color = Cesium.Color.GRAY.withAlpha(0.7); break;
+        case '6': color = Cesium.Color.YELLOW.withAlpha(0.7); break;
+        case '1':
+        case '9': color = Cesium.Color.PINK.withAlpha(0.7); break;
+        default: color = Cesium.Color.CYAN.withAlpha(0.7); break;
+    }
+
+    // 箭頭長度依速度
+    const speed = parseFloat(ship.speed) || 0;
+    const course = parseFloat(ship.course) || 0;
+    const arrowLength = 10 + speed * 100;
+
+    return viewer.entities.add({
+        name: ship.shipname || "Unknown",
+        position: Cesium.Cartesian3.fromDegrees(ship.lon, ship.lat),
+        polyline: getArrowPolyline(ship.lon, ship.lat, course, arrowLength, color),
+        description: `
+            <table>
+            <tr><td>船名:</td><td>${ship.shipname || "未知"}</td></tr>
+            <tr><td>位置:</td><td>${ship.landmark_label || "—"}</td></tr>
+            <tr><td>速度:</td><td>${ship.speed ?? "—"} 節</td></tr>
+            <tr><td>航向:</td><td>${ship.course ?? "—"}°</td></tr>
+            <tr><td>最後更新:</td><td>${ship.timestamp || "未知"}</td></tr>
+            </table>
+            
+        `
+    });
+}
+
 async function loadLatestShips() {
     try {
         // ★ 每次先把舊的 CN entity 清掉
         cnEntities.forEach(e => viewer.entities.remove(e));  // ★
         cnEntities = [];                                     // ★
 
-        const resp = await fetch("http://127.0.0.1:5000/api/chinaboat/latest");
-        const data = await resp.json();
-        const boats = data.data || [];
-
-        console.log(`🛰️ CN 最新船舶資料（箭頭版）: ${boats.length} 筆`);
-
-        boats.forEach(ship => {
-            if (!ship.lat || !ship.lon) return;
+        // ⭐ 優先要求欄式二進位格式，後端不支援時仍回傳 JSON
+        const resp = await fetch("http://127.0.0.1:5000/api/chinaboat/latest?landmarks=1", {
+            headers: { Accept: `${VESSEL_BINARY_MIME}, application/json;q=0.9` }
+        });
 
-            // 船種顏色維持原樣
-            let color;
-            switch (ship.shiptype) {
-                case '2': color = Cesium.Color.BLUE.withAlpha(0.7); break;
-                case '3':
-                case '7':
-                case '8': color = Cesium.Color.GRAY.withAlpha(0.7); break;
-                case '6': color = Cesium.Color.YELLOW.withAlpha(0.7); break;
-                case '1':
-                case '9': color = Cesium.Color.PINK.withAlpha(0.7); break;
-                default: color = Cesium.Color.CYAN.withAlpha(0.7); break;
+        if ((resp.headers.get("Content-Type") || "").includes(VESSEL_BINARY_MIME)) {
+            const v = decodeVesselBinary(await resp.arrayBuffer());
+            console.log(`🛰️ CN 最新船舶資料（二進位）: ${v.count} 筆`);
+            // 二進位格式不含文字描述，另以一次批次請求取得
+            const landmarkLabels = await describeByLandmark(v.lat, v.lon);
+            for (let i = 0; i < v.count; i++) {
+                const entity = drawLatestShip({
+                    shipname: v.shipname(i),
+                    lat: v.lat[i],
+                    lon: v.lon[i],
+                    course: Number.isNaN(v.course[i]) ? null : v.course[i],
+                    speed: Number.isNaN(v.speed[i]) ? null : v.speed[i],
+                    shiptype: String(v.shiptype[i]),
+                    timestamp: Number.isNaN(v.ts[i]) ? null : new Date(v.ts[i] * 1000).toISOString(),
+                    landmark_label: landmarkLabels[i],
+                });
+                if (entity) cnEntities.push(entity);
             }
+        } else {
+            const data = await resp.json();
+            const boats = data.data || [];
 
-            // 箭頭長度依速度
-            const speed = parseFloat(ship.speed) || 0;
-            const course = parseFloat(ship.course) || 0;
-            const arrowLength = 10 + speed * 100;
+            console.log(`🛰️ CN 最新船舶資料（箭頭版）: ${boats.length} 筆`);
 
-            const entity = viewer.entities.add({
-                name: ship.shipname || "Unknown",
-                position: Cesium.Cartesian3.fromDegrees(ship.lon, ship.lat),
-                polyline: getArrowPolyline(ship.lon, ship.lat, course, arrowLength, color),
-                description: `
-                    <table>
-                    <tr><td>船名:</td><td>${ship.shipname || "未知"}</td></tr>
-                    <tr><td>速度:</td><td>${ship.speed ?? "—"} 節</td></tr>
-                    <tr><td>航向:</td><td>${ship.course ?? "—"}°</td></tr>
-                    <tr><td>最後更新:</td><td>${ship.timestamp || "未知"}</td></tr>
-                    </table>
-                    
-                `
+            boats.forEach(ship => {
+                const entity = drawLatestShip(ship);
+                if (entity) cnEntities.push(entity);
             });
-            cnEntities.push(entity);
-
-        });
+        }
 
         console.log("✅ CN 最新船舶（箭頭）顯示完成");
 
@@ -438,9 +532,107 @@ async function loadLatestShips() {
     }
 }
 
+// ================================
+// CN 最新位置（圖磚版）：只抓畫面內的圖磚，低層級顯示聚合數量
+// ================================
+const VESSEL_TILE_API = "http://127.0.0.1:5000/api/tiles/vessels";
+const MAX_VISIBLE_TILES = 64;
+
+function cameraTileZoom() {
+    const height = viewer.camera.positionCartographic.height;
+    // 依相機高度粗估 XYZ 層級
+    return Math.max(0, Math.min(14, Math.round(Math.log2(40075016 / Math.max(height, 1)))));
+}
+
+function visibleTiles(z) {
+    const rect = viewer.camera.computeViewRectangle();
+    if (!rect) return [];
+    const n = 2 ** z;
+    const lonToX = lon => Math.min(n - 1, Math.max(0, Math.floor((lon + 180) / 360 * n)));
+    const latToY = lat => {
+        const r = Cesium.Math.toRadians(Math.max(-85.05, Math.min(85.05, lat)));
+        return Math.min(n - 1, Math.max(0, Math.floor((1 - Math.log(Math.tan(r) + 1 / Math.cos(r)) / Math.PI) / 2 * n)));
+    };
+    let west = Cesium.Math.toDegrees(rect.west);
+    let east = Cesium.Math.toDegrees(rect.east);
+    if (west > east) { west = -180; east = 180; }   // 跨換日線時直接取全部經度
+    const x0 = lonToX(west), x1 = lonToX(east);
+    const y0 = latToY(Cesium.Math.toDegrees(rect.north)), y1 = latToY(Cesium.Math.toDegrees(rect.south));
+
+    const tiles = [];
+    for (let x = x0; x <= x1; x++) {
+        for (let y = y0; y <= y1; y++) {
+            tiles.push([x, y]);
+            if (tiles.length >= MAX_VISIBLE_TILES) return tiles;
+        }
+    }
+    return tiles;
+}
+
+function drawVesselCluster(cluster) {
+    return viewer.entities.add({
+        position: Cesium.Cartesian3.fromDegrees(cluster.lon, cluster.lat),
+        point: {
+            pixelSize: Math.min(30, 8 + Math.log2(cluster.count) * 3),
+            color: Cesium.Color.CYAN.withAlpha(0.6),
+            outlineColor: Cesium.Color.WHITE,
+            outlineWidth: 1,
+        },
+        label: {
+            text: String(cluster.count),
+            font: "12px sans-serif",
+            fillColor: Cesium.Color.WHITE,
+            verticalOrigin: Cesium.VerticalOrigin.CENTER,
+            horizontalOrigin: Cesium.HorizontalOrigin.CENTER,
+            disableDepthTestDistance: Number.POSITIVE_INFINITY,
+        },
+        description: `此區域共 ${cluster.count} 艘船，請放大檢視`,
+    });
+}
+
+async function loadLatestShipTiles() {
+    const z = cameraTileZoom();
+    try {
+        const tiles = await Promise.all(
+            visibleTiles(z).map(([x, y]) =>
+                fetch(`${VESSEL_TILE_API}/${z}/${x}/${y}`).then(r => {
+                    if (!r.ok) throw new Error(`tile ${z}/${x}/${y}: ${r.status}`);
+                    return r.json();
+                })
+            )
+        );
+
+        cnEntities.forEach(e => viewer.entities.remove(e));
+        cnEntities = [];
+
+        let count = 0;
+        tiles.forEach(tile => {
+            count += tile.count;
+            (tile.clusters || []).forEach(c => cnEntities.push(drawVesselCluster(c)));
+            (tile.vessels || []).forEach(ship => {
+                const entity = drawLatestShip(ship);
+                if (entity) cnEntities.push(entity);
+            });
+        });
+        console.log(`🧩 CN 圖磚 z=${z}：${tiles.length} 張、${count} 艘`);
+    } catch (error) {
+        // 後端不支援圖磚時，退回一次載入全部
+        console.warn("⚠️ 圖磚載入失敗，改用完整清單:", error);
+        loadLatestShips();
+    }
+}
+
+// 相機停止移動後重新載入畫面內圖磚
+let tileReloadTimer = null;
+viewer.camera.moveEnd.addEventListener(() => {
+    if (!toggleCN.checked) return;
+    clearTimeout(tileReloadTimer);
+    tileReloadTimer = setTimeout(loadLatestShipTiles, 300);
+});
+
 
 // 一進來載入所有資料
-loadLatestShips();   // 所有船隻（最新一筆）
+loadLatestShipTiles();   // 畫面內船隻（最新一筆）
 loadCCGShips();      // 海警船（12nm 紅色、12–24nm 黃色）
 
 // ======== 畫框查詢 ========
@@ -616,6 +808,8 @@ async function updateCCGPanel() {
         // 🚫 要排除的海警船清單
         const hiddenShips = ["CHINACOASTGUARD14532", "CHINACOASTGUARD14532"];
 
+        const landmarkLabels = await landmarkLabelsFor([...data12.boats, ...data24.boats]);
+
         // 更新 12nm 內列表
         data12.boats.forEach(ship => {
             //const name = (ship.shipname || "").trim().toUpperCase();
@@ -624,6 +818,7 @@ async function updateCCGPanel() {
             const li = document.createElement("li");
             li.innerHTML = `
                 <strong>${ship.shipname || "未知"}</strong><br>
+                ${landmarkLabels.get(ship) || "位置不明"}<br>
                 經緯度: ${ship.lat?.toFixed(3)}, ${ship.lon?.toFixed(3)}<br>
                 更新: ${formatTimeDiff(ship.timestamp)}
             `;
@@ -638,6 +833,7 @@ async function updateCCGPanel() {
             const li = document.createElement("li");
             li.innerHTML = `
                 <strong>${ship.shipname || "未知"}</strong><br>
+                ${landmarkLabels.get(ship) || "位置不明"}<br>
                 經緯度: ${ship.lat?.toFixed(3)}, ${ship.lon?.toFixed(3)}<br>
                 更新: ${formatTimeDiff(ship.timestamp)}
             `;
@@ -661,7 +857,7 @@ toggleCN.addEventListener('change', () => {
         cnEntities.forEach(e => viewer.entities.remove(e));
         cnEntities = [];
     } else {
-        loadLatestShips();
+        loadLatestShipTiles();
     }
 });
 
@@ -686,7 +882,7 @@ setInterval(() => {
     console.log("⏱ 自動刷新 CN / CCG 圖層");
 
     if (toggleCN.checked) {
-        loadLatestShips();
+        loadLatestShipTiles();
     } else {
         cnEntities.forEach(e => viewer.entities.remove(e));
         cnEntities = [];
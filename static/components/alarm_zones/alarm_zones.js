@@ -114,6 +114,7 @@ function updateAlarmBadges() {
         <div class="ship-item">
           🚢 ${s.shipname}<br>
           📍 ${s.lat}, ${s.lon}
+          ${s.entered_at ? `<br>⏱️ ${s.entered_at} 進入（停留 ${formatDwell(s.dwell_s)}）` : ""}
         </div>
       `).join("");
 
@@ -124,6 +125,13 @@ function updateAlarmBadges() {
   });
 }
 
+// 停留秒數 → 「N 小時 M 分」
+function formatDwell(seconds) {
+  const minutes = Math.floor((seconds || 0) / 60);
+  if (minutes < 60) return `${minutes} 分`;
+  return `${Math.floor(minutes / 60)} 小時 ${minutes % 60} 分`;
+}
+
 // -----------------------------------------------------------
 // 🚀 載入資料庫的警戒區（預設不顯示）
 // -----------------------------------------------------------
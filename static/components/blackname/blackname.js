@@ -29,6 +29,11 @@ loadHTML(`
             <input type="text" id="bn-note" placeholder="例如：海警常出沒金門" style="width: 210px;">
           </label><br>
           <button id="bn-addBtn">加入黑名單</button>
+          <div class="btn-row" style="margin-top:6px;">
+            <button id="bn-importBtn">📤 批次匯入（CSV / JSON）</button>
+            <button id="bn-exportBtn">📄 匯出 CSV</button>
+            <input type="file" id="bn-importFile" accept=".csv,.json,.ndjson,.jsonl" style="display:none;">
+          </div>
         </div>
       </div>
 
@@ -65,6 +70,9 @@ const toggleblacknamePanelBtn = document.getElementById("toggleblacknamePanelBtn
 const bnNameInput  = document.getElementById("bn-name");
 const bnNoteInput  = document.getElementById("bn-note");
 const bnAddBtn     = document.getElementById("bn-addBtn");
+const bnImportBtn  = document.getElementById("bn-importBtn");
+const bnExportBtn  = document.getElementById("bn-exportBtn");
+const bnImportFile = document.getElementById("bn-importFile");
 
 const bnList       = document.getElementById("bn-list");
 const bnRefreshPosBtn = document.getElementById("bn-refreshPosBtn");
@@ -86,45 +94,37 @@ toggleblacknamePanelBtn.addEventListener("click", () => {
 //  設定常數 & 狀態
 // =====================
 const BLACKLIST_API = "http://127.0.0.1:5000/api/blacklist_ships";
-const CHINA_LATEST_API = "http://127.0.0.1:5000/api/chinaboat/latest";
+const BLACKLIST_POSITIONS_API = `${BLACKLIST_API}/positions`;
 
 let blacklistItems = [];
-let latestCNShips = [];
+let blacklistPositions = {}; // { 黑名單 id: 最新位置 }
 let latestFetchedTime = 0;
 
 // =====================
-//  抓最新 CN 船
+//  抓黑名單對應的最新位置（後端已依正規化船名比對好）
 // =====================
-async function fetchLatestCNShips(force = false) {
+async function fetchBlacklistPositions(force = false) {
   const now = Date.now();
 
-  if (!force && now - latestFetchedTime < 60 * 1000 && latestCNShips.length > 0) return;
+  if (!force && now - latestFetchedTime < 60 * 1000 && latestFetchedTime > 0) return;
 
   try {
-    const resp = await fetch(CHINA_LATEST_API);
+    const resp = await fetch(BLACKLIST_POSITIONS_API);
     const json = await resp.json();
-    latestCNShips = json.data || [];
+    blacklistPositions = {};
+    (json.items || []).forEach(entry => {
+      if (entry.position) blacklistPositions[entry.id] = entry.position;
+    });
     latestFetchedTime = now;
-    console.log(`🛰 最新 CN 船舶資料: ${latestCNShips.length} 筆`);
+    console.log(`🛰 黑名單船舶位置: ${json.matched || 0} / ${json.count || 0} 筆`);
   } catch (err) {
-    console.error("❌ 取得最新 CN 船資料失敗：", err);
-    alert("無法取得中國籍船舶最新位置，請檢查後端 /chinaboat/latest");
+    console.error("❌ 取得黑名單船舶位置失敗：", err);
+    alert("無法取得黑名單船舶最新位置，請檢查後端 /blacklist_ships/positions");
   }
 }
 
-// =====================
-//  只用「船名」比對
-// =====================
 function findShipForItem(item) {
-  if (!latestCNShips.length) return null;
-
-  const targetName = (item.name || "").trim().toUpperCase();
-  if (!targetName) return null;
-
-  return latestCNShips.find(ship => {
-    const shipName = (ship.shipname || "").trim().toUpperCase();
-    return shipName === targetName;
-  }) || null;
+  return blacklistPositions[item.id] || null;
 }
 
 // =====================
@@ -176,7 +176,7 @@ function removeItemEntity(item) {
 // 更新位置
 // =====================
 async function updateItemEntityPosition(item, flyTo = false) {
-  await fetchLatestCNShips(false);
+  await fetchBlacklistPositions(false);
 
   const ship = findShipForItem(item);
   if (!ship) {
@@ -308,6 +308,7 @@ async function handleAddBlacklist() {
 
   blacklistItems.push(item);
   addBlacklistListItem(item);
+  latestFetchedTime = 0;
 
   bnNameInput.value = "";
   bnNoteInput.value = "";
@@ -315,14 +316,50 @@ async function handleAddBlacklist() {
   alert("已加入黑名單！");
 }
 
+// =====================
+// 批次匯入 / 匯出
+// =====================
+async function handleImportFile() {
+  const file = bnImportFile.files[0];
+  if (!file) return;
+
+  const form = new FormData();
+  form.append("file", file);
+
+  try {
+    const resp = await fetch(`${BLACKLIST_API}/import`, { method: "POST", body: form });
+    if (!resp.ok) throw new Error(await resp.text());
+    const report = await resp.json();
+
+    const errorLines = (report.errors || []).slice(0, 10)
+      .map(e => `第 ${e.row} 列：${e.error}`).join("\n");
+    alert(
+      `匯入完成：新增 ${report.inserted}、更新 ${report.updated}、未變更 ${report.unchanged}` +
+      (report.error_count ? `\n錯誤 ${report.error_count} 筆：\n${errorLines}` : "")
+    );
+
+    latestFetchedTime = 0;
+    await loadBlacklistFromDB();
+  } catch (err) {
+    alert("匯入失敗：" + err.message);
+  } finally {
+    bnImportFile.value = "";
+  }
+}
+
 // =====================
 // 事件
 // =====================
 bnAddBtn.addEventListener("click", handleAddBlacklist);
+bnImportBtn.addEventListener("click", () => bnImportFile.click());
+bnImportFile.addEventListener("change", handleImportFile);
+bnExportBtn.addEventListener("click", () => {
+  window.location.href = `${BLACKLIST_API}/export?format=csv`;
+});
 bnReloadListBtn.addEventListener("click", loadBlacklistFromDB);
 
 bnRefreshPosBtn.addEventListener("click", async () => {
-  await fetchLatestCNShips(true);
+  await fetchBlacklistPositions(true);
 
   const liNodes = Array.from(bnList.querySelectorAll("li"));
   for (const li of liNodes) {
@@ -342,5 +379,5 @@ bnRefreshPosBtn.addEventListener("click", async () => {
 // =====================
 window.addEventListener("DOMContentLoaded", () => {
   loadBlacklistFromDB();
-  fetchLatestCNShips(true);
+  fetchBlacklistPositions(true);
 });
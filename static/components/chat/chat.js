@@ -211,54 +211,89 @@ function geojsonToCSV(geojson) {
   return `${headers}\n${rows.join('\n')}`;
 }
 
-// 處理發送消息的函數
+// 後端對話 session（延續上下文，清除對話時結束）
+let chatSessionId = null;
+
+// 處理發送消息的函數：提交背景工作後以 SSE 追蹤進度（長的工具鏈不會被瀏覽器 / proxy 逾時中斷）
 async function sendMessage() {
   const message = userInput.value.trim();
   if (!message) return;
 
   appendMessage(message, 'user');
   userInput.value = '';
+  loadingIndicator.textContent = '思考中...';
   loadingIndicator.style.display = 'block';
   const selectedApi = apiSelector.value;
 
-  const controller = new AbortController();
-  const timeoutId = setTimeout(() => {
-    controller.abort();
-  }, 180000); // 3 minutes timeout
-
   try {
-    let endpoint = '/generate'; // Default endpoint
-
-    const response = await fetch(endpoint, {
+    const response = await fetch('/api/jobs', {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
       },
-      body: JSON.stringify({ llm: selectedApi, prompt: message }),
-      signal: controller.signal // Pass the signal property to fetch
+      body: JSON.stringify({
+        kind: 'generate',
+        payload: { llm: selectedApi, prompt: message, session_id: chatSessionId },
+      }),
     });
-
-    clearTimeout(timeoutId); // Clear the timeout if the request completes
-
     const data = await response.json();
+    if (!response.ok) {
+      appendMessage(data.error || 'Error: Could not submit the request', 'model');
+      return;
+    }
 
-    if (response.ok) {
-      appendMessage(data.response, 'model');
+    const job = await waitForJob(data.job_id);
+    if (job.status === 'done') {
+      chatSessionId = job.result.session_id || chatSessionId;
+      appendMessage(job.result.response, 'model');
     } else {
-      appendMessage(data.error, 'model');
+      appendMessage(job.error || '工作已取消', 'model');
     }
 
   } catch (error) {
-    if (error.name === 'AbortError') {
+    if (error.message === 'timeout') {
       appendMessage('Error: Request timed out', 'model');
     } else {
       appendMessage('Error: Could not connect to the API', 'model');
     }
   } finally {
     loadingIndicator.style.display = 'none';
+    loadingIndicator.textContent = '思考中...';
   }
 }
 
+// 以 Server-Sent Events 追蹤背景工作，完成（或失敗 / 取消）時 resolve
+function waitForJob(jobId, timeoutMs = 600000) {
+  return new Promise((resolve, reject) => {
+    const source = new EventSource(`/api/jobs/${jobId}/events`);
+    const timer = setTimeout(() => {
+      source.close();
+      reject(new Error('timeout'));
+    }, timeoutMs);
+
+    const onUpdate = (event) => {
+      const job = JSON.parse(event.data);
+      if (job.message) {
+        loadingIndicator.textContent = `思考中...（${job.message}）`;
+      }
+      if (['done', 'failed', 'cancelled'].includes(job.status)) {
+        clearTimeout(timer);
+        source.close();
+        resolve(job);
+      }
+    };
+    ['queued', 'running', 'done', 'failed', 'cancelled'].forEach((name) => source.addEventListener(name, onUpdate));
+
+    source.onerror = () => {
+      // 連線中斷時瀏覽器會自動重連；只有無法重連（例如工作已不存在）時才放棄
+      if (source.readyState === EventSource.CLOSED) {
+        clearTimeout(timer);
+        reject(new Error('connection'));
+      }
+    };
+  });
+}
+
 // 切換按鈕的事件監聽器
 toggleChatPanelBtn.addEventListener('click', () => {
   isChatPanelCollapsed = !isChatPanelCollapsed;
@@ -289,4 +324,8 @@ userInput.addEventListener('keydown', (event) => {
 clearChatButton.addEventListener('click', () => {
   chatWindow.innerHTML = '';
   numGoejson = 0;
+  if (chatSessionId) {
+    fetch(`/api/chat_sessions/${chatSessionId}`, { method: 'DELETE' }).catch(() => {});
+    chatSessionId = null;
+  }
 });
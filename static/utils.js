@@ -67,3 +67,42 @@ export function makePanelDraggable(panelId, headerClass) {
     header.style.cursor = 'default';
   });
 }
+
+
+// ======== 船位二進位格式（application/x-aicop-vessels）========
+// 格式說明見 services/wire_format.py；以 TypedArray 直接讀取，不需逐筆 parseFloat
+export const VESSEL_BINARY_MIME = 'application/x-aicop-vessels';
+
+export function decodeVesselBinary(buffer) {
+  const view = new DataView(buffer);
+  const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+  if (magic !== 'AISV') throw new Error('不是 AISV 格式');
+
+  const count = view.getUint32(8, true);
+  const namesBytes = view.getUint32(16, true);
+  let pos = 24;
+  const take = (Type) => {
+    const arr = new Type(buffer, pos, count);
+    pos += arr.byteLength;
+    return arr;
+  };
+
+  const ts = take(Float64Array);
+  const mmsi = take(Uint32Array);
+  const lat = take(Float32Array);
+  const lon = take(Float32Array);
+  const course = take(Float32Array);
+  const speed = take(Float32Array);
+  const nameIndex = take(Uint32Array);
+  const shiptype = take(Uint8Array);
+  pos += (4 - (count % 4)) % 4;
+
+  const table = namesBytes
+    ? new TextDecoder().decode(new Uint8Array(buffer, pos, namesBytes)).split('\n')
+    : [];
+
+  return {
+    count, ts, mmsi, lat, lon, course, speed, shiptype,
+    shipname: i => table[nameIndex[i]] || '',
+  };
+}